@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, g, request, jsonify, send_from_directory
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
 import os
@@ -6,8 +6,10 @@ import pandas as pd
 import sqlite3
 from sqlalchemy import create_engine, Column, Integer, String, Float, MetaData, Table, inspect, text, Boolean, DateTime
 from sqlalchemy.orm import sessionmaker
-import re
 import bcrypt
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 import tempfile
 import uuid
@@ -17,7 +19,19 @@ from blueprints.database_blueprint import create_database_blueprint
 from blueprints.analysis_blueprint import create_analysis_blueprint
 from blueprints.data_blueprint import create_data_blueprint
 from service import database_service, analysis_service, data_service
+from service.analysis_cache import AnalysisCache
+from service.analysis_pool import AnalysisPool, parse_pool_policy
+from service.column_sketch import ColumnSketchStore
+from service.table_frame import TableFrameCache
+from service.table_aggregates import TableAggregateStore
+from service.table_cube import TableCubeStore
+from service.table_sample import TableSampleStore
 from service.auth_service import AuthService
+from service.backup_scheduler import BackupScheduler
+from service.database_backup import DatabaseBackup, DatabaseSwapGate, LocalDirectoryBucket, install_database_file
+from service.wal_replication import WalBackup
+from service.classification import classify_admission_method, classify_school_type, classify_region, normalize_city
+from service.column_resolution import auto_detect_subject_columns, resolve_column_name
 from repository.auth_repository import AuthRepository
 from repository.database_repository import DatabaseRepository
 
@@ -29,6 +43,20 @@ except ImportError:
     CLOUD_STORAGE_AVAILABLE = False
     storage = None
 
+# 冷啟動各階段耗時
+_startup_started = time.perf_counter()
+
+
+@contextmanager
+def startup_phase(name):
+    """量測啟動階段耗時並輸出 [STARTUP] 日誌"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        print(f"[STARTUP] {name}: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
 # 設定資料庫路徑
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 EXCEL_DATA_DB_PATH = os.path.join(BASE_DIR, 'excel_data.db')
@@ -96,237 +124,6 @@ def filter_dataframe_until_empty_row(df):
         return pd.DataFrame()  # 返回空的 DataFrame
 
 
-# 入學管道分類邏輯
-def classify_admission_method(method_name):
-    """
-    根據入學管道名稱判斷入學管道類型
-    """
-    # 處理空值、空字串和純空白字串
-    if pd.isna(method_name):
-        return '其他'
-    
-    method_name = str(method_name).strip()
-    if method_name == '':
-        return '其他'
-    
-    # 檢查是否只包含換行或空白字元
-    if all(c.isspace() for c in method_name):
-        return '其他'
-    
-    # 定義各類型入學管道的關鍵字（按優先級排序）
-    classification_rules = [
-        # 自然組和社會組的處理（優先處理，因為可能包含在申請入學中）
-        ('自然組', [r'^\(自然組\)$', r'自然組']),
-        ('社會組', [r'^\(社會組\)$', r'社會組']),
-        
-        # 繁星推薦
-        ('繁星推薦', [r'^繁星推薦$', r'^繁星$']),
-        
-        # 申請入學（完全匹配，不允許其他字元）
-        ('申請入學', [r'^申請入學$']),
-        
-        # 僑生
-        ('僑生', [r'^僑生$']),
-        
-        # 願景（包含【願景】格式）
-        ('願景', [r'^【願景】$'])
-    ]
-    
-    # 檢查每一個規則
-    for category, patterns in classification_rules:
-        for pattern in patterns:
-            if re.search(pattern, method_name):
-                return category
-    
-    # 如果都不符合，歸類為其他
-    return '其他'
-    
-
-
-# 學校類型分類邏輯
-def classify_school_type(school_name):
-    """
-    根據學校名稱或類型判斷學校類型
-    將值分類為：國立、市立、縣立、私立、財團、國大轉、私大轉、科大轉、僑生、其他
-    空白值、空字串或純空格都歸類為其他
-    """
-    # 處理空值、空字串或純空格的情況
-    if pd.isna(school_name) or not str(school_name).strip():
-        return '其他'
-
-    school_name = str(school_name).strip()
-    
-    # 完全匹配的類型（優先）
-    exact_matches = {
-        '國立': '國立',
-        '私立': '私立',
-        '財團法人': '財團',
-        '市立': '市立',
-        '大陸台商': '其他',
-        '私大轉': '私大轉',
-        '科大轉': '科大轉',
-        '國大轉': '國大轉',
-        '僑生': '僑生'
-    }
-    
-    # 檢查完全匹配
-    for key, value in exact_matches.items():
-        if school_name == key:
-            return value
-    
-    # 關鍵字檢查（按優先順序）
-    if '國立' in school_name:
-        return '國立'
-    elif '市立' in school_name:
-        return '市立'
-    elif '縣立' in school_name:
-        return '縣立'
-    elif '財團法人' in school_name:
-        return '財團'
-    elif '私立' in school_name:
-        return '私立'
-    elif '僑' in school_name or '海外' in school_name:
-        return '僑生'
-    elif '國立' in school_name and ('大學' in school_name or '學院' in school_name):
-        return '國大轉'
-    elif '私立' in school_name and ('大學' in school_name or '學院' in school_name):
-        return '私大轉'
-    elif '科技' in school_name or '技術學院' in school_name or '專科' in school_name:
-        return '科大轉'
-    
-    # 地區檢查（這些通常也是國外/僑生）
-    foreign_keywords = ['美國', '加拿大', '澳洲', '紐西蘭', '英國', '德國', 
-                       '法國', '日本', '韓國', '馬來西亞', '印尼', '越南', 
-                       '泰國', '緬甸', '柬埔寨', '新加坡', '汶萊', '菲律賓']
-    for keyword in foreign_keywords:
-        if keyword in school_name:
-            return '其他'
-    
-    return '其他'
-
-
-# 地理區域分類規則
-def classify_region(region):
-    """
-    根據縣市名稱判斷所屬區域
-    """
-    if pd.isna(region):
-        return '其他'
-    
-    region = str(region).strip()
-    if region == '':
-        return '其他'
-    
-    # 統一將「臺」轉換為「台」，避免兩種寫法造成的匹配問題
-    region = region.replace('臺', '台')
-
-    # 地理區域對應表
-    region_mapping = {
-        # 北台灣
-        '台北市': '北台灣',
-        '新北市': '北台灣',
-        '基隆市': '北台灣',
-        '宜蘭縣': '北台灣',
-        '桃園市': '北台灣',
-        '新竹市': '北台灣',
-        '新竹縣': '北台灣',
-        
-        # 中台灣
-        '苗栗縣': '中台灣',
-        '台中市': '中台灣',
-        '彰化縣': '中台灣',
-        '南投縣': '中台灣',
-        '雲林縣': '中台灣',
-        
-        # 南台灣
-        '嘉義市': '南台灣',
-        '嘉義縣': '南台灣',
-        '台南市': '南台灣',
-        '高雄市': '南台灣',
-        '屏東縣': '南台灣',
-        
-        # 東台灣
-        '花蓮縣': '東台灣',
-        '台東縣': '東台灣'
-    }
-
-    return region_mapping.get(region, '其他')
-
-
-def normalize_column_name(column_name):
-    """將欄位名稱標準化，避免前後端命名格式差異。"""
-    if column_name is None:
-        return ''
-    return str(column_name).strip().replace(' ', '_').replace('-', '_').replace('(', '').replace(')', '')
-
-
-def build_column_lookup(available_columns):
-    """建立欄位名稱查詢索引（原名 + 標準化 + 小寫）。"""
-    lookup = {}
-    for col in available_columns:
-        normalized = normalize_column_name(col)
-        lookup[str(col)] = col
-        lookup[normalized] = col
-        lookup[normalized.lower()] = col
-    return lookup
-
-
-def resolve_column_name(requested_name, available_columns, label='欄位', candidates=None, required=True):
-    """解析請求欄位名稱，支援標準化比對與候選欄位自動偵測。"""
-    lookup = build_column_lookup(available_columns)
-
-    if requested_name:
-        request_key = normalize_column_name(requested_name)
-        resolved = (
-            lookup.get(str(requested_name))
-            or lookup.get(request_key)
-            or lookup.get(request_key.lower())
-        )
-        if resolved:
-            return resolved
-        if required:
-            raise ValueError(f'{label} {requested_name} 不存在')
-
-    if candidates:
-        for candidate in candidates:
-            candidate_key = normalize_column_name(candidate)
-            resolved = (
-                lookup.get(str(candidate))
-                or lookup.get(candidate_key)
-                or lookup.get(candidate_key.lower())
-            )
-            if resolved:
-                return resolved
-
-    if required:
-        raise ValueError(f'找不到可用的{label}，可用欄位：{available_columns}')
-
-    return None
-
-
-def auto_detect_subject_columns(available_columns, excluded_columns=None):
-    """自動偵測可能是成績科目的欄位。"""
-    excluded_columns = excluded_columns or []
-    excluded_keys = {normalize_column_name(col).lower() for col in excluded_columns if col}
-
-    auto_subjects = []
-    for col in available_columns:
-        normalized = normalize_column_name(col).lower()
-
-        if normalized in {'id', 'user_id'}:
-            continue
-        if normalized in excluded_keys:
-            continue
-
-        # 排除常見維度欄位，保留可能是分數的欄位
-        if any(keyword in normalized for keyword in ['年度', 'year', '性別', 'gender', 'school', '高中', '地區', 'region', '管道', 'method']):
-            continue
-
-        auto_subjects.append(col)
-
-    return auto_subjects
-
-
 ALLOWED_EXCEL_EXTENSIONS = {'.xlsx', '.xls'}
 
 
@@ -385,9 +182,10 @@ storage_client = None
 bucket = None
 if is_cloud_environment():
     try:
-        storage_client = storage.Client()
-        BUCKET_NAME = os.getenv('GCS_BUCKET_NAME', 'student-analytics-files')
-        bucket = storage_client.bucket(BUCKET_NAME)
+        with startup_phase('cloud_storage_client'):
+            storage_client = storage.Client()
+            BUCKET_NAME = os.getenv('GCS_BUCKET_NAME', 'student-analytics-files')
+            bucket = storage_client.bucket(BUCKET_NAME)
         print("[INFO] 雲端環境：已啟用 Cloud Storage")
     except Exception as e:
         print(f"[WARNING] Cloud Storage 初始化失敗: {e}")
@@ -410,96 +208,236 @@ def get_database_url():
     db_path = os.path.join(app.config['DATABASE_FOLDER'], 'excel_data.db')
     return f'sqlite:///{db_path}'
 
+# 資料庫備份目的地：設定 DB_BACKUP_DIR 時使用本機目錄（本地開發／量測用），雲端環境使用 GCS bucket
+def get_backup_bucket():
+    """取得資料庫備份用的 bucket，無可用目的地時回傳 None"""
+    backup_dir = os.getenv('DB_BACKUP_DIR')
+    if backup_dir:
+        return LocalDirectoryBucket(backup_dir)
+    if not IS_PRODUCTION or not CLOUD_STORAGE_AVAILABLE or storage_client is None:
+        return None
+    return storage_client.bucket(os.getenv('GCS_DB_BUCKET', 'student-analytics-db-backup'))
+
+
+# 備份模式：snapshot（預設，上傳內容有變更的完整快照）或 wal（WAL 模式，只上傳新提交的 WAL 區段並定期上傳快照）
+DB_BACKUP_MODE = os.getenv('DB_BACKUP_MODE', 'snapshot').strip().lower()
+
+backup_bucket = get_backup_bucket()
+database_backup = None
+if backup_bucket is not None:
+    backup_databases = {
+        'excel_data.db': os.path.join(app.config['DATABASE_FOLDER'], 'excel_data.db'),
+        'fakedata.db': os.path.join(app.config['DATABASE_FOLDER'], 'fakedata.db'),
+    }
+    if DB_BACKUP_MODE == 'wal':
+        database_backup = WalBackup(
+            backup_bucket,
+            backup_databases,
+            snapshot_interval_seconds=float(os.getenv('DB_WAL_SNAPSHOT_INTERVAL_SECONDS', '3600')),
+        )
+    else:
+        database_backup = DatabaseBackup(backup_bucket, backup_databases)
+
+# 啟動時的資料庫還原模式：
+# - blocking（預設）：所有資料庫還原完成後才開始服務
+# - background：本地沒有的資料庫仍同步下載；本地已有的資料庫先以現有檔案服務，
+#   於第一個請求時在背景更新，更新完成前寫入請求會等待（最多 DB_RESTORE_WRITE_WAIT_SECONDS 秒）；
+#   下載完成後替換檔案時，所有請求短暫等待進行中的請求結束與檔案替換完成
+DB_RESTORE_MODE = os.getenv('DB_RESTORE_MODE', 'blocking').strip().lower()
+DB_RESTORE_WRITE_WAIT_SECONDS = float(os.getenv('DB_RESTORE_WRITE_WAIT_SECONDS', '30'))
+restore_complete = threading.Event()
+# 背景還原期間請求持有共用權；替換資料庫檔案時等待進行中的請求結束，並阻擋新請求到替換完成
+database_swap_gate = DatabaseSwapGate()
+_deferred_restore_names = []
+_deferred_restore_lock = threading.Lock()
+_deferred_restore_started = False
+
+
+def log_restore_results(results):
+    """輸出每個資料庫的還原結果與耗時"""
+    for name, result in results.items():
+        timings = ', '.join(f"{key}={value}" for key, value in result.items() if key.endswith('_ms'))
+        status = result['status']
+        if status == 'downloaded':
+            print(f"[INFO] ✓ 從 {backup_bucket.name} 下載 {name} 成功（{result['bytes']} bytes，{timings}）")
+        elif status == 'up_to_date':
+            print(f"[INFO] ✓ 本地 {name} 已是最新版本，略過下載（{timings}）")
+        elif status == 'not_found':
+            print(f"[INFO] Cloud Storage 中無 {name}，將使用本地資料庫")
+        else:
+            print(f"[WARNING] {name} 下載失敗: {result.get('error')}，將使用本地資料庫")
+
+
 # 從 Cloud Storage 下載資料庫（如果存在）
 def download_database_from_gcs():
-    """啟動時從 Cloud Storage 下載資料庫"""
-    if not IS_PRODUCTION or not CLOUD_STORAGE_AVAILABLE or storage_client is None:
+    """啟動時從 Cloud Storage 並行還原資料庫，只下載與本地內容不同的檔案"""
+    if database_backup is None:
         print("[INFO] 跳過資料庫下載（本地環境或 Storage 不可用）")
+        restore_complete.set()
         return
-    
+
+    names = list(database_backup.databases)
+    if DB_RESTORE_MODE == 'background':
+        _deferred_restore_names[:] = [name for name in names if os.path.exists(database_backup.databases[name])]
+        names = [name for name in names if name not in _deferred_restore_names]
+
     try:
-        db_bucket_name = os.getenv('GCS_DB_BUCKET', 'student-analytics-db-backup')
-        db_bucket = storage_client.bucket(db_bucket_name)
-        
-        # 下載 excel_data.db
-        blob = db_bucket.blob('excel_data.db')
-        if blob.exists():
-            db_path = os.path.join(app.config['DATABASE_FOLDER'], 'excel_data.db')
-            blob.download_to_filename(db_path)
-            print(f"[INFO] ✓ 從 gs://{db_bucket_name}/excel_data.db 下載資料庫成功")
-        else:
-            print(f"[INFO] Cloud Storage 中無 excel_data.db，將建立新資料庫")
-        
-        # 下載 fakedata.db
-        fake_blob = db_bucket.blob('fakedata.db')
-        if fake_blob.exists():
-            fake_db_path = os.path.join(app.config['DATABASE_FOLDER'], 'fakedata.db')
-            fake_blob.download_to_filename(fake_db_path)
-            print(f"[INFO] ✓ 從 gs://{db_bucket_name}/fakedata.db 下載假資料庫成功")
-        else:
-            print(f"[INFO] Cloud Storage 中無 fakedata.db，將使用本地假資料庫")
+        log_restore_results(database_backup.restore_all(names))
     except Exception as e:
         print(f"[WARNING] 資料庫下載失敗: {e}，將使用空資料庫")
 
-# 上傳資料庫到 Cloud Storage
+    if _deferred_restore_names:
+        print(f"[INFO] 背景更新資料庫: {', '.join(_deferred_restore_names)}（寫入請求將等待更新完成）")
+    else:
+        restore_complete.set()
+
+
+def _install_restored_database(source_path, dest_path):
+    """
+    背景還原下載完成後替換資料庫：等待進行中的請求結束並阻擋新請求，
+    先關閉連線池（連線仍開著舊檔與 -wal / -shm）再替換檔案，並清除依舊檔內容建立的快取
+    """
+    with database_swap_gate.exclusive():
+        engine.dispose()
+        install_database_file(source_path, dest_path)
+        analysis_cache.clear()
+        table_frame_cache.clear()
+        column_sketch_store.clear()
+        table_sample_store.clear()
+
+
+def _run_deferred_restore():
+    """背景更新本地已有的資料庫（下載期間照常服務，只有替換檔案時短暫阻擋請求）；替換後重新初始化資料表"""
+    global _db_initialized
+    started = time.perf_counter()
+    try:
+        results = database_backup.restore_all(_deferred_restore_names, install_fn=_install_restored_database)
+        log_restore_results(results)
+        if any(result['status'] == 'downloaded' for result in results.values()):
+            init_database()
+            _db_initialized = False
+    except Exception as e:
+        print(f"[WARNING] 背景資料庫更新失敗: {e}，將使用本地資料庫")
+    finally:
+        restore_complete.set()
+        print(f"[STARTUP] background_restore: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+def start_deferred_restore():
+    """在實際處理請求的行程中啟動背景還原（gunicorn --preload 時主行程 fork 後不會保留執行緒）"""
+    global _deferred_restore_started
+    if restore_complete.is_set() or _deferred_restore_started:
+        return
+    with _deferred_restore_lock:
+        if _deferred_restore_started:
+            return
+        _deferred_restore_started = True
+    threading.Thread(target=_run_deferred_restore, name='db-restore', daemon=True).start()
+
+
+# 上傳資料庫到 Cloud Storage（只上傳內容有變更的資料庫快照）
 def backup_database_to_gcs():
     """備份資料庫到 Cloud Storage"""
-    if not IS_PRODUCTION or not CLOUD_STORAGE_AVAILABLE or storage_client is None:
+    if database_backup is None:
         return {"success": False, "message": "非生產環境或 Storage 不可用"}
     
     try:
-        db_bucket_name = os.getenv('GCS_DB_BUCKET', 'student-analytics-db-backup')
-        db_bucket = storage_client.bucket(db_bucket_name)
-        
-        # 備份 excel_data.db
-        db_path = os.path.join(app.config['DATABASE_FOLDER'], 'excel_data.db')
-        if os.path.exists(db_path):
-            blob = db_bucket.blob('excel_data.db')
-            blob.upload_from_filename(db_path)
-            print(f"[INFO] ✓ 資料庫已備份到 gs://{db_bucket_name}/excel_data.db")
-        else:
-            print(f"[WARNING] excel_data.db 不存在，跳過備份")
-        
-        # 備份 fakedata.db
-        fake_db_path = os.path.join(app.config['DATABASE_FOLDER'], 'fakedata.db')
-        if os.path.exists(fake_db_path):
-            fake_blob = db_bucket.blob('fakedata.db')
-            fake_blob.upload_from_filename(fake_db_path)
-            print(f"[INFO] ✓ 假資料庫已備份到 gs://{db_bucket_name}/fakedata.db")
-        else:
-            print(f"[WARNING] fakedata.db 不存在，跳過備份")
-        
-        return {"success": True, "message": "備份成功"}
+        summary = database_backup.run()
+        print(f"[INFO] ✓ 資料庫備份完成，傳輸 {summary['bytes_shipped']} bytes（{summary['seconds']}s）")
+        return {"success": True, "message": "備份成功", **summary}
     except Exception as e:
         print(f"[ERROR] 資料庫備份失敗: {e}")
         return {"success": False, "message": str(e)}
 
+# 寫入操作只標記資料庫已變更，由背景排程器合併短時間內的多次寫入後再上傳
+backup_scheduler = BackupScheduler(
+    backup_database_to_gcs,
+    quiet_seconds=float(os.getenv('BACKUP_QUIET_SECONDS', '5')),
+    max_delay_seconds=float(os.getenv('BACKUP_MAX_DELAY_SECONDS', '60')),
+    flush_timeout=float(os.getenv('BACKUP_FLUSH_TIMEOUT_SECONDS', '240')),
+)
+
 DATABASE_URL = get_database_url()
 DATABASE_PATH = os.path.join(app.config['DATABASE_FOLDER'], 'excel_data.db')  # SQLite 路徑（本地用）
 
-# 啟動時下載資料庫
-download_database_from_gcs()
-
+# create_engine 不會開啟連線，可在還原前建立（背景還原完成後以 engine.dispose() 重建連線）
 engine = create_engine(DATABASE_URL, echo=False)
 metadata = MetaData()
 
+# 分析端點結果快取（資料表寫入時失效；ANALYSIS_CACHE_MAX_MB=0 停用）
+analysis_cache = AnalysisCache(max_bytes=int(float(os.getenv('ANALYSIS_CACHE_MAX_MB', '64')) * 1024 * 1024))
+
+# 分析用的資料表欄位快取，與結果快取共用資料表版本（TABLE_FRAME_CACHE_MAX_MB=0 停用，改為每次查詢 SQLite）
+table_frame_cache = TableFrameCache(
+    max_bytes=int(float(os.getenv('TABLE_FRAME_CACHE_MAX_MB', '128')) * 1024 * 1024),
+    version_fn=analysis_cache.table_version,
+)
+
+# column_stats 的欄位數值摘要（百分位數 / 直方圖），有效筆數超過 COLUMN_STATS_EXACT_MAX_VALUES 的欄位才使用摘要
+column_sketch_store = ColumnSketchStore(
+    exact_max_values=int(os.getenv('COLUMN_STATS_EXACT_MAX_VALUES', '50000')),
+    version_fn=analysis_cache.table_version,
+)
+
+# CPU 密集分析的行程池（ANALYSIS_POOL_WORKERS=0 停用）：資料表筆數達 ANALYSIS_POOL_MIN_ROWS 的分析改在子行程計算，
+# ANALYSIS_POOL_POLICY 可逐一覆寫端點門檻（analysis=rows 或 analysis=off）
+analysis_pool = AnalysisPool(
+    max_workers=int(os.getenv('ANALYSIS_POOL_WORKERS', '0')),
+    policy=parse_pool_policy(
+        os.getenv('ANALYSIS_POOL_POLICY'), min_rows=int(os.getenv('ANALYSIS_POOL_MIN_ROWS', '100000'))
+    ),
+)
+
+# approximate 分析的分層抽樣（依年度分層，APPROXIMATE_SAMPLE_FRACTION=0 停用）：筆數達 APPROXIMATE_MIN_ROWS 的資料表
+# 於上傳時抽樣，資料表變更後下次 approximate 請求時重新抽樣
+table_sample_store = TableSampleStore(
+    fraction=float(os.getenv('APPROXIMATE_SAMPLE_FRACTION', '0.05')),
+    min_rows=int(os.getenv('APPROXIMATE_MIN_ROWS', '100000')),
+    min_per_stratum=int(os.getenv('APPROXIMATE_MIN_PER_YEAR', '200')),
+    max_bytes=int(float(os.getenv('APPROXIMATE_SAMPLE_MAX_MB', '64')) * 1024 * 1024),
+    version_fn=analysis_cache.table_version,
+)
+
+# 上傳的資料表建立年度 × 類別筆數與各年度數值彙總（存在同一資料庫），資料列異動時在同一交易中增量更新；
+# 不重複值超過 TABLE_AGGREGATE_MAX_VALUES 的欄位不建立維度彙總，設為 0 停用
+table_aggregate_store = TableAggregateStore(max_values=int(os.getenv('TABLE_AGGREGATE_MAX_VALUES', '1000')))
+
+# 上傳的資料表另建 年度 × 性別 × 學校類型 × 入學管道 × 地區 的 OLAP cube（分類後的標籤，存在同一資料庫），
+# 儀表板分析以 roll-up 回答；維度組合數超過 TABLE_CUBE_MAX_CELLS 的資料表不建立，設為 0 停用
+table_cube_store = TableCubeStore(
+    classifiers={
+        'school_type': classify_school_type,
+        'method_type': classify_admission_method,
+        'region': classify_region,
+        'city': normalize_city,
+    },
+    max_cells=int(os.getenv('TABLE_CUBE_MAX_CELLS', '20000')),
+)
+
+# 啟動時下載資料庫
+with startup_phase('database_restore'):
+    download_database_from_gcs()
+
 
 # 動態建立表格（每個 Excel 檔案+工作表對應一個資料表）
-def create_excel_table(table_name, columns):
+def create_excel_table(table_name, columns, target_engine=None, target_metadata=None):
     """
     為 Excel 檔案的特定工作表建立對應的資料表
     table_name: 表名（檔名_工作表名）
     columns: 欄位名稱列表
+    target_engine / target_metadata: 指定其他資料庫（例如 benchmark 的暫存資料庫），預設為主資料庫
     """
-    inspector = inspect(engine)
+    target_engine = target_engine if target_engine is not None else engine
+    target_metadata = target_metadata if target_metadata is not None else metadata
+    inspector = inspect(target_engine)
     
     # 清理 SQLAlchemy metadata 快取
-    if table_name in metadata.tables:
-        metadata.remove(metadata.tables[table_name])
+    if table_name in target_metadata.tables:
+        target_metadata.remove(target_metadata.tables[table_name])
     
     # 若表格已存在則先刪除
     if inspector.has_table(table_name):
-        with engine.connect() as conn:
+        with target_engine.connect() as conn:
             conn.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
             conn.commit()
     
@@ -514,8 +452,8 @@ def create_excel_table(table_name, columns):
         cols.append(Column(safe_col_name, String))
     
     # 使用 extend_existing=True 避免重複定義錯誤
-    table = Table(table_name, metadata, *cols, extend_existing=True)
-    metadata.create_all(engine)
+    table = Table(table_name, target_metadata, *cols, extend_existing=True)
+    target_metadata.create_all(target_engine)
     return table
 
 # === 使用者認證相關的資料表定義 ===
@@ -559,14 +497,64 @@ def init_database():
 # 使用 Flask 的 before_first_request 確保資料庫已初始化
 _db_initialized = False
 
+
+@app.before_request
+def hold_database_during_restore():
+    """背景還原進行中時請求持有共用權（在其他使用資料庫的 before_request 之前），替換檔案期間等待"""
+    if restore_complete.is_set():
+        return None
+    if not database_swap_gate.acquire_shared(timeout=DB_RESTORE_WRITE_WAIT_SECONDS):
+        return jsonify({'error': '資料庫正在還原中，請稍後再試', 'code': 'database_restoring'}), 503
+    g.holds_database_gate = True
+    return None
+
+
+@app.teardown_request
+def release_database_gate(exception=None):
+    del exception
+    if g.pop('holds_database_gate', False):
+        database_swap_gate.release_shared()
+
+
 @app.before_request
 def ensure_database_initialized():
     global _db_initialized
     if not _db_initialized:
+        if database_backup is not None:
+            # 在實際處理請求的行程中開啟備份連線（WAL 模式需在寫入開始前就位）
+            database_backup.start()
         init_database()
         create_default_admin()
         _db_initialized = True
 
+# 背景還原期間仍可執行的請求：讀取、分析與不寫入資料庫的檔案預覽
+RESTORE_SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+RESTORE_SAFE_BLUEPRINTS = {'analysis'}
+RESTORE_SAFE_ENDPOINTS = {
+    'auth.login',
+    'database.get_table_columns',
+    'data.list_excel_sheets',
+    'data.read_columns_from_file',
+    'data.get_excel_data_post',
+}
+
+
+@app.before_request
+def wait_for_database_restore():
+    """背景還原尚未完成時，寫入請求等待還原完成，逾時回傳 503"""
+    if restore_complete.is_set():
+        return None
+    start_deferred_restore()
+    if (request.method in RESTORE_SAFE_METHODS
+            or request.blueprint in RESTORE_SAFE_BLUEPRINTS
+            or request.endpoint in RESTORE_SAFE_ENDPOINTS):
+        return None
+    # 等待期間放開共用權，否則替換檔案時會等待這個請求
+    release_database_gate()
+    if restore_complete.wait(DB_RESTORE_WRITE_WAIT_SECONDS):
+        return None
+    return jsonify({'error': '資料庫正在還原中，請稍後再試', 'code': 'database_restoring'}), 503
+
 Session = sessionmaker(bind=engine)
 
 # === 輔助函數 ===
@@ -657,6 +645,10 @@ database_service.configure_database_service(
     database_folder=app.config['DATABASE_FOLDER'],
     get_database_engine_fn=get_database_engine,
     repository=database_repository,
+    analysis_cache_instance=analysis_cache,
+    column_sketch_store_instance=column_sketch_store,
+    table_aggregate_store_instance=table_aggregate_store,
+    table_cube_store_instance=table_cube_store,
 )
 analysis_service.configure_analysis_service(
     get_database_engine_fn=get_database_engine,
@@ -665,10 +657,19 @@ analysis_service.configure_analysis_service(
     classify_school_type_fn=classify_school_type,
     classify_admission_method_fn=classify_admission_method,
     classify_region_fn=classify_region,
+    table_frame_cache_instance=table_frame_cache,
+    column_sketch_store_instance=column_sketch_store,
+    analysis_pool_instance=analysis_pool,
+    table_sample_store_instance=table_sample_store,
+    table_aggregate_store_instance=table_aggregate_store,
+    table_cube_store_instance=table_cube_store,
 )
 
 app.register_blueprint(create_database_blueprint())
-app.register_blueprint(create_analysis_blueprint())
+app.register_blueprint(create_analysis_blueprint(
+    analysis_cache, table_frame_cache, column_sketch_store, analysis_pool, table_sample_store, table_aggregate_store,
+    table_cube_store,
+))
 data_service.configure_data_service(
     upload_folder_path=app.config['UPLOAD_FOLDER'],
     database_path_value=DATABASE_PATH,
@@ -676,15 +677,23 @@ data_service.configure_data_service(
     session_factory=Session,
     engine_instance=engine,
     metadata_instance=metadata,
-    backup_database_to_gcs_fn=backup_database_to_gcs,
+    backup_scheduler_instance=backup_scheduler,
     get_database_engine_fn=get_database_engine,
     filter_dataframe_until_empty_row_fn=filter_dataframe_until_empty_row,
     validate_excel_file_fn=validate_excel_file,
     create_excel_table_fn=create_excel_table,
     is_cloud_environment_fn=is_cloud_environment,
+    analysis_cache_instance=analysis_cache,
+    column_sketch_store_instance=column_sketch_store,
+    table_sample_store_instance=table_sample_store,
+    table_aggregate_store_instance=table_aggregate_store,
+    table_cube_store_instance=table_cube_store,
 )
 app.register_blueprint(create_data_blueprint())
 
 
+print(f"[STARTUP] total: {(time.perf_counter() - _startup_started) * 1000:.1f} ms")
+
+
 def create_app():
     return app
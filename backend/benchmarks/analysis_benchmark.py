@@ -0,0 +1,245 @@
+"""
+分析端點效能基準測試
+
+以合成學生資料（預設 20 個年度、20 萬筆）建立暫存 SQLite 資料表，重複呼叫分析端點，
+輸出每個端點的最短 / 中位數耗時。預設每次都直接查詢 SQLite；加上 --frame-cache 時
+先暖機資料表欄位快取，量測的是不含 SQLite 讀取的計算時間。
+
+結果為 JSON，可存檔後以 --compare 與其他 commit 的結果比較。
+
+用法（於 backend/ 目錄執行）：
+    python -m benchmarks.analysis_benchmark --rows 200000 --output analysis.json
+    python -m benchmarks.analysis_benchmark --rows 200000 --analyses all --frame-cache --compare analysis.json
+"""
+import argparse
+import contextlib
+import inspect
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.ingest_benchmark import BACKEND_DIR, git_commit
+from benchmarks.synthetic_data import SUBJECT_COLUMNS, generate_student_frame
+
+TABLE_NAME = 'students'
+DEFAULT_ROWS = [200000]
+DEFAULT_ANALYSES = ['subject_average_stats']
+
+# 各分析端點的請求內容（table_name 由 benchmark 補上）
+ANALYSIS_CASES = {
+    'subject_average_stats': {
+        'year_col': '年度', 'gender_col': '性別', 'school_type_col': '高中別', 'admission_col': '入學管道',
+        'subjects': SUBJECT_COLUMNS,
+    },
+    'multi_subject_stats': {'year_col': '年度', 'subjects': SUBJECT_COLUMNS[:4]},
+    'yearly_admission_stats': {'year_col': '年度', 'gender_col': '性別'},
+    'school_source_stats': {'year_col': '年度', 'school_col': '高中別'},
+    'admission_method_stats': {'year_col': '年度', 'method_col': '入學管道'},
+    'geographic_stats': {'year_col': '年度', 'region_col': '地區', 'get_city_details': True},
+    'top_schools_stats': {'year_col': '年度', 'school_col': '畢業學校'},
+    'gender_subject_analysis': {'year_col': '年度', 'gender_col': '性別', 'subjects': SUBJECT_COLUMNS[:4]},
+    'admission_subject_analysis': {'year_col': '年度', 'admission_col': '入學管道', 'subjects': SUBJECT_COLUMNS[:4]},
+    'school_type_subject_analysis': {'year_col': '年度', 'school_type_col': '高中別', 'subjects': SUBJECT_COLUMNS[:4]},
+    'region_subject_analysis': {'year_col': '年度', 'region_col': '地區', 'subjects': SUBJECT_COLUMNS[:4]},
+}
+
+
+def database_path(db_dir, rows, width, years, seed):
+    return os.path.join(db_dir, f'students_{rows}x{width}_y{years}_s{seed}.db')
+
+
+def ensure_database(db_dir, rows, width, years, seed):
+    """產生（或重用快取的）合成資料庫；與上傳流程相同，所有欄位以文字儲存"""
+    from sqlalchemy import create_engine
+
+    path = database_path(db_dir, rows, width, years, seed)
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        df = generate_student_frame(rows, width=width, years=years, seed=seed)
+        df = df.astype(object).where(df.notna(), None)
+        for column in df.columns:
+            df[column] = df[column].map(lambda value: None if value is None else str(value))
+        os.makedirs(db_dir, exist_ok=True)
+        engine = create_engine(f'sqlite:///{path}')
+        try:
+            df.to_sql(TABLE_NAME, engine, index_label='id')
+        finally:
+            engine.dispose()
+        print(f"[bench] 已產生 {os.path.basename(path)}（{time.perf_counter() - started:.1f}s）", file=sys.stderr)
+    return path
+
+
+def configured_names(analysis_service):
+    """configure_analysis_service 設定的模組變數名稱"""
+    parameters = inspect.signature(analysis_service.configure_analysis_service).parameters
+    return [name.removesuffix('_fn').removesuffix('_instance') for name in parameters]
+
+
+@contextlib.contextmanager
+def configured_analysis_service(engine, frame_cache=False):
+    """暫時將 analysis_service 指向 benchmark 資料庫，結束後還原原本的設定"""
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+    from sqlalchemy import inspect
+
+    from service import analysis_service
+    from service.classification import classify_admission_method, classify_region, classify_school_type
+    from service.table_frame import TableFrameCache
+
+    with contextlib.redirect_stdout(sys.stderr):
+        import app_factory
+
+    def get_engine(table_name):
+        bench_inspector = inspect(engine)
+        if not bench_inspector.has_table(table_name):
+            raise ValueError(f'找不到指定的資料表: {table_name}')
+        return engine, bench_inspector
+
+    # configure_analysis_service 會重設所有參數對應的模組設定（xxx_fn / xxx_instance → xxx），全部保存後還原
+    previous = {name: getattr(analysis_service, name) for name in configured_names(analysis_service)}
+    analysis_service.configure_analysis_service(
+        get_database_engine_fn=get_engine,
+        resolve_column_name_fn=app_factory.resolve_column_name,
+        auto_detect_subject_columns_fn=app_factory.auto_detect_subject_columns,
+        classify_school_type_fn=classify_school_type,
+        classify_admission_method_fn=classify_admission_method,
+        classify_region_fn=classify_region,
+        table_frame_cache_instance=TableFrameCache() if frame_cache else None,
+    )
+    try:
+        yield analysis_service
+    finally:
+        for name, value in previous.items():
+            setattr(analysis_service, name, value)
+
+
+def run_analysis_case(service, analysis, repeats, frame_cache=False):
+    payload = {'table_name': TABLE_NAME, **ANALYSIS_CASES[analysis]}
+    analysis_fn = getattr(service, analysis)
+    timings = []
+    # 應用程式的 print 日誌導向 stderr，stdout 只保留 JSON 結果
+    with contextlib.redirect_stdout(sys.stderr):
+        if frame_cache:
+            analysis_fn(payload)
+        for _ in range(repeats):
+            started = time.perf_counter()
+            result = analysis_fn(payload)
+            timings.append(time.perf_counter() - started)
+
+    status = result[1] if isinstance(result, tuple) else 200
+    if status != 200:
+        raise RuntimeError(f'{analysis} 失敗: {result[0]}')
+    return {
+        'analysis': analysis,
+        'min_seconds': round(min(timings), 4),
+        'median_seconds': round(statistics.median(timings), 4),
+    }
+
+
+def run_benchmark(rows_list, db_dir, analyses=None, width=15, years=20, seed=0, repeats=3, frame_cache=False):
+    import pandas as pd
+    from sqlalchemy import create_engine
+
+    analyses = analyses or DEFAULT_ANALYSES
+    results = []
+    for rows in rows_list:
+        path = ensure_database(db_dir, rows, width, years, seed)
+        engine = create_engine(f'sqlite:///{path}', echo=False)
+        try:
+            with configured_analysis_service(engine, frame_cache) as service:
+                for analysis in analyses:
+                    result = {'rows': rows, **run_analysis_case(service, analysis, repeats, frame_cache)}
+                    print(
+                        f"[bench] rows={rows} {analysis} min={result['min_seconds']}s "
+                        f"median={result['median_seconds']}s",
+                        file=sys.stderr,
+                    )
+                    results.append(result)
+        finally:
+            engine.dispose()
+
+    return {
+        'benchmark': 'analysis',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'width': width,
+        'years': years,
+        'seed': seed,
+        'repeats': repeats,
+        'frame_cache': frame_cache,
+        'results': results,
+    }
+
+
+def compare_reports(baseline, current):
+    """比較兩份報告，回傳每個案例的中位數耗時比值（current / baseline）"""
+    baseline_cases = {(r['rows'], r['analysis']): r for r in baseline.get('results', [])}
+    comparison = []
+    for result in current.get('results', []):
+        base = baseline_cases.get((result['rows'], result['analysis']))
+        if not base:
+            continue
+        comparison.append({
+            'rows': result['rows'],
+            'analysis': result['analysis'],
+            'baseline_median_seconds': base['median_seconds'],
+            'median_ratio': round(result['median_seconds'] / base['median_seconds'], 3) if base['median_seconds'] else None,
+        })
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='分析端點效能基準測試')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='資料表筆數')
+    parser.add_argument('--analyses', nargs='+', default=DEFAULT_ANALYSES,
+                        help=f'要量測的分析端點，all 代表全部：{", ".join(ANALYSIS_CASES)}')
+    parser.add_argument('--width', type=int, default=15, help='資料表總欄位數')
+    parser.add_argument('--years', type=int, default=20, help='年度數量')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=3, help='每個端點的量測次數')
+    parser.add_argument('--frame-cache', action='store_true', help='使用（已暖機的）資料表欄位快取')
+    parser.add_argument('--db-dir', default=os.path.join(tempfile.gettempdir(), 'student-analysis-bench'),
+                        help='合成資料庫快取目錄')
+    parser.add_argument('--output', help='將 JSON 結果寫入檔案（預設輸出至 stdout）')
+    parser.add_argument('--compare', help='與先前輸出的 JSON 結果比較')
+    args = parser.parse_args(argv)
+
+    analyses = list(ANALYSIS_CASES) if args.analyses == ['all'] else args.analyses
+    unknown = [analysis for analysis in analyses if analysis not in ANALYSIS_CASES]
+    if unknown:
+        parser.error(f'未知的分析端點: {unknown}')
+
+    report = run_benchmark(
+        args.rows,
+        args.db_dir,
+        analyses=analyses,
+        width=args.width,
+        years=args.years,
+        seed=args.seed,
+        repeats=args.repeats,
+        frame_cache=args.frame_cache,
+    )
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['comparison'] = {'baseline': args.compare, 'cases': compare_reports(json.load(f), report)}
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""
+Excel 匯入流程效能基準測試
+
+以合成學生資料活頁簿（預設 1 萬 / 10 萬 / 50 萬筆，可指定不同欄位數）離線執行
+upload_to_local_storage → process_excel_data，資料寫入暫存 SQLite 資料庫，
+輸出各階段耗時（Excel 解析、空白列過濾、列資料組裝、寫入、衍生結構、備份）、每秒筆數與峰值記憶體。
+衍生結構（欄位摘要、彙總、cube、分層樣本）由與應用程式相同設定（同樣的環境變數）的暫存 store 建立；
+筆數低於 COLUMN_STATS_EXACT_MAX_VALUES / APPROXIMATE_MIN_ROWS 時與服務中一樣不建立摘要 / 樣本（table_sample 階段不出現）。
+備份階段為匯入後立即 flush 到暫存目錄 bucket 的耗時（不計入 total_seconds，實際服務中由排程器在背景執行）。
+
+結果為 JSON，可存檔後以 --compare 與其他 commit 的結果比較。
+
+用法（於 backend/ 目錄執行）：
+    python -m benchmarks.ingest_benchmark --rows 10000 100000 500000 --widths 15 40 --output ingest.json
+    python -m benchmarks.ingest_benchmark --rows 10000 --compare ingest.json
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+
+try:
+    import resource
+except ImportError:  # Windows 沒有 resource 模組
+    resource = None
+
+from benchmarks.synthetic_data import write_student_workbook
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+DEFAULT_ROWS = [10000, 100000, 500000]
+DEFAULT_WIDTHS = [15]
+SHEET_NAME = '學生資料'
+STAGE_ORDER = [
+    'save_upload', 'excel_parse', 'filter_rows', 'create_table', 'build_rows', 'insert_rows',
+    'column_sketches', 'aggregates', 'cube', 'table_sample', 'backup',
+]
+# configure_data_service 設定的模組變數（加上 ingest_stage_hook），in-process 執行結束後全部還原
+DATA_SERVICE_GLOBALS = (
+    'upload_folder', 'database_path', 'bucket', 'Session', 'engine', 'metadata', 'backup_scheduler',
+    'get_database_engine', 'filter_dataframe_until_empty_row', 'validate_excel_file', 'create_excel_table',
+    'is_cloud_environment', 'analysis_cache', 'column_sketch_store', 'table_sample_store', 'table_aggregate_store',
+    'table_cube_store', 'ingest_stage_hook',
+)
+
+
+def workbook_path(workbook_dir, rows, width, seed):
+    return os.path.join(workbook_dir, f'students_{rows}x{width}_s{seed}.xlsx')
+
+
+def ensure_workbook(workbook_dir, rows, width, seed):
+    """產生（或重用快取的）合成活頁簿，產生時間不計入匯入耗時。"""
+    path = workbook_path(workbook_dir, rows, width, seed)
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        write_student_workbook(path, rows, width=width, sheet_name=SHEET_NAME, seed=seed)
+        print(f"[bench] 已產生 {os.path.basename(path)}（{time.perf_counter() - started:.1f}s）", file=sys.stderr)
+    return path
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # Linux 回傳 KB，macOS 回傳 bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / divisor, 1)
+
+
+def run_ingest_case(path, rows, width, trace_memory=False):
+    """
+    以暫存資料庫執行一次完整匯入並回傳量測結果
+    在獨立行程中呼叫時，peak_rss_mb 即為單一案例的峰值記憶體
+    """
+    # 應用程式的 print 日誌導向 stderr，stdout 只保留 JSON 結果
+    with contextlib.redirect_stdout(sys.stderr):
+        return _run_ingest_case(path, rows, width, trace_memory)
+
+
+def _run_ingest_case(path, rows, width, trace_memory):
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+    from sqlalchemy import MetaData, create_engine, inspect
+    from sqlalchemy.orm import sessionmaker
+    from werkzeug.datastructures import FileStorage
+
+    import app_factory
+    from service import data_service
+    from service.analysis_cache import AnalysisCache
+    from service.backup_scheduler import BackupScheduler
+    from service.column_sketch import ColumnSketchStore
+    from service.database_backup import DatabaseBackup, LocalDirectoryBucket
+    from service.table_aggregates import TableAggregateStore
+    from service.table_cube import TableCubeStore
+    from service.table_sample import TableSampleStore
+
+    work_dir = tempfile.mkdtemp(prefix='ingest-bench-')
+    upload_dir = os.path.join(work_dir, 'uploads')
+    os.makedirs(upload_dir)
+    db_path = os.path.join(work_dir, 'excel_data.db')
+    bench_engine = create_engine(f'sqlite:///{db_path}', echo=False)
+    bench_metadata = MetaData()
+    # 備份到暫存目錄，不會備份應用程式的資料庫；安靜期設長，備份只在量測的 flush 時執行
+    bench_backup = DatabaseBackup(LocalDirectoryBucket(os.path.join(work_dir, 'backup')), {'excel_data.db': db_path})
+    bench_backup_scheduler = BackupScheduler(bench_backup.run, quiet_seconds=3600, max_delay_seconds=3600)
+    # 衍生結構的 store 沿用應用程式實例的設定，但不共用其內容
+    bench_cache = AnalysisCache()
+    bench_sketches = ColumnSketchStore(
+        exact_max_values=app_factory.column_sketch_store.exact_max_values, version_fn=bench_cache.table_version,
+    )
+    app_sample = app_factory.table_sample_store
+    bench_sample = TableSampleStore(
+        fraction=app_sample.fraction,
+        min_rows=app_sample.min_rows,
+        min_per_stratum=app_sample.min_per_stratum,
+        max_bytes=app_sample.max_bytes,
+        version_fn=bench_cache.table_version,
+    )
+    bench_aggregates = TableAggregateStore(max_values=app_factory.table_aggregate_store.max_values)
+    bench_cube = TableCubeStore(
+        classifiers=app_factory.table_cube_store.classifiers, max_cells=app_factory.table_cube_store.max_cells,
+    )
+
+    stages = {}
+    backup_result = None
+
+    def record_stage(stage_name, seconds):
+        stage = stages.setdefault(stage_name, {'seconds': 0.0})
+        stage['seconds'] = round(stage['seconds'] + seconds, 4)
+        if trace_memory:
+            stage['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+            tracemalloc.reset_peak()
+
+    previous = {name: getattr(data_service, name) for name in DATA_SERVICE_GLOBALS}
+    data_service.configure_data_service(
+        upload_folder_path=upload_dir,
+        database_path_value=db_path,
+        bucket_instance=None,
+        session_factory=sessionmaker(bind=bench_engine),
+        engine_instance=bench_engine,
+        metadata_instance=bench_metadata,
+        backup_scheduler_instance=bench_backup_scheduler,
+        get_database_engine_fn=lambda table_name: (bench_engine, inspect(bench_engine)),
+        filter_dataframe_until_empty_row_fn=app_factory.filter_dataframe_until_empty_row,
+        validate_excel_file_fn=app_factory.validate_excel_file,
+        create_excel_table_fn=partial(app_factory.create_excel_table, target_engine=bench_engine, target_metadata=bench_metadata),
+        is_cloud_environment_fn=lambda: False,
+        analysis_cache_instance=bench_cache,
+        column_sketch_store_instance=bench_sketches,
+        table_sample_store_instance=bench_sample,
+        table_aggregate_store_instance=bench_aggregates,
+        table_cube_store_instance=bench_cube,
+    )
+    data_service.ingest_stage_hook = record_stage
+
+    try:
+        if trace_memory:
+            tracemalloc.start()
+        with open(path, 'rb') as stream:
+            upload = FileStorage(stream=stream, filename=os.path.basename(path))
+            started = time.perf_counter()
+            payload, status = data_service.upload_to_local_storage(
+                upload, SHEET_NAME, upload.filename, upload.filename, 'bench'
+            )
+            total_seconds = time.perf_counter() - started
+        if status == 200:
+            with data_service.ingest_stage('backup'):
+                backup_result = bench_backup_scheduler.flush(timeout=600)
+        traced_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        for name, value in previous.items():
+            setattr(data_service, name, value)
+        bench_backup_scheduler.shutdown()
+        bench_engine.dispose()
+        database_size = os.path.getsize(db_path) if os.path.exists(db_path) else 0
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if status != 200:
+        raise RuntimeError(f'匯入失敗: {payload}')
+
+    rows_inserted = payload.get('rows_inserted', 0)
+    result = {
+        'rows': rows,
+        'width': width,
+        'rows_inserted': rows_inserted,
+        'workbook_mb': round(os.path.getsize(path) / 1024 / 1024, 2),
+        'database_mb': round(database_size / 1024 / 1024, 2),
+        'total_seconds': round(total_seconds, 4),
+        'rows_per_second': round(rows_inserted / total_seconds, 1) if total_seconds > 0 else None,
+        'backup_bytes': backup_result['bytes_shipped'] if backup_result else None,
+        'stages': {name: stages[name] for name in STAGE_ORDER if name in stages},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    if traced_peak is not None:
+        result['peak_traced_mb'] = round(traced_peak / 1024 / 1024, 1)
+    return result
+
+
+def run_case_isolated(path, rows, width, trace_memory=False):
+    """以 spawn 子行程執行單一案例，避免前一案例的記憶體影響峰值量測。"""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_ingest_case, path, rows, width, trace_memory).result()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def run_benchmark(rows_list, widths, workbook_dir, seed=0, isolated=True, trace_memory=False):
+    import pandas as pd
+
+    results = []
+    for width in widths:
+        for rows in rows_list:
+            path = ensure_workbook(workbook_dir, rows, width, seed)
+            runner = run_case_isolated if isolated else run_ingest_case
+            result = runner(path, rows, width, trace_memory)
+            print(
+                f"[bench] rows={rows} width={width} total={result['total_seconds']}s "
+                f"rows/s={result['rows_per_second']} peak_rss={result['peak_rss_mb']}MB",
+                file=sys.stderr,
+            )
+            results.append(result)
+
+    return {
+        'benchmark': 'ingest',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'seed': seed,
+        'results': results,
+    }
+
+
+def compare_reports(baseline, current):
+    """比較兩份報告，回傳每個案例與階段的耗時比值（current / baseline）。"""
+    baseline_cases = {(r['rows'], r['width']): r for r in baseline.get('results', [])}
+    comparison = []
+    for result in current.get('results', []):
+        base = baseline_cases.get((result['rows'], result['width']))
+        if not base:
+            continue
+        stage_ratios = {}
+        for stage_name, stage in result['stages'].items():
+            base_seconds = base['stages'].get(stage_name, {}).get('seconds')
+            if base_seconds:
+                stage_ratios[stage_name] = round(stage['seconds'] / base_seconds, 3)
+        comparison.append({
+            'rows': result['rows'],
+            'width': result['width'],
+            'total_ratio': round(result['total_seconds'] / base['total_seconds'], 3) if base['total_seconds'] else None,
+            'stage_ratios': stage_ratios,
+        })
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Excel 匯入流程效能基準測試')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='每個活頁簿的資料筆數')
+    parser.add_argument('--widths', type=int, nargs='+', default=DEFAULT_WIDTHS, help='活頁簿總欄位數')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workbook-dir', default=os.path.join(tempfile.gettempdir(), 'student-ingest-bench'),
+                        help='合成活頁簿快取目錄')
+    parser.add_argument('--output', help='將 JSON 結果寫入檔案（預設輸出至 stdout）')
+    parser.add_argument('--compare', help='與先前輸出的 JSON 結果比較')
+    parser.add_argument('--in-process', action='store_true', help='不使用子行程（峰值記憶體會累計）')
+    parser.add_argument('--trace-memory', action='store_true', help='以 tracemalloc 量測各階段峰值（會拖慢執行）')
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(
+        args.rows,
+        args.widths,
+        args.workbook_dir,
+        seed=args.seed,
+        isolated=not args.in_process,
+        trace_memory=args.trace_memory,
+    )
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['comparison'] = {'baseline': args.compare, 'cases': compare_reports(json.load(f), report)}
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
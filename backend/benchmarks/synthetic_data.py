@@ -0,0 +1,89 @@
+"""
+合成學生資料產生器（僅供 benchmark 使用）
+
+產生的欄位與真實上傳的學生資料表相同：年度、性別、畢業學校、高中別、入學管道、地區，
+其餘欄位為科目成績。成績中混入少量空值與非數值（例如「缺考」），以貼近實際資料。
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+DIMENSION_COLUMNS = ['年度', '性別', '畢業學校', '高中別', '入學管道', '地區']
+SUBJECT_COLUMNS = ['會計學', '計算機概論', '微積分', '基礎程式設計', '統計1', '經濟學', '程式設計', '管理學', '統計2']
+
+GENDER_VALUES = ['男', '女', 'M', 'F', '男生', '女生']
+SCHOOL_TYPE_VALUES = ['國立', '市立', '縣立', '私立', '財團法人', '私大轉', '科大轉', '國大轉', '僑生', '']
+ADMISSION_VALUES = ['申請入學', '繁星推薦', '(自然組)', '(社會組)', '僑生', '【願景】', '考試分發', '']
+CITY_VALUES = [
+    '台北市', '臺北市', '新北市', '基隆市', '宜蘭縣', '桃園市', '新竹市', '新竹縣',
+    '苗栗縣', '台中市', '臺中市', '彰化縣', '南投縣', '雲林縣',
+    '嘉義市', '嘉義縣', '台南市', '臺南市', '高雄市', '屏東縣',
+    '花蓮縣', '台東縣', '臺東縣', '台北市大安區', '高雄市前鎮區', '馬來西亞', '',
+]
+SCHOOL_PREFIXES = ['國立', '市立', '縣立', '私立', '財團法人私立']
+
+
+def build_school_names(count, rng):
+    """產生指定數量的高中名稱，模擬數百所不同學校。"""
+    cities = [city for city in CITY_VALUES if city and len(city) == 3]
+    names = []
+    for index in range(count):
+        prefix = SCHOOL_PREFIXES[index % len(SCHOOL_PREFIXES)]
+        city = cities[int(rng.integers(len(cities)))]
+        names.append(f'{prefix}{city[:2]}第{index + 1}高級中學')
+    return names
+
+
+def subject_column_names(width):
+    """依總欄位數決定科目欄位名稱，超出預設科目時以「選修N」補足。"""
+    subject_count = max(1, width - len(DIMENSION_COLUMNS))
+    names = SUBJECT_COLUMNS[:subject_count]
+    for index in range(len(names), subject_count):
+        names.append(f'選修{index - len(SUBJECT_COLUMNS) + 1}')
+    return names
+
+
+def generate_student_frame(rows, width=15, years=20, school_count=300, seed=0):
+    """
+    產生合成學生資料 DataFrame
+    rows: 資料筆數
+    width: 總欄位數（6 個維度欄位 + 科目欄位）
+    years: 年度數量（自 100 學年度起）
+    """
+    rng = np.random.default_rng(seed)
+    school_names = np.array(build_school_names(school_count, rng), dtype=object)
+
+    data = {
+        '年度': (100 + rng.integers(0, years, size=rows)).astype(str),
+        '性別': np.array(GENDER_VALUES, dtype=object)[rng.integers(0, len(GENDER_VALUES), size=rows)],
+        '畢業學校': school_names[rng.zipf(1.3, size=rows) % school_count],
+        '高中別': np.array(SCHOOL_TYPE_VALUES, dtype=object)[rng.integers(0, len(SCHOOL_TYPE_VALUES), size=rows)],
+        '入學管道': np.array(ADMISSION_VALUES, dtype=object)[rng.integers(0, len(ADMISSION_VALUES), size=rows)],
+        '地區': np.array(CITY_VALUES, dtype=object)[rng.integers(0, len(CITY_VALUES), size=rows)],
+    }
+
+    for subject in subject_column_names(width):
+        scores = np.clip(rng.normal(70, 15, size=rows), 0, 100).round(0).astype(object)
+        missing = rng.random(rows)
+        scores[missing < 0.05] = None
+        scores[(missing >= 0.05) & (missing < 0.06)] = '缺考'
+        data[subject] = scores
+
+    return pd.DataFrame(data)
+
+
+def write_student_workbook(path, rows, width=15, years=20, sheet_name='學生資料', seed=0):
+    """將合成資料寫成 Excel 檔；使用 openpyxl write-only 模式以支援數十萬筆資料。"""
+    from openpyxl import Workbook
+
+    df = generate_student_frame(rows, width=width, years=years, seed=seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_name)
+    sheet.append(df.columns.tolist())
+    for row in df.itertuples(index=False, name=None):
+        sheet.append(list(row))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    workbook.save(path)
+    return path
@@ -4,7 +4,8 @@ from flask_jwt_extended import jwt_required
 from service import analysis_service
 
 
-def create_analysis_blueprint():
+def create_analysis_blueprint(analysis_cache=None, table_frame_cache=None, column_sketch_store=None, analysis_pool=None,
+                              table_sample_store=None, table_aggregate_store=None, table_cube_store=None):
     analysis_bp = Blueprint("analysis", __name__)
 
     def to_http(result):
@@ -14,76 +15,109 @@ def create_analysis_blueprint():
             payload, status = result, 200
         return jsonify(payload), status
 
+    def run_cached(endpoint, service_fn):
+        data = request.get_json(silent=True) or {}
+        if analysis_cache is None:
+            return to_http(service_fn(data))
+        return to_http(analysis_cache.get_or_compute(endpoint, data, lambda: service_fn(data)))
+
+    def run_analysis(endpoint):
+        data = request.get_json(silent=True) or {}
+        if data.get('table_names'):
+            # 多個資料表的虛擬聯集，各資料表同時掃描後合併（見 analysis_service.union_analysis）
+            return run_cached(endpoint, lambda data: analysis_service.union_analysis(endpoint, data))
+        if data.get('approximate'):
+            # 以抽樣資料回傳估計值與信賴區間，精確結果在背景計算後存入快取（見 analysis_service.approximate_analysis）
+            return to_http(analysis_service.approximate_analysis(endpoint, data, analysis_cache))
+        # 大型資料表的 CPU 密集分析依行程池策略改在子行程計算（見 analysis_service.run_analysis）
+        return run_cached(endpoint, lambda data: analysis_service.run_analysis(endpoint, data))
+
     @analysis_bp.route('/api/column_stats', methods=['POST'])
     @jwt_required()
     def column_stats():
-        data = request.get_json(silent=True) or {}
-        return to_http(analysis_service.column_stats(data))
+        return run_analysis('column_stats')
 
     @analysis_bp.route('/api/multi_subject_stats', methods=['POST'])
     @jwt_required()
     def multi_subject_stats():
-        data = request.get_json(silent=True) or {}
-        return to_http(analysis_service.multi_subject_stats(data))
+        return run_analysis('multi_subject_stats')
 
     @analysis_bp.route('/api/yearly_admission_stats', methods=['POST'])
     @jwt_required()
     def yearly_admission_stats():
-        data = request.get_json(silent=True) or {}
-        return to_http(analysis_service.yearly_admission_stats(data))
+        return run_analysis('yearly_admission_stats')
 
     @analysis_bp.route('/api/school_source_stats', methods=['POST'])
     @jwt_required()
     def school_source_stats():
-        data = request.get_json(silent=True) or {}
-        return to_http(analysis_service.school_source_stats(data))
+        return run_analysis('school_source_stats')
 
     @analysis_bp.route('/api/admission_method_stats', methods=['POST'])
     @jwt_required()
     def admission_method_stats():
-        data = request.get_json(silent=True) or {}
-        return to_http(analysis_service.admission_method_stats(data))
+        return run_analysis('admission_method_stats')
 
     @analysis_bp.route('/api/geographic_stats', methods=['POST'])
     @jwt_required()
     def geographic_stats():
-        data = request.get_json(silent=True) or {}
-        return to_http(analysis_service.geographic_stats(data))
+        return run_analysis('geographic_stats')
 
     @analysis_bp.route('/api/top_schools_stats', methods=['POST'])
     @jwt_required()
     def top_schools_stats():
-        data = request.get_json(silent=True) or {}
-        return to_http(analysis_service.top_schools_stats(data))
+        return run_analysis('top_schools_stats')
 
     @analysis_bp.route('/api/subject_average_stats', methods=['POST'])
     @jwt_required()
     def subject_average_stats():
-        data = request.get_json(silent=True) or {}
-        return to_http(analysis_service.subject_average_stats(data))
+        return run_analysis('subject_average_stats')
 
     @analysis_bp.route('/api/analysis/gender-subject', methods=['POST'])
     @jwt_required()
     def gender_subject_analysis():
-        data = request.get_json(silent=True) or {}
-        return to_http(analysis_service.gender_subject_analysis(data))
+        return run_analysis('gender_subject_analysis')
 
     @analysis_bp.route('/api/analysis/admission-subject', methods=['POST'])
     @jwt_required()
     def admission_subject_analysis():
-        data = request.get_json(silent=True) or {}
-        return to_http(analysis_service.admission_subject_analysis(data))
+        return run_analysis('admission_subject_analysis')
 
     @analysis_bp.route('/api/analysis/school-type-subject', methods=['POST'])
     @jwt_required()
     def school_type_subject_analysis():
-        data = request.get_json(silent=True) or {}
-        return to_http(analysis_service.school_type_subject_analysis(data))
+        return run_analysis('school_type_subject_analysis')
 
     @analysis_bp.route('/api/analysis/region-subject', methods=['POST'])
     @jwt_required()
     def region_subject_analysis():
+        return run_analysis('region_subject_analysis')
+
+    @analysis_bp.route('/api/analysis/subject-correlation', methods=['POST'])
+    @jwt_required()
+    def subject_correlation_analysis():
+        return run_analysis('subject_correlation_analysis')
+
+    @analysis_bp.route('/api/analysis/pivot', methods=['POST'])
+    @jwt_required()
+    def pivot_analysis():
+        return run_analysis('pivot_analysis')
+
+    @analysis_bp.route('/api/analysis/batch', methods=['POST'])
+    @jwt_required()
+    def batch_analysis():
         data = request.get_json(silent=True) or {}
-        return to_http(analysis_service.region_subject_analysis(data))
+        return to_http(analysis_service.batch_analysis(data, analysis_cache))
+
+    @analysis_bp.route('/api/analysis/cache_stats', methods=['GET'])
+    @jwt_required()
+    def analysis_cache_stats():
+        stats = analysis_cache.stats() if analysis_cache is not None else {'enabled': False}
+        stats['frames'] = table_frame_cache.stats() if table_frame_cache is not None else {'enabled': False}
+        stats['sketches'] = column_sketch_store.stats() if column_sketch_store is not None else {'enabled': False}
+        stats['pool'] = analysis_pool.stats() if analysis_pool is not None else {'enabled': False}
+        stats['samples'] = table_sample_store.stats() if table_sample_store is not None else {'enabled': False}
+        stats['aggregates'] = table_aggregate_store.stats() if table_aggregate_store is not None else {'enabled': False}
+        stats['cube'] = table_cube_store.stats() if table_cube_store is not None else {'enabled': False}
+        return jsonify(stats), 200
 
     return analysis_bp
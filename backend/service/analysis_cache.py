@@ -0,0 +1,194 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    """同一個快取鍵正在進行中的計算，並行的相同請求等待這份結果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _as_response(result):
+    """將 service 回傳值統一為 (payload, status)"""
+    if isinstance(result, tuple) and len(result) == 2:
+        return result
+    return result, 200
+
+
+class AnalysisCache:
+    """
+    分析端點的結果快取
+    - 快取鍵 = 端點名稱 + 資料表版本 + 正規化後的請求內容（JSON 排序鍵）；
+      跨資料表分析（table_names）的鍵包含每個資料表的版本，任一資料表變更即失效
+    - 資料列新增/修改/刪除、上傳與刪除檔案後呼叫 invalidate_table() 遞增資料表版本；
+      整個資料庫被替換（背景還原）時呼叫 clear()
+    - 依結果序列化後的位元組數做 LRU 淘汰，總量不超過 max_bytes
+    - 相同快取鍵同時未命中時只計算一次，其他請求等待同一份結果
+    快取存在行程記憶體中（部署為單一 gunicorn worker + 多執行緒）
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._versions = {}
+        self._epoch = 0
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._saved_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def table_version(self, table_name):
+        with self._lock:
+            return self._versions.get(table_name, 0)
+
+    def invalidate_table(self, table_name):
+        """資料表內容變更（須在寫入 commit 之後呼叫），該表的舊結果立即移除"""
+        with self._lock:
+            self._versions[table_name] = self._versions.get(table_name, 0) + 1
+            self._invalidations += 1
+            for key in [key for key in self._entries if table_name in key[1]]:
+                self._bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        """資料庫檔案被替換時清除全部結果；進行中的計算會存到舊 epoch，不會再被命中"""
+        with self._lock:
+            self._epoch += 1
+            self._invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_or_compute(self, endpoint, data, compute):
+        """
+        回傳 (payload, status)；只快取 status 200 的結果
+        請求內容沒有 table_name / table_names 或無法正規化時直接計算，不經過快取
+        """
+        key = self._make_key(endpoint, data)
+        if key is None:
+            return _as_response(compute())
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                self._saved_seconds += entry[2]
+                return entry[0], 200
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._misses += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        started = time.perf_counter()
+        try:
+            flight.result = _as_response(compute())
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            payload, status = flight.result if flight.result is not None else (None, None)
+            size = self._payload_size(key, payload) if status == 200 else None
+            with self._lock:
+                self._flights.pop(key, None)
+                if size is not None:
+                    self._store(key, payload, size, time.perf_counter() - started)
+            flight.done.set()
+
+    def peek(self, endpoint, data):
+        """回傳已快取的 payload（計入命中），沒有時回傳 None；不計算也不等待進行中的計算"""
+        key = self._make_key(endpoint, data)
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            self._saved_seconds += entry[2]
+            return entry[0]
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses + self._coalesced
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'coalesced': self._coalesced,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else None,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+                'saved_seconds': round(self._saved_seconds, 3),
+                'in_flight': len(self._flights),
+            }
+
+    def _make_key(self, endpoint, data):
+        if not self.enabled or not isinstance(data, dict):
+            return None
+        table_names = data['table_names'] if 'table_names' in data else [data.get('table_name')]
+        if not isinstance(table_names, list) or not table_names or not all(
+            isinstance(table_name, str) and table_name for table_name in table_names
+        ):
+            return None
+        table_names = tuple(sorted(set(table_names)))
+        try:
+            body = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        except (TypeError, ValueError):
+            return None
+        with self._lock:
+            return endpoint, table_names, self._epoch, self._table_versions(table_names), body
+
+    def _table_versions(self, table_names):
+        """呼叫端須持有 self._lock"""
+        return tuple(self._versions.get(table_name, 0) for table_name in table_names)
+
+    @staticmethod
+    def _payload_size(key, payload):
+        try:
+            encoded = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str)
+        except (TypeError, ValueError):
+            return None
+        return len(encoded.encode('utf-8')) + len(key[-1].encode('utf-8'))
+
+    def _store(self, key, payload, size, compute_seconds):
+        """呼叫端須持有 self._lock"""
+        _, table_names, epoch, versions, _ = key
+        if size > self.max_bytes or epoch != self._epoch or versions != self._table_versions(table_names):
+            # 計算期間資料表已變更，結果不會再被命中
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[1]
+        self._entries[key] = (payload, size, compute_seconds)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted[1]
+            self._evictions += 1
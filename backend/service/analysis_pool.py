@@ -0,0 +1,201 @@
+import gc
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from service.table_frame import EncodedColumn, TableFrame
+
+# 預設改在子行程計算的分析：以 pandas 計算為主、大型資料表上會長時間持有 GIL 的端點
+# （其餘端點的計算主要是 SQLite 的 GROUP BY，查詢期間不持有 GIL）
+OFFLOAD_ANALYSES = (
+    'subject_average_stats',
+    'multi_subject_stats',
+    'gender_subject_analysis',
+    'admission_subject_analysis',
+    'school_type_subject_analysis',
+    'region_subject_analysis',
+    'subject_correlation_analysis',
+)
+DEFAULT_MIN_ROWS = 100000
+
+# 共用記憶體中各陣列的起始位置對齊（位元組）
+_ALIGNMENT = 64
+
+
+def parse_pool_policy(text, min_rows=DEFAULT_MIN_ROWS):
+    """
+    各分析改在子行程計算的資料列門檻 {analysis: min_rows}：OFFLOAD_ANALYSES 預設使用 min_rows，
+    text 為逗號分隔的 analysis=rows 覆寫（rows 為 off 時該分析一律在請求執行緒內計算）
+    """
+    policy = dict.fromkeys(OFFLOAD_ANALYSES, min_rows)
+    for item in (text or '').split(','):
+        name, _, value = item.partition('=')
+        name, value = name.strip(), value.strip()
+        if not name:
+            continue
+        if value.lower() == 'off':
+            policy.pop(name, None)
+        else:
+            policy[name] = int(value)
+    return policy
+
+
+def share_frame(frame):
+    """
+    將 TableFrame 的欄位代碼（codes）與已轉換的數值欄位複製到一塊 SharedMemory，回傳 (handle, segment)
+    handle 只記錄各陣列的位置與不重複值（uniques），傳給子行程時不必 pickle 整份資料；
+    非字典編碼的欄位（含數值等原始值）uniques 即整欄原始值，仍隨 handle 傳送
+    呼叫端用完後須 close() 並 unlink() segment
+    """
+    arrays = [
+        *(('numeric', name, values) for name, values in frame.numeric_columns.items()),
+        *(('codes', name, column.codes) for name, column in frame.columns.items()),
+    ]
+    layouts = []
+    size = 0
+    for _, _, array in arrays:
+        layouts.append((size, array.dtype.str, len(array)))
+        size += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+
+    segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for (_, _, array), (offset, dtype, length) in zip(arrays, layouts):
+        np.ndarray((length,), dtype=dtype, buffer=segment.buf, offset=offset)[:] = array
+
+    handle = {'segment': segment.name, 'table_name': frame.table_name, 'size': size, 'columns': [], 'numeric': []}
+    for (kind, name, _), layout in zip(arrays, layouts):
+        if kind == 'numeric':
+            handle['numeric'].append((name, layout))
+        else:
+            column = frame.columns[name]
+            handle['columns'].append((name, layout, column.uniques, column.distinct))
+    return handle, segment
+
+
+def attach_frame(handle):
+    """子行程中由 share_frame 的 handle 重建 TableFrame（codes 與數值欄位直接指向共用記憶體），回傳 (frame, segment)"""
+    segment = shared_memory.SharedMemory(name=handle['segment'])
+
+    def view(layout):
+        offset, dtype, length = layout
+        array = np.ndarray((length,), dtype=dtype, buffer=segment.buf, offset=offset)
+        array.flags.writeable = False
+        return array
+
+    columns = {
+        name: EncodedColumn.from_parts(view(layout), uniques, distinct)
+        for name, layout, uniques, distinct in handle['columns']
+    }
+    numeric_columns = {name: view(layout) for name, layout in handle['numeric']}
+    return TableFrame.from_encoded(handle['table_name'], columns, numeric_columns), segment
+
+
+def release_frame(segment):
+    """子行程用完 attach_frame 的資料後關閉共用記憶體（仍有陣列參照時先回收）"""
+    try:
+        segment.close()
+    except BufferError:
+        gc.collect()
+        try:
+            segment.close()
+        except BufferError:
+            print(f"[WARNING] 共用記憶體 {segment.name} 仍有參照，暫不關閉")
+
+
+class AnalysisPool:
+    """
+    CPU 密集分析的行程池：部署為單一 gunicorn worker + 多執行緒，pandas 計算期間持有 GIL，
+    大型資料表的分析會拖慢同一行程的其他請求（登入、資料瀏覽）
+    - policy {analysis: min_rows}：資料表筆數達門檻的分析改在子行程計算，其餘在請求執行緒內計算
+    - 子行程以 forkserver（不支援時 spawn）啟動，不繼承主行程的執行緒與連線；第一次使用時才建立
+    - 子行程異常結束時行程池失效，下次使用時重新建立
+    max_workers 為 0 時停用
+    """
+
+    def __init__(self, max_workers=0, policy=None):
+        self.max_workers = max_workers
+        self.policy = dict(parse_pool_policy(None) if policy is None else policy)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._offloaded = 0
+        self._inline = 0
+        self._failures = 0
+        self._starts = 0
+        self._worker_seconds = 0.0
+        self._shared_bytes = 0
+
+    @property
+    def enabled(self):
+        return self.max_workers > 0
+
+    def applies_to(self, analysis):
+        return self.enabled and analysis in self.policy
+
+    def should_offload(self, analysis, row_count):
+        """依 policy 決定是否改在子行程計算，並記錄決定結果"""
+        offload = self.applies_to(analysis) and row_count >= self.policy[analysis]
+        with self._lock:
+            if offload:
+                self._offloaded += 1
+            else:
+                self._inline += 1
+        return offload
+
+    def run(self, fn, *args, shared_bytes=0):
+        """在子行程執行 fn(*args) 並等待結果；行程池失效時拋出 BrokenProcessPool，由呼叫端改在本行程計算"""
+        executor = self._get_executor()
+        started = time.perf_counter()
+        try:
+            result = executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise
+        with self._lock:
+            self._worker_seconds += time.perf_counter() - started
+            self._shared_bytes += shared_bytes
+        return result
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'max_workers': self.max_workers,
+                'running': self._executor is not None,
+                'policy': dict(self.policy),
+                'offloaded': self._offloaded,
+                'inline': self._inline,
+                'failures': self._failures,
+                'starts': self._starts,
+                'worker_seconds': round(self._worker_seconds, 3),
+                'shared_bytes': self._shared_bytes,
+            }
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                if context.get_start_method() == 'forkserver':
+                    # 分析模組在 forkserver 中匯入一次，之後建立的子行程直接繼承
+                    context.set_forkserver_preload(['service.analysis_service'])
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+                self._starts += 1
+                print(f"[INFO] 分析行程池已啟動（{self.max_workers} 個子行程，{context.get_start_method()}）")
+            return self._executor
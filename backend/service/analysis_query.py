@@ -0,0 +1,250 @@
+"""
+分析查詢的共用元件
+- QuerySpec：宣告式的查詢規格（投影欄位、篩選條件、分組、量值欄位、筆數上限），
+  compile_query 編譯為單一參數化 SQL；TableFrame 也以相同的篩選條件在記憶體中計算，所有分析端點共用同一條查詢路徑
+- 分組查詢回傳各原始值組合的可合併部分彙總（筆數、有效數值筆數、總和、平方和、最小、最大），
+  分類維度（學校類型、入學管道、地區等）只對不重複的原始值分類，再合併部分彙總
+"""
+from collections import namedtuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from service.classification import classify_distinct
+from service.column_sketch import parse_number
+
+# 維度：欄位 + 分類器名稱（None 表示直接使用原始值）
+Dimension = namedtuple('Dimension', ['column', 'classifier'])
+
+# 量值：count 計算資料列數（指定欄位時改為有效數值筆數），mean / min / max / sum 作用於欄位轉換後的數值
+Measure = namedtuple('Measure', ['type', 'column'])
+
+# 篩選：op 為 in / eq / not_empty / not_null；any_not_null 時 column 為 None、values 為欄位清單（任一欄位非 NULL）
+Filter = namedtuple('Filter', ['column', 'op', 'values'])
+
+# 查詢規格：grouped 時依 columns 分組並回傳部分彙總（PARTIAL_AGGREGATIONS，無量值欄位時只有筆數）；
+# columns 為空的分組查詢回傳整個資料表的單列彙總
+QuerySpec = namedtuple(
+    'QuerySpec',
+    ['table_name', 'columns', 'filters', 'grouped', 'measure_column', 'limit'],
+    defaults=((), False, None, None),
+)
+
+MEASURE_TYPES = ('count', 'mean', 'min', 'max', 'sum')
+# 前端可使用的篩選條件（any_not_null 只供內部使用）
+FILTER_OPS = ('in', 'eq', 'not_empty', 'not_null')
+MAX_ROW_DIMENSIONS = 3
+MAX_FILTER_VALUES = 500
+
+# 部分彙總欄位名稱
+ROWS = '_rows'
+VALUE_COUNT = '_value_count'
+VALUE_TOTAL = '_value_total'
+VALUE_SUM_SQ = '_value_sum_sq'
+VALUE_MIN = '_value_min'
+VALUE_MAX = '_value_max'
+PARTIAL_AGGREGATIONS = {
+    ROWS: 'sum', VALUE_COUNT: 'sum', VALUE_TOTAL: 'sum', VALUE_SUM_SQ: 'sum', VALUE_MIN: 'min', VALUE_MAX: 'max',
+}
+
+
+def numeric_sql(column):
+    """
+    欄位值轉為數值的 SQL 運算式（規則同 parse_number，無法轉換時為 NULL）
+    SQLite 本身可辨識的數值字串（與 REAL 比較時套用 NUMERIC affinity 後相等）直接 CAST，
+    其餘（千分位逗號、全形數字、文字等）才呼叫註冊的 parse_number 函式
+    """
+    quoted = f'"{column}"'
+    return f'CASE WHEN CAST({quoted} AS REAL) = {quoted} THEN CAST({quoted} AS REAL) ELSE parse_number({quoted}) END'
+
+
+def register_numeric_function(session):
+    """在本次查詢使用的 SQLite 連線上註冊 parse_number（重複註冊只是覆蓋）"""
+    connection = session.connection().connection.driver_connection
+    connection.create_function('parse_number', 1, parse_number, deterministic=True)
+
+
+def parse_dimension(spec, resolve_fn, classifiers, label):
+    """維度可為欄位名稱字串或 { column, classifier }；格式錯誤時拋出 ValueError"""
+    if isinstance(spec, str):
+        spec = {'column': spec}
+    if not isinstance(spec, dict) or not spec.get('column'):
+        raise ValueError(f'{label}格式錯誤，須為欄位名稱或 {{ column, classifier }}')
+    classifier = spec.get('classifier')
+    if classifier is not None and classifier not in classifiers:
+        raise ValueError(f'不支援的分類器: {classifier}，可用：{list(classifiers)}')
+    return Dimension(resolve_fn(spec['column'], label), classifier)
+
+
+def parse_measure(spec, resolve_fn):
+    spec = spec or {'type': 'count'}
+    if isinstance(spec, str):
+        spec = {'type': spec}
+    measure_type = spec.get('type', 'count') if isinstance(spec, dict) else None
+    if measure_type not in MEASURE_TYPES:
+        raise ValueError(f'measure.type 必須為 {"、".join(MEASURE_TYPES)} 之一')
+    column = spec.get('column')
+    if measure_type != 'count' and not column:
+        raise ValueError(f'measure {measure_type} 需要指定 column')
+    return Measure(measure_type, resolve_fn(column, '量值欄位') if column else None)
+
+
+def parse_filters(specs, resolve_fn):
+    if specs is None:
+        return []
+    if not isinstance(specs, list):
+        raise ValueError('filters 必須為清單')
+    filters = []
+    for spec in specs:
+        if not isinstance(spec, dict) or spec.get('op', 'in') not in FILTER_OPS or not spec.get('column'):
+            raise ValueError(f'篩選條件格式錯誤，須為 {{ column, op: {"/".join(FILTER_OPS)}, values }}')
+        op = spec.get('op', 'in')
+        values = ()
+        if op == 'eq':
+            values = (spec.get('value'),)
+        elif op == 'in':
+            values = spec.get('values')
+            if not isinstance(values, list) or not values or len(values) > MAX_FILTER_VALUES:
+                raise ValueError(f'in 篩選條件需要 1 到 {MAX_FILTER_VALUES} 個 values')
+            values = tuple(values)
+        filters.append(Filter(resolve_fn(spec['column'], '篩選欄位'), op, values))
+    return filters
+
+
+def row_filters(not_empty=(), years_col=None, years=None, any_not_null=()):
+    """分析端點常用的條件：not_empty 各欄位非空、years_col IN years（有指定時）、any_not_null 任一欄位非 NULL"""
+    filters = [Filter(column, 'not_empty', ()) for column in not_empty]
+    if years:
+        filters.append(Filter(years_col, 'in', tuple(years)))
+    if any_not_null:
+        filters.append(Filter(None, 'any_not_null', tuple(any_not_null)))
+    return filters
+
+
+def spec_columns(spec):
+    """查詢用到的所有欄位（投影 + 篩選 + 量值），依序去重"""
+    columns = list(spec.columns)
+    for condition in spec.filters:
+        columns.extend(condition.values if condition.op == 'any_not_null' else [condition.column])
+    if spec.measure_column is not None:
+        columns.append(spec.measure_column)
+    return list(dict.fromkeys(columns))
+
+
+def partial_columns(spec):
+    """分組查詢結果中部分彙總的欄位名稱"""
+    return [ROWS] if spec.measure_column is None else list(PARTIAL_AGGREGATIONS)
+
+
+def _compile_filters(filters):
+    conditions = []
+    params = {}
+    for index, condition in enumerate(filters):
+        column = f'"{condition.column}"'
+        if condition.op == 'not_empty':
+            conditions.append(f'{column} IS NOT NULL AND {column} != \'\'')
+        elif condition.op == 'not_null':
+            conditions.append(f'{column} IS NOT NULL')
+        elif condition.op == 'any_not_null':
+            conditions.append('(' + ' OR '.join(f'"{col}" IS NOT NULL' for col in condition.values) + ')')
+        else:
+            placeholders = []
+            for value_index, value in enumerate(condition.values):
+                key = f'f{index}_{value_index}'
+                params[key] = None if value is None else str(value)
+                placeholders.append(f':{key}')
+            conditions.append(f'{column} IN ({", ".join(placeholders)})')
+    return conditions, params
+
+
+def compile_query(spec):
+    """
+    將 QuerySpec 編譯為 (text, params)：只 SELECT 用到的欄位，篩選條件全部在 WHERE 中完成（參數化）
+    分組且有量值欄位時數值轉換在 SQLite 中進行（執行前需 register_numeric_function）
+    """
+    conditions, params = _compile_filters(spec.filters)
+    where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+    keys = [f'"{col}"' for col in spec.columns]
+    limit = f' LIMIT {int(spec.limit)}' if spec.limit is not None else ''
+
+    if not spec.grouped:
+        return text(f'SELECT {", ".join(keys)} FROM "{spec.table_name}"{where}{limit}'), params
+
+    group_by = f' GROUP BY {", ".join(keys)}' if keys else ''
+    if spec.measure_column is None:
+        select = ', '.join([*keys, f'COUNT(*) AS {ROWS}'])
+        return text(f'SELECT {select} FROM "{spec.table_name}"{where}{group_by}{limit}'), params
+
+    # LIMIT -1 使子查詢不被展開到外層，每列只轉換一次數值
+    select = ', '.join([
+        *keys, f'COUNT(*) AS {ROWS}', f'COUNT(_v) AS {VALUE_COUNT}', f'TOTAL(_v) AS {VALUE_TOTAL}',
+        f'TOTAL(_v * _v) AS {VALUE_SUM_SQ}', f'MIN(_v) AS {VALUE_MIN}', f'MAX(_v) AS {VALUE_MAX}',
+    ])
+    inner = ', '.join([*keys, f'{numeric_sql(spec.measure_column)} AS _v'])
+    return text(
+        f'SELECT {select} FROM (SELECT {inner} FROM "{spec.table_name}"{where} LIMIT -1){group_by}{limit}'
+    ), params
+
+
+def run_query(session, spec):
+    """
+    直接在資料庫執行 QuerySpec：非分組查詢回傳 tuple 清單，分組查詢回傳 DataFrame（columns + 部分彙總欄位）
+    （分析端點經由 analysis_service 執行，有記憶體欄位資料時改由 TableFrame 計算）
+    """
+    if spec.grouped and spec.measure_column is not None:
+        register_numeric_function(session)
+    rows = session.execute(*compile_query(spec)).fetchall()
+    if not spec.grouped:
+        return rows
+    return pd.DataFrame(rows, columns=[*spec.columns, *partial_columns(spec)])
+
+
+def dimension_keys(df, dimensions, classifiers):
+    """各維度的鍵值 Series：分類維度只對不重複原始值分類（空值以空字串交給分類器）"""
+    keys = []
+    for dimension in dimensions:
+        values = df[dimension.column]
+        if dimension.classifier:
+            values = classify_distinct(values.where(values.notna(), ''), classifiers[dimension.classifier])
+        keys.append(values.rename(None))
+    return keys
+
+
+def combine_partials(df, keys):
+    """依鍵值合併部分彙總；keys 為空時回傳單列的總計"""
+    partials = [col for col in PARTIAL_AGGREGATIONS if col in df.columns]
+    aggregations = {col: PARTIAL_AGGREGATIONS[col] for col in partials}
+    if not keys:
+        return df[partials].agg(aggregations).to_frame().T
+    return df[partials].groupby(keys, sort=False, dropna=False).agg(aggregations)
+
+
+def measure_value(partial, measure, ndigits=2):
+    """由一列部分彙總計算量值；沒有有效數值時 mean / min / max 為 None"""
+    if measure.type == 'count':
+        return int(partial[VALUE_COUNT] if measure.column else partial[ROWS])
+    count = int(partial[VALUE_COUNT])
+    if not count:
+        return None
+    if measure.type == 'mean':
+        return round(float(partial[VALUE_TOTAL]) / count, ndigits)
+    if measure.type == 'sum':
+        return round(float(partial[VALUE_TOTAL]), ndigits)
+    return float(partial[VALUE_MIN] if measure.type == 'min' else partial[VALUE_MAX])
+
+
+def sort_key(value):
+    """維度鍵值排序：可轉為數字者依數值排在前，其餘依字串，空值最後"""
+    if value is None or (isinstance(value, float) and value != value):
+        return (2, 0.0, '')
+    number = parse_number(value)
+    if number is not None:
+        return (0, number, str(value))
+    return (1, 0.0, str(value))
+
+
+def key_value(value):
+    """鍵值轉為 JSON 可序列化的值（NaN 視為 None）"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
@@ -1,14 +1,44 @@
+import json
+import math
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+
+import numpy as np
 import pandas as pd
 
-from sqlalchemy import text
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 
+from service import analysis_query
+from service.analysis_pool import attach_frame, release_frame, share_frame
+from service.analysis_query import QuerySpec
+from service.classification import classify_distinct, normalize_city
+from service.column_sketch import (
+    DEFAULT_HISTOGRAM_BINS,
+    DEFAULT_PERCENTILES,
+    MAX_HISTOGRAM_BINS,
+    ColumnSketch,
+    exact_histogram,
+    exact_percentiles,
+    parse_number,
+)
+from service.table_frame import TableFrame, coerce_numeric, merge_grouped
+
 get_database_engine = None
 resolve_column_name = None
 auto_detect_subject_columns = None
 classify_school_type = None
 classify_admission_method = None
 classify_region = None
+table_frame_cache = None
+column_sketch_store = None
+analysis_pool = None
+table_sample_store = None
+table_aggregate_store = None
+table_cube_store = None
 
 
 def configure_analysis_service(
@@ -18,19 +48,421 @@ def configure_analysis_service(
     classify_school_type_fn,
     classify_admission_method_fn,
     classify_region_fn,
+    table_frame_cache_instance=None,
+    column_sketch_store_instance=None,
+    analysis_pool_instance=None,
+    table_sample_store_instance=None,
+    table_aggregate_store_instance=None,
+    table_cube_store_instance=None,
 ):
-    global get_database_engine, resolve_column_name, auto_detect_subject_columns, classify_school_type, classify_admission_method, classify_region
+    global get_database_engine, resolve_column_name, auto_detect_subject_columns, classify_school_type, classify_admission_method, classify_region, table_frame_cache, column_sketch_store, analysis_pool, table_sample_store
+    global table_aggregate_store, table_cube_store
     get_database_engine = get_database_engine_fn
     resolve_column_name = resolve_column_name_fn
     auto_detect_subject_columns = auto_detect_subject_columns_fn
     classify_school_type = classify_school_type_fn
     classify_admission_method = classify_admission_method_fn
     classify_region = classify_region_fn
+    table_frame_cache = table_frame_cache_instance
+    column_sketch_store = column_sketch_store_instance
+    analysis_pool = analysis_pool_instance
+    table_sample_store = table_sample_store_instance
+    table_aggregate_store = table_aggregate_store_instance
+    table_cube_store = table_cube_store_instance
+
+
+# _grouped_value_counts 回傳的筆數欄位名稱
+ROW_COUNT_COL = analysis_query.ROWS
+
+# 未指定年度欄位時自動偵測的候選名稱
+YEAR_COLUMN_CANDIDATES = ['年度', '入學年度', '學年度', 'year']
+
+# 批次分析期間共用的資料表狀態 {table_name: _SharedTable}；單一端點請求時為 None
+_shared_tables = ContextVar('analysis_shared_tables', default=None)
+
+
+class _SharedTable:
+    """批次分析中同一資料表的共用狀態：引擎與欄位只解析一次，所需欄位的聯集只讀取一次"""
+
+    def __init__(self, table_name, column_hints):
+        self.table_name = table_name
+        self.column_hints = column_hints
+        # 有分析會自動偵測欄位時，第一次就讀取全部欄位
+        self.load_all_columns = False
+        self.frame = None
+        # frame 為固定的欄位資料（子行程的共用記憶體、approximate 分析的抽樣資料）時不經由快取重新讀取
+        self.pinned = False
+        self.loads = 0
+        self.load_seconds = 0.0
+        self._engine = None
+
+    def engine(self):
+        if self._engine is None:
+            self._engine = get_database_engine(self.table_name)
+        return self._engine
+
+    def frame_with(self, columns, numeric=()):
+        """
+        回傳包含 columns 的共用欄位資料；缺少欄位時連同已讀取與預期會用到的欄位重新讀取一次
+        有行程內的資料表欄位快取時改由快取取得，loads 只計算實際讀取資料庫的次數
+        """
+        if self.frame is not None and self.frame.has_columns(columns):
+            # 使用快取時經由快取轉換數值欄位，記憶體用量才會計入
+            if self.pinned or not _frame_cache_enabled() or self.frame.has_numeric(numeric):
+                return self.frame
+        current_engine, _ = self.engine()
+        wanted = self._wanted_columns(columns)
+        started = time.perf_counter()
+        if _frame_cache_enabled():
+            self.frame, loaded = table_frame_cache.get(current_engine, self.table_name, wanted, numeric)
+        else:
+            self.frame, loaded = TableFrame.load(current_engine, self.table_name, wanted), True
+        if loaded:
+            self.loads += 1
+            self.load_seconds += time.perf_counter() - started
+        return self.frame
+
+    def _wanted_columns(self, columns):
+        """本次讀取的欄位：已讀取的欄位 + 預期會用到的欄位（column_hints 或全部欄位）+ columns"""
+        _, current_inspector = self.engine()
+        available_columns = [col['name'] for col in current_inspector.get_columns(self.table_name)]
+        wanted = list(self.frame.columns) if self.frame is not None else []
+        if self.load_all_columns:
+            wanted.extend(available_columns)
+        for hint in self.column_hints:
+            resolved = resolve_column_name(hint, available_columns, required=False)
+            safe_hint = hint.replace(' ', '_').replace('-', '_').replace('(', '').replace(')', '')
+            wanted.extend(col for col in (resolved, safe_hint) if col in available_columns)
+        wanted.extend(columns)
+        return wanted
+
+
+# 跨資料表分析中代表各資料列來源資料表的虛擬欄位，可作為分組維度或篩選欄位
+SOURCE_TABLE_COLUMN = '_source_table'
+MAX_UNION_TABLES = 12
+# 同時掃描的資料表數（不超過 SQLAlchemy 連線池預設的 5 條連線）
+UNION_SCAN_WORKERS = 4
+
+
+class _UnionInspector:
+    """虛擬聯集的欄位反射：各資料表欄位的聯集（依出現順序）+ SOURCE_TABLE_COLUMN"""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def get_columns(self, table_name):
+        return [{'name': column} for column in self.columns]
+
+
+class _UnionTable(_SharedTable):
+    """
+    多個資料表（各次上傳）組成的虛擬聯集（UNION ALL，欄位依名稱對齊，資料表沒有的欄位視為 NULL）
+    - 分組查詢在各資料表分別執行（各自使用增量彙總、欄位快取或 SQLite），同時掃描後合併部分彙總
+    - 需要資料列的查詢同時讀取各資料表的投影欄位後依資料表順序串接
+    """
+
+    def __init__(self, table_name, members, column_hints):
+        super().__init__(table_name, column_hints)
+        self.members = {member: _SharedTable(member, column_hints) for member in members}
+        self.member_columns = {}
+
+    def engine(self):
+        """回傳 (第一個資料表的引擎, _UnionInspector)；任一資料表不存在時拋出 ValueError"""
+        if self._engine is None:
+            first_engine = None
+            columns = []
+            for member, shared in self.members.items():
+                member_engine, member_inspector = shared.engine()
+                first_engine = first_engine or member_engine
+                self.member_columns[member] = [col['name'] for col in member_inspector.get_columns(member)]
+                columns.extend(self.member_columns[member])
+            self._engine = first_engine, _UnionInspector([*dict.fromkeys(columns), SOURCE_TABLE_COLUMN])
+        return self._engine
+
+    def _scan(self, fn):
+        """fn(member, shared) 以執行緒同時在各資料表執行（各自取得連線），依資料表順序回傳結果"""
+        workers = min(UNION_SCAN_WORKERS, len(self.members))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='union-scan') as executor:
+            futures = [executor.submit(fn, member, shared) for member, shared in self.members.items()]
+            return [future.result() for future in futures]
+
+    def frame_with(self, columns, numeric=()):
+        if self.frame is not None and self.frame.has_columns(columns):
+            return self.frame
+        wanted = list(dict.fromkeys(self._wanted_columns(columns)))
+
+        def load(member, shared):
+            present = [col for col in wanted if col in self.member_columns[member]]
+            # 沒有任何需要的欄位時仍讀取一個欄位以取得筆數
+            return shared.frame_with(present or self.member_columns[member][:1])
+
+        started = time.perf_counter()
+        frames = self._scan(load)
+        union_columns = {}
+        for column in wanted:
+            parts = []
+            for member, frame in zip(self.members, frames):
+                if column == SOURCE_TABLE_COLUMN:
+                    parts.append(np.full(frame.row_count, member, dtype=object))
+                elif column in frame.columns:
+                    parts.append(frame.columns[column].values())
+                else:
+                    parts.append(np.full(frame.row_count, None, dtype=object))
+            union_columns[column] = np.concatenate(parts)
+        self.frame = TableFrame(self.table_name, union_columns)
+        self.loads += 1
+        self.load_seconds += time.perf_counter() - started
+        return self.frame
+
+    def _member_spec(self, spec, member):
+        """
+        將聯集的 QuerySpec 轉為單一資料表的查詢，回傳 (spec, 固定值欄位)；
+        資料表沒有的欄位與來源資料表欄位以固定值補上，條件必定不成立時回傳 (None, None)
+        """
+        available = self.member_columns[member]
+        filters = []
+        for condition in spec.filters:
+            if condition.op == 'any_not_null':
+                if SOURCE_TABLE_COLUMN in condition.values:
+                    continue
+                present = tuple(col for col in condition.values if col in available)
+                if not present:
+                    return None, None
+                filters.append(condition._replace(values=present))
+            elif condition.column == SOURCE_TABLE_COLUMN:
+                if condition.op in ('in', 'eq') and member not in {str(value) for value in condition.values}:
+                    return None, None
+            elif condition.column in available:
+                filters.append(condition)
+            else:
+                # NULL 不符合任何篩選條件
+                return None, None
+        constants = {
+            col: member if col == SOURCE_TABLE_COLUMN else None for col in spec.columns if col not in available
+        }
+        member_spec = spec._replace(
+            table_name=member,
+            columns=[col for col in spec.columns if col in available],
+            filters=filters,
+            measure_column=spec.measure_column if spec.measure_column in available else None,
+            limit=None,
+        )
+        return member_spec, constants
+
+    def grouped(self, spec):
+        """等同 _query_grouped：各資料表同時執行分組查詢後以 merge_grouped 合併"""
+        self.engine()
+        partials = analysis_query.partial_columns(spec)
+
+        def run(member, shared):
+            member_spec, constants = self._member_spec(spec, member)
+            if member_spec is None:
+                return None
+            session = sessionmaker(bind=shared.engine()[0])()
+            try:
+                # 執行緒不繼承 _shared_tables，各資料表走一般的查詢路徑（增量彙總、欄位快取或 SQLite）
+                df = _query_grouped(session, member_spec)
+            finally:
+                session.close()
+            for column, value in constants.items():
+                df[column] = pd.Series([value] * len(df), index=df.index, dtype=object)
+            if spec.measure_column is not None and member_spec.measure_column is None:
+                # 資料表沒有量值欄位：沒有有效數值
+                df[analysis_query.VALUE_COUNT] = 0
+                df[analysis_query.VALUE_TOTAL] = 0.0
+                df[analysis_query.VALUE_SUM_SQ] = 0.0
+                df[analysis_query.VALUE_MIN] = None
+                df[analysis_query.VALUE_MAX] = None
+            return df[[*spec.columns, *partials]]
+
+        merged = merge_grouped([df for df in self._scan(run) if df is not None], spec.columns, spec.measure_column)
+        return merged.head(spec.limit) if spec.limit is not None else merged
+
+
+def _shared_table(table_name):
+    shared_tables = _shared_tables.get()
+    return shared_tables.get(table_name) if shared_tables else None
+
+
+def _frame_cache_enabled():
+    return table_frame_cache is not None and table_frame_cache.enabled
+
+
+def _table_frame(session, table_name, columns, numeric=()):
+    """
+    取得包含 columns 的記憶體欄位資料：批次分析期間使用共用資料表，否則使用行程內的資料表欄位快取
+    兩者皆無時回傳 None，由呼叫端直接查詢 SQLite
+    """
+    shared = _shared_table(table_name)
+    if shared is not None:
+        return shared.frame_with(columns, numeric)
+    if _frame_cache_enabled():
+        return table_frame_cache.get(session.get_bind(), table_name, columns, numeric)[0]
+    return None
+
+
+def _table_engine(table_name):
+    """取得 (engine, inspector)；批次分析期間同一資料表共用，欄位反射結果由 inspector 快取"""
+    shared = _shared_table(table_name)
+    if shared is not None:
+        return shared.engine()
+    return get_database_engine(table_name)
+
+
+def _query_rows(session, spec):
+    """執行非分組的 QuerySpec（tuple 清單）；有記憶體欄位資料（見 _table_frame）時直接過濾，不再查詢資料庫"""
+    frame = _table_frame(session, spec.table_name, analysis_query.spec_columns(spec))
+    if frame is not None:
+        return frame.select_rows(spec.columns, filters=spec.filters, limit=spec.limit)
+    return analysis_query.run_query(session, spec)
+
+
+def _query_grouped(session, spec):
+    """
+    執行分組的 QuerySpec，回傳 DataFrame：columns + 部分彙總欄位（analysis_query.partial_columns），
+    列數為不重複的值組合數而非資料筆數
+    資料表有增量彙總且查詢符合彙總範圍時直接讀取彙總（以固定的欄位資料計算時除外，例如 approximate 的抽樣資料）
+    """
+    shared = _shared_table(spec.table_name)
+    if isinstance(shared, _UnionTable):
+        return shared.grouped(spec)
+    if table_aggregate_store is not None and (shared is None or not shared.pinned):
+        df = table_aggregate_store.query(session, spec)
+        if df is not None:
+            return df
+    frame = _table_frame(session, spec.table_name, analysis_query.spec_columns(spec))
+    if frame is not None:
+        return frame.grouped(spec.columns, filters=spec.filters, measure_column=spec.measure_column)
+    return analysis_query.run_query(session, spec)
+
+
+def _select_rows(session, table_name, columns, not_empty=(), years_col=None, years=None, any_not_null=(), limit=None):
+    """
+    讀取 columns 的資料列（tuple 清單），條件：not_empty 各欄位非空、years_col IN years（有指定時）、
+    any_not_null 任一欄位非 NULL；limit 限制筆數
+    """
+    filters = analysis_query.row_filters(not_empty, years_col, years, any_not_null)
+    return _query_rows(session, QuerySpec(table_name, list(columns), filters, limit=limit))
+
+
+def _select_frame(session, table_name, columns, numeric=(), **conditions):
+    """
+    _select_rows 的 DataFrame 版本；numeric 中的欄位（科目成績）以 pd.to_numeric(errors='coerce') 轉為 float64
+    使用記憶體欄位資料時，轉換結果隨資料表快取保存，不必每次重新轉換
+    """
+    numeric = [col for col in numeric if col in columns]
+    spec = QuerySpec(table_name, list(columns), analysis_query.row_filters(**conditions))
+    frame = _table_frame(session, table_name, analysis_query.spec_columns(spec), numeric)
+    if frame is not None:
+        return frame.select_frame(spec.columns, numeric=numeric, filters=spec.filters)
+
+    df = pd.DataFrame(analysis_query.run_query(session, spec), columns=spec.columns)
+    for position, col in enumerate(columns):
+        if col in numeric:
+            df.isetitem(position, coerce_numeric(df.iloc[:, position]))
+    return df
+
+
+def _grouped_value_counts(session, table_name, columns, year_col, years=None):
+    """
+    各欄位原始值組合的筆數（只計算年度欄位非空的資料列，有指定 years 時再篩選 year_col IN years）
+    回傳 DataFrame：columns + [ROW_COUNT_COL]
+    """
+    filters = analysis_query.row_filters([year_col], year_col, years)
+    return _query_grouped(session, QuerySpec(table_name, list(columns), filters, grouped=True))
+
+
+def _cube_applies(table_name):
+    """OLAP cube 只用於直接讀取資料表的分析（固定的欄位資料與跨資料表的虛擬聯集沒有 cube）"""
+    shared = _shared_table(table_name)
+    return table_cube_store is not None and (shared is None or not (shared.pinned or isinstance(shared, _UnionTable)))
+
+
+def _cube_counts(session, table_name, year_col, dimensions):
+    """
+    由 OLAP cube（service.table_cube）取得 年度 × dimensions 的筆數，dimensions 為 {cube 維度: 端點使用的欄位}
+    回傳 DataFrame：[year_col, *dimensions, ROW_COUNT_COL]，學校類型、入學管道、地區、縣市已是分類後的標籤；
+    cube 不適用時回傳 None，由呼叫端依原始值分組計數後再分類
+    """
+    if not _cube_applies(table_name):
+        return None
+    return table_cube_store.counts(session, table_name, year_col, dimensions)
+
+
+def _cube_moments(session, table_name, year_col, columns):
+    """由 OLAP cube 取得各成績欄位依年度的彙總（見 TableCubeStore.moments）；cube 不適用時回傳 None"""
+    if not _cube_applies(table_name):
+        return None
+    return table_cube_store.moments(session, table_name, year_col, {}, columns)
+
+
+def _numeric_column_distribution(session, table_name, column):
+    """
+    欄位非空值轉為數值後的 (排序後的相異數值, 各值筆數, skipped)
+    以 GROUP BY 取得相異原始值的筆數，只有相異值回到 Python 轉換
+    """
+    # 以欄位本身作為非空條件的欄位
+    grouped = _grouped_value_counts(session, table_name, [column], column)
+    numbers = np.array([parse_number(value) for value in grouped[column]], dtype=float)
+    counts = grouped[ROW_COUNT_COL].to_numpy(dtype=np.int64)
+    valid = ~np.isnan(numbers)
+    values, inverse = np.unique(numbers[valid], return_inverse=True)
+    merged = np.bincount(inverse, weights=counts[valid], minlength=len(values)).astype(np.int64)
+    return values, merged, int(counts[~valid].sum())
+
+
+def _numeric_column_summary(session, table_name, column):
+    """
+    欄位非空值轉為數值後的 (筆數, 總和, 平方和, 最小, 最大, skipped)
+    以不分組的 QuerySpec 在 SQLite 中完成數值轉換與彙總，只有一列結果回到 Python
+    """
+    spec = QuerySpec(table_name, [], analysis_query.row_filters([column]), grouped=True, measure_column=column)
+    partial = _query_grouped(session, spec).iloc[0]
+    count = int(partial[analysis_query.VALUE_COUNT])
+    minimum, maximum = (
+        (float(partial[analysis_query.VALUE_MIN]), float(partial[analysis_query.VALUE_MAX])) if count else (None, None)
+    )
+    return count, float(partial[analysis_query.VALUE_TOTAL]), float(partial[analysis_query.VALUE_SUM_SQ]), \
+        minimum, maximum, int(partial[analysis_query.ROWS]) - count
+
+
+def _column_stats_options(data):
+    """解析 column_stats 的 mode / percentiles / bins，格式錯誤時回傳 (None, 錯誤訊息)"""
+    mode = data.get('mode', 'auto')
+    if mode not in ('auto', 'exact', 'sketch'):
+        return None, 'mode 必須為 auto、exact 或 sketch'
+    percentiles = data.get('percentiles', DEFAULT_PERCENTILES)
+    if not isinstance(percentiles, (list, tuple)) or not all(
+        isinstance(p, (int, float)) and not isinstance(p, bool) and 0 <= p <= 100 for p in percentiles
+    ):
+        return None, 'percentiles 必須為 0 到 100 的數字清單'
+    bins = data.get('bins', DEFAULT_HISTOGRAM_BINS)
+    if not isinstance(bins, int) or isinstance(bins, bool) or not 0 <= bins <= MAX_HISTOGRAM_BINS:
+        return None, f'bins 必須為 0 到 {MAX_HISTOGRAM_BINS} 的整數（0 表示不計算直方圖）'
+    return (mode, list(percentiles), bins), None
+
+
+def _sketch_column_stats(column, sketch, raw_data, percentiles, bins):
+    return {
+        'column': column,
+        'stats': sketch.stats(),
+        'percentiles': sketch.percentiles(percentiles),
+        'histogram': sketch.histogram(bins) if bins else None,
+        'mode': 'sketch',
+        'raw_data': raw_data,
+    }
+
+
 def column_stats(data):
     """
     從資料庫讀取資料並計算指定欄位的統計數據
-    前端傳入 { table_name: 資料表名稱, column: 欄位名稱 }
-    回傳該欄位的平均數、變異數、最大、最小、筆數
+    前端傳入 { table_name: 資料表名稱, column: 欄位名稱, mode?, percentiles?, bins? }
+    回傳該欄位的平均數、變異數、最大、最小、筆數，以及百分位數與等寬直方圖
+    - mode = exact：讀取整個欄位精確計算
+    - mode = sketch：以欄位數值摘要（KLL，見 service.column_sketch）估計百分位數與直方圖
+    - mode = auto（預設）：有效筆數超過摘要門檻時使用摘要，小型資料表精確計算
+    已有摘要時只讀取前 100 筆原始資料，不必讀取整個欄位；精確計算時數值轉換與彙總在 SQLite 中進行，
+    百分位數與直方圖只需要各相異數值的筆數（percentiles 為空且 bins 為 0 時不讀取）
     """
     try:
         data = data or {}
@@ -39,10 +471,15 @@ def column_stats(data):
         
         if not table_name or not column:
             return ({'error': '缺少 table_name 或 column'}), 400
+
+        options, error = _column_stats_options(data)
+        if error:
+            return {'error': error}, 400
+        mode, percentiles, bins = options
             
         # 檢查資料表是否存在
         try:
-            current_engine, current_inspector = get_database_engine(table_name)
+            current_engine, current_inspector = _table_engine(table_name)
         except ValueError as e:
             return ({'error': str(e)}), 404
             
@@ -59,45 +496,57 @@ def column_stats(data):
             
             if safe_column not in available_columns:
                 return ({'error': f'找不到欄位 {column}，可用欄位：{available_columns}'}), 400
+
+            # 跨資料表分析的虛擬聯集沒有資料表版本，不使用也不保存數值摘要
+            sketches = None if isinstance(_shared_table(table_name), _UnionTable) else column_sketch_store
+            version = None
+            if mode != 'exact' and sketches is not None:
+                sketch = sketches.get(table_name, safe_column)
+                if sketch is not None:
+                    result = _select_rows(session, table_name, [safe_column], not_empty=[safe_column], limit=100)
+                    return _sketch_column_stats(column, sketch, [row[0] for row in result], percentiles, bins)
+                # 讀取前取得版本，讀取期間資料表有異動時不保存摘要
+                version = sketches.table_version(table_name)
+
+            count, total, sum_sq, minimum, maximum, skipped = _numeric_column_summary(session, table_name, safe_column)
             
-            # 使用原始 SQL 查詢
-            query = text(f'SELECT "{safe_column}" FROM "{table_name}" WHERE "{safe_column}" IS NOT NULL AND "{safe_column}" != ""')
-            result = session.execute(query).fetchall()
-            
-            # 處理數據
-            raw_values = [row[0] for row in result]
-            values = []
-            skipped = 0
-            
-            for v in raw_values:
-                if v == '' or v is None:
-                    continue
-                try:
-                    v_str = str(v).strip().replace('，', '').replace(',', '')
-                    if v_str == '' or v_str.lower() == 'nan':
-                        skipped += 1
-                        continue
-                    values.append(float(v_str))
-                except Exception:
-                    skipped += 1
-            
-            if not values:
+            if not count:
                 return ({'error': '該欄位無有效數值可統計'}), 400
-            
-            import numpy as np
+
+            # 限制回傳資料量
+            raw_data = [row[0] for row in _select_rows(session, table_name, [safe_column], not_empty=[safe_column], limit=100)]
+
+            if mode == 'sketch' or (
+                mode == 'auto' and sketches is not None and count > sketches.exact_max_values
+            ):
+                values, counts, skipped = _numeric_column_distribution(session, table_name, safe_column)
+                values = np.repeat(values, counts)
+                if sketches is not None:
+                    sketch = sketches.build(table_name, safe_column, values, skipped, version)
+                else:
+                    sketch = ColumnSketch(values, skipped, version=None)
+                return _sketch_column_stats(column, sketch, raw_data, percentiles, bins)
+
+            mean = total / count
             stats = {
-                'mean': float(np.mean(values)),
-                'std': float(np.std(values, ddof=1)) if len(values) > 1 else 0.0,
-                'min': float(min(values)),
-                'max': float(max(values)),
-                'count': len(values),
-                'skipped': skipped
+                'mean': float(mean),
+                'std': math.sqrt(max(sum_sq - total * mean, 0.0) / (count - 1)) if count > 1 else 0.0,
+                'min': float(minimum),
+                'max': float(maximum),
+                'count': int(count),
+                'skipped': int(skipped)
             }
+
+            if percentiles or bins:
+                values, counts, _ = _numeric_column_distribution(session, table_name, safe_column)
             
             return ({
                 'column': column, 
                 'stats': stats,
-                'raw_data': raw_values[:100]  # 限制回傳資料量
+                'percentiles': exact_percentiles(values, counts, percentiles) if percentiles else {},
+                'histogram': exact_histogram(values, counts, bins) if bins else None,
+                'mode': 'exact',
+                'raw_data': raw_data
             })
             
         finally:
@@ -122,7 +571,7 @@ def multi_subject_stats(data):
             
         # 檢查資料表是否存在
         try:
-            current_engine, current_inspector = get_database_engine(table_name)
+            current_engine, current_inspector = _table_engine(table_name)
         except ValueError as e:
             return ({'error': str(e)}), 404
             
@@ -154,57 +603,37 @@ def multi_subject_stats(data):
         if not resolved_subjects:
             return ({'error': '沒有有效的科目欄位'}), 400
         
-        # 從資料庫讀取資料
+        # 各科目依 年度 × 成績原始值 分組計數（有增量彙總時直接讀取），只有相異的原始值回到 Python 轉換；
+        # 成績沿用 pd.to_numeric 的規則（與 subject_average_stats 等科目分析相同，千分位逗號、全形數字不計入）
         SessionLocal = sessionmaker(bind=current_engine)
         session = SessionLocal()
         try:
-            # 構建查詢語句
-            selected_subject_columns = [resolved for _, resolved in resolved_subjects]
-            columns_str = f'"{resolved_year_col}", ' + ', '.join([f'"{col}"' for col in selected_subject_columns])
-            query = text(
-                f'SELECT {columns_str} FROM "{table_name}" '
-                f'WHERE "{resolved_year_col}" IS NOT NULL AND "{resolved_year_col}" != ""'
-            )
-            result = session.execute(query).fetchall()
-            
-            # 轉換為 DataFrame 進行分析
-            columns = [resolved_year_col] + selected_subject_columns
-            df = pd.DataFrame(result, columns=columns)
-            
-            # 轉換年度欄位
-            try:
-                df[resolved_year_col] = pd.to_numeric(df[resolved_year_col], errors='coerce')
-                df = df.dropna(subset=[resolved_year_col])
-                df[resolved_year_col] = df[resolved_year_col].astype(int)
-            except Exception as e:
-                print(f"年度欄位轉換失敗: {e}")
-                df[resolved_year_col] = df[resolved_year_col].astype(str)
-            
-            # 轉換科目欄位為數值
-            for _, resolved_col in resolved_subjects:
-                df[resolved_col] = pd.to_numeric(df[resolved_col], errors='coerce')
-            
-            # 按年度分組計算平均
-            grouped = df.groupby(resolved_year_col)
-            years = sorted(grouped.groups.keys())
-            result_data = {original_col: [] for original_col, _ in resolved_subjects}
-            
-            for year in years:
-                group = grouped.get_group(year)
-                for original_col, resolved_col in resolved_subjects:
-                    vals = group[resolved_col].dropna().tolist()
-                    avg = sum(vals)/len(vals) if vals else None
-                    result_data[original_col].append(avg)
-                    
+            result_data = {}
+            years = []
+            for original_col, resolved_col in resolved_subjects:
+                grouped = _grouped_value_counts(session, table_name, [resolved_year_col, resolved_col], resolved_year_col)
+                year_values = pd.to_numeric(grouped[resolved_year_col], errors='coerce')
+                valid = year_values.notna().to_numpy()
+                year_keys = year_values[valid].astype(int).to_numpy()
+                rows = grouped[ROW_COUNT_COL].to_numpy(dtype=np.int64)[valid]
+                scores = coerce_numeric(grouped[resolved_col].to_numpy(dtype=object)[valid])
+                scored = ~np.isnan(scores)
+                totals = pd.Series(np.where(scored, scores * rows, 0.0)).groupby(year_keys).sum()
+                counts = pd.Series(np.where(scored, rows, 0)).groupby(year_keys).sum()
+                years = [int(year) for year in counts.index]
+                result_data[original_col] = [
+                    float(total) / count if count else None for total, count in zip(totals, counts)
+                ]
+
             return ({
-                'years': years, 
+                'years': years,
                 'subjects': [original for original, _ in resolved_subjects],
                 'data': result_data
             })
-            
+
         finally:
             session.close()
-            
+
     except Exception as e:
         return ({'error': str(e)}), 500
 
@@ -221,7 +650,7 @@ def yearly_admission_stats(data):
 
         # 檢查資料表是否存在
         try:
-            current_engine, current_inspector = get_database_engine(table_name)
+            current_engine, current_inspector = _table_engine(table_name)
         except ValueError as e:
             return ({'error': str(e)}), 404
 
@@ -246,14 +675,14 @@ def yearly_admission_stats(data):
         SessionLocal = sessionmaker(bind=current_engine)
         session = SessionLocal()
         try:
-            if has_gender:
-                query = text(f'SELECT "{safe_year_col}", "{safe_gender_col}" FROM "{table_name}" WHERE "{safe_year_col}" IS NOT NULL AND "{safe_year_col}" != ""')
-                result = session.execute(query).fetchall()
-                df = pd.DataFrame(result, columns=[safe_year_col, safe_gender_col])
+            # 由 OLAP cube roll-up 或由 SQLite 依原始值分組計數，以下轉換只作用在不重複的值組合上
+            df = _cube_counts(session, table_name, safe_year_col, {'gender': safe_gender_col} if has_gender else {})
+            if df is not None:
+                df = df.rename(columns={'gender': safe_gender_col})
+            elif has_gender:
+                df = _grouped_value_counts(session, table_name, [safe_year_col, safe_gender_col], safe_year_col)
             else:
-                query = text(f'SELECT "{safe_year_col}" FROM "{table_name}" WHERE "{safe_year_col}" IS NOT NULL AND "{safe_year_col}" != ""')
-                result = session.execute(query).fetchall()
-                df = pd.DataFrame(result, columns=[safe_year_col])
+                df = _grouped_value_counts(session, table_name, [safe_year_col], safe_year_col)
             
             # 轉換年度欄位
             try:
@@ -276,7 +705,7 @@ def yearly_admission_stats(data):
                 df[safe_gender_col] = df[safe_gender_col].replace(gender_mapping)
                 
                 # 按年份和性別分組統計
-                gender_year_counts = df.groupby([safe_year_col, safe_gender_col]).size().unstack(fill_value=0)
+                gender_year_counts = df.groupby([safe_year_col, safe_gender_col])[ROW_COUNT_COL].sum().unstack(fill_value=0)
                 years = sorted(gender_year_counts.index.tolist())
                 
                 # 確保有男女兩列
@@ -308,7 +737,7 @@ def yearly_admission_stats(data):
                 })
             else:
                 # 沒有性別欄位，只統計總數
-                year_counts = df[safe_year_col].value_counts().sort_index()
+                year_counts = df.groupby(safe_year_col)[ROW_COUNT_COL].sum().sort_index()
                 years = year_counts.index.tolist()
                 counts = year_counts.values.tolist()
                 
@@ -342,7 +771,7 @@ def school_source_stats(data):
         
         # 檢查資料表是否存在
         try:
-            current_engine, current_inspector = get_database_engine(table_name)
+            current_engine, current_inspector = _table_engine(table_name)
         except ValueError as e:
             return ({'error': str(e)}), 404
         
@@ -363,23 +792,22 @@ def school_source_stats(data):
         SessionLocal = sessionmaker(bind=current_engine)
         session = SessionLocal()
         try:
-            query = text(f'SELECT "{safe_year_col}", "{safe_school_col}" FROM "{table_name}" WHERE "{safe_year_col}" IS NOT NULL AND "{safe_year_col}" != ""')
-            result = session.execute(query).fetchall()
-            
-            if not result:
+            # 由 OLAP cube 取得 (年度, 學校類型) 筆數；沒有 cube 時由 SQLite 依 (年度, 學校) 原始值分組計數再分類
+            df = _cube_counts(session, table_name, safe_year_col, {'school_type': safe_school_col})
+            if df is None:
+                df = _grouped_value_counts(session, table_name, [safe_year_col, safe_school_col], safe_year_col)
+
+                # 將空的學校欄位填入空字串
+                df[safe_school_col] = df[safe_school_col].fillna('')
+
+                # 只對不重複的學校名稱進行學校類型分類
+                df['school_type'] = classify_distinct(df[safe_school_col], classify_school_type)
+
+            if df.empty:
                 return ({'error': '沒有有效的年份資料'}), 400
             
-            # 轉換為 DataFrame
-            df = pd.DataFrame(result, columns=[safe_year_col, safe_school_col])
-            
-            # 將空的學校欄位填入空字串
-            df[safe_school_col] = df[safe_school_col].fillna('')
-            
-            # 對每一筆資料進行學校類型分類
-            df['school_type'] = df[safe_school_col].apply(classify_school_type)
-            
-            # 按年份和學校類型分組統計
-            school_type_stats = df.groupby([safe_year_col, 'school_type']).size().unstack(fill_value=0)
+            # 按年份和學校類型加總筆數
+            school_type_stats = df.groupby([safe_year_col, 'school_type'])[ROW_COUNT_COL].sum().unstack(fill_value=0)
             
             # 確保所有學校類型都存在
             all_types = ['國立', '市立', '縣立', '私立', '財團', '國大轉', '私大轉', '科大轉', '僑生', '其他']
@@ -399,7 +827,7 @@ def school_source_stats(data):
                 'years': years,
                 'school_types': all_types,
                 'data': {},
-                'total_students': int(len(df)),
+                'total_students': int(df[ROW_COUNT_COL].sum()),
                 'year_range': f"{min(years)} - {max(years)}" if years else "無資料"
             }
             
@@ -459,7 +887,7 @@ def admission_method_stats(data):
         
         # 檢查資料表是否存在
         try:
-            current_engine, current_inspector = get_database_engine(table_name)
+            current_engine, current_inspector = _table_engine(table_name)
         except ValueError as e:
             return ({'error': str(e)}), 404
         
@@ -480,20 +908,19 @@ def admission_method_stats(data):
         SessionLocal = sessionmaker(bind=current_engine)
         session = SessionLocal()
         try:
-            query = text(f'SELECT "{safe_year_col}", "{safe_method_col}" FROM "{table_name}" WHERE "{safe_year_col}" IS NOT NULL AND "{safe_year_col}" != ""')
-            result = session.execute(query).fetchall()
-            
-            if not result:
+            # 由 OLAP cube 取得 (年度, 入學管道類型) 筆數；沒有 cube 時由 SQLite 依 (年度, 入學管道) 原始值分組計數再分類
+            df = _cube_counts(session, table_name, safe_year_col, {'method_type': safe_method_col})
+            if df is None:
+                df = _grouped_value_counts(session, table_name, [safe_year_col, safe_method_col], safe_year_col)
+
+                # 只對不重複的入學管道名稱進行分類
+                df['method_type'] = classify_distinct(df[safe_method_col], classify_admission_method)
+
+            if df.empty:
                 return ({'error': '沒有有效的年份資料'}), 400
             
-            # 轉換為 DataFrame
-            df = pd.DataFrame(result, columns=[safe_year_col, safe_method_col])
-            
-            # 對入學管道欄位進行分類
-            df['method_type'] = df[safe_method_col].apply(lambda x: classify_admission_method(x))
-            
-            # 按年份和入學管道類型分組統計
-            method_type_stats = df.groupby([safe_year_col, 'method_type']).size().unstack(fill_value=0)
+            # 按年份和入學管道類型加總筆數
+            method_type_stats = df.groupby([safe_year_col, 'method_type'])[ROW_COUNT_COL].sum().unstack(fill_value=0)
             
             # 確保所有入學管道類型都存在
             all_types = ['申請入學', '繁星推薦', '自然組', '社會組', '僑生', '願景', '其他']
@@ -516,7 +943,7 @@ def admission_method_stats(data):
                 'years': years,
                 'method_types': all_types,
                 'data': {},
-                'total_students': int(len(df)),
+                'total_students': int(df[ROW_COUNT_COL].sum()),
                 'year_range': f"{min(years)} - {max(years)}" if years else "無資料"
             }
             
@@ -610,7 +1037,7 @@ def geographic_stats(data):
 
         # 檢查資料表是否存在
         try:
-            current_engine, current_inspector = get_database_engine(table_name)
+            current_engine, current_inspector = _table_engine(table_name)
         except ValueError as e:
             return ({'error': str(e)}), 404
 
@@ -631,17 +1058,16 @@ def geographic_stats(data):
         SessionLocal = sessionmaker(bind=current_engine)
         session = SessionLocal()
         try:
-            query = text(f'SELECT "{safe_year_col}", "{safe_region_col}" FROM "{table_name}" WHERE "{safe_year_col}" IS NOT NULL AND "{safe_year_col}" != ""')
-            result = session.execute(query).fetchall()
-            
-            if not result:
+            # 由 OLAP cube 取得 (年度, 區域, 縣市) 筆數；沒有 cube 時由 SQLite 依 (年度, 地區) 原始值分組計數再分類
+            df = _cube_counts(session, table_name, safe_year_col, {'region': safe_region_col, 'city': safe_region_col})
+            if df is None:
+                df = _grouped_value_counts(session, table_name, [safe_year_col, safe_region_col], safe_year_col)
+
+                # 將不重複的地區名稱映射到區域
+                df['region'] = classify_distinct(df[safe_region_col], classify_region)
+
+            if df.empty:
                 return ({'error': '沒有有效的年份資料'}), 400
-            
-            # 轉換為 DataFrame
-            df = pd.DataFrame(result, columns=[safe_year_col, safe_region_col])
-            
-            # 將地區映射到區域
-            df['region'] = df[safe_region_col].apply(classify_region)
 
             # 轉換年度欄位
             try:
@@ -654,7 +1080,7 @@ def geographic_stats(data):
 
             # 按年度和區域統計
             region_order = ['北台灣', '中台灣', '南台灣', '東台灣', '其他']
-            grouped = df.groupby([safe_year_col, 'region']).size().unstack(fill_value=0)
+            grouped = df.groupby([safe_year_col, 'region'])[ROW_COUNT_COL].sum().unstack(fill_value=0)
             
             # 確保所有區域都存在
             for region in region_order:
@@ -686,34 +1112,29 @@ def geographic_stats(data):
                     '東台灣': ['花蓮縣', '台東縣']
                 }
                 
+                # 不重複的地區值標準化為縣市名稱（「臺」轉「台」，鄉鎮市區以開頭的縣市比對），
+                # 再建立一次 年度 × 縣市 的人數矩陣，各區域的縣市資料都由這個矩陣取出
+                if 'city' not in df.columns:
+                    df['city'] = classify_distinct(df[safe_region_col], normalize_city)
+                city_matrix = (
+                    df.dropna(subset=['city'])
+                    .groupby([safe_year_col, 'city'])[ROW_COUNT_COL].sum()
+                    .unstack(fill_value=0)
+                    .reindex(index=years, fill_value=0)
+                )
+                
                 # 針對四個主要區域進行詳細縣市分析
                 for region in ['北台灣', '中台灣', '南台灣', '東台灣']:
-                    expected_cities = region_cities_mapping.get(region, [])
+                    expected_cities = [
+                        city for city in region_cities_mapping.get(region, []) if city in city_matrix.columns
+                    ]
+                    city_totals = city_matrix[expected_cities].sum()
                     
-                    city_data = []
-                    for city in expected_cities:
-                        # 先將資料庫中的縣市名稱標準化（統一轉成「台」）
-                        df_normalized = df.copy()
-                        df_normalized[safe_region_col] = df_normalized[safe_region_col].apply(lambda x: str(x).replace('臺', '台') if pd.notna(x) else x)
-                        
-                        # 按年度和縣市統計
-                        city_df = df_normalized[df_normalized[safe_region_col] == city]
-                        city_by_year = city_df.groupby(safe_year_col).size() if not city_df.empty else pd.Series()
-                        
-                        # 確保所有年份都有數據
-                        year_data = []
-                        for year in years:
-                            if not city_by_year.empty and year in city_by_year.index:
-                                year_data.append(int(city_by_year[year]))
-                            else:
-                                year_data.append(0)
-                        
-                        # 只有當該城市有資料時才加入
-                        if sum(year_data) > 0:
-                            city_data.append({
-                                'name': city,
-                                'data': year_data
-                            })
+                    # 只有當該城市有資料時才加入，確保所有年份都有數據
+                    city_data = [
+                        {'name': city, 'data': [int(count) for count in city_matrix[city]]}
+                        for city in expected_cities if city_totals[city] > 0
+                    ]
                     
                     # 按總人數排序縣市
                     city_data.sort(key=lambda x: sum(x['data']), reverse=True)
@@ -734,8 +1155,30 @@ def geographic_stats(data):
         return ({'error': f'處理資料時發生錯誤: {str(e)}'}), 500
 
 
+# top_schools_stats 的 top_n 預設值與上限
+DEFAULT_TOP_SCHOOLS = 20
+MAX_TOP_SCHOOLS = 500
+
+
+def _top_schools_entry(count, total_students, year_counts, years):
+    """top_schools_stats 單一學校（或其他學校合計）的人數、比例與各年度人數"""
+    count = int(count)
+    entry = {
+        'total_count': count,
+        'percentage': round((count / total_students) * 100, 2) if total_students else 0.0,
+    }
+    if years is not None:
+        for year in years:
+            entry[f'year_{int(year)}'] = int(year_counts.get(year, 0))
+    return entry
+
+
 def top_schools_stats(data):
-    """前20大入學高中統計 - 使用統一的資料處理方式"""
+    """
+    前 N 大入學高中統計
+    前端傳入 { table_name, school_col, year_col?, top_n?: 預設 20, include_others?: 是否回傳其餘學校合計, years?: 年份篩選 }
+    學校（× 年度）人數由 SQLite 端 GROUP BY 計算，再以學校 × 年度的樞紐表排名
+    """
     try:
         data = data or {}
         
@@ -743,17 +1186,26 @@ def top_schools_stats(data):
         table_name = data.get('table_name')
         school_col = data.get('school_col')
         year_col = data.get('year_col')  # 可選
+        top_n = data.get('top_n', DEFAULT_TOP_SCHOOLS)
+        include_others = bool(data.get('include_others', False))
+        years_filter = data.get('years') or []
         
         if not table_name or not school_col:
             return ({'error': '資料表名稱和學校欄位為必要參數'}), 400
-        
-        print(f"[top_schools_stats] 開始分析前20大入學高中")
+        if isinstance(top_n, bool) or not isinstance(top_n, int) or not 1 <= top_n <= MAX_TOP_SCHOOLS:
+            return ({'error': f'top_n 必須是 1 到 {MAX_TOP_SCHOOLS} 之間的整數'}), 400
+        if not isinstance(years_filter, list):
+            return ({'error': 'years 必須是陣列'}), 400
+        if years_filter and not year_col:
+            return ({'error': '指定 years 時必須提供年份欄位'}), 400
+        
+        print(f"[top_schools_stats] 開始分析前{top_n}大入學高中")
         print(f"[top_schools_stats] table_name: {table_name}")
-        print(f"[top_schools_stats] school_col: {school_col}, year_col: {year_col}")
+        print(f"[top_schools_stats] school_col: {school_col}, year_col: {year_col}, years: {years_filter}")
         
         # 使用統一的資料庫引擎獲取方法
         try:
-            current_engine, current_inspector = get_database_engine(table_name)
+            current_engine, current_inspector = _table_engine(table_name)
         except ValueError as e:
             return ({'error': str(e)}), 404
         
@@ -778,110 +1230,67 @@ def top_schools_stats(data):
         session = SessionLocal()
         
         try:
-            # 構建查詢語句
+            # 學校（× 年度）原始值組合的人數；學校空值在下方清理時排除
             if safe_year_col:
-                select_cols = f'"{safe_school_col}", "{safe_year_col}"'
-                query = text(f'SELECT {select_cols} FROM "{table_name}" WHERE "{safe_school_col}" IS NOT NULL AND "{safe_school_col}" != "" AND "{safe_year_col}" IS NOT NULL AND "{safe_year_col}" != ""')
-                result = session.execute(query).fetchall()
-                df = pd.DataFrame(result, columns=[safe_school_col, safe_year_col])
+                counts = _grouped_value_counts(
+                    session, table_name, [safe_school_col, safe_year_col], safe_year_col, years=years_filter
+                )
             else:
-                query = text(f'SELECT "{safe_school_col}" FROM "{table_name}" WHERE "{safe_school_col}" IS NOT NULL AND "{safe_school_col}" != ""')
-                result = session.execute(query).fetchall()
-                df = pd.DataFrame(result, columns=[safe_school_col])
+                counts = _grouped_value_counts(session, table_name, [safe_school_col], safe_school_col)
             
-            if df.empty:
+            if counts.empty:
                 return ({'error': '沒有找到資料'}), 400
             
-            print(f"[top_schools_stats] 資料讀取完成，共 {len(df)} 筆記錄")
+            print(f"[top_schools_stats] 資料讀取完成，共 {int(counts[ROW_COUNT_COL].sum())} 筆記錄")
             
-            # 清理學校名稱資料
-            df[safe_school_col] = df[safe_school_col].fillna('未知')
-            df[safe_school_col] = df[safe_school_col].astype(str).str.strip()
-            
-            # 過濾掉無效的學校名稱
-            df = df[df[safe_school_col] != '']
-            df = df[df[safe_school_col] != '未知']
-            df = df[df[safe_school_col] != 'nan']
-            
-            result_data = {}
+            # 清理學校名稱（只處理不重複的值），過濾無效的學校名稱
+            school_names = counts[safe_school_col].fillna('未知').astype(str).str.strip()
+            cleaned = pd.DataFrame({'school': school_names, 'count': counts[ROW_COUNT_COL]})
+            if safe_year_col:
+                cleaned['year'] = pd.to_numeric(counts[safe_year_col], errors='coerce')
+                cleaned = cleaned.dropna(subset=['year'])
+            cleaned = cleaned[~cleaned['school'].isin(['', '未知', 'nan'])]
             
+            # 學校 × 年度樞紐表（不分年度時只有一欄）
             if safe_year_col:
-                # 按年份分析
-                df[safe_year_col] = pd.to_numeric(df[safe_year_col], errors='coerce')
-                df = df.dropna(subset=[safe_year_col])
-                
-                # 按學校和年份統計
-                yearly_stats = df.groupby([safe_school_col, safe_year_col]).size().reset_index(name='count')
-                
-                # 計算每個學校的總人數
-                school_totals = yearly_stats.groupby(safe_school_col)['count'].sum().reset_index()
-                school_totals = school_totals.sort_values('count', ascending=False)
-                
-                # 取前20大學校
-                top20_schools = school_totals.head(20)
-                
-                # 獲取年份列表
-                years = sorted(df[safe_year_col].unique())
-                
-                # 為每個學校添加年度詳細資料
-                schools_data = []
-                total_students = df.shape[0]
-                
-                for idx, (_, row) in enumerate(top20_schools.iterrows()):
-                    school_name = row[safe_school_col]
-                    total_count = row['count']
-                    
-                    school_data = {
-                        'rank': idx + 1,
-                        'school_name': school_name,
-                        'total_count': int(total_count),
-                        'percentage': round((total_count / total_students) * 100, 2)
-                    }
-                    
-                    # 添加每年的詳細數據
-                    for year in years:
-                        year_count = yearly_stats[
-                            (yearly_stats[safe_school_col] == school_name) & 
-                            (yearly_stats[safe_year_col] == year)
-                        ]['count'].sum()
-                        school_data[f'year_{int(year)}'] = int(year_count)
-                    
-                    schools_data.append(school_data)
-                
-                result_data = {
-                    'schools': schools_data,
-                    'total_students': int(total_students),
-                    'by_year': True,
-                    'years': [int(year) for year in years]
-                }
-                
+                pivot = cleaned.groupby(['school', 'year'])['count'].sum().unstack(fill_value=0)
+                years = sorted(pivot.columns)
             else:
-                # 不按年份分析
-                school_counts = df[safe_school_col].value_counts().reset_index()
-                school_counts.columns = [safe_school_col, 'count']
-                
-                # 取前20大學校
-                top20_schools = school_counts.head(20)
-                
-                # 格式化結果
-                schools_data = []
-                total_students = df.shape[0]
-                
-                for idx, (_, row) in enumerate(top20_schools.iterrows()):
-                    schools_data.append({
-                        'rank': idx + 1,
-                        'school_name': row[safe_school_col],
-                        'total_count': int(row['count']),
-                        'percentage': round((row['count'] / total_students) * 100, 2)
-                    })
-                
-                result_data = {
-                    'schools': schools_data,
-                    'total_students': int(total_students),
-                    'by_year': False
+                pivot = cleaned.groupby('school')['count'].sum().to_frame()
+                years = None
+            school_totals = pivot.sum(axis=1)
+            total_students = int(cleaned['count'].sum())
+            
+            # 部分排序取前 N 大；人數相同時依學校名稱排列
+            top_schools = school_totals.nlargest(top_n, keep='first')
+            
+            schools_data = []
+            for idx, (school_name, total_count) in enumerate(top_schools.items()):
+                year_counts = pivot.loc[school_name] if years is not None else None
+                schools_data.append({
+                    'rank': idx + 1,
+                    'school_name': school_name,
+                    **_top_schools_entry(total_count, total_students, year_counts, years),
+                })
+            
+            result_data = {
+                'schools': schools_data,
+                'total_students': total_students,
+                'by_year': years is not None,
+            }
+            if years is not None:
+                result_data['years'] = [int(year) for year in years]
+            
+            if include_others:
+                other_schools = pivot.drop(index=top_schools.index)
+                result_data['others'] = {
+                    'school_count': len(other_schools),
+                    **_top_schools_entry(
+                        int(other_schools.to_numpy().sum()), total_students, other_schools.sum(), years
+                    ),
                 }
             
-            print(f"[top_schools_stats] 分析完成，前20大學校數據已生成")
+            print(f"[top_schools_stats] 分析完成，前{top_n}大學校數據已生成")
             return (result_data)
             
         finally:
@@ -892,6 +1301,195 @@ def top_schools_stats(data):
         return ({'error': f'處理資料時發生錯誤: {str(e)}'}), 500
 
 
+# subject_average_stats 的性別值對照（先去除空白並轉為大寫）
+SUMMARY_GENDER_MAPPING = {
+    'M': '男', 'MALE': '男', '男生': '男', '1': '男',
+    'F': '女', 'FEMALE': '女', '女生': '女', '2': '女'
+}
+
+
+def _normalize_summary_gender(value):
+    text = str(value).strip().upper()
+    return SUMMARY_GENDER_MAPPING.get(text, text)
+
+
+def _yearly_label_counts(labels, year_values, years, weights=None):
+    """
+    各年度各類別的人數矩陣（年度 × 出現的類別），沒有資料的年度為 0；weights 為各列代表的人數（cube 的組合筆數）
+    labels 為 None（未指定該維度欄位）時沒有任何類別欄
+    """
+    if labels is None:
+        return pd.DataFrame(index=years)
+    if weights is None:
+        counts = labels.groupby(year_values).value_counts()
+    else:
+        counts = weights.groupby([year_values, labels]).sum()
+    return counts.unstack(fill_value=0).reindex(index=years, fill_value=0)
+
+
+def _label_summary(labels, weights=None):
+    """各類別的總人數 {類別: 人數}；labels 為 None 時為空"""
+    if labels is None:
+        return {}
+    counts = labels.value_counts() if weights is None else weights.groupby(labels).sum()
+    return {k: int(v) for k, v in counts.to_dict().items()}
+
+
+def _subject_average_frame_parts(session, table_name, dimensions, subject_columns):
+    """
+    subject_average_stats 由資料列計算的各年度統計；dimensions 為 (年度, 性別, 高中類型, 入學管道) 欄位
+    回傳各年度人數、類別人數、科目平均與整體成績統計，或 (錯誤, status)
+    """
+    year_col, gender_col, school_type_col, admission_col = dimensions
+    # 依序去重，避免欄位重複出現在 SELECT
+    select_columns = list(dict.fromkeys(col for col in (*dimensions, *subject_columns) if col))
+    complete_df = _select_frame(
+        session, table_name, select_columns, not_empty=[year_col],
+        numeric=[col for col in subject_columns if col not in dimensions],
+    )
+    if complete_df.empty:
+        return ({'error': '沒有找到相關資料'}), 404
+
+    complete_df[year_col] = pd.to_numeric(complete_df[year_col], errors='coerce')
+    complete_df = complete_df.dropna(subset=[year_col])
+    if complete_df.empty:
+        return ({'error': '年度欄位沒有可用資料'}), 400
+    complete_df[year_col] = complete_df[year_col].astype(int)
+
+    for subject_col in subject_columns:
+        complete_df[subject_col] = pd.to_numeric(complete_df[subject_col], errors='coerce')
+
+    # 僅保留至少有一筆有效分數的科目
+    valid_subject_columns = [col for col in subject_columns if complete_df[col].notna().any()]
+    if not valid_subject_columns:
+        return ({'error': '所選科目欄位皆無有效數值資料'}), 400
+
+    years = sorted(complete_df[year_col].unique())
+
+    # 各維度只正規化／分類一次（只處理不重複的值），再以單次年度分組計算人數與各科平均
+    year_values = complete_df[year_col]
+    grouped = complete_df.groupby(year_col)
+    gender_labels = (
+        classify_distinct(complete_df[gender_col], _normalize_summary_gender) if gender_col else None
+    )
+    school_type_labels = (
+        classify_distinct(complete_df[school_type_col], classify_school_type) if school_type_col else None
+    )
+    admission_labels = (
+        classify_distinct(complete_df[admission_col], classify_admission_method) if admission_col else None
+    )
+
+    overall_stats = {}
+    for subject_col in valid_subject_columns:
+        valid_scores = complete_df[subject_col].dropna()
+        overall_stats[subject_col] = {
+            'overall_average': round(float(valid_scores.mean()), 2),
+            'min_score': round(float(valid_scores.min()), 2),
+            'max_score': round(float(valid_scores.max()), 2),
+            'std_dev': round(float(valid_scores.std()), 2) if len(valid_scores) > 1 else 0.0,
+            'total_students': int(len(valid_scores))
+        }
+
+    return {
+        'years': years,
+        'subject_columns': valid_subject_columns,
+        'year_sizes': grouped.size(),
+        'subject_means': grouped[valid_subject_columns].mean(),
+        'subject_counts': grouped[valid_subject_columns].count(),
+        'gender_counts': _yearly_label_counts(gender_labels, year_values, years),
+        'school_type_counts': _yearly_label_counts(school_type_labels, year_values, years),
+        'admission_counts': _yearly_label_counts(admission_labels, year_values, years),
+        'overall_stats': overall_stats,
+        'total_students': int(len(complete_df)),
+        'school_type_summary': _label_summary(school_type_labels),
+        'admission_summary': _label_summary(admission_labels),
+    }
+
+
+def _subject_average_cube_parts(session, table_name, dimensions, subject_columns):
+    """
+    _subject_average_frame_parts 的 OLAP cube 版本：人數由 年度 × 性別 × 學校類型 × 入學管道 的組合筆數 roll-up，
+    成績由各科目依年度的有效筆數、總和、平方和、最小、最大計算，回應時間與資料筆數無關
+    沒有 cube、欄位與 cube 不同或科目欄位同時是維度欄位時回傳 None
+    """
+    year_col, gender_col, school_type_col, admission_col = dimensions
+    if set(dimensions) & set(subject_columns):
+        return None
+    cube_dimensions = {
+        name: column
+        for name, column in (('gender', gender_col), ('school_type', school_type_col), ('method_type', admission_col))
+        if column
+    }
+    counts = _cube_counts(session, table_name, year_col, cube_dimensions)
+    moments = _cube_moments(session, table_name, year_col, subject_columns) if counts is not None else None
+    if moments is None:
+        return None
+    if counts.empty:
+        return ({'error': '沒有找到相關資料'}), 404
+
+    # 年度原始值轉換規則與逐列計算相同，轉換後相同的年度合併
+    for frame in (counts, moments):
+        frame[year_col] = pd.to_numeric(frame[year_col], errors='coerce')
+    counts = counts.dropna(subset=[year_col]).astype({year_col: int})
+    moments = moments.dropna(subset=[year_col]).astype({year_col: int})
+    if counts.empty:
+        return ({'error': '年度欄位沒有可用資料'}), 400
+
+    per_subject = moments.groupby('col').agg({
+        analysis_query.VALUE_COUNT: 'sum', analysis_query.VALUE_TOTAL: 'sum', analysis_query.VALUE_SUM_SQ: 'sum',
+        analysis_query.VALUE_MIN: 'min', analysis_query.VALUE_MAX: 'max',
+    })
+    valid_subject_columns = [
+        col for col in subject_columns if col in per_subject.index and per_subject.at[col, analysis_query.VALUE_COUNT] > 0
+    ]
+    if not valid_subject_columns:
+        return ({'error': '所選科目欄位皆無有效數值資料'}), 400
+
+    years = sorted(counts[year_col].unique())
+    year_values = counts[year_col]
+    weights = counts[ROW_COUNT_COL]
+    by_year = moments.groupby([year_col, 'col'])[[analysis_query.VALUE_COUNT, analysis_query.VALUE_TOTAL]].sum()
+    subject_counts = by_year[analysis_query.VALUE_COUNT].unstack(fill_value=0).reindex(
+        index=years, columns=valid_subject_columns, fill_value=0
+    )
+    subject_totals = by_year[analysis_query.VALUE_TOTAL].unstack(fill_value=0.0).reindex(
+        index=years, columns=valid_subject_columns, fill_value=0.0
+    )
+    gender_labels = classify_distinct(counts['gender'], _normalize_summary_gender) if gender_col else None
+    school_type_labels = counts['school_type'] if school_type_col else None
+    admission_labels = counts['method_type'] if admission_col else None
+
+    overall_stats = {}
+    for subject_col in valid_subject_columns:
+        partial = per_subject.loc[subject_col]
+        count = int(partial[analysis_query.VALUE_COUNT])
+        total = float(partial[analysis_query.VALUE_TOTAL])
+        mean = total / count
+        variance = max(float(partial[analysis_query.VALUE_SUM_SQ]) - total * mean, 0.0) / (count - 1) if count > 1 else 0.0
+        overall_stats[subject_col] = {
+            'overall_average': round(mean, 2),
+            'min_score': round(float(partial[analysis_query.VALUE_MIN]), 2),
+            'max_score': round(float(partial[analysis_query.VALUE_MAX]), 2),
+            'std_dev': round(math.sqrt(variance), 2) if count > 1 else 0.0,
+            'total_students': count,
+        }
+
+    return {
+        'years': years,
+        'subject_columns': valid_subject_columns,
+        'year_sizes': weights.groupby(year_values).sum(),
+        'subject_means': subject_totals / subject_counts.where(subject_counts > 0),
+        'subject_counts': subject_counts,
+        'gender_counts': _yearly_label_counts(gender_labels, year_values, years, weights),
+        'school_type_counts': _yearly_label_counts(school_type_labels, year_values, years, weights),
+        'admission_counts': _yearly_label_counts(admission_labels, year_values, years, weights),
+        'overall_stats': overall_stats,
+        'total_students': int(weights.sum()),
+        'school_type_summary': _label_summary(school_type_labels, weights),
+        'admission_summary': _label_summary(admission_labels, weights),
+    }
+
+
 def subject_average_stats(data):
     """大一各科平均成績分析（動態欄位版本）。"""
     session = None
@@ -903,7 +1501,7 @@ def subject_average_stats(data):
             return ({'error': '缺少 table_name 參數'}), 400
 
         try:
-            current_engine, current_inspector = get_database_engine(table_name)
+            current_engine, current_inspector = _table_engine(table_name)
         except ValueError as e:
             return ({'error': str(e)}), 404
 
@@ -982,115 +1580,51 @@ def subject_average_stats(data):
         selected_subject_columns = [resolved for _, resolved in subject_pairs]
         selected_subject_labels = {resolved: original for original, resolved in subject_pairs}
 
-        select_columns = [year_col]
-        if gender_col:
-            select_columns.append(gender_col)
-        if school_type_col:
-            select_columns.append(school_type_col)
-        if admission_col:
-            select_columns.append(admission_col)
-        select_columns.extend(selected_subject_columns)
-
-        # 依序去重，避免欄位重複出現在 SELECT
-        select_columns = list(dict.fromkeys(select_columns))
-
-        select_clause = ', '.join([f'"{col}"' for col in select_columns])
-        query = text(
-            f'SELECT {select_clause} FROM "{table_name}" '
-            f'WHERE "{year_col}" IS NOT NULL AND "{year_col}" != ""'
-        )
+        school_types = ['國立', '私立', '財團', '市立', '其他', '私大轉', '科大轉', '國大轉', '僑生']
+        admission_types = ['申請入學', '繁星推薦', '自然組', '社會組', '僑生', '願景', '其他']
 
         SessionLocal = sessionmaker(bind=current_engine)
         session = SessionLocal()
-        result_rows = session.execute(query).fetchall()
-
-        complete_df = pd.DataFrame(result_rows, columns=select_columns)
-        if complete_df.empty:
-            return ({'error': '沒有找到相關資料'}), 404
-
-        complete_df[year_col] = pd.to_numeric(complete_df[year_col], errors='coerce')
-        complete_df = complete_df.dropna(subset=[year_col])
-        if complete_df.empty:
-            return ({'error': '年度欄位沒有可用資料'}), 400
-        complete_df[year_col] = complete_df[year_col].astype(int)
-
-        for subject_col in selected_subject_columns:
-            complete_df[subject_col] = pd.to_numeric(complete_df[subject_col], errors='coerce')
-
-        # 僅保留至少有一筆有效分數的科目
-        valid_subject_columns = [col for col in selected_subject_columns if complete_df[col].notna().any()]
-        if not valid_subject_columns:
-            return ({'error': '所選科目欄位皆無有效數值資料'}), 400
-
-        selected_subject_columns = valid_subject_columns
+        dimensions = (year_col, gender_col, school_type_col, admission_col)
+        # 有 OLAP cube 時各年度的人數與科目成績彙總由 cube roll-up，不讀取資料列
+        parts = _subject_average_cube_parts(session, table_name, dimensions, selected_subject_columns)
+        if parts is None:
+            parts = _subject_average_frame_parts(session, table_name, dimensions, selected_subject_columns)
+        if isinstance(parts, tuple):
+            return parts
+
+        years = parts['years']
+        selected_subject_columns = parts['subject_columns']
         subject_labels = [selected_subject_labels[col] for col in selected_subject_columns]
+        year_sizes = parts['year_sizes']
+        subject_means = parts['subject_means']
+        subject_counts = parts['subject_counts']
+        gender_counts = parts['gender_counts'].reindex(columns=['男', '女'], fill_value=0)
+        school_type_counts = parts['school_type_counts'].reindex(columns=school_types, fill_value=0)
+        admission_counts = parts['admission_counts'].reindex(columns=admission_types, fill_value=0)
 
-        school_types = ['國立', '私立', '財團', '市立', '其他', '私大轉', '科大轉', '國大轉', '僑生']
-        admission_types = ['申請入學', '繁星推薦', '自然組', '社會組', '僑生', '願景', '其他']
-
-        years = sorted(complete_df[year_col].unique())
         yearly_averages = []
-
         for year in years:
-            year_data = complete_df[complete_df[year_col] == year].copy()
-            year_avg = {'年度': int(year), '總人數': int(len(year_data))}
-
-            # 性別統計
-            if gender_col and gender_col in year_data.columns:
-                normalized_gender = year_data[gender_col].astype(str).str.strip().str.upper().replace({
-                    'M': '男', 'MALE': '男', '男生': '男', '1': '男',
-                    'F': '女', 'FEMALE': '女', '女生': '女', '2': '女'
-                })
-                year_avg['男性人數'] = int((normalized_gender == '男').sum())
-                year_avg['女性人數'] = int((normalized_gender == '女').sum())
-            else:
-                year_avg['男性人數'] = 0
-                year_avg['女性人數'] = 0
-
-            # 高中類型統計
-            school_type_counts = {}
-            if school_type_col and school_type_col in year_data.columns:
-                classified_school_types = year_data[school_type_col].apply(classify_school_type)
-                school_type_counts = classified_school_types.value_counts().to_dict()
+            year_avg = {
+                '年度': int(year),
+                '總人數': int(year_sizes[year]),
+                '男性人數': int(gender_counts.at[year, '男']),
+                '女性人數': int(gender_counts.at[year, '女']),
+            }
             for school_type in school_types:
-                year_avg[f'{school_type}人數'] = int(school_type_counts.get(school_type, 0))
-
-            # 入學管道統計
-            admission_counts = {}
-            if admission_col and admission_col in year_data.columns:
-                classified_admission = year_data[admission_col].apply(classify_admission_method)
-                admission_counts = classified_admission.value_counts().to_dict()
+                year_avg[f'{school_type}人數'] = int(school_type_counts.at[year, school_type])
             for admission_type in admission_types:
-                year_avg[f'{admission_type}人數'] = int(admission_counts.get(admission_type, 0))
+                year_avg[f'{admission_type}人數'] = int(admission_counts.at[year, admission_type])
 
             # 科目平均成績
             for subject_col in selected_subject_columns:
                 label = selected_subject_labels[subject_col]
-                valid_scores = year_data[subject_col].dropna()
-                year_avg[label] = round(float(valid_scores.mean()), 2) if len(valid_scores) > 0 else None
+                has_scores = subject_counts.at[year, subject_col] > 0
+                year_avg[label] = round(float(subject_means.at[year, subject_col]), 2) if has_scores else None
 
             yearly_averages.append(year_avg)
 
-        overall_stats = {}
-        for subject_col in selected_subject_columns:
-            label = selected_subject_labels[subject_col]
-            valid_scores = complete_df[subject_col].dropna()
-            if len(valid_scores) > 0:
-                overall_stats[label] = {
-                    'overall_average': round(float(valid_scores.mean()), 2),
-                    'min_score': round(float(valid_scores.min()), 2),
-                    'max_score': round(float(valid_scores.max()), 2),
-                    'std_dev': round(float(valid_scores.std()), 2) if len(valid_scores) > 1 else 0.0,
-                    'total_students': int(len(valid_scores))
-                }
-            else:
-                overall_stats[label] = {
-                    'overall_average': None,
-                    'min_score': None,
-                    'max_score': None,
-                    'std_dev': None,
-                    'total_students': 0
-                }
+        overall_stats = {selected_subject_labels[col]: stats for col, stats in parts['overall_stats'].items()}
 
         subject_averages = [
             (subject, stats['overall_average'])
@@ -1100,30 +1634,13 @@ def subject_average_stats(data):
         highest_subject = max(subject_averages, key=lambda x: x[1]) if subject_averages else None
         lowest_subject = min(subject_averages, key=lambda x: x[1]) if subject_averages else None
 
-        gender_summary = {'男性': 0, '女性': 0}
-        if gender_col and gender_col in complete_df.columns:
-            normalized_gender = complete_df[gender_col].astype(str).str.strip().str.upper().replace({
-                'M': '男', 'MALE': '男', '男生': '男', '1': '男',
-                'F': '女', 'FEMALE': '女', '女生': '女', '2': '女'
-            })
-            gender_summary = {
-                '男性': int((normalized_gender == '男').sum()),
-                '女性': int((normalized_gender == '女').sum())
-            }
-
-        school_type_summary = {}
-        if school_type_col and school_type_col in complete_df.columns:
-            school_type_summary = {
-                k: int(v)
-                for k, v in complete_df[school_type_col].apply(classify_school_type).value_counts().to_dict().items()
-            }
-
-        admission_summary = {}
-        if admission_col and admission_col in complete_df.columns:
-            admission_summary = {
-                k: int(v)
-                for k, v in complete_df[admission_col].apply(classify_admission_method).value_counts().to_dict().items()
-            }
+        # 整體摘要沿用上面的正規化與分類結果
+        gender_summary = {
+            '男性': int(gender_counts['男'].sum()),
+            '女性': int(gender_counts['女'].sum()),
+        }
+        school_type_summary = parts['school_type_summary']
+        admission_summary = parts['admission_summary']
 
         result = {
             'yearly_data': yearly_averages,
@@ -1131,7 +1648,7 @@ def subject_average_stats(data):
             'subjects': subject_labels,
             'years': [int(year) for year in years],
             'year_range': f"{int(min(years))}-{int(max(years))}",
-            'total_students': int(len(complete_df)),
+            'total_students': parts['total_students'],
             'gender_summary': gender_summary,
             'school_type_summary': school_type_summary,
             'admission_summary': admission_summary,
@@ -1167,6 +1684,147 @@ def subject_average_stats(data):
             session.close()
 
 
+# 成績累加值：總和、有效筆數、平方和（可合併，平均、標準差與信賴區間都由此計算）
+ScoreMoments = namedtuple('ScoreMoments', ['total', 'count', 'sum_sq'])
+EMPTY_SCORES = ScoreMoments(0.0, 0, 0.0)
+
+# 雙尾 95% t 分布臨界值（自由度 → 臨界值）；查表取不超過實際自由度的最大項，自由度夠大時為常態分布的 1.96
+T_CRITICAL_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+    11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093, 20: 2.086,
+    21: 2.080, 22: 2.074, 23: 2.069, 24: 2.064, 25: 2.060, 26: 2.056, 27: 2.052, 28: 2.048, 29: 2.045, 30: 2.042,
+    40: 2.021, 60: 2.000, 120: 1.980, 1000: 1.960,
+}
+
+
+def _aggregate_subject_scores(df, group_cols, subject_cols):
+    """
+    科目成績分析共用的彙總核心：以單次分組計算每個群組（例如 類別 × 年度）各科目的成績總和、有效筆數與平方和
+    subject_cols 須已轉為數值；回傳 {群組鍵: {科目欄位: ScoreMoments}}，群組有資料列但科目皆為空值時筆數為 0
+    """
+    subject_cols = list(dict.fromkeys(subject_cols))
+    if df.empty:
+        return {}
+    scores = df[subject_cols]
+    squared = (scores ** 2).add_suffix('__sq')
+    keys = [df[col] for col in group_cols]
+    stats = pd.concat([scores, squared], axis=1).groupby(keys, sort=False).agg(['sum', 'count'])
+    sums = stats.xs('sum', axis=1, level=1)
+    totals = sums[subject_cols].to_numpy(dtype=float)
+    sum_squares = sums[squared.columns].to_numpy(dtype=float)
+    counts = stats.xs('count', axis=1, level=1)[subject_cols].to_numpy()
+    return {
+        key: {
+            col: ScoreMoments(float(totals[i, j]), int(counts[i, j]), float(sum_squares[i, j]))
+            for j, col in enumerate(subject_cols)
+        }
+        for i, key in enumerate(stats.index)
+    }
+
+
+def _combine_scores(scores_list):
+    """合併多組 ScoreMoments"""
+    total = 0.0
+    count = 0
+    sum_sq = 0.0
+    for scores in scores_list:
+        total += scores.total
+        count += scores.count
+        sum_sq += scores.sum_sq
+    return ScoreMoments(total, count, sum_sq)
+
+
+def _round_score(value, ndigits):
+    """以 numpy 的捨入方式取位數，與原本對 Series.mean() 結果呼叫 round() 的數值一致"""
+    return float(np.round(value, ndigits))
+
+
+def _score_mean(scores, ndigits):
+    """由 ScoreMoments 計算平均並取位數，沒有有效成績時回傳 None"""
+    return _round_score(scores.total / scores.count, ndigits) if scores.count else None
+
+
+def _score_variance(scores):
+    """樣本變異數（ddof=1），筆數不足 2 時回傳 None"""
+    if scores.count < 2:
+        return None
+    return max(scores.sum_sq - scores.total * scores.total / scores.count, 0.0) / (scores.count - 1)
+
+
+def _t_critical_95(degrees_of_freedom):
+    usable = [df for df in T_CRITICAL_95 if df <= degrees_of_freedom]
+    return T_CRITICAL_95[max(usable)] if usable else None
+
+
+def _score_std(scores, ndigits):
+    variance = _score_variance(scores)
+    return _round_score(math.sqrt(variance), ndigits) if variance is not None else None
+
+
+def _score_ci95(scores, ndigits):
+    """平均數的 95% 信賴區間 [下界, 上界]（t 分布），筆數不足 2 時回傳 None"""
+    variance = _score_variance(scores)
+    if variance is None:
+        return None
+    mean = scores.total / scores.count
+    margin = _t_critical_95(scores.count - 1) * math.sqrt(variance / scores.count)
+    return [_round_score(mean - margin, ndigits), _round_score(mean + margin, ndigits)]
+
+
+def _difference_ci95(first, second, ndigits):
+    """兩組平均差（first - second）的 95% 信賴區間（Welch t 檢定的自由度），任一組筆數不足 2 時回傳 None"""
+    first_variance = _score_variance(first)
+    second_variance = _score_variance(second)
+    if first_variance is None or second_variance is None:
+        return None
+    first_se2 = first_variance / first.count
+    second_se2 = second_variance / second.count
+    difference = first.total / first.count - second.total / second.count
+    standard_error = math.sqrt(first_se2 + second_se2)
+    if standard_error == 0:
+        return [_round_score(difference, ndigits), _round_score(difference, ndigits)]
+    degrees_of_freedom = (first_se2 + second_se2) ** 2 / (
+        first_se2 ** 2 / (first.count - 1) + second_se2 ** 2 / (second.count - 1)
+    )
+    margin = (_t_critical_95(degrees_of_freedom) or T_CRITICAL_95[1]) * standard_error
+    return [_round_score(difference - margin, ndigits), _round_score(difference + margin, ndigits)]
+
+
+def _category_yearly_subject_averages(group_stats, categories, years, final_subjects, subject_lookup):
+    """
+    依 (類別, 年度) 彙總結果組出 {類別: [{'year', 'subjects': {科目: 平均}}]}
+    只列出有資料列的年度；科目分組（type == 'group'）以所有成員科目的成績合併計算平均
+    """
+    details = {}
+    for category in categories:
+        yearly_data = []
+        for year in years:
+            group = group_stats.get((category, year))
+            if group is None:
+                continue
+            
+            year_result = {'year': year, 'subjects': {}}
+            for subject_info in final_subjects:
+                member_cols = [subject_lookup[name] for name in subject_info['subjects'] if name in subject_lookup]
+                average = _score_mean(_combine_scores(group[col] for col in member_cols), 2)
+                if average is not None:
+                    year_result['subjects'][subject_info['name']] = average
+            yearly_data.append(year_result)
+        details[category] = yearly_data
+    return details
+
+
+def _gender_spread(male_scores, female_scores):
+    """男女成績的標準差、平均數 95% 信賴區間與平均差的 95% 信賴區間（筆數不足時為 None）"""
+    return {
+        'male_std': _score_std(male_scores, 2),
+        'female_std': _score_std(female_scores, 2),
+        'male_ci95': _score_ci95(male_scores, 2),
+        'female_ci95': _score_ci95(female_scores, 2),
+        'difference_ci95': _difference_ci95(male_scores, female_scores, 2),
+    }
+
+
 def gender_subject_analysis(data):
     """
     性別科目成績分析 API
@@ -1199,7 +1857,7 @@ def gender_subject_analysis(data):
         
         # 建立資料庫連接
         try:
-            current_engine, current_inspector = get_database_engine(table_name)
+            current_engine, current_inspector = _table_engine(table_name)
         except ValueError as e:
             return ({'error': str(e)}), 404
         
@@ -1233,35 +1891,13 @@ def gender_subject_analysis(data):
         if safe_gender_col not in available_columns:
             return ({'error': f'性別欄位 {gender_col} 不存在'}), 400
         
-        # 建構 SQL 查詢 - 包含年度、性別和所有科目欄位
-        select_cols = [f'"{safe_year_col}"', f'"{safe_gender_col}"']
-        select_cols.extend([f'"{subject["safe"]}"' for subject in safe_subject_cols])
-        
-        # 建構 WHERE 條件
-        where_conditions = [
-            f'"{safe_year_col}" IS NOT NULL',
-            f'"{safe_year_col}" != ""',
-            f'"{safe_gender_col}" IS NOT NULL',
-            f'"{safe_gender_col}" != ""'
-        ]
-        
-        # 如果有年份篩選，添加年份條件
-        if years_filter and len(years_filter) > 0:
-            years_str = ', '.join([str(year) for year in years_filter])
-            where_conditions.append(f'"{safe_year_col}" IN ({years_str})')
-        
-        query = text(f'''
-            SELECT {", ".join(select_cols)}
-            FROM "{table_name}" 
-            WHERE {" AND ".join(where_conditions)}
-        ''')
-        
-        print(f"[gender_subject_analysis] 執行查詢: {query}")
-        result = session.execute(query)
-        
-        # 建立 DataFrame
+        # 讀取年度、性別和所有科目欄位
         column_names = [safe_year_col, safe_gender_col] + [subject['safe'] for subject in safe_subject_cols]
-        df = pd.DataFrame(result.fetchall(), columns=column_names)
+        df = _select_frame(
+            session, table_name, column_names,
+            not_empty=[safe_year_col, safe_gender_col], years_col=safe_year_col, years=years_filter,
+            numeric=[col for col in column_names[2:] if col not in (safe_year_col, safe_gender_col)],
+        )
         
         if df.empty:
             return ({'error': '沒有找到符合條件的資料'}), 404
@@ -1286,9 +1922,9 @@ def gender_subject_analysis(data):
         if df.empty:
             return ({'error': '沒有找到有效的性別資料'}), 404
         
-        # 科目成績資料轉為數值
-        for subject in safe_subject_cols:
-            df[subject['safe']] = pd.to_numeric(df[subject['safe']], errors='coerce')
+        # 科目成績資料轉為數值（每個欄位只轉換一次）
+        for subject_col in dict.fromkeys(subject['safe'] for subject in safe_subject_cols):
+            df[subject_col] = pd.to_numeric(df[subject_col], errors='coerce')
         
         # 處理科目分組
         final_subjects = []
@@ -1331,94 +1967,86 @@ def gender_subject_analysis(data):
             'analysis_mode': analysis_mode
         }
         
-        # 整體男女平均成績
-        overall_male_scores = []
-        overall_female_scores = []
+        # 一次 groupby 取得 年度 × 性別 × 科目 的成績總和與筆數
+        group_stats = _aggregate_subject_scores(df, [safe_year_col, safe_gender_col], [subject['safe'] for subject in final_subjects])
+        years = sorted({year for year, _ in group_stats})
+        
+        def gender_scores(year, gender, subject_col):
+            return group_stats.get((year, gender), {}).get(subject_col, EMPTY_SCORES)
+        
+        # 整體男女成績（所有科目、年度合併）
+        overall_male = EMPTY_SCORES
+        overall_female = EMPTY_SCORES
         
         # 逐科目分析
         for subject in final_subjects:
             subject_name = subject['original']
             subject_col = subject['safe']
             
-            # 過濾有效成績
-            subject_df = df[[safe_year_col, safe_gender_col, subject_col]].dropna()
-            
-            if subject_df.empty:
-                continue
-            
-            # 年度分組分析
             yearly_stats = []
-            years = sorted(subject_df[safe_year_col].unique())
-            
             for year in years:
-                year_data = subject_df[subject_df[safe_year_col] == year]
-                
-                male_data = year_data[year_data[safe_gender_col] == '男'][subject_col]
-                female_data = year_data[year_data[safe_gender_col] == '女'][subject_col]
+                male_scores = gender_scores(year, '男', subject_col)
+                female_scores = gender_scores(year, '女', subject_col)
+                if male_scores.count == 0 and female_scores.count == 0:
+                    continue
                 
-                male_avg = male_data.mean() if len(male_data) > 0 else None
-                female_avg = female_data.mean() if len(female_data) > 0 else None
+                male_avg = _score_mean(male_scores, 2)
+                female_avg = _score_mean(female_scores, 2)
+                raw_difference = None
+                if male_scores.count and female_scores.count:
+                    raw_difference = male_scores.total / male_scores.count - female_scores.total / female_scores.count
                 
                 yearly_stats.append({
                     'year': int(year),
-                    'male_avg': round(male_avg, 2) if male_avg is not None else None,
-                    'female_avg': round(female_avg, 2) if female_avg is not None else None,
-                    'male_count': len(male_data),
-                    'female_count': len(female_data),
-                    'difference': round(male_avg - female_avg, 2) if male_avg is not None and female_avg is not None else None
+                    'male_avg': male_avg,
+                    'female_avg': female_avg,
+                    'male_count': male_scores.count,
+                    'female_count': female_scores.count,
+                    'difference': _round_score(raw_difference, 2) if raw_difference is not None else None,
+                    **_gender_spread(male_scores, female_scores),
                 })
                 
-                # 收集整體統計用的資料
-                if male_avg is not None:
-                    overall_male_scores.extend(male_data.tolist())
-                if female_avg is not None:
-                    overall_female_scores.extend(female_data.tolist())
+                overall_male = _combine_scores([overall_male, male_scores])
+                overall_female = _combine_scores([overall_female, female_scores])
             
-            analysis_results['subject_details'][subject_name] = yearly_stats
+            if yearly_stats:
+                analysis_results['subject_details'][subject_name] = yearly_stats
         
         # 計算整體統計
-        if overall_male_scores and overall_female_scores:
+        if overall_male.count and overall_female.count:
             analysis_results['overall_summary'] = {
-                'male_avg': round(sum(overall_male_scores) / len(overall_male_scores), 2),
-                'female_avg': round(sum(overall_female_scores) / len(overall_female_scores), 2),
-                'total_male_records': len(overall_male_scores),
-                'total_female_records': len(overall_female_scores)
+                'male_avg': round(overall_male.total / overall_male.count, 2),
+                'female_avg': round(overall_female.total / overall_female.count, 2),
+                'total_male_records': overall_male.count,
+                'total_female_records': overall_female.count
             }
             
             # 計算整體差異
             overall_diff = analysis_results['overall_summary']['male_avg'] - analysis_results['overall_summary']['female_avg']
             analysis_results['overall_summary']['difference'] = round(overall_diff, 2)
+            analysis_results['overall_summary'].update(_gender_spread(overall_male, overall_female))
         
         # 如果是整體平均分析模式，添加科目對比數據
         if analysis_mode == 'overall':
             subject_comparison = []
             
             for subject in final_subjects:
-                subject_name = subject['original']
                 subject_col = subject['safe']
                 
-                # 過濾有效成績
-                subject_df = df[[safe_year_col, safe_gender_col, subject_col]].dropna()
-                
-                if subject_df.empty:
-                    continue
-                
                 # 計算整體男女平均（所有年份合併）
-                male_data = subject_df[subject_df[safe_gender_col] == '男'][subject_col]
-                female_data = subject_df[subject_df[safe_gender_col] == '女'][subject_col]
+                male_scores = _combine_scores(gender_scores(year, '男', subject_col) for year in years)
+                female_scores = _combine_scores(gender_scores(year, '女', subject_col) for year in years)
                 
-                male_avg = male_data.mean() if len(male_data) > 0 else None
-                female_avg = female_data.mean() if len(female_data) > 0 else None
-                
-                if male_avg is not None and female_avg is not None:
-                    difference = round(male_avg - female_avg, 2)
+                if male_scores.count and female_scores.count:
+                    raw_difference = male_scores.total / male_scores.count - female_scores.total / female_scores.count
                     subject_comparison.append({
-                        'subject': subject_name,
-                        'male_avg': round(male_avg, 2),
-                        'female_avg': round(female_avg, 2),
-                        'difference': difference,
-                        'male_count': len(male_data),
-                        'female_count': len(female_data)
+                        'subject': subject['original'],
+                        'male_avg': _score_mean(male_scores, 2),
+                        'female_avg': _score_mean(female_scores, 2),
+                        'difference': _round_score(raw_difference, 2),
+                        'male_count': male_scores.count,
+                        'female_count': female_scores.count,
+                        **_gender_spread(male_scores, female_scores),
                     })
             
             analysis_results['subject_comparison'] = subject_comparison
@@ -1466,7 +2094,7 @@ def admission_subject_analysis(data):
         
         # 建立資料庫連接
         try:
-            current_engine, current_inspector = get_database_engine(table_name)
+            current_engine, current_inspector = _table_engine(table_name)
         except ValueError as e:
             return ({'error': str(e)}), 404
         
@@ -1500,34 +2128,13 @@ def admission_subject_analysis(data):
         if safe_admission_col not in available_columns:
             return ({'error': f'入學管道欄位 {admission_col} 不存在'}), 400
         
-        # 建構 SQL 查詢 - 包含年度、入學管道和所有科目欄位
-        select_cols = [f'"{safe_year_col}"', f'"{safe_admission_col}"']
-        select_cols.extend([f'"{subject["safe"]}"' for subject in safe_subject_cols])
-        
-        # 建構 WHERE 條件
-        where_conditions = [
-            f'"{safe_year_col}" IS NOT NULL',
-            f'"{safe_year_col}" != ""',
-            f'"{safe_admission_col}" IS NOT NULL',
-            f'"{safe_admission_col}" != ""'
-        ]
-        
-        # 如果有年份篩選，添加年份條件
-        if years_filter and len(years_filter) > 0:
-            years_str = ', '.join([str(year) for year in years_filter])
-            where_conditions.append(f'"{safe_year_col}" IN ({years_str})')
-        
-        query = text(f'''
-            SELECT {", ".join(select_cols)}
-            FROM "{table_name}" 
-            WHERE {" AND ".join(where_conditions)}
-        ''')
-        
-        print(f"[admission_subject_analysis] 執行查詢: {query}")
-        result = session.execute(query)
-        
-        # 讀取資料並轉換為 DataFrame
-        df = pd.DataFrame(result.fetchall(), columns=[safe_year_col, safe_admission_col] + [subject["safe"] for subject in safe_subject_cols])
+        # 讀取年度、入學管道和所有科目欄位
+        column_names = [safe_year_col, safe_admission_col] + [subject['safe'] for subject in safe_subject_cols]
+        df = _select_frame(
+            session, table_name, column_names,
+            not_empty=[safe_year_col, safe_admission_col], years_col=safe_year_col, years=years_filter,
+            numeric=[col for col in column_names[2:] if col not in (safe_year_col, safe_admission_col)],
+        )
         
         if df.empty:
             return ({'error': '查詢結果為空，請檢查篩選條件'}), 404
@@ -1535,7 +2142,7 @@ def admission_subject_analysis(data):
         print(f"[admission_subject_analysis] 讀取到 {len(df)} 筆資料")
         
         # 使用入學管道分類函數對資料進行分類
-        df['classified_admission'] = df[safe_admission_col].apply(classify_admission_method)
+        df['classified_admission'] = classify_distinct(df[safe_admission_col], classify_admission_method)
         
         # 獲取所有可用的年份，過濾空值和空字串
         all_years = sorted([year for year in df[safe_year_col].unique().tolist() if str(year).strip() != ''])
@@ -1573,58 +2180,18 @@ def admission_subject_analysis(data):
             'method_details': {}
         }
         
-        # 對每個最終入學管道進行分析
-        for method in final_admission_methods:
-            method_data = df[df['classified_admission'] == method].copy()
-            yearly_data = []
-            
-            for year in all_years:
-                year_data = method_data[method_data[safe_year_col] == year]
-                
-                if not year_data.empty:
-                    year_result = {'year': year, 'subjects': {}}
-                    
-                    for subject_info in final_subjects:
-                        subject_name = subject_info['name']
-                        subject_type = subject_info['type']
-                        subject_cols_list = subject_info['subjects']
-                        
-                        if subject_type == 'group':
-                            # 科目分組：計算多個科目的平均分
-                            valid_scores = []
-                            for subject_col in subject_cols_list:
-                                # 找到對應的安全欄位名稱
-                                safe_col = None
-                                for safe_subject in safe_subject_cols:
-                                    if safe_subject['original'] == subject_col:
-                                        safe_col = safe_subject['safe']
-                                        break
-                                
-                                if safe_col and safe_col in year_data.columns:
-                                    scores = pd.to_numeric(year_data[safe_col], errors='coerce').dropna()
-                                    valid_scores.extend(scores.tolist())
-                            
-                            if valid_scores:
-                                group_avg = round(sum(valid_scores) / len(valid_scores), 2)
-                                year_result['subjects'][subject_name] = group_avg
-                        else:
-                            # 單一科目：直接計算該科目的平均分
-                            subject_col = subject_cols_list[0]
-                            safe_col = None
-                            for safe_subject in safe_subject_cols:
-                                if safe_subject['original'] == subject_col:
-                                    safe_col = safe_subject['safe']
-                                    break
-                            
-                            if safe_col and safe_col in year_data.columns:
-                                scores = pd.to_numeric(year_data[safe_col], errors='coerce').dropna()
-                                if len(scores) > 0:
-                                    subject_avg = round(scores.mean(), 2)
-                                    year_result['subjects'][subject_name] = subject_avg
-                    
-                    yearly_data.append(year_result)
-            
-            analysis_results['method_details'][method] = yearly_data
+        # 科目成績轉為數值後，以一次 groupby 取得 入學管道 × 年度 × 科目 的成績總和與筆數
+        subject_lookup = {}
+        for subject in safe_subject_cols:
+            subject_lookup.setdefault(subject['original'], subject['safe'])
+        subject_columns = list(dict.fromkeys(subject['safe'] for subject in safe_subject_cols))
+        for subject_col in subject_columns:
+            df[subject_col] = pd.to_numeric(df[subject_col], errors='coerce')
+        group_stats = _aggregate_subject_scores(df, ['classified_admission', safe_year_col], subject_columns)
+        
+        analysis_results['method_details'] = _category_yearly_subject_averages(
+            group_stats, final_admission_methods, all_years, final_subjects, subject_lookup
+        )
         
         print(f"[admission_subject_analysis] 分析完成，涵蓋 {len(final_subjects)} 科目，{len(all_admission_methods)} 個入學管道")
         return (analysis_results)
@@ -1668,7 +2235,7 @@ def school_type_subject_analysis(data):
         
         # 建立資料庫連接
         try:
-            current_engine, current_inspector = get_database_engine(table_name)
+            current_engine, current_inspector = _table_engine(table_name)
         except ValueError as e:
             return ({'error': str(e)}), 404
         
@@ -1704,34 +2271,13 @@ def school_type_subject_analysis(data):
         if safe_school_type_col not in available_columns:
             return ({'error': f'高中類型欄位 {school_type_col} 不存在'}), 400
         
-        # 建構 SQL 查詢 - 包含年度、高中類型和所有科目欄位
-        select_cols = [f'"{safe_year_col}"', f'"{safe_school_type_col}"']
-        select_cols.extend([f'"{subject["safe"]}"' for subject in safe_subject_cols])
-        
-        # 建構 WHERE 條件
-        where_conditions = [
-            f'"{safe_year_col}" IS NOT NULL',
-            f'"{safe_year_col}" != ""',
-            f'"{safe_school_type_col}" IS NOT NULL',
-            f'"{safe_school_type_col}" != ""'
-        ]
-        
-        # 如果有年份篩選，添加年份條件
-        if years_filter and len(years_filter) > 0:
-            years_str = ', '.join([str(year) for year in years_filter])
-            where_conditions.append(f'"{safe_year_col}" IN ({years_str})')
-        
-        query = text(f'''
-            SELECT {", ".join(select_cols)}
-            FROM "{table_name}" 
-            WHERE {" AND ".join(where_conditions)}
-        ''')
-        
-        print(f"[school_type_subject_analysis] 執行查詢: {query}")
-        result = session.execute(query)
-        
-        # 讀取資料並轉換為 DataFrame
-        df = pd.DataFrame(result.fetchall(), columns=[safe_year_col, safe_school_type_col] + [subject["safe"] for subject in safe_subject_cols])
+        # 讀取年度、高中類型和所有科目欄位
+        column_names = [safe_year_col, safe_school_type_col] + [subject['safe'] for subject in safe_subject_cols]
+        df = _select_frame(
+            session, table_name, column_names,
+            not_empty=[safe_year_col, safe_school_type_col], years_col=safe_year_col, years=years_filter,
+            numeric=[col for col in column_names[2:] if col not in (safe_year_col, safe_school_type_col)],
+        )
         
         if df.empty:
             return ({'error': '查詢結果為空，請檢查篩選條件'}), 404
@@ -1739,7 +2285,7 @@ def school_type_subject_analysis(data):
         print(f"[school_type_subject_analysis] 讀取到 {len(df)} 筆資料")
         
         # 使用高中類型分類函數對資料進行分類
-        df['classified_school_type'] = df[safe_school_type_col].apply(classify_school_type)
+        df['classified_school_type'] = classify_distinct(df[safe_school_type_col], classify_school_type)
         
         # 獲取所有可用的年份，過濾空值和空字串
         all_years = sorted([year for year in df[safe_year_col].unique().tolist() if str(year).strip() != ''])
@@ -1777,58 +2323,18 @@ def school_type_subject_analysis(data):
             'type_details': {}
         }
         
-        # 對每個最終高中類型進行分析
-        for school_type in final_school_types:
-            type_data = df[df['classified_school_type'] == school_type].copy()
-            yearly_data = []
-            
-            for year in all_years:
-                year_data = type_data[type_data[safe_year_col] == year]
-                
-                if not year_data.empty:
-                    year_result = {'year': year, 'subjects': {}}
-                    
-                    for subject_info in final_subjects:
-                        subject_name = subject_info['name']
-                        subject_type = subject_info['type']
-                        subject_cols_list = subject_info['subjects']
-                        
-                        if subject_type == 'group':
-                            # 科目分組：計算多個科目的平均分
-                            valid_scores = []
-                            for subject_col in subject_cols_list:
-                                # 找到對應的安全欄位名稱
-                                safe_col = None
-                                for safe_subject in safe_subject_cols:
-                                    if safe_subject['original'] == subject_col:
-                                        safe_col = safe_subject['safe']
-                                        break
-                                
-                                if safe_col and safe_col in year_data.columns:
-                                    scores = pd.to_numeric(year_data[safe_col], errors='coerce').dropna()
-                                    valid_scores.extend(scores.tolist())
-                            
-                            if valid_scores:
-                                group_avg = round(sum(valid_scores) / len(valid_scores), 2)
-                                year_result['subjects'][subject_name] = group_avg
-                        else:
-                            # 單一科目：直接計算該科目的平均分
-                            subject_col = subject_cols_list[0]
-                            safe_col = None
-                            for safe_subject in safe_subject_cols:
-                                if safe_subject['original'] == subject_col:
-                                    safe_col = safe_subject['safe']
-                                    break
-                            
-                            if safe_col and safe_col in year_data.columns:
-                                scores = pd.to_numeric(year_data[safe_col], errors='coerce').dropna()
-                                if len(scores) > 0:
-                                    subject_avg = round(scores.mean(), 2)
-                                    year_result['subjects'][subject_name] = subject_avg
-                    
-                    yearly_data.append(year_result)
-            
-            analysis_results['type_details'][school_type] = yearly_data
+        # 科目成績轉為數值後，以一次 groupby 取得 高中類型 × 年度 × 科目 的成績總和與筆數
+        subject_lookup = {}
+        for subject in safe_subject_cols:
+            subject_lookup.setdefault(subject['original'], subject['safe'])
+        subject_columns = list(dict.fromkeys(subject['safe'] for subject in safe_subject_cols))
+        for subject_col in subject_columns:
+            df[subject_col] = pd.to_numeric(df[subject_col], errors='coerce')
+        group_stats = _aggregate_subject_scores(df, ['classified_school_type', safe_year_col], subject_columns)
+        
+        analysis_results['type_details'] = _category_yearly_subject_averages(
+            group_stats, final_school_types, all_years, final_subjects, subject_lookup
+        )
         
         print(f"[school_type_subject_analysis] 分析完成，涵蓋 {len(final_subjects)} 科目，{len(final_school_types)} 個高中類型")
         return (analysis_results)
@@ -1870,7 +2376,7 @@ def region_subject_analysis(data):
         
         # 建立資料庫連接
         try:
-            current_engine, current_inspector = get_database_engine(table_name)
+            current_engine, current_inspector = _table_engine(table_name)
         except ValueError as e:
             return ({'error': str(e)}), 400
 
@@ -1913,43 +2419,15 @@ def region_subject_analysis(data):
         display_subjects = [original for original, _ in valid_subject_pairs]
         resolved_subject_cols = [resolved for _, resolved in valid_subject_pairs]
         
-        # 構建查詢
+        # 讀取年度、地區與科目欄位（至少一個科目有值的資料列）
         select_columns = [resolved_year_col, resolved_region_col] + resolved_subject_cols
-        columns_str = ', '.join([f'"{col}"' for col in select_columns])
-        query_params = {}
-        
-        # 基本查詢
-        query = f'''
-        SELECT {columns_str}
-        FROM "{table_name}"
-        WHERE "{resolved_year_col}" IS NOT NULL 
-        AND "{resolved_year_col}" != ""
-        AND "{resolved_region_col}" IS NOT NULL
-        AND "{resolved_region_col}" != ""
-        '''
-        
-        # 添加年份篩選條件
-        if years_filter and len(years_filter) > 0:
-            year_placeholders = []
-            for idx, year in enumerate(years_filter):
-                key = f'year_{idx}'
-                year_placeholders.append(f':{key}')
-                query_params[key] = str(year)
-            query += f' AND "{resolved_year_col}" IN ({", ".join(year_placeholders)})'
-        
-        # 添加科目欄位非空條件
-        subject_conditions = []
-        for col in resolved_subject_cols:
-            subject_conditions.append(f'"{col}" IS NOT NULL')
-        if subject_conditions:
-            query += ' AND (' + ' OR '.join(subject_conditions) + ')'
-        
-        print(f"[region_subject_analysis] 執行查詢: {query}")
-        
-        # 執行查詢
-        with current_engine.connect() as conn:
-            result = conn.execute(text(query), query_params)
-            df = pd.DataFrame(result.fetchall(), columns=result.keys())
+        df = _select_frame(
+            session, table_name, select_columns,
+            not_empty=[resolved_year_col, resolved_region_col],
+            years_col=resolved_year_col, years=years_filter,
+            any_not_null=resolved_subject_cols,
+            numeric=[col for col in resolved_subject_cols if col not in (resolved_year_col, resolved_region_col)],
+        )
         
         print(f"[region_subject_analysis] 讀取到 {len(df)} 筆資料")
         
@@ -1985,52 +2463,30 @@ def region_subject_analysis(data):
             'region_details': {}
         }
         
-        # 對每個最終地區進行分析
+        # 科目成績轉為數值後，以一次 groupby 取得 地區 × 年度 × 科目 的成績總和與筆數
+        subject_columns = list(dict.fromkeys(resolved_subject_cols))
+        for subject_col in subject_columns:
+            df[subject_col] = pd.to_numeric(df[subject_col], errors='coerce')
+        group_stats = _aggregate_subject_scores(df, [resolved_region_col, resolved_year_col], subject_columns)
+        
+        # 對每個最終地區進行分析（該年度沒有資料時仍列出空記錄）
+        subjects_with_data = set()
         for region in final_regions:
-            region_data = df[df[resolved_region_col] == region].copy()
             yearly_data = []
-            
             for year in available_years:
-                year_data_filtered = region_data[region_data[resolved_year_col] == year]
-                
-                if not year_data_filtered.empty:
-                    year_result = {'year': year, 'subjects': {}}
-                    
-                    for original_subject, resolved_subject in valid_subject_pairs:
-                        if resolved_subject in year_data_filtered.columns:
-                            subject_values = pd.to_numeric(year_data_filtered[resolved_subject], errors='coerce').dropna()
-                            if len(subject_values) > 0:
-                                avg_score = round(subject_values.mean(), 1)
-                                year_result['subjects'][original_subject] = avg_score
-                            else:
-                                year_result['subjects'][original_subject] = None
-                        else:
-                            year_result['subjects'][original_subject] = None
-                    
-                    yearly_data.append(year_result)
-                else:
-                    # 如果該年度沒有數據，仍要添加空記錄
-                    year_result = {'year': year, 'subjects': {}}
-                    for original_subject, _ in valid_subject_pairs:
-                        year_result['subjects'][original_subject] = None
-                    yearly_data.append(year_result)
+                group = group_stats.get((region, year), {})
+                year_result = {'year': year, 'subjects': {}}
+                for original_subject, resolved_subject in valid_subject_pairs:
+                    average = _score_mean(group.get(resolved_subject, EMPTY_SCORES), 1)
+                    year_result['subjects'][original_subject] = average
+                    if average is not None:
+                        subjects_with_data.add(original_subject)
+                yearly_data.append(year_result)
             
             result_data['region_details'][region] = yearly_data
         
         # 篩選出實際有數據的科目
-        final_subjects = []
-        for subject in display_subjects:
-            has_data = False
-            for region_detail in result_data['region_details'].values():
-                for year_data in region_detail:
-                    if year_data['subjects'].get(subject) is not None:
-                        has_data = True
-                        break
-                if has_data:
-                    break
-            if has_data:
-                final_subjects.append(subject)
-        
+        final_subjects = [subject for subject in display_subjects if subject in subjects_with_data]
         result_data['subjects'] = final_subjects
         
         print(f"[region_subject_analysis] 分析完成，涵蓋 {len(final_subjects)} 科目，{len(final_regions)} 個地區")
@@ -2045,3 +2501,913 @@ def region_subject_analysis(data):
         if session is not None:
             session.close()
 
+
+# 相關係數分析：成對有效筆數下限（不足或任一科變異為 0 時為 None）、科目數上限、可用的分組方式
+MIN_CORRELATION_PAIRS = 3
+MAX_CORRELATION_SUBJECTS = 40
+CORRELATION_GROUPS = ('year', 'gender')
+
+
+def _centered(values, present):
+    """各欄減去該欄有效值的平均，缺值位置為 0"""
+    counts = present.sum(axis=0)
+    totals = np.where(present, values, 0.0).sum(axis=0)
+    means = np.divide(totals, counts, out=np.zeros(values.shape[1]), where=counts > 0)
+    return np.where(present, values - means, 0.0)
+
+
+def _pairwise_pearson(values):
+    """
+    欄位兩兩的 Pearson 相關係數（pairwise-complete：每一對只使用兩科皆有成績的資料列），以遮罩矩陣乘法一次計算
+    values 為 n × k 的 float64（NaN 為缺值）；回傳 (相關係數矩陣, 成對筆數矩陣)，無法計算的位置為 NaN
+    """
+    present = ~np.isnan(values)
+    mask = present.astype(float)
+    # 先減去各欄平均（不影響相關係數），避免大數相減的精度損失
+    filled = _centered(values, present)
+    pairs = mask.T @ mask
+    sums = filled.T @ mask  # [i, j]：第 i 科在 i、j 皆有成績的資料列上的總和
+    sum_squares = (filled * filled).T @ mask
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = filled.T @ filled - sums * sums.T / pairs
+        variance = sum_squares - sums * sums / pairs
+        correlation = covariance / np.sqrt(variance * variance.T)
+    correlation[(pairs < MIN_CORRELATION_PAIRS) | ~(variance > 0) | ~(variance.T > 0)] = np.nan
+    return np.clip(correlation, -1.0, 1.0), pairs.astype(np.int64)
+
+
+def _pairwise_spearman(values):
+    """
+    Spearman 相關係數（pairwise-complete）：每一對的名次只在兩科皆有成績的資料列中計算（同分取平均名次）
+    對第 j 科有成績的資料列，一次排名各科（只保留第 j 科也有成績的列）與「第 i 科有成績時的第 j 科」，
+    兩組名次逐欄計算 Pearson 即為第 j 欄
+    """
+    present = ~np.isnan(values)
+    count = values.shape[1]
+    correlation = np.full((count, count), np.nan)
+    for j in range(count):
+        rows = present[:, j]
+        subset = values[rows]
+        paired = np.where(present[rows], subset[:, [j]], np.nan)
+        ranks = pd.DataFrame(subset).rank(method='average').to_numpy()
+        paired_ranks = pd.DataFrame(paired).rank(method='average').to_numpy()
+        valid = ~np.isnan(ranks)
+        pairs = valid.sum(axis=0)
+        first = _centered(ranks, valid)
+        second = _centered(paired_ranks, valid)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            first_sq = (first * first).sum(axis=0)
+            second_sq = (second * second).sum(axis=0)
+            column = (first * second).sum(axis=0) / np.sqrt(first_sq * second_sq)
+        column[(pairs < MIN_CORRELATION_PAIRS) | ~(first_sq > 0) | ~(second_sq > 0)] = np.nan
+        correlation[:, j] = np.clip(column, -1.0, 1.0)
+    return correlation
+
+
+def _correlation_matrix(matrix, ndigits=4):
+    return [[None if np.isnan(value) else round(float(value), ndigits) for value in row] for row in matrix]
+
+
+def _correlation_block(values):
+    pearson, pairs = _pairwise_pearson(values)
+    return {
+        'records': int(len(values)),
+        'pearson': _correlation_matrix(pearson),
+        'spearman': _correlation_matrix(_pairwise_spearman(values)),
+        'pairs': pairs.tolist(),
+    }
+
+
+def subject_correlation_analysis(data):
+    """
+    科目成績兩兩的 Pearson / Spearman 相關係數矩陣（pairwise-complete：每一對只使用兩科皆有成績的學生）
+    前端傳入 { table_name, subjects（未指定時自動偵測）, group_by: year / gender（可選）, year_col, gender_col, years }
+    回傳 overall 與各分組的 pearson / spearman / pairs（成對筆數）矩陣，順序同 subjects
+    """
+    session = None
+    try:
+        data = data or {}
+        table_name = data.get('table_name')
+        group_by = data.get('group_by')
+        years_filter = data.get('years')
+
+        if not table_name:
+            return ({'error': '缺少 table_name 參數'}), 400
+        if group_by is not None and group_by not in CORRELATION_GROUPS:
+            return ({'error': f'group_by 必須為 {"、".join(CORRELATION_GROUPS)} 之一'}), 400
+
+        try:
+            current_engine, current_inspector = _table_engine(table_name)
+        except ValueError as e:
+            return ({'error': str(e)}), 404
+
+        columns_info = current_inspector.get_columns(table_name)
+        available_columns = [col['name'] for col in columns_info]
+
+        try:
+            year_col = resolve_column_name(
+                data.get('year_col'),
+                available_columns,
+                label='年度欄位',
+                candidates=YEAR_COLUMN_CANDIDATES,
+                required=group_by == 'year' or bool(years_filter)
+            )
+            gender_col = resolve_column_name(
+                data.get('gender_col'),
+                available_columns,
+                label='性別欄位',
+                candidates=['性別', 'gender', 'sex'],
+                required=group_by == 'gender'
+            )
+        except ValueError as e:
+            return ({'error': str(e)}), 400
+
+        requested_subjects = data.get('subjects') or []
+        subject_pairs = []
+        if requested_subjects:
+            missing_subjects = []
+            for subject in requested_subjects:
+                resolved_col = resolve_column_name(subject, available_columns, label='科目欄位', required=False)
+                if resolved_col is None:
+                    missing_subjects.append(subject)
+                else:
+                    subject_pairs.append((subject, resolved_col))
+            if missing_subjects:
+                return ({'error': f'找不到科目欄位: {missing_subjects}'}), 400
+        else:
+            subject_pairs = [
+                (subject, subject)
+                for subject in auto_detect_subject_columns(available_columns, excluded_columns=[year_col, gender_col])
+            ]
+
+        group_col = {'year': year_col, 'gender': gender_col}.get(group_by)
+        # 同一欄位只計算一次；分組欄位不列入科目
+        subject_labels = {}
+        for original, resolved_col in subject_pairs:
+            if resolved_col != group_col:
+                subject_labels.setdefault(resolved_col, original)
+        subject_cols = list(subject_labels)
+
+        if len(subject_cols) < 2:
+            return ({'error': '至少需要兩個科目欄位才能計算相關係數'}), 400
+        if len(subject_cols) > MAX_CORRELATION_SUBJECTS:
+            return ({'error': f'科目欄位最多 {MAX_CORRELATION_SUBJECTS} 個'}), 400
+
+        SessionLocal = sessionmaker(bind=current_engine)
+        session = SessionLocal()
+        group_columns = [group_col] if group_col else []
+        df = _select_frame(
+            session, table_name, [*group_columns, *subject_cols], numeric=subject_cols,
+            not_empty=group_columns, years_col=year_col, years=years_filter, any_not_null=subject_cols,
+        )
+        if df.empty:
+            return ({'error': '沒有找到相關資料'}), 404
+
+        values = df[subject_cols].to_numpy(dtype=float)
+        groups = []
+        if group_by == 'year':
+            keys = pd.to_numeric(df[group_col], errors='coerce')
+            valid = keys.notna().to_numpy()
+            keys = keys[valid].astype(int).to_numpy()
+            for year in sorted(set(keys.tolist())):
+                groups.append({'group': int(year), **_correlation_block(values[valid][keys == year])})
+        elif group_by == 'gender':
+            keys = classify_distinct(df[group_col], _normalize_summary_gender).to_numpy()
+            for gender in ('男', '女'):
+                if (keys == gender).any():
+                    groups.append({'group': gender, **_correlation_block(values[keys == gender])})
+
+        result = {
+            'subjects': [subject_labels[col] for col in subject_cols],
+            'overall': _correlation_block(values),
+            'group_by': group_by,
+            'groups': groups,
+            'min_pairs': MIN_CORRELATION_PAIRS,
+            'resolved_columns': {
+                'year_col': year_col,
+                'gender_col': gender_col,
+                'subject_cols': subject_cols,
+            },
+        }
+        print(f"[subject_correlation_analysis] 分析完成，{len(subject_cols)} 科目、{len(df)} 筆資料、{len(groups)} 個分組")
+        return (result)
+
+    except Exception as e:
+        print(f"[subject_correlation_analysis] Error: {str(e)}")
+        return ({'error': f'處理資料時發生錯誤: {str(e)}'}), 500
+
+    finally:
+        if session is not None:
+            session.close()
+
+
+# 交叉分析的維度上限與表格大小上限（列鍵數 × 欄鍵數）
+MAX_PIVOT_CELLS = 20000
+PIVOT_TOTAL_LABEL = '合計'
+
+
+def _pivot_classifiers():
+    """交叉分析可用的分類維度（使用目前設定的分類函數）"""
+    return {
+        'school_type': classify_school_type,
+        'admission_method': classify_admission_method,
+        'region': classify_region,
+        'city': normalize_city,
+    }
+
+
+def _partials_by_key(partials):
+    """將 combine_partials 的結果轉為 {鍵值 tuple: 部分彙總列}，鍵值中的 NaN 轉為 None"""
+    return {
+        tuple(analysis_query.key_value(value) for value in (key if isinstance(key, tuple) else (key,))): partial
+        for key, partial in partials.iterrows()
+    }
+
+
+def pivot_analysis(data):
+    """
+    通用交叉分析：列維度 × 欄維度（選填）的量值表，新的圖表只需要新的設定
+    前端傳入 {
+        table_name,
+        rows: [欄位名稱 或 { column, classifier }]（最多 3 個）,
+        column: 欄位名稱 或 { column, classifier }（選填）,
+        measure: { type: count / mean / min / max / sum, column }（預設 count 資料列數）,
+        filters: [{ column, op: in / eq / not_empty / not_null, values / value }],
+        year_col, years（等同 year_col 的 in 篩選）,
+        include_empty: 未分類的維度是否保留空值（預設 false）
+    }
+    分類器：school_type / admission_method / region / city
+    編譯為單一 GROUP BY 查詢（見 service.analysis_query），分類只對不重複的原始值進行後再合併部分彙總
+    """
+    try:
+        data = data or {}
+        table_name = data.get('table_name')
+        row_specs = data.get('rows')
+        if isinstance(row_specs, (str, dict)):
+            row_specs = [row_specs]
+
+        if not table_name or not row_specs:
+            return ({'error': '缺少 table_name 或 rows'}), 400
+        if not isinstance(row_specs, list) or len(row_specs) > analysis_query.MAX_ROW_DIMENSIONS:
+            return ({'error': f'rows 最多 {analysis_query.MAX_ROW_DIMENSIONS} 個維度'}), 400
+
+        try:
+            current_engine, current_inspector = _table_engine(table_name)
+        except ValueError as e:
+            return ({'error': str(e)}), 404
+
+        available_columns = [col['name'] for col in current_inspector.get_columns(table_name)]
+        classifiers = _pivot_classifiers()
+
+        def resolve(name, label):
+            return resolve_column_name(name, available_columns, label=label)
+
+        try:
+            row_dimensions = [analysis_query.parse_dimension(spec, resolve, classifiers, '列維度') for spec in row_specs]
+            column_dimension = (
+                analysis_query.parse_dimension(data['column'], resolve, classifiers, '欄維度')
+                if data.get('column') else None
+            )
+            measure = analysis_query.parse_measure(data.get('measure'), resolve)
+            filters = analysis_query.parse_filters(data.get('filters'), resolve)
+            if data.get('years'):
+                if not data.get('year_col'):
+                    raise ValueError('指定 years 時需要 year_col')
+                filters.append(analysis_query.Filter(resolve(data['year_col'], '年度欄位'), 'in', tuple(data['years'])))
+        except ValueError as e:
+            return ({'error': str(e)}), 400
+
+        dimensions = [*row_dimensions, *([column_dimension] if column_dimension else [])]
+        group_columns = list(dict.fromkeys(dimension.column for dimension in dimensions))
+        not_empty = [] if data.get('include_empty') else list(dict.fromkeys(
+            dimension.column for dimension in dimensions if not dimension.classifier
+        ))
+
+        SessionLocal = sessionmaker(bind=current_engine)
+        session = SessionLocal()
+        try:
+            df = _query_grouped(session, QuerySpec(
+                table_name, group_columns, [*filters, *analysis_query.row_filters(not_empty)],
+                grouped=True, measure_column=measure.column,
+            ))
+        finally:
+            session.close()
+
+        if df.empty:
+            return ({'error': '沒有符合條件的資料'}), 400
+
+        keys = analysis_query.dimension_keys(df, dimensions, classifiers)
+        row_keys = keys[:len(row_dimensions)]
+        column_keys = keys[len(row_dimensions):]
+
+        row_partials = _partials_by_key(analysis_query.combine_partials(df, row_keys))
+        column_partials = _partials_by_key(analysis_query.combine_partials(df, column_keys)) if column_dimension else {}
+        cell_partials = _partials_by_key(analysis_query.combine_partials(df, keys)) if column_dimension else row_partials
+        grand_partial = analysis_query.combine_partials(df, []).iloc[0]
+
+        sorted_rows = sorted(row_partials, key=lambda key: [analysis_query.sort_key(value) for value in key])
+        sorted_columns = sorted(column_partials, key=lambda key: analysis_query.sort_key(key[0]))
+        if len(sorted_rows) * max(len(sorted_columns), 1) > MAX_PIVOT_CELLS:
+            return ({'error': f'交叉表超過 {MAX_PIVOT_CELLS} 格，請減少維度或加上篩選條件'}), 400
+
+        def value_of(partials, key):
+            partial = partials.get(key)
+            if partial is None:
+                return 0 if measure.type == 'count' else None
+            return analysis_query.measure_value(partial, measure)
+
+        row_totals = [value_of(row_partials, key) for key in sorted_rows]
+        grand_total = analysis_query.measure_value(grand_partial, measure)
+        if column_dimension:
+            cells = [[value_of(cell_partials, (*row, *column)) for column in sorted_columns] for row in sorted_rows]
+            column_totals = [value_of(column_partials, key) for key in sorted_columns]
+        else:
+            cells = [[total] for total in row_totals]
+            column_totals = [grand_total]
+
+        def describe(dimension):
+            return {'column': dimension.column, 'classifier': dimension.classifier}
+
+        return {
+            'table_name': table_name,
+            'rows': [describe(dimension) for dimension in row_dimensions],
+            'column': describe(column_dimension) if column_dimension else None,
+            'measure': {'type': measure.type, 'column': measure.column},
+            'row_keys': [list(key) for key in sorted_rows],
+            'column_keys': [key[0] for key in sorted_columns] if column_dimension else [PIVOT_TOTAL_LABEL],
+            'cells': cells,
+            'row_totals': row_totals,
+            'column_totals': column_totals,
+            'grand_total': grand_total,
+            'total_rows': int(grand_partial[analysis_query.ROWS]),
+        }
+
+    except Exception as e:
+        return ({'error': str(e)}), 500
+
+
+
+# 批次端點可執行的分析（類型名稱與單一端點的快取鍵相同）
+BATCH_ANALYSES = {
+    'column_stats': column_stats,
+    'multi_subject_stats': multi_subject_stats,
+    'yearly_admission_stats': yearly_admission_stats,
+    'school_source_stats': school_source_stats,
+    'admission_method_stats': admission_method_stats,
+    'geographic_stats': geographic_stats,
+    'top_schools_stats': top_schools_stats,
+    'subject_average_stats': subject_average_stats,
+    'gender_subject_analysis': gender_subject_analysis,
+    'admission_subject_analysis': admission_subject_analysis,
+    'school_type_subject_analysis': school_type_subject_analysis,
+    'region_subject_analysis': region_subject_analysis,
+    'pivot_analysis': pivot_analysis,
+    'subject_correlation_analysis': subject_correlation_analysis,
+}
+MAX_BATCH_ANALYSES = 50
+
+# 可由 OLAP cube（service.table_cube）roll-up 回答的分析
+CUBE_ANALYSES = (
+    'yearly_admission_stats', 'school_source_stats', 'admission_method_stats', 'geographic_stats', 'subject_average_stats',
+)
+
+# 子行程中各資料庫 URL 的引擎（子行程內重用）
+_worker_engines = {}
+
+
+def _worker_config():
+    """子行程沿用主行程目前設定的欄位解析與分類函式（以模組路徑 pickle）；子行程不使用欄位快取與數值摘要"""
+    return {
+        'resolve_column_name_fn': resolve_column_name,
+        'auto_detect_subject_columns_fn': auto_detect_subject_columns,
+        'classify_school_type_fn': classify_school_type,
+        'classify_admission_method_fn': classify_admission_method,
+        'classify_region_fn': classify_region,
+    }
+
+
+def _run_with_frame(analysis_type, data, frame, engine_pair):
+    """以 frame 作為該資料表的欄位資料執行分析（不再讀取資料庫的資料列），回傳 (payload, status)"""
+    shared = _SharedTable(frame.table_name, [])
+    shared.frame = frame
+    shared.pinned = True
+    shared._engine = engine_pair
+    token = _shared_tables.set({shared.table_name: shared})
+    try:
+        result = BATCH_ANALYSES[analysis_type](data)
+    finally:
+        _shared_tables.reset(token)
+    return result if isinstance(result, tuple) and len(result) == 2 else (result, 200)
+
+
+def _offloaded_analysis(analysis_type, data, database_url, handle, config):
+    """行程池子行程的進入點：以共用記憶體中的欄位資料作為該資料表的共用狀態執行分析，回傳 (payload, status)"""
+    configure_analysis_service(get_database_engine_fn=None, **config)
+    engine = _worker_engines.get(database_url)
+    if engine is None:
+        engine = _worker_engines[database_url] = create_engine(database_url, echo=False)
+
+    frame, segment = attach_frame(handle)
+    try:
+        return _run_with_frame(analysis_type, data, frame, (engine, inspect(engine)))
+    finally:
+        del frame
+        release_frame(segment)
+
+
+def run_analysis(analysis_type, data):
+    """
+    執行 BATCH_ANALYSES 中的分析端點；資料表筆數達行程池門檻（analysis_pool.policy）時改在子行程計算，
+    子行程只接收分析用到的投影欄位（共用記憶體），結果與在本行程計算相同
+    行程池未啟用、資料表不存在或子行程失敗時在本行程計算
+    """
+    analysis_fn = BATCH_ANALYSES[analysis_type]
+    data = data or {}
+    table_name = data.get('table_name')
+    if (
+        analysis_pool is None or not analysis_pool.applies_to(analysis_type)
+        or not isinstance(table_name, str) or not table_name or _shared_tables.get()
+    ):
+        return analysis_fn(data)
+    try:
+        current_engine, current_inspector = get_database_engine(table_name)
+    except ValueError:
+        return analysis_fn(data)
+
+    if analysis_type in CUBE_ANALYSES and table_cube_store is not None:
+        # 有 OLAP cube 時只讀取 cube，不必把資料列交給子行程
+        with sessionmaker(bind=current_engine)() as session:
+            if table_cube_store.definition(session, table_name) is not None:
+                return analysis_fn(data)
+
+    with current_engine.connect() as connection:
+        row_count = connection.execute(text(f'SELECT COUNT(*) FROM "{table_name}"')).scalar()
+    hints = _column_hints(analysis_type, data)
+    if not analysis_pool.should_offload(analysis_type, row_count) or hints == []:
+        return analysis_fn(data)
+
+    try:
+        # 與批次分析相同：依請求中的欄位讀取投影欄位（有欄位快取時直接使用快取）
+        shared = _SharedTable(table_name, hints or [])
+        shared.load_all_columns = hints is None
+        shared._engine = (current_engine, current_inspector)
+        handle, segment = share_frame(shared.frame_with([]))
+        try:
+            return analysis_pool.run(
+                _offloaded_analysis, analysis_type, data,
+                current_engine.url.render_as_string(hide_password=False), handle, _worker_config(),
+                shared_bytes=handle['size'],
+            )
+        finally:
+            segment.close()
+            segment.unlink()
+    except Exception as e:
+        analysis_pool.record_failure()
+        print(f"[WARNING] {analysis_type} 子行程計算失敗，改在本行程計算: {e}")
+        return analysis_fn(data)
+
+def union_analysis(analysis_type, data):
+    """
+    跨資料表分析：data['table_names'] 中的資料表（各次上傳的各屆資料）視為一個虛擬聯集執行 BATCH_ANALYSES 的分析，
+    SOURCE_TABLE_COLUMN 為各資料列的來源資料表（可作為 pivot 的維度、篩選欄位或 group_by 欄位）
+    分組查詢在各資料表同時執行後合併部分彙總，需要資料列的分析同時讀取各資料表的投影欄位後串接；
+    在本行程計算（不經由行程池），回傳的 union 說明聯集的資料表與各表讀取統計
+    """
+    data = data or {}
+    table_names = data.get('table_names')
+    if not isinstance(table_names, list) or not table_names or not all(
+        isinstance(table_name, str) and table_name for table_name in table_names
+    ):
+        return {'error': 'table_names 必須是資料表名稱的非空陣列'}, 400
+    table_names = list(dict.fromkeys(table_names))
+    if len(table_names) > MAX_UNION_TABLES:
+        return {'error': f'單次最多合併 {MAX_UNION_TABLES} 個資料表'}, 400
+
+    params = {key: value for key, value in data.items() if key != 'table_names'}
+    params['table_name'] = ' + '.join(table_names)
+    hints = _column_hints(analysis_type, params)
+    union = _UnionTable(params['table_name'], table_names, hints or [])
+    union.load_all_columns = hints is None
+    try:
+        union.engine()
+    except ValueError as e:
+        return {'error': str(e)}, 404
+
+    token = _shared_tables.set({union.table_name: union})
+    try:
+        result = BATCH_ANALYSES[analysis_type](params)
+    finally:
+        _shared_tables.reset(token)
+    payload, status = result if isinstance(result, tuple) and len(result) == 2 else (result, 200)
+    if status == 200 and isinstance(payload, dict):
+        payload['union'] = {
+            'tables': table_names,
+            'source_column': SOURCE_TABLE_COLUMN,
+            'loads': {member: shared.loads for member, shared in union.members.items()},
+        }
+    return payload, status
+
+# 分析參數中代表欄位名稱的鍵，批次開始前收集起來讓所需欄位一次讀取
+_COLUMN_PARAM_KEYS = ('column', 'year_col', 'gender_col', 'school_col', 'method_col', 'region_col', 'admission_col', 'school_type_col')
+
+
+def _column_hints(analysis_type, params):
+    """回傳分析會用到的欄位名稱；需要自動偵測科目欄位時回傳 None"""
+    if analysis_type in ('subject_average_stats', 'subject_correlation_analysis') and not params.get('subjects'):
+        return None
+    hints = [params.get(key) for key in _COLUMN_PARAM_KEYS]
+    subjects = params.get('subjects')
+    if isinstance(subjects, list):
+        hints.extend(subjects)
+    return [hint for hint in hints if isinstance(hint, str) and hint]
+
+
+def _run_batch_job(analysis_type, params, analysis_cache):
+    analysis_fn = BATCH_ANALYSES[analysis_type]
+    if params.get('table_names'):
+        analysis_fn = lambda params: union_analysis(analysis_type, params)
+    try:
+        if analysis_cache is not None:
+            payload, status = analysis_cache.get_or_compute(analysis_type, params, lambda: analysis_fn(params))
+        else:
+            result = analysis_fn(params)
+            payload, status = result if isinstance(result, tuple) and len(result) == 2 else (result, 200)
+    except Exception as e:
+        payload, status = {'error': str(e)}, 500
+    return {'status': status, 'data': payload}
+
+
+def batch_analysis(data, analysis_cache=None):
+    """
+    批次分析：一次請求執行多個分析，同一資料表的引擎與欄位只解析一次，所需欄位的聯集只讀取一次
+    前端傳入 { table_name: 預設資料表, analyses: [{ id, type, params }, ...] }；params 有 table_names 時為跨資料表分析（union_analysis）
+    回傳 { results: { id: { status, data } }, tables: 各資料表讀取統計, seconds }
+    """
+    try:
+        data = data or {}
+        default_table = data.get('table_name')
+        specs = data.get('analyses')
+
+        if not isinstance(specs, list) or not specs:
+            return ({'error': 'analyses 必須是非空陣列'}), 400
+        if len(specs) > MAX_BATCH_ANALYSES:
+            return ({'error': f'單次最多執行 {MAX_BATCH_ANALYSES} 個分析'}), 400
+
+        jobs = []
+        for index, spec in enumerate(specs):
+            if not isinstance(spec, dict) or not isinstance(spec.get('params') or {}, dict):
+                return ({'error': f'第 {index + 1} 個分析格式錯誤'}), 400
+            spec_id = str(spec.get('id', index))
+            analysis_type = spec.get('type')
+            if any(spec_id == job[0] for job in jobs):
+                return ({'error': f'分析 id 重複: {spec_id}'}), 400
+            if analysis_type not in BATCH_ANALYSES:
+                return ({'error': f'不支援的分析類型: {analysis_type}'}), 400
+
+            params = dict(spec.get('params') or {})
+            if default_table and not params.get('table_name') and not params.get('table_names'):
+                params['table_name'] = default_table
+            jobs.append((spec_id, analysis_type, params))
+
+        shared_tables = {}
+        for _, analysis_type, params in jobs:
+            table_name = params.get('table_name')
+            if isinstance(table_name, str) and table_name and not params.get('table_names'):
+                shared = shared_tables.setdefault(table_name, _SharedTable(table_name, []))
+                hints = _column_hints(analysis_type, params)
+                if hints is None:
+                    shared.load_all_columns = True
+                else:
+                    shared.column_hints = list(dict.fromkeys(shared.column_hints + hints))
+
+        started = time.perf_counter()
+        results = {}
+        token = _shared_tables.set(shared_tables)
+        try:
+            for spec_id, analysis_type, params in jobs:
+                results[spec_id] = _run_batch_job(analysis_type, params, analysis_cache)
+        finally:
+            _shared_tables.reset(token)
+
+        tables = {}
+        for table_name, shared in shared_tables.items():
+            tables[table_name] = {
+                'loads': shared.loads,
+                'rows': shared.frame.row_count if shared.frame is not None else 0,
+                'columns': len(shared.frame.columns) if shared.frame is not None else 0,
+                'load_ms': round(shared.load_seconds * 1000, 1),
+            }
+
+        return ({
+            'results': results,
+            'tables': tables,
+            'seconds': round(time.perf_counter() - started, 3),
+        })
+
+    except Exception as e:
+        return ({'error': str(e)}), 500
+
+
+# approximate 分析的信賴水準；筆數估計的區間使用常態分布臨界值
+APPROXIMATE_CONFIDENCE = 0.95
+Z_CRITICAL_95 = 1.96
+
+# 背景中計算精確結果的請求（分析類型 + 參數），同一請求同時只排一次
+_exact_jobs = set()
+_exact_jobs_lock = threading.Lock()
+
+
+def _estimated_count(sample_count, stratum):
+    """
+    分層 stratum = (母體筆數 N, 樣本筆數 n) 中，樣本有 sample_count 筆的類別推估母體筆數 N·p，
+    變異數 N²(1 - n/N)·p(1 - p)/(n - 1)（不放回抽樣的有限母體校正）；回傳 (估計值, 變異數)
+    """
+    population, sampled = stratum
+    proportion = sample_count / sampled
+    variance = 0.0
+    if sampled > 1:
+        variance = population ** 2 * (1 - sampled / population) * proportion * (1 - proportion) / (sampled - 1)
+    return population * proportion, variance
+
+
+def _count_ci95(estimate, variance):
+    margin = Z_CRITICAL_95 * math.sqrt(variance)
+    return [max(round(estimate - margin), 0), round(estimate + margin)]
+
+
+def _proportion_ci95(count, total, stratum):
+    """分層內比例 count / total 的 95% 信賴區間（百分比，一位小數），total 為 0 時回傳 None"""
+    if not total:
+        return None
+    population, sampled = stratum
+    proportion = count / total
+    margin = 0.0
+    if total > 1:
+        margin = Z_CRITICAL_95 * math.sqrt((1 - sampled / population) * proportion * (1 - proportion) / (total - 1))
+    return [round(max(proportion - margin, 0.0) * 100, 1), round(min(proportion + margin, 1.0) * 100, 1)]
+
+
+def _sampled_mean_ci95(scores, stratum, ndigits):
+    """單一分層內平均數的 95% 信賴區間：同 _score_ci95，標準誤再乘上有限母體校正 sqrt(1 - n/N)"""
+    variance = _score_variance(scores)
+    if variance is None:
+        return None
+    population, sampled = stratum
+    mean = scores.total / scores.count
+    margin = _t_critical_95(scores.count - 1) * math.sqrt(variance / scores.count * (1 - sampled / population))
+    return [_round_score(mean - margin, ndigits), _round_score(mean + margin, ndigits)]
+
+
+def _stratified_mean(yearly_scores, strata, ndigits):
+    """
+    跨年度的平均數與 95% 信賴區間：各年度的樣本平均以推估的有效筆數 N·m/n 加權
+    （權重視為已知），沒有有效成績時回傳 (None, None)
+    """
+    weights, means, variances = [], [], []
+    for year, scores in yearly_scores.items():
+        if not scores.count:
+            continue
+        population, sampled = strata[year]
+        weights.append(population * scores.count / sampled)
+        means.append(scores.total / scores.count)
+        variances.append((_score_variance(scores) or 0.0) / scores.count * (1 - sampled / population))
+    if not weights:
+        return None, None
+    total_weight = sum(weights)
+    mean = sum(weight * value for weight, value in zip(weights, means)) / total_weight
+    margin = Z_CRITICAL_95 * math.sqrt(sum((weight / total_weight) ** 2 * variance
+                                           for weight, variance in zip(weights, variances)))
+    return _round_score(mean, ndigits), [_round_score(mean - margin, ndigits), _round_score(mean + margin, ndigits)]
+
+
+def _sample_year_values(sample, year_col, columns, numeric=()):
+    """樣本中年度欄位非空且可轉為數值的資料列：回傳 (columns 的 DataFrame, 整數年度 Series)"""
+    df = sample.frame.select_frame(
+        [year_col, *columns], numeric=numeric, filters=analysis_query.row_filters([year_col])
+    )
+    years = pd.to_numeric(df[year_col], errors='coerce')
+    valid = years.notna()
+    return df.loc[valid, list(columns)], years[valid].astype(int)
+
+
+def _sample_year_scores(sample, year_col, subject_cols):
+    """樣本中各年度各科目的 ScoreMoments：{年度: {科目欄位: ScoreMoments}}"""
+    df, years = _sample_year_values(sample, year_col, subject_cols, numeric=subject_cols)
+    return _aggregate_subject_scores(df.assign(_year=years), ['_year'], subject_cols)
+
+
+def _estimated_label_totals(sample, year_col, label_col, classify_fn):
+    """樣本中分類後各類別的人數，依年度分層推估母體人數：{類別: (估計值, 變異數)}，依估計值由大到小"""
+    df, years = _sample_year_values(sample, year_col, [label_col])
+    strata = sample.year_strata()
+    labels = classify_distinct(df[label_col], classify_fn)
+    totals = {}
+    for (year, label), count in labels.groupby(years).value_counts().items():
+        estimate, variance = _estimated_count(int(count), strata[year])
+        previous = totals.get(label, (0.0, 0.0))
+        totals[label] = (previous[0] + estimate, previous[1] + variance)
+    return dict(sorted(totals.items(), key=lambda item: -item[1][0]))
+
+
+def _estimate_yearly_admission(payload, data, sample):
+    """yearly_admission_stats：各年度人數推估為母體人數並附上 *_ci95，性別比例附上信賴區間"""
+    year_col = data['year_col'].replace(' ', '_').replace('-', '_').replace('(', '').replace(')', '')
+    strata = sample.year_strata()
+    years = payload['years']
+    if year_col != sample.stratum_column or any(year not in strata for year in years):
+        return None
+
+    # 比例以樣本人數計算，須在人數換成推估值之前
+    if payload['has_gender']:
+        for key, counts in (('male_percentages', payload['male_counts']), ('female_percentages', payload['female_counts'])):
+            payload[f'{key}_ci95'] = [
+                _proportion_ci95(count, total, strata[year])
+                for count, total, year in zip(counts, payload['total_counts'], years)
+            ]
+
+    for key in ('male_counts', 'female_counts', 'total_counts'):
+        if key not in payload:
+            continue
+        estimates = [_estimated_count(count, strata[year]) for count, year in zip(payload[key], years)]
+        payload[key] = [round(estimate) for estimate, _ in estimates]
+        payload[f'{key}_ci95'] = [_count_ci95(estimate, variance) for estimate, variance in estimates]
+        if key == 'total_counts':
+            total = sum(estimate for estimate, _ in estimates)
+            payload['total_students'] = round(total)
+            payload['total_students_ci95'] = _count_ci95(total, sum(variance for _, variance in estimates))
+    return payload
+
+
+def _estimate_multi_subject(payload, data, sample):
+    """multi_subject_stats：各年度平均即樣本平均，另附 data_ci95 {科目: [各年度的 [下界, 上界]]}"""
+    available_columns = list(sample.frame.columns)
+    year_col = resolve_column_name(
+        data.get('year_col'), available_columns, label='年度欄位', candidates=YEAR_COLUMN_CANDIDATES
+    )
+    subject_cols = [resolve_column_name(subject, available_columns, label='科目欄位') for subject in payload['subjects']]
+    strata = sample.year_strata()
+    years = payload['years']
+    if year_col != sample.stratum_column or year_col in subject_cols or any(year not in strata for year in years):
+        return None
+
+    scores = _sample_year_scores(sample, year_col, subject_cols)
+    payload['data_ci95'] = {
+        subject: [_sampled_mean_ci95(scores[year][col], strata[year], 2) for year in years]
+        for subject, col in zip(payload['subjects'], subject_cols)
+    }
+    return payload
+
+
+def _estimate_subject_average(payload, data, sample):
+    """
+    subject_average_stats：各年度人數推估為母體人數、各科平均附上 *_ci95；整體平均改為依年度加權的分層平均，
+    各摘要人數依年度分層推估（min_score / max_score / std_dev 為樣本值）
+    """
+    resolved = payload['resolved_columns']
+    year_col = resolved['year_col']
+    subject_cols = resolved['subject_cols']
+    strata = sample.year_strata()
+    years = payload['years']
+    if year_col != sample.stratum_column or year_col in subject_cols or any(year not in strata for year in years):
+        return None
+
+    scores = _sample_year_scores(sample, year_col, subject_cols)
+    count_totals = {}
+    for entry in payload['yearly_data']:
+        year = entry['年度']
+        for key in [key for key in entry if key.endswith('人數')]:
+            estimate, variance = _estimated_count(entry[key], strata[year])
+            entry[key] = round(estimate)
+            entry[f'{key}_ci95'] = _count_ci95(estimate, variance)
+            previous = count_totals.get(key, (0.0, 0.0))
+            count_totals[key] = (previous[0] + estimate, previous[1] + variance)
+        for col, label in zip(subject_cols, payload['subjects']):
+            entry[f'{label}_ci95'] = _sampled_mean_ci95(scores[year][col], strata[year], 2)
+
+    for col, label in zip(subject_cols, payload['subjects']):
+        yearly_scores = {year: scores[year][col] for year in years}
+        stats = payload['overall_stats'][label]
+        stats['overall_average'], stats['overall_average_ci95'] = _stratified_mean(yearly_scores, strata, 2)
+        students = [_estimated_count(year_scores.count, strata[year]) for year, year_scores in yearly_scores.items()]
+        total = sum(estimate for estimate, _ in students)
+        stats['total_students'] = round(total)
+        stats['total_students_ci95'] = _count_ci95(total, sum(variance for _, variance in students))
+
+    averages = [
+        (label, stats['overall_average'])
+        for label, stats in payload['overall_stats'].items()
+        if stats['overall_average'] is not None
+    ]
+    highest = max(averages, key=lambda item: item[1]) if averages else None
+    lowest = min(averages, key=lambda item: item[1]) if averages else None
+    payload['highest_subject'] = {'subject': highest[0], 'average': highest[1]} if highest else None
+    payload['lowest_subject'] = {'subject': lowest[0], 'average': lowest[1]} if lowest else None
+
+    total, variance = count_totals['總人數']
+    payload['total_students'] = round(total)
+    payload['total_students_ci95'] = _count_ci95(total, variance)
+    genders = {'男性': count_totals['男性人數'], '女性': count_totals['女性人數']}
+    payload['gender_summary'] = {label: round(estimate) for label, (estimate, _) in genders.items()}
+    payload['gender_summary_ci95'] = {label: _count_ci95(*estimate) for label, estimate in genders.items()}
+
+    for key, column_key, classify_fn in (
+        ('school_type_summary', 'school_type_col', classify_school_type),
+        ('admission_summary', 'admission_col', classify_admission_method),
+    ):
+        if resolved[column_key] is None or resolved[column_key] == year_col:
+            continue
+        totals = _estimated_label_totals(sample, year_col, resolved[column_key], classify_fn)
+        payload[key] = {label: round(estimate) for label, (estimate, _) in totals.items()}
+        payload[f'{key}_ci95'] = {label: _count_ci95(*estimate) for label, estimate in totals.items()}
+    return payload
+
+
+# 有估計方式的分析：以抽樣資料計算後推估母體值並附上信賴區間；其餘分析的 approximate 請求直接回傳精確結果
+APPROXIMATE_ESTIMATORS = {
+    'yearly_admission_stats': _estimate_yearly_admission,
+    'multi_subject_stats': _estimate_multi_subject,
+    'subject_average_stats': _estimate_subject_average,
+}
+
+
+def _schedule_exact(analysis_type, data, analysis_cache):
+    """在背景執行緒計算精確結果存入分析快取，之後相同的 approximate 請求直接回傳精確結果"""
+    key = (analysis_type, json.dumps(data, sort_keys=True, ensure_ascii=False, default=str))
+    with _exact_jobs_lock:
+        if key in _exact_jobs:
+            return
+        _exact_jobs.add(key)
+
+    def compute_exact():
+        try:
+            analysis_cache.get_or_compute(analysis_type, data, lambda: run_analysis(analysis_type, data))
+        except Exception as e:
+            print(f"[WARNING] {analysis_type} 背景精確計算失敗: {e}")
+        finally:
+            with _exact_jobs_lock:
+                _exact_jobs.discard(key)
+
+    threading.Thread(target=compute_exact, name=f'exact-{analysis_type}', daemon=True).start()
+
+
+def approximate_analysis(analysis_type, data, analysis_cache=None):
+    """
+    approximate: true 的分析請求：大型資料表改以依年度分層的抽樣資料（table_sample_store）計算，
+    人數推估為母體值、平均數為樣本平均，並附上 95% 信賴區間（*_ci95）與 approximation 抽樣資訊；
+    同時在背景計算精確結果存入分析快取，精確結果已快取時直接回傳（approximation.exact 為 True）
+    沒有估計方式的分析、未達抽樣門檻的資料表直接計算精確結果
+    """
+    data = data or {}
+    exact_data = {key: value for key, value in data.items() if key != 'approximate'}
+
+    def exact(reason):
+        if analysis_cache is not None:
+            payload, status = analysis_cache.get_or_compute(
+                analysis_type, exact_data, lambda: run_analysis(analysis_type, exact_data)
+            )
+        else:
+            result = run_analysis(analysis_type, exact_data)
+            payload, status = result if isinstance(result, tuple) and len(result) == 2 else (result, 200)
+        if status != 200:
+            return payload, status
+        return {**payload, 'approximation': {'exact': True, 'reason': reason}}, 200
+
+    if analysis_cache is not None:
+        cached = analysis_cache.peek(analysis_type, exact_data)
+        if cached is not None:
+            return {**cached, 'approximation': {'exact': True, 'reason': 'cached'}}, 200
+
+    estimator = APPROXIMATE_ESTIMATORS.get(analysis_type)
+    table_name = exact_data.get('table_name')
+    if estimator is None or table_sample_store is None or not isinstance(table_name, str) or not table_name:
+        return exact('unsupported')
+    try:
+        engine_pair = get_database_engine(table_name)
+    except ValueError as e:
+        return ({'error': str(e)}), 404
+
+    sample = table_sample_store.get(engine_pair[0], table_name)
+    if sample is None:
+        return exact('small_table')
+    payload, status = _run_with_frame(analysis_type, exact_data, sample.frame, engine_pair)
+    if status != 200:
+        return payload, status
+    estimated = estimator(payload, exact_data, sample)
+    if estimated is None:
+        # 請求的年度欄位不是抽樣的分層欄位，無法推估
+        return exact('not_stratified')
+
+    exact_pending = analysis_cache is not None and analysis_cache.enabled
+    if exact_pending:
+        _schedule_exact(analysis_type, exact_data, analysis_cache)
+    estimated['approximation'] = {
+        'exact': False,
+        'sample_rows': sample.sample_rows,
+        'total_rows': sample.total_rows,
+        'sample_fraction': round(sample.sample_rows / sample.total_rows, 4),
+        'stratified_by': sample.stratum_column,
+        'strata': len(sample.year_strata()),
+        'confidence': APPROXIMATE_CONFIDENCE,
+        'exact_pending': exact_pending,
+    }
+    return estimated, 200
@@ -0,0 +1,162 @@
+import atexit
+import os
+import threading
+import time
+
+
+class BackupScheduler:
+    """
+    資料庫備份排程器
+    寫入操作只需呼叫 mark_dirty()；排程器在背景執行緒中等待寫入停止 quiet_seconds 秒
+    （或自第一次標記起最多 max_delay_seconds 秒）後，將這段期間的多次寫入合併成一次備份。
+    """
+
+    def __init__(self, backup_fn, quiet_seconds=5.0, max_delay_seconds=60.0, flush_timeout=None):
+        self.backup_fn = backup_fn
+        self.quiet_seconds = quiet_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.flush_timeout = flush_timeout
+        self._reset_state()
+        atexit.register(self.shutdown)
+        if hasattr(os, 'register_at_fork'):
+            # gunicorn --preload 會在 fork 前載入 app，子行程需重建鎖與背景執行緒
+            os.register_at_fork(after_in_child=self._reset_state)
+
+    def _reset_state(self):
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._flush_requested = False
+        self._dirty_since = None
+        self._last_marked = None
+        self._generation = 0
+        self._completed_generation = 0
+        self._running = False
+        self._last_result = None
+        self._last_backup_at = None
+        self._marks = 0
+        self._backups_run = 0
+
+    def mark_dirty(self):
+        """標記資料庫已變更，實際備份由背景執行緒合併後執行。"""
+        with self._condition:
+            now = time.monotonic()
+            self._generation += 1
+            self._marks += 1
+            if self._dirty_since is None:
+                self._dirty_since = now
+            self._last_marked = now
+            self._ensure_worker()
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """立即執行備份並等待完成，回傳備份結果；逾時回傳 None。"""
+        timeout = self.flush_timeout if timeout is None else timeout
+        with self._condition:
+            self._generation += 1
+            target_generation = self._generation
+            if self._dirty_since is None:
+                self._dirty_since = self._last_marked = time.monotonic()
+            self._flush_requested = True
+
+            if self._stopped:
+                return self._run_pending_locked()
+
+            self._ensure_worker()
+            self._condition.notify_all()
+            finished = self._condition.wait_for(
+                lambda: self._completed_generation >= target_generation,
+                timeout=timeout,
+            )
+            return self._last_result if finished else None
+
+    def shutdown(self, timeout=None):
+        """停止背景執行緒；若仍有未備份的變更會先完成備份。"""
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+            # 已停止的排程器不需在行程結束時再處理，也不再被 atexit 保留
+            atexit.unregister(self.shutdown)
+            self._flush_requested = True
+            self._condition.notify_all()
+            thread = self._thread
+
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        else:
+            with self._condition:
+                self._run_pending_locked()
+
+    def status(self):
+        with self._condition:
+            return {
+                'pending': self._dirty_since is not None,
+                'running': self._running,
+                'marks': self._marks,
+                'backups_run': self._backups_run,
+                'last_backup_at': self._last_backup_at,
+                'last_result': self._last_result,
+            }
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._worker_loop, name='db-backup-scheduler', daemon=True)
+        self._thread.start()
+
+    def _next_deadline(self):
+        return min(self._last_marked + self.quiet_seconds, self._dirty_since + self.max_delay_seconds)
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                while self._dirty_since is None and not self._stopped:
+                    self._condition.wait()
+                if self._dirty_since is None:
+                    return
+
+                # 去抖動：等到安靜期結束、達到最長延遲，或有人要求立即備份
+                while not self._flush_requested and not self._stopped:
+                    remaining = self._next_deadline() - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                target_generation = self._take_pending_locked()
+
+            result = self._run_backup()
+
+            with self._condition:
+                self._finish_locked(target_generation, result)
+
+    def _take_pending_locked(self):
+        target_generation = self._generation
+        self._dirty_since = None
+        self._last_marked = None
+        self._flush_requested = False
+        self._running = True
+        return target_generation
+
+    def _finish_locked(self, target_generation, result):
+        self._running = False
+        self._completed_generation = max(self._completed_generation, target_generation)
+        self._last_result = result
+        self._last_backup_at = time.time()
+        self._backups_run += 1
+        self._condition.notify_all()
+
+    def _run_pending_locked(self):
+        if self._dirty_since is None:
+            return self._last_result
+        target_generation = self._take_pending_locked()
+        result = self._run_backup()
+        self._finish_locked(target_generation, result)
+        return result
+
+    def _run_backup(self):
+        try:
+            return self.backup_fn()
+        except Exception as e:
+            print(f"[ERROR] 背景備份失敗: {e}")
+            return {"success": False, "message": str(e)}
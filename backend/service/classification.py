@@ -0,0 +1,210 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# 每個分類函數快取的不重複值數量上限（跨請求共用）
+CLASSIFY_CACHE_SIZE = 4096
+
+# 入學管道分類規則（按優先級排序，模組載入時編譯一次）
+ADMISSION_RULES = [
+    # 自然組和社會組的處理（優先處理，因為可能包含在申請入學中）
+    ('自然組', [re.compile(r'^\(自然組\)$'), re.compile(r'自然組')]),
+    ('社會組', [re.compile(r'^\(社會組\)$'), re.compile(r'社會組')]),
+
+    # 繁星推薦
+    ('繁星推薦', [re.compile(r'^繁星推薦$'), re.compile(r'^繁星$')]),
+
+    # 申請入學（完全匹配，不允許其他字元）
+    ('申請入學', [re.compile(r'^申請入學$')]),
+
+    # 僑生
+    ('僑生', [re.compile(r'^僑生$')]),
+
+    # 願景（包含【願景】格式）
+    ('願景', [re.compile(r'^【願景】$')]),
+]
+
+# 學校類型完全匹配（優先於關鍵字檢查）
+SCHOOL_TYPE_EXACT_MATCHES = {
+    '國立': '國立',
+    '私立': '私立',
+    '財團法人': '財團',
+    '市立': '市立',
+    '大陸台商': '其他',
+    '私大轉': '私大轉',
+    '科大轉': '科大轉',
+    '國大轉': '國大轉',
+    '僑生': '僑生',
+}
+
+# 國外地區關鍵字（這些通常也是國外/僑生）
+FOREIGN_KEYWORDS = (
+    '美國', '加拿大', '澳洲', '紐西蘭', '英國', '德國',
+    '法國', '日本', '韓國', '馬來西亞', '印尼', '越南',
+    '泰國', '緬甸', '柬埔寨', '新加坡', '汶萊', '菲律賓',
+)
+
+# 地理區域對應表
+REGION_MAPPING = {
+    # 北台灣
+    '台北市': '北台灣',
+    '新北市': '北台灣',
+    '基隆市': '北台灣',
+    '宜蘭縣': '北台灣',
+    '桃園市': '北台灣',
+    '新竹市': '北台灣',
+    '新竹縣': '北台灣',
+
+    # 中台灣
+    '苗栗縣': '中台灣',
+    '台中市': '中台灣',
+    '彰化縣': '中台灣',
+    '南投縣': '中台灣',
+    '雲林縣': '中台灣',
+
+    # 南台灣
+    '嘉義市': '南台灣',
+    '嘉義縣': '南台灣',
+    '台南市': '南台灣',
+    '高雄市': '南台灣',
+    '屏東縣': '南台灣',
+
+    # 東台灣
+    '花蓮縣': '東台灣',
+    '台東縣': '東台灣',
+}
+
+# 縣市名稱的長度（由長到短），含鄉鎮市區的地區字串以開頭的縣市名稱比對
+CITY_NAME_LENGTHS = sorted({len(city) for city in REGION_MAPPING}, reverse=True)
+
+
+# 入學管道分類邏輯
+def classify_admission_method(method_name):
+    """
+    根據入學管道名稱判斷入學管道類型
+    """
+    # 處理空值
+    if pd.isna(method_name):
+        return '其他'
+    return _classify_admission_text(str(method_name).strip())
+
+
+@lru_cache(maxsize=CLASSIFY_CACHE_SIZE)
+def _classify_admission_text(method_name):
+    # 空字串或只包含換行、空白字元
+    if method_name == '' or all(c.isspace() for c in method_name):
+        return '其他'
+
+    for category, patterns in ADMISSION_RULES:
+        for pattern in patterns:
+            if pattern.search(method_name):
+                return category
+
+    # 如果都不符合，歸類為其他
+    return '其他'
+
+
+# 學校類型分類邏輯
+def classify_school_type(school_name):
+    """
+    根據學校名稱或類型判斷學校類型
+    將值分類為：國立、市立、縣立、私立、財團、國大轉、私大轉、科大轉、僑生、其他
+    空白值、空字串或純空格都歸類為其他
+    """
+    if pd.isna(school_name):
+        return '其他'
+    return _classify_school_type_text(str(school_name).strip())
+
+
+@lru_cache(maxsize=CLASSIFY_CACHE_SIZE)
+def _classify_school_type_text(school_name):
+    if not school_name:
+        return '其他'
+
+    exact_match = SCHOOL_TYPE_EXACT_MATCHES.get(school_name)
+    if exact_match is not None:
+        return exact_match
+
+    # 關鍵字檢查（按優先順序）
+    if '國立' in school_name:
+        return '國立'
+    elif '市立' in school_name:
+        return '市立'
+    elif '縣立' in school_name:
+        return '縣立'
+    elif '財團法人' in school_name:
+        return '財團'
+    elif '私立' in school_name:
+        return '私立'
+    elif '僑' in school_name or '海外' in school_name:
+        return '僑生'
+    elif '國立' in school_name and ('大學' in school_name or '學院' in school_name):
+        return '國大轉'
+    elif '私立' in school_name and ('大學' in school_name or '學院' in school_name):
+        return '私大轉'
+    elif '科技' in school_name or '技術學院' in school_name or '專科' in school_name:
+        return '科大轉'
+
+    if any(keyword in school_name for keyword in FOREIGN_KEYWORDS):
+        return '其他'
+
+    return '其他'
+
+
+# 地理區域分類規則
+def classify_region(region):
+    """
+    根據縣市名稱判斷所屬區域
+    """
+    if pd.isna(region):
+        return '其他'
+    return _classify_region_text(str(region).strip())
+
+
+@lru_cache(maxsize=CLASSIFY_CACHE_SIZE)
+def _classify_region_text(region):
+    city = _normalize_city_text(region)
+    return REGION_MAPPING[city] if city is not None else '其他'
+
+
+def normalize_city(region):
+    """
+    將地區字串標準化為 REGION_MAPPING 中的縣市名稱，無法對應時回傳 None
+    「臺」統一為「台」；含鄉鎮市區的字串（例如 臺北市大安區）以開頭的縣市名稱比對
+    """
+    if pd.isna(region):
+        return None
+    return _normalize_city_text(str(region).strip())
+
+
+@lru_cache(maxsize=CLASSIFY_CACHE_SIZE)
+def _normalize_city_text(region):
+    # 統一將「臺」轉換為「台」，避免兩種寫法造成的匹配問題
+    region = region.replace('臺', '台')
+    for length in CITY_NAME_LENGTHS:
+        if region[:length] in REGION_MAPPING:
+            return region[:length]
+    return None
+
+
+def classify_distinct(values, classify_fn):
+    """
+    只對欄位中的不重複值呼叫分類函數，再以 factorize 的代碼把結果展開回每一列
+    回傳與 values 相同索引的 Series（NaN / None 也各自視為一個值交給分類函數處理）
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    labels = np.array([classify_fn(value) for value in uniques], dtype=object)
+    return pd.Series(labels[codes], index=values.index, name=values.name)
+
+
+def classification_cache_info():
+    """回傳各分類函數 LRU 快取的命中統計"""
+    caches = {
+        'admission_method': _classify_admission_text,
+        'school_type': _classify_school_type_text,
+        'region': _classify_region_text,
+        'city': _normalize_city_text,
+    }
+    return {name: cached.cache_info()._asdict() for name, cached in caches.items()}
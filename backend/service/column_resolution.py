@@ -0,0 +1,72 @@
+def normalize_column_name(column_name):
+    """將欄位名稱標準化，避免前後端命名格式差異。"""
+    if column_name is None:
+        return ''
+    return str(column_name).strip().replace(' ', '_').replace('-', '_').replace('(', '').replace(')', '')
+
+
+def build_column_lookup(available_columns):
+    """建立欄位名稱查詢索引（原名 + 標準化 + 小寫）。"""
+    lookup = {}
+    for col in available_columns:
+        normalized = normalize_column_name(col)
+        lookup[str(col)] = col
+        lookup[normalized] = col
+        lookup[normalized.lower()] = col
+    return lookup
+
+
+def resolve_column_name(requested_name, available_columns, label='欄位', candidates=None, required=True):
+    """解析請求欄位名稱，支援標準化比對與候選欄位自動偵測。"""
+    lookup = build_column_lookup(available_columns)
+
+    if requested_name:
+        request_key = normalize_column_name(requested_name)
+        resolved = (
+            lookup.get(str(requested_name))
+            or lookup.get(request_key)
+            or lookup.get(request_key.lower())
+        )
+        if resolved:
+            return resolved
+        if required:
+            raise ValueError(f'{label} {requested_name} 不存在')
+
+    if candidates:
+        for candidate in candidates:
+            candidate_key = normalize_column_name(candidate)
+            resolved = (
+                lookup.get(str(candidate))
+                or lookup.get(candidate_key)
+                or lookup.get(candidate_key.lower())
+            )
+            if resolved:
+                return resolved
+
+    if required:
+        raise ValueError(f'找不到可用的{label}，可用欄位：{available_columns}')
+
+    return None
+
+
+def auto_detect_subject_columns(available_columns, excluded_columns=None):
+    """自動偵測可能是成績科目的欄位。"""
+    excluded_columns = excluded_columns or []
+    excluded_keys = {normalize_column_name(col).lower() for col in excluded_columns if col}
+
+    auto_subjects = []
+    for col in available_columns:
+        normalized = normalize_column_name(col).lower()
+
+        if normalized in {'id', 'user_id'}:
+            continue
+        if normalized in excluded_keys:
+            continue
+
+        # 排除常見維度欄位，保留可能是分數的欄位
+        if any(keyword in normalized for keyword in ['年度', 'year', '性別', 'gender', 'school', '高中', '地區', 'region', '管道', 'method']):
+            continue
+
+        auto_subjects.append(col)
+
+    return auto_subjects
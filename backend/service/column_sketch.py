@@ -0,0 +1,403 @@
+import math
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+DEFAULT_HISTOGRAM_BINS = 10
+MAX_HISTOGRAM_BINS = 100
+
+
+def parse_number(value):
+    """
+    column_stats 的數值轉換規則：去除空白與千分位逗號後以 float() 轉換；為空、為 nan 或無法轉換時回傳 None
+    也註冊為 SQLite 的 deterministic 函式 parse_number（見 analysis_query.numeric_sql）
+    """
+    return _parse_number_text(str(value)) if value is not None else None
+
+
+@lru_cache(maxsize=4096)
+def _parse_number_text(value):
+    text = value.strip().replace('，', '').replace(',', '')
+    if text == '' or text.lower() == 'nan':
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def parse_numeric_values(raw_values):
+    """
+    將欄位原始值轉為數值（parse_number）：None 與空字串直接略過，無法轉換的值計入 skipped
+    回傳 (float64 陣列, skipped)；相同字串只解析一次
+    """
+    strings = np.array([str(value) for value in raw_values if value is not None and value != ''], dtype=object)
+    if not len(strings):
+        return np.empty(0, dtype=float), 0
+    codes, uniques = pd.factorize(strings)
+    parsed = np.array([_parse_number_text(value) for value in uniques], dtype=float)
+    numbers = parsed[codes]
+    valid = ~np.isnan(numbers)
+    return numbers[valid], int(len(numbers) - valid.sum())
+
+
+class KLLSketch:
+    """
+    KLL 分位數摘要：各層壓縮器保存已排序抽樣的值，第 h 層每個值代表 2**h 筆原始資料
+    - 可增量加入與合併（merge），記憶體約為 O(k log(n/k))
+    - 尚未壓縮過（只有第 0 層）時保存全部資料，查詢結果為精確值
+    - 壓縮時的隨機取樣以固定種子產生，相同輸入得到相同結果
+    """
+
+    __slots__ = ('k', 'levels', 'n', '_rng')
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.levels = [np.empty(0, dtype=float)]
+        self.n = 0
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += len(values)
+        self._compress()
+
+    def merge(self, other):
+        for height, items in enumerate(other.levels):
+            if height == len(self.levels):
+                self.levels.append(np.empty(0, dtype=float))
+            self.levels[height] = np.concatenate([self.levels[height], items])
+        self.n += other.n
+        self._compress()
+
+    @property
+    def exact(self):
+        return len(self.levels) == 1
+
+    def _capacity(self, height):
+        depth = len(self.levels) - 1 - height
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self):
+        height = 0
+        while height < len(self.levels):
+            items = self.levels[height]
+            if len(items) <= self._capacity(height):
+                height += 1
+                continue
+            if height + 1 == len(self.levels):
+                self.levels.append(np.empty(0, dtype=float))
+            items = np.sort(items)
+            # 奇數筆時保留一筆在本層，其餘兩兩一組取其一升到上一層（權重加倍）
+            kept = items[-1:] if len(items) % 2 else items[:0]
+            paired = items[:len(items) - len(kept)]
+            promoted = paired[int(self._rng.integers(2))::2]
+            self.levels[height] = kept
+            self.levels[height + 1] = np.concatenate([self.levels[height + 1], promoted])
+            # 新增層數後各層容量改變，從頭重新檢查
+            height = 0
+
+    def weighted_items(self):
+        """回傳 (排序後的值, 對應權重)"""
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** height, dtype=np.int64) for height, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], weights[order]
+
+    def rank(self, points, inclusive=True):
+        """估計 <= points（inclusive=False 時為 <）的資料筆數"""
+        items, weights = self.weighted_items()
+        cumulative = np.concatenate([[0], np.cumsum(weights)])
+        side = 'right' if inclusive else 'left'
+        return cumulative[np.searchsorted(items, np.asarray(points, dtype=float), side=side)]
+
+    def memory_bytes(self):
+        return sum(level.nbytes for level in self.levels)
+
+
+def _moments(values):
+    """(筆數, 平均, 離均差平方和)"""
+    if not len(values):
+        return 0, 0.0, 0.0
+    mean = float(values.mean())
+    return len(values), mean, float(((values - mean) ** 2).sum())
+
+
+class ColumnSketch:
+    """
+    單一欄位的數值摘要：KLL 分位數摘要與可合併的動差（筆數、平均、離均差平方和）、最小 / 最大值與 skipped 筆數
+    刪除的值記在另一個 KLL 摘要，查詢時以「新增 - 刪除」估計排名；刪除到目前的最小 / 最大值時無法維持，回傳 False
+    """
+
+    def __init__(self, values, skipped, version, k=200):
+        self.inserted = KLLSketch(k)
+        self.deleted = KLLSketch(k)
+        self.count, self.mean, self.m2 = 0, 0.0, 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.skipped = skipped
+        self.version = version
+        self._add(values)
+
+    @property
+    def exact(self):
+        return self.inserted.exact and self.deleted.exact
+
+    def _add(self, values):
+        if not len(values):
+            return
+        self.inserted.update(values)
+        count, mean, m2 = _moments(values)
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+    def _remove(self, values):
+        if not len(values):
+            return True
+        if values.min() <= self.minimum or values.max() >= self.maximum or len(values) >= self.count:
+            return False
+        self.deleted.update(values)
+        count, mean, m2 = _moments(values)
+        remaining = self.count - count
+        remaining_mean = (self.count * self.mean - count * mean) / remaining
+        delta = mean - remaining_mean
+        self.m2 = max(self.m2 - m2 - delta * delta * remaining * count / self.count, 0.0)
+        self.mean = remaining_mean
+        self.count = remaining
+        return True
+
+    def apply(self, inserted_raw, deleted_raw):
+        """套用資料列異動（原始值清單）；無法增量維護時回傳 False"""
+        deleted, deleted_skipped = parse_numeric_values(deleted_raw)
+        inserted, inserted_skipped = parse_numeric_values(inserted_raw)
+        if not self._remove(deleted):
+            return False
+        self._add(inserted)
+        self.skipped += inserted_skipped - deleted_skipped
+        return self.count > 0
+
+    def stats(self):
+        return {
+            'mean': float(self.mean),
+            'std': float(math.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else 0.0,
+            'min': float(self.minimum),
+            'max': float(self.maximum),
+            'count': int(self.count),
+            'skipped': int(self.skipped),
+        }
+
+    def _rank(self, points, inclusive=True):
+        ranks = self.inserted.rank(points, inclusive) - self.deleted.rank(points, inclusive)
+        return np.clip(ranks, 0, self.count)
+
+    def percentiles(self, percentiles):
+        """估計各百分位數，回傳值一定落在 [最小值, 最大值]"""
+        candidates = np.unique(self.inserted.weighted_items()[0])
+        candidates = candidates[(candidates >= self.minimum) & (candidates <= self.maximum)]
+        cdf = np.maximum.accumulate(self._rank(candidates))
+        result = {}
+        for percentile in percentiles:
+            if percentile <= 0:
+                value = self.minimum
+            elif percentile >= 100:
+                value = self.maximum
+            else:
+                position = min(np.searchsorted(cdf, percentile / 100 * self.count, side='left'), len(candidates) - 1)
+                value = candidates[position]
+            result[percentile_key(percentile)] = float(value)
+        return result
+
+    def histogram(self, bins):
+        """等寬直方圖（區間規則同 numpy.histogram：最後一個區間包含最大值）"""
+        if not (math.isfinite(self.minimum) and math.isfinite(self.maximum)):
+            return None
+        edges = np.linspace(self.minimum, self.maximum, bins + 1) if self.maximum > self.minimum else \
+            np.linspace(self.minimum - 0.5, self.maximum + 0.5, bins + 1)
+        below = np.concatenate([[0], self._rank(edges[1:-1], inclusive=False), [self.count]])
+        counts = np.diff(np.maximum.accumulate(below))
+        return {'edges': [float(edge) for edge in edges], 'counts': [int(count) for count in counts]}
+
+    def memory_bytes(self):
+        return self.inserted.memory_bytes() + self.deleted.memory_bytes()
+
+
+def percentile_key(percentile):
+    return f'p{percentile:g}'
+
+
+def exact_percentiles(values, counts, percentiles):
+    """
+    由排序後的相異數值與各值筆數計算百分位數，結果與 numpy.percentile（linear）對完整資料的計算相同
+    """
+    cumulative = np.cumsum(counts)
+    total = int(cumulative[-1])
+    positions = np.asarray(percentiles, dtype=float) / 100 * (total - 1)
+    lower = np.floor(positions)
+    below = values[np.searchsorted(cumulative, lower, side='right')]
+    above = values[np.searchsorted(cumulative, np.minimum(lower + 1, total - 1), side='right')]
+    fraction = positions - lower
+    difference = above - below
+    # 與 numpy 的內插公式相同：fraction >= 0.5 時由上方的值往回內插
+    points = np.where(fraction >= 0.5, above - difference * (1 - fraction), below + difference * fraction)
+    return {percentile_key(percentile): float(point) for percentile, point in zip(percentiles, points)}
+
+
+def exact_histogram(values, counts, bins):
+    """相異數值與各值筆數的等寬直方圖，結果與 numpy.histogram 對完整資料的計算相同"""
+    if not np.isfinite(values).all():
+        return None
+    histogram, edges = np.histogram(values, bins=bins, weights=counts)
+    return {'edges': [float(edge) for edge in edges], 'counts': [int(count) for count in histogram]}
+
+
+class ColumnSketchStore:
+    """
+    各資料表欄位的數值摘要（ColumnSketch），供大型資料表的 column_stats 計算百分位數與直方圖而不必重讀整個欄位
+    - 上傳時由已在記憶體中的資料建立，資料列新增 / 修改 / 刪除以 begin_change / end_change 包住寫入並增量更新
+    - 每個摘要記錄建立時的資料表版本（version_fn，即 AnalysisCache.table_version）；
+      有異動未經 end_change（例如刪除檔案）時版本對不上，摘要視為失效，下次查詢時重建
+    - 同一資料表有寫入進行中時不保存新建立的摘要（讀取可能已包含尚未套用的異動），同時有多筆寫入時直接移除摘要
+    - 筆數不超過 exact_max_values 的欄位不建立摘要，由 column_stats 直接精確計算
+    - 以 LRU 保留最多 max_entries 個欄位；摘要存在行程記憶體中（部署為單一 gunicorn worker + 多執行緒）
+    """
+
+    def __init__(self, exact_max_values=50000, max_entries=2048, version_fn=None, k=200):
+        self.exact_max_values = exact_max_values
+        self.max_entries = max_entries
+        self.k = k
+        self._version_fn = version_fn or (lambda table_name: 0)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._hits = 0
+        self._builds = 0
+        self._updates = 0
+        self._drops = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def table_version(self, table_name):
+        return self._version_fn(table_name)
+
+    def get(self, table_name, column):
+        """回傳目前有效的摘要，沒有或已失效時回傳 None"""
+        key = (table_name, column)
+        version = self.table_version(table_name)
+        with self._lock:
+            sketch = self._entries.get(key)
+            if sketch is None:
+                return None
+            if sketch.version != version:
+                del self._entries[key]
+                self._drops += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return sketch
+
+    def build(self, table_name, column, values, skipped, version):
+        """
+        由完整欄位的數值建立摘要；version 須為讀取資料前取得的資料表版本，讀取期間資料表有異動時不保存
+        回傳建立的摘要（筆數過少或不保存時仍回傳，供本次查詢使用）
+        """
+        sketch = ColumnSketch(values, skipped, version, k=self.k)
+        if not self.enabled or sketch.count <= self.exact_max_values:
+            return sketch
+        with self._lock:
+            if self.table_version(table_name) == version and not self._pending.get(table_name):
+                self._entries[(table_name, column)] = sketch
+                self._entries.move_to_end((table_name, column))
+                self._builds += 1
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._drops += 1
+        return sketch
+
+    def build_table(self, table_name, columns):
+        """上傳時建立：columns 為 {欄位: 原始值清單}，只保存有數值且筆數超過 exact_max_values 的欄位"""
+        if not self.enabled:
+            return
+        version = self.table_version(table_name)
+        for column, raw_values in columns.items():
+            if len(raw_values) <= self.exact_max_values:
+                continue
+            values, skipped = parse_numeric_values(raw_values)
+            self.build(table_name, column, values, skipped, version)
+
+    def begin_change(self, table_name):
+        """資料列寫入前呼叫，回傳寫入前的資料表版本（傳給 end_change）"""
+        with self._lock:
+            self._pending[table_name] = self._pending.get(table_name, 0) + 1
+        return self.table_version(table_name)
+
+    def end_change(self, table_name, previous_version, committed, inserted=None, deleted=None):
+        """
+        寫入結束後呼叫（committed 時須在遞增資料表版本之後）：inserted / deleted 為異動後 / 前的資料列（{欄位: 值}）
+        摘要版本等於 previous_version 且沒有其他寫入進行中時增量更新並推進到目前版本，否則移除；未 commit 時保持不變
+        """
+        inserted = inserted or {}
+        deleted = deleted or {}
+        version = self.table_version(table_name)
+        with self._lock:
+            remaining = self._pending.get(table_name, 1) - 1
+            if remaining:
+                self._pending[table_name] = remaining
+            else:
+                self._pending.pop(table_name, None)
+            if not committed:
+                return
+            for key in [key for key in self._entries if key[0] == table_name]:
+                sketch = self._entries[key]
+                column = key[1]
+                if not remaining and sketch.version == previous_version and sketch.apply(
+                    [inserted[column]] if column in inserted else [],
+                    [deleted[column]] if column in deleted else [],
+                ):
+                    sketch.version = version
+                    self._updates += 1
+                else:
+                    del self._entries[key]
+                    self._drops += 1
+
+    def has_table(self, table_name):
+        with self._lock:
+            return any(key[0] == table_name for key in self._entries)
+
+    def drop(self, table_name):
+        """資料表被刪除時移除其全部摘要（同名資料表重新上傳前不佔用 LRU 名額）"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == table_name]:
+                del self._entries[key]
+                self._drops += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': sum(sketch.memory_bytes() for sketch in self._entries.values()),
+                'exact_max_values': self.exact_max_values,
+                'hits': self._hits,
+                'builds': self._builds,
+                'updates': self._updates,
+                'drops': self._drops,
+            }
@@ -1,7 +1,9 @@
 import os
 import sqlite3
 import tempfile
+import time
 import uuid
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
 import pandas as pd
@@ -14,12 +16,20 @@ bucket = None
 Session = None
 engine = None
 metadata = None
-backup_database_to_gcs = None
+backup_scheduler = None
 get_database_engine = None
 filter_dataframe_until_empty_row = None
 validate_excel_file = None
 create_excel_table = None
 is_cloud_environment = None
+analysis_cache = None
+column_sketch_store = None
+table_sample_store = None
+table_aggregate_store = None
+table_cube_store = None
+
+# 匯入流程各階段的計時回呼（benchmark 使用），簽名為 hook(stage_name, seconds)
+ingest_stage_hook = None
 
 
 def configure_data_service(
@@ -29,16 +39,22 @@ def configure_data_service(
     session_factory,
     engine_instance,
     metadata_instance,
-    backup_database_to_gcs_fn,
+    backup_scheduler_instance,
     get_database_engine_fn,
     filter_dataframe_until_empty_row_fn,
     validate_excel_file_fn,
     create_excel_table_fn,
     is_cloud_environment_fn,
+    analysis_cache_instance=None,
+    column_sketch_store_instance=None,
+    table_sample_store_instance=None,
+    table_aggregate_store_instance=None,
+    table_cube_store_instance=None,
 ):
     global upload_folder, database_path, bucket, Session, engine, metadata
-    global backup_database_to_gcs, get_database_engine, filter_dataframe_until_empty_row
-    global validate_excel_file, create_excel_table, is_cloud_environment
+    global backup_scheduler, get_database_engine, filter_dataframe_until_empty_row
+    global validate_excel_file, create_excel_table, is_cloud_environment, analysis_cache, column_sketch_store
+    global table_sample_store, table_aggregate_store, table_cube_store
 
     upload_folder = upload_folder_path
     database_path = database_path_value
@@ -46,12 +62,49 @@ def configure_data_service(
     Session = session_factory
     engine = engine_instance
     metadata = metadata_instance
-    backup_database_to_gcs = backup_database_to_gcs_fn
+    backup_scheduler = backup_scheduler_instance
     get_database_engine = get_database_engine_fn
     filter_dataframe_until_empty_row = filter_dataframe_until_empty_row_fn
     validate_excel_file = validate_excel_file_fn
     create_excel_table = create_excel_table_fn
     is_cloud_environment = is_cloud_environment_fn
+    analysis_cache = analysis_cache_instance
+    column_sketch_store = column_sketch_store_instance
+    table_sample_store = table_sample_store_instance
+    table_aggregate_store = table_aggregate_store_instance
+    table_cube_store = table_cube_store_instance
+
+
+def _table_changed(table_name):
+    """資料表建立或刪除後使該表的分析結果快取失效"""
+    if analysis_cache is not None and table_name:
+        analysis_cache.invalidate_table(table_name)
+
+
+@contextmanager
+def ingest_stage(stage_name):
+    """記錄匯入流程單一階段的耗時；未設定 ingest_stage_hook 時不做任何事。"""
+    if ingest_stage_hook is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ingest_stage_hook(stage_name, time.perf_counter() - started)
+
+
+def _build_derived(stage_name, table_name, build_fn):
+    """
+    資料表 commit 後建立衍生結構（欄位摘要、彙總、cube、樣本）；失敗時只記錄警告，上傳仍然成功，
+    沒有衍生結構的資料表在分析時改為直接查詢
+    """
+    try:
+        with ingest_stage(stage_name):
+            build_fn()
+    except Exception as e:
+        print(f"[WARNING] {table_name} 的 {stage_name} 建立失敗，分析改為直接查詢資料表: {e}")
 
 
 def upload_file(file, sheet_name, current_user_id):
@@ -113,7 +166,8 @@ def upload_to_cloud_storage(file, sheet_name, original_filename, safe_filename,
 
 def upload_to_local_storage(file, sheet_name, original_filename, safe_filename, current_user_id):
     filepath = os.path.join(upload_folder, safe_filename)
-    file.save(filepath)
+    with ingest_stage('save_upload'):
+        file.save(filepath)
 
     if not sheet_name:
         xl = pd.ExcelFile(filepath)
@@ -124,7 +178,8 @@ def upload_to_local_storage(file, sheet_name, original_filename, safe_filename,
             "need_sheet_selection": True,
         }, 200
 
-    df = pd.read_excel(filepath, sheet_name=sheet_name)
+    with ingest_stage('excel_parse'):
+        df = pd.read_excel(filepath, sheet_name=sheet_name)
     return process_excel_data(
         file=file,
         df=df,
@@ -135,7 +190,8 @@ def upload_to_local_storage(file, sheet_name, original_filename, safe_filename,
 
 
 def process_excel_data(file, df, sheet_name, current_user_id, file_id=None, blob_name=None, stored_filename=None):
-    df = filter_dataframe_until_empty_row(df)
+    with ingest_stage('filter_rows'):
+        df = filter_dataframe_until_empty_row(df)
     if df.empty:
         return {"error": "工作表中沒有有效資料"}, 400
 
@@ -144,20 +200,45 @@ def process_excel_data(file, df, sheet_name, current_user_id, file_id=None, blob
     timestamp = datetime.now().strftime('%y%m%d%H%M%S')
     table_name = f"{current_user_id}_{safe_sheet_name}_{timestamp}"
 
-    table = create_excel_table(table_name, columns)
+    with ingest_stage('create_table'):
+        table = create_excel_table(table_name, columns)
     session = Session()
 
     try:
-        data_dicts = []
-        for _, row in df.iterrows():
-            row_dict = {'user_id': current_user_id}
-            for i, col in enumerate(columns):
-                safe_col_name = col.replace(' ', '_').replace('-', '_').replace('(', '').replace(')', '')
-                row_dict[safe_col_name] = str(row.iloc[i]) if pd.notna(row.iloc[i]) else ''
-            data_dicts.append(row_dict)
-
-        session.execute(table.insert(), data_dicts)
-        session.commit()
+        with ingest_stage('build_rows'):
+            data_dicts = []
+            for _, row in df.iterrows():
+                row_dict = {'user_id': current_user_id}
+                for i, col in enumerate(columns):
+                    safe_col_name = col.replace(' ', '_').replace('-', '_').replace('(', '').replace(')', '')
+                    row_dict[safe_col_name] = str(row.iloc[i]) if pd.notna(row.iloc[i]) else ''
+                data_dicts.append(row_dict)
+
+        with ingest_stage('insert_rows'):
+            session.execute(table.insert(), data_dicts)
+            session.commit()
+            _table_changed(table_name)
+
+        if column_sketch_store is not None:
+            # 大型資料表的欄位數值摘要直接由記憶體中的資料建立，column_stats 不必再讀取整個欄位
+            _build_derived('column_sketches', table_name, lambda: column_sketch_store.build_table(table_name, {
+                col: [row[col] for row in data_dicts] for col in data_dicts[0] if col != 'user_id'
+            }))
+
+        if table_aggregate_store is not None:
+            # 年度 × 類別筆數與各年度數值彙總，之後的資料列異動在同一交易中增量更新
+            _build_derived('aggregates', table_name,
+                           lambda: table_aggregate_store.build(get_database_engine(table_name)[0], table_name))
+
+        if table_cube_store is not None:
+            # 年度 × 性別 × 學校類型 × 入學管道 × 地區的筆數與科目彙總，儀表板分析只讀取 cube
+            _build_derived('cube', table_name,
+                           lambda: table_cube_store.build(get_database_engine(table_name)[0], table_name))
+
+        if table_sample_store is not None and table_sample_store.enabled and len(data_dicts) >= table_sample_store.min_rows:
+            # approximate 分析使用的分層樣本；之後資料列增刪改會遞增資料表版本，下次 approximate 請求時重新抽樣
+            _build_derived('table_sample', table_name,
+                           lambda: table_sample_store.build(get_database_engine(table_name)[0], table_name))
 
         if file_id and blob_name:
             current_time = datetime.utcnow()
@@ -184,7 +265,8 @@ def process_excel_data(file, df, sheet_name, current_user_id, file_id=None, blob
         if file_id:
             response_data["file_id"] = file_id
 
-        backup_database_to_gcs()
+        with ingest_stage('backup'):
+            backup_scheduler.mark_dirty()
         return response_data, 200
     except Exception as e:
         session.rollback()
@@ -413,12 +495,21 @@ def delete_file(file_id, user_id):
             try:
                 session = Session()
                 session.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
+                if table_aggregate_store is not None:
+                    table_aggregate_store.drop(session, table_name)
+                if table_cube_store is not None:
+                    table_cube_store.drop(session, table_name)
                 session.commit()
                 session.close()
             except Exception as e:
                 print(f"[WARNING] 資料表刪除失敗: {e}")
+            _table_changed(table_name)
+            if column_sketch_store is not None:
+                column_sketch_store.drop(table_name)
+            if table_sample_store is not None:
+                table_sample_store.drop(table_name)
 
-        backup_database_to_gcs()
+        backup_scheduler.mark_dirty()
         return {'success': True, 'message': '檔案已刪除'}, 200
     except Exception as e:
         return {'success': False, 'error': str(e)}, 500
@@ -426,7 +517,9 @@ def delete_file(file_id, user_id):
 
 def manual_backup():
     try:
-        result = backup_database_to_gcs()
+        result = backup_scheduler.flush()
+        if result is None:
+            return {'success': False, 'message': '備份逾時，將於背景繼續執行'}, 504
         return result, 200 if result.get('success') else 500
     except Exception as e:
         return {'success': False, 'error': str(e)}, 500
@@ -0,0 +1,388 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+MANIFEST_BLOB = 'manifest.json'
+SNAPSHOT_PREFIX = 'snapshots'
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digests(path):
+    """計算檔案的 (sha256 hex, md5 base64)，md5 格式與 GCS blob.md5_hash 相同。"""
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+            md5.update(chunk)
+    return sha256.hexdigest(), base64.b64encode(md5.digest()).decode('ascii')
+
+
+def snapshot_database(source_path, dest_path):
+    """以 SQLite online backup API 取得一致性快照，不直接複製正在寫入的檔案。"""
+    # 路徑轉為 file: URI（百分比編碼），含 ?、#、% 的路徑才不會被當成 URI 參數
+    source = sqlite3.connect(f'{Path(source_path).resolve().as_uri()}?mode=ro', uri=True)
+    try:
+        dest = sqlite3.connect(dest_path)
+        try:
+            source.backup(dest)
+        finally:
+            dest.close()
+    finally:
+        source.close()
+
+
+def install_database_file(source_path, dest_path):
+    """以下載完成的檔案取代資料庫，並移除舊檔遺留的 -wal / -shm / -journal 以免與新檔混用。"""
+    for suffix in ('-wal', '-shm', '-journal'):
+        stale_path = f'{dest_path}{suffix}'
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+    os.replace(source_path, dest_path)
+
+
+class DatabaseSwapGate:
+    """
+    服務中替換資料庫檔案用的讀寫閘門
+    - 請求以 acquire_shared / release_shared 持有共用權，可同時多個
+    - exclusive() 先阻擋新的請求、再等待進行中的請求結束，期間可關閉連線池並替換檔案
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._active = 0
+        self._swapping = False
+
+    def acquire_shared(self, timeout=None):
+        """取得共用權；替換進行中時等待，逾時回傳 False"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: not self._swapping, timeout=timeout):
+                return False
+            self._active += 1
+            return True
+
+    def release_shared(self):
+        with self._condition:
+            self._active -= 1
+            if self._active == 0:
+                self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._swapping)
+            self._swapping = True
+            self._condition.wait_for(lambda: self._active == 0)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._swapping = False
+                self._condition.notify_all()
+
+
+class LocalBlob:
+    """LocalDirectoryBucket 的 blob，提供與 google.cloud.storage.Blob 相同的常用方法。"""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.size = None
+        self.md5_hash = None
+        self.generation = None
+
+    @property
+    def path(self):
+        return os.path.join(self.bucket.root, *self.name.split('/'))
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def reload(self):
+        stat = os.stat(self.path)
+        self.size = stat.st_size
+        self.generation = stat.st_mtime_ns
+        self.md5_hash = file_digests(self.path)[1]
+
+    def upload_from_filename(self, filename, content_type=None):
+        del content_type
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f'{self.path}.uploading'
+        shutil.copyfile(filename, temp_path)
+        os.replace(temp_path, self.path)
+        self.bucket.bytes_uploaded += os.path.getsize(self.path)
+        self.bucket.uploads += 1
+
+    def upload_from_string(self, data, content_type=None):
+        del content_type
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f'{self.path}.uploading'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, self.path)
+        self.bucket.bytes_uploaded += len(data)
+        self.bucket.uploads += 1
+
+    def download_to_filename(self, filename):
+        shutil.copyfile(self.path, filename)
+        self.bucket.bytes_downloaded += os.path.getsize(filename)
+
+    def download_as_bytes(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.bucket.bytes_downloaded += len(data)
+        return data
+
+    def delete(self):
+        os.remove(self.path)
+
+
+class LocalDirectoryBucket:
+    """
+    以本機目錄模擬 Cloud Storage bucket（本地開發與測試用）
+    同時統計上傳與下載的位元組數，便於量測每次寫入實際傳輸的資料量
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.name = self.root
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        self.uploads = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def blob(self, name):
+        return LocalBlob(self, name)
+
+    def get_blob(self, name):
+        blob = self.blob(name)
+        if not blob.exists():
+            return None
+        blob.reload()
+        return blob
+
+    def list_blobs(self, prefix=''):
+        blobs = []
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.uploading'):
+                    continue
+                relative = os.path.relpath(os.path.join(directory, filename), self.root).replace(os.sep, '/')
+                if relative.startswith(prefix):
+                    blobs.append(self.blob(relative))
+        return sorted(blobs, key=lambda blob: blob.name)
+
+
+class DatabaseBackup:
+    """
+    增量資料庫備份
+    - 以 PRAGMA data_version 與檔案狀態判斷資料庫自上次備份後是否有變更，未變更則直接跳過
+    - 有變更時以 online backup API 取得快照，內容雜湊與上次相同仍跳過
+    - 快照以 gzip 壓縮後依內容雜湊命名上傳（snapshots/<db>/<sha256>.db.gz），manifest.json 指向最新版本
+    - manifest 上傳後只保留最近 keep_snapshots 個快照（最新版本與 manifest 中的 previous），其餘刪除
+    """
+
+    def __init__(self, bucket, databases, keep_snapshots=2):
+        self.bucket = bucket
+        self.databases = dict(databases)
+        self.keep_snapshots = max(1, keep_snapshots)
+        self._manifest = None
+        self._monitors = {}
+        self._last_seen = {}
+        self.last_run = None
+        self.total_bytes_shipped = 0
+
+    def start(self):
+        """快照模式不需要常駐連線（與 WalBackup 介面一致）。"""
+
+    def run(self):
+        """備份所有資料庫，回傳本次備份摘要。"""
+        started = time.perf_counter()
+        manifest = self._load_manifest()
+        results = {}
+        bytes_shipped = 0
+
+        for name, path in self.databases.items():
+            result = self._backup_one(name, path, manifest)
+            results[name] = result
+            bytes_shipped += result.get('bytes_shipped', 0)
+
+        if any(result['status'] == 'uploaded' for result in results.values()):
+            manifest_bytes = json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+            self.bucket.blob(MANIFEST_BLOB).upload_from_string(manifest_bytes, content_type='application/json')
+            bytes_shipped += len(manifest_bytes)
+            # manifest 已指向新快照後才刪除舊快照，還原時不會讀到已刪除的 blob
+            for name, result in results.items():
+                if result['status'] == 'uploaded':
+                    result['snapshots_deleted'] = self._prune_snapshots(name, manifest['databases'][name])
+
+        self.total_bytes_shipped += bytes_shipped
+        self.last_run = {
+            'databases': results,
+            'bytes_shipped': bytes_shipped,
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+        return self.last_run
+
+    def restore_if_changed(self, name, dest_path, install_fn=install_database_file):
+        """
+        本地已有相同版本（快照 sha256 或舊版 blob 的 md5 相同）時不下載
+        下載完成的暫存檔以 install_fn(暫存檔, dest_path) 取代資料庫（服務中還原時由呼叫端先關閉連線）
+        回傳 {'status': 'up_to_date' | 'downloaded' | 'not_found', 各步驟耗時 (ms)}
+        """
+        timings = {}
+        started = time.perf_counter()
+        entry = self._load_manifest()['databases'].get(name)
+        legacy_blob = None if entry else self.bucket.get_blob(name)
+        timings['metadata_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+        if entry is None and legacy_blob is None:
+            return {'status': 'not_found', **timings}
+
+        if os.path.exists(dest_path):
+            started = time.perf_counter()
+            sha256, md5 = file_digests(dest_path)
+            timings['local_hash_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            if (entry and entry['sha256'] == sha256) or (legacy_blob and legacy_blob.md5_hash == md5):
+                return {'status': 'up_to_date', **timings}
+
+        started = time.perf_counter()
+        if entry:
+            self._download_snapshot(entry['blob'], dest_path, install_fn)
+        else:
+            temp_path = f'{dest_path}.download'
+            legacy_blob.download_to_filename(temp_path)
+            install_fn(temp_path, dest_path)
+        timings['download_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return {'status': 'downloaded', 'bytes': os.path.getsize(dest_path), **timings}
+
+    def restore_all(self, names=None, max_workers=None, install_fn=install_database_file):
+        """並行還原多個資料庫（只下載與本地不同的檔案），回傳 {名稱: 結果}。"""
+        names = list(names or self.databases)
+        if not names:
+            return {}
+        # 先在主執行緒讀取 manifest，避免各下載執行緒重複讀取
+        self._load_manifest()
+
+        def restore_one(name):
+            try:
+                return self.restore_if_changed(name, self.databases[name], install_fn)
+            except Exception as e:
+                return {'status': 'failed', 'error': str(e)}
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(names), thread_name_prefix='db-restore') as executor:
+            return dict(zip(names, executor.map(restore_one, names)))
+
+    def _load_manifest(self):
+        if self._manifest is None:
+            blob = self.bucket.get_blob(MANIFEST_BLOB)
+            self._manifest = json.loads(blob.download_as_bytes()) if blob is not None else {'databases': {}}
+        return self._manifest
+
+    def _change_marker(self, name, path):
+        """回傳代表資料庫目前狀態的標記；標記與上次相同表示資料庫未變更。"""
+        stats = []
+        for candidate in (path, f'{path}-wal'):
+            try:
+                stat = os.stat(candidate)
+                stats.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                stats.append(None)
+
+        monitor = self._monitors.get(name)
+        if monitor is None or monitor[0] != stats[0][0]:
+            if monitor is not None:
+                monitor[1].close()
+            # 檔案被替換（inode 改變）時重新建立監看連線
+            monitor = (stats[0][0], sqlite3.connect(path, check_same_thread=False))
+            self._monitors[name] = monitor
+        data_version = monitor[1].execute('PRAGMA data_version').fetchone()[0]
+        return data_version, tuple(stats)
+
+    def _backup_one(self, name, path, manifest):
+        if not os.path.exists(path):
+            print(f"[WARNING] {name} 不存在，跳過備份")
+            return {'status': 'missing'}
+
+        marker = self._change_marker(name, path)
+        if self._last_seen.get(name) == marker:
+            return {'status': 'unchanged'}
+
+        work_dir = tempfile.mkdtemp(prefix='db-backup-')
+        try:
+            snapshot_path = os.path.join(work_dir, name)
+            snapshot_database(path, snapshot_path)
+            sha256, _ = file_digests(snapshot_path)
+
+            entry = manifest['databases'].get(name)
+            if entry and entry.get('sha256') == sha256:
+                self._last_seen[name] = marker
+                return {'status': 'unchanged', 'sha256': sha256}
+
+            blob_name = f'{SNAPSHOT_PREFIX}/{name}/{sha256}.db.gz'
+            compressed_path = f'{snapshot_path}.gz'
+            with open(snapshot_path, 'rb') as source, gzip.open(compressed_path, 'wb', compresslevel=6) as target:
+                shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+            size = os.path.getsize(snapshot_path)
+            compressed_size = os.path.getsize(compressed_path)
+
+            blob = self.bucket.blob(blob_name)
+            bytes_shipped = 0
+            if not blob.exists():
+                blob.upload_from_filename(compressed_path, content_type='application/gzip')
+                bytes_shipped = compressed_size
+
+            previous = [entry['blob'], *entry.get('previous', [])] if entry else []
+            manifest['databases'][name] = {
+                'sha256': sha256,
+                'blob': blob_name,
+                'previous': [blob for blob in previous if blob != blob_name][:self.keep_snapshots - 1],
+                'size': size,
+                'compressed_size': compressed_size,
+                'updated_at': datetime.now(timezone.utc).isoformat(),
+            }
+            self._last_seen[name] = marker
+            print(f"[INFO] ✓ {name} 已備份（{size} → {compressed_size} bytes，{blob_name}）")
+            return {'status': 'uploaded', 'sha256': sha256, 'bytes_shipped': bytes_shipped}
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _prune_snapshots(self, name, entry):
+        """刪除 manifest 不再引用的快照（只保留最新版本與 previous），回傳刪除數量"""
+        keep = {entry['blob'], *entry.get('previous', [])}
+        deleted = 0
+        for blob in self.bucket.list_blobs(prefix=f'{SNAPSHOT_PREFIX}/{name}/'):
+            if blob.name in keep:
+                continue
+            try:
+                blob.delete()
+                deleted += 1
+            except Exception as e:
+                print(f"[WARNING] 舊快照刪除失敗 {blob.name}: {e}")
+        return deleted
+
+    def _download_snapshot(self, blob_name, dest_path, install_fn=install_database_file):
+        temp_compressed = f'{dest_path}.download.gz'
+        temp_path = f'{dest_path}.download'
+        try:
+            self.bucket.blob(blob_name).download_to_filename(temp_compressed)
+            with gzip.open(temp_compressed, 'rb') as source, open(temp_path, 'wb') as target:
+                shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+            install_fn(temp_path, dest_path)
+        finally:
+            for leftover in (temp_compressed, temp_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
@@ -1,4 +1,5 @@
 import os
+from contextlib import contextmanager
 
 from sqlalchemy import inspect, text
 from sqlalchemy.orm import sessionmaker
@@ -8,16 +9,76 @@ FAKEDATA_DB_PATH = None
 DATABASE_FOLDER = None
 get_database_engine = None
 database_repository = None
+analysis_cache = None
+column_sketch_store = None
+table_aggregate_store = None
+table_cube_store = None
 
 
-def configure_database_service(app_instance, engine_instance, fakedata_db_path, database_folder, get_database_engine_fn, repository=None):
+def configure_database_service(app_instance, engine_instance, fakedata_db_path, database_folder, get_database_engine_fn, repository=None, analysis_cache_instance=None, column_sketch_store_instance=None, table_aggregate_store_instance=None, table_cube_store_instance=None):
     del app_instance
-    global engine, FAKEDATA_DB_PATH, DATABASE_FOLDER, get_database_engine, database_repository
+    global engine, FAKEDATA_DB_PATH, DATABASE_FOLDER, get_database_engine, database_repository, analysis_cache, column_sketch_store
+    global table_aggregate_store, table_cube_store
     engine = engine_instance
     FAKEDATA_DB_PATH = fakedata_db_path
     DATABASE_FOLDER = database_folder
     get_database_engine = get_database_engine_fn
     database_repository = repository
+    analysis_cache = analysis_cache_instance
+    column_sketch_store = column_sketch_store_instance
+    table_aggregate_store = table_aggregate_store_instance
+    table_cube_store = table_cube_store_instance
+
+
+@contextmanager
+def _row_change(table_name):
+    """
+    包住資料列的寫入與 commit；區塊內將異動後 / 前的資料列（{欄位: 值}）設定於 change['inserted'] / change['deleted']
+    正常結束時使該表的分析結果快取失效並增量更新欄位數值摘要，發生例外時摘要維持不變
+    """
+    change = {}
+    previous_version = column_sketch_store.begin_change(table_name) if column_sketch_store is not None else None
+    committed = False
+    try:
+        yield change
+        committed = True
+    finally:
+        if committed and analysis_cache is not None:
+            analysis_cache.invalidate_table(table_name)
+        if column_sketch_store is not None:
+            column_sketch_store.end_change(table_name, previous_version, committed, **change)
+
+
+def _stored_row(session, table_name, row_id):
+    row = session.execute(text(f"SELECT * FROM `{table_name}` WHERE id = :row_id"), {'row_id': row_id}).mappings().first()
+    return dict(row) if row else None
+
+
+def _sketched_row(session, table_name, row_id):
+    """該表有欄位數值摘要時讀取異動前的資料列，供摘要扣除舊值；沒有摘要時不多做查詢"""
+    if column_sketch_store is None or not column_sketch_store.has_table(table_name):
+        return None
+    return _stored_row(session, table_name, row_id)
+
+
+def _aggregate_definition(session, table_name):
+    """
+    該表的增量彙總與 OLAP cube 定義 (aggregates, cube)，沒有的部分為 None；
+    有任一項時 CRUD 在 commit 前以寫入前後實際儲存的資料列更新（見 _apply_aggregates）
+    """
+    definitions = (
+        table_aggregate_store.definition(session, table_name) if table_aggregate_store is not None else None,
+        table_cube_store.definition(session, table_name) if table_cube_store is not None else None,
+    )
+    return definitions if any(definitions) else None
+
+
+def _apply_aggregates(session, table_name, definitions, deleted=None, inserted=None):
+    aggregates, cube = definitions
+    if aggregates is not None:
+        table_aggregate_store.apply(session, table_name, aggregates, deleted=deleted, inserted=inserted)
+    if cube is not None:
+        table_cube_store.apply(session, table_name, cube, deleted=deleted, inserted=inserted)
 
 
 def list_database_tables_new(current_user_id):
@@ -210,8 +271,15 @@ def create_table_row(table_name, current_user_id, payload):
             for col in columns:
                 insert_data[col] = current_user_id if col == 'user_id' else data.get(col, '')
 
-            result = session.execute(text(insert_query), insert_data)
-            session.commit()
+            with _row_change(table_name) as change:
+                result = session.execute(text(insert_query), insert_data)
+                definition = _aggregate_definition(session, table_name)
+                if definition is not None:
+                    _apply_aggregates(
+                        session, table_name, definition, inserted=_stored_row(session, table_name, result.lastrowid)
+                    )
+                session.commit()
+                change['inserted'] = insert_data
             return {'success': True, 'message': '資料新增成功', 'inserted_id': result.lastrowid}, 200
         finally:
             session.close()
@@ -254,8 +322,21 @@ def update_table_row(table_name, row_id, current_user_id, payload):
                 if col in data:
                     update_data[col] = data[col]
 
-            session.execute(text(update_query), update_data)
-            session.commit()
+            with _row_change(table_name) as change:
+                definition = _aggregate_definition(session, table_name)
+                if definition is not None:
+                    previous_row = _stored_row(session, table_name, row_id)
+                else:
+                    previous_row = _sketched_row(session, table_name, row_id)
+                session.execute(text(update_query), update_data)
+                if definition is not None:
+                    _apply_aggregates(
+                        session, table_name, definition,
+                        deleted=previous_row, inserted=_stored_row(session, table_name, row_id),
+                    )
+                session.commit()
+                change['inserted'] = {col: value for col, value in update_data.items() if col != 'row_id'}
+                change['deleted'] = {col: previous_row[col] for col in change['inserted']} if previous_row else None
             return {'success': True, 'message': '資料更新成功'}, 200
         finally:
             session.close()
@@ -279,8 +360,16 @@ def delete_table_row(table_name, row_id, current_user_id):
                 return {'success': False, 'error': '找不到指定的資料或無權限刪除'}, 404
 
             delete_query = f"DELETE FROM `{table_name}` WHERE id = :row_id AND user_id = :user_id"
-            session.execute(text(delete_query), {'row_id': row_id, 'user_id': current_user_id})
-            session.commit()
+            with _row_change(table_name) as change:
+                definition = _aggregate_definition(session, table_name)
+                if definition is not None:
+                    change['deleted'] = _stored_row(session, table_name, row_id)
+                else:
+                    change['deleted'] = _sketched_row(session, table_name, row_id)
+                session.execute(text(delete_query), {'row_id': row_id, 'user_id': current_user_id})
+                if definition is not None:
+                    _apply_aggregates(session, table_name, definition, deleted=change['deleted'])
+                session.commit()
             return {'success': True, 'message': '資料刪除成功'}, 200
         finally:
             session.close()
@@ -0,0 +1,335 @@
+"""
+資料表的增量彙總：與資料表存在同一個 SQLite 資料庫，資料列新增 / 修改 / 刪除時在同一交易中更新
+- _analysis_counts：各年度 × 維度欄位原始值的筆數（dim 為空字串時是各年度的總筆數）
+- _analysis_moments：各年度各數值欄位的筆數、有效數值筆數、總和、平方和、最小、最大（數值轉換同 parse_number）
+- _analysis_aggregates：各資料表的年度欄位、維度欄位與數值欄位
+只計算年度欄位非空的資料列；分組查詢（QuerySpec）符合彙總的範圍時直接讀取彙總，不再掃描資料表
+"""
+import json
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from service import analysis_query
+from service.analysis_query import Filter
+from service.column_resolution import resolve_column_name
+from service.column_sketch import parse_number
+from service.table_frame import _object_array, in_mask
+from service.table_sample import STRATUM_CANDIDATES
+
+AGGREGATE_TABLE_PREFIX = '_analysis_'
+REGISTRY_TABLE = '_analysis_aggregates'
+COUNTS_TABLE = '_analysis_counts'
+MOMENTS_TABLE = '_analysis_moments'
+
+# 判斷數值欄位時讀取的資料列數，以及非空值中可轉為數值的最低比例
+MEASURE_PROBE_ROWS = 1000
+MEASURE_MIN_SHARE = 0.5
+
+AggregateDefinition = namedtuple('AggregateDefinition', ['year_col', 'dimensions', 'measures'])
+
+_SCHEMA = (
+    f'CREATE TABLE IF NOT EXISTS {REGISTRY_TABLE} ('
+    'table_name TEXT PRIMARY KEY, year_col TEXT NOT NULL, dimensions TEXT NOT NULL, measures TEXT NOT NULL)',
+    # year / value 不宣告型別，保留資料表原始值的儲存類別（排序與比較才會與直接查詢資料表相同）
+    f'CREATE TABLE IF NOT EXISTS {COUNTS_TABLE} (table_name TEXT NOT NULL, dim TEXT NOT NULL, year, value, '
+    'rows INTEGER NOT NULL)',
+    f'CREATE INDEX IF NOT EXISTS {COUNTS_TABLE}_key ON {COUNTS_TABLE} (table_name, dim, year, value)',
+    f'CREATE TABLE IF NOT EXISTS {MOMENTS_TABLE} (table_name TEXT NOT NULL, col TEXT NOT NULL, year, '
+    'rows INTEGER NOT NULL, value_count INTEGER NOT NULL, total REAL NOT NULL, sum_sq REAL NOT NULL, vmin REAL, vmax REAL)',
+    f'CREATE INDEX IF NOT EXISTS {MOMENTS_TABLE}_key ON {MOMENTS_TABLE} (table_name, col, year)',
+)
+
+
+def is_aggregate_table(table_name):
+    return table_name.startswith(AGGREGATE_TABLE_PREFIX)
+
+
+def _register_numeric_function(connection):
+    connection.connection.driver_connection.create_function('parse_number', 1, parse_number, deterministic=True)
+
+
+class TableAggregateStore:
+    """
+    增量彙總的建立、維護與查詢
+    - build：上傳完成後由資料表重建；不重複值超過 max_values 的欄位（學號、姓名等）不建立維度彙總
+    - apply：資料列異動時以異動前 / 後實際儲存的資料列更新彙總，由呼叫端在同一交易中 commit
+    - query：分組 QuerySpec 符合彙總範圍時回傳與直接查詢相同的 DataFrame，否則回傳 None
+    max_values 為 0 時停用（build 只清除舊彙總）
+    """
+
+    def __init__(self, max_values=1000):
+        self.max_values = max_values
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._changes = 0
+        self._builds = 0
+        self._build_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return self.max_values > 0
+
+    def build(self, engine, table_name):
+        """重建該表的彙總（單一交易），回傳 AggregateDefinition；沒有年度欄位時回傳 None"""
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            for statement in _SCHEMA:
+                connection.execute(text(statement))
+            self._delete(connection, table_name)
+            if not self.enabled:
+                return None
+            definition = self._define(connection, table_name)
+            if definition is None:
+                return None
+            self._populate(connection, table_name, definition)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._builds += 1
+            self._build_seconds += elapsed
+        print(f"[INFO] {table_name} 彙總建立完成：{len(definition.dimensions)} 個維度欄位、"
+              f"{len(definition.measures)} 個數值欄位，{elapsed * 1000:.0f} ms")
+        return definition
+
+    def drop(self, session, table_name):
+        """資料表刪除時在同一交易中移除彙總"""
+        if self._has_registry(session):
+            self._delete(session, table_name)
+
+    def definition(self, session, table_name):
+        """該表的 AggregateDefinition，沒有彙總時回傳 None"""
+        if not self.enabled or not self._has_registry(session):
+            return None
+        row = session.execute(
+            text(f'SELECT year_col, dimensions, measures FROM {REGISTRY_TABLE} WHERE table_name = :table'),
+            {'table': table_name},
+        ).first()
+        if row is None:
+            return None
+        return AggregateDefinition(row[0], json.loads(row[1]), json.loads(row[2]))
+
+    def apply(self, session, table_name, definition, deleted=None, inserted=None):
+        """以異動前（deleted）/ 後（inserted）的資料列 {欄位: 值} 更新彙總；須在資料列寫入之後、commit 之前呼叫"""
+        for row, sign in ((deleted, -1), (inserted, 1)):
+            if row is None:
+                continue
+            year = row.get(definition.year_col)
+            if year is None or year == '':
+                continue
+            for dim in ('', *definition.dimensions):
+                self._add_count(session, table_name, dim, year, row.get(dim) if dim else None, sign)
+            for column in definition.measures:
+                self._add_moments(session, table_name, definition, column, year, parse_number(row.get(column)), sign)
+        with self._lock:
+            self._changes += 1
+
+    def query(self, session, spec):
+        """
+        由彙總回答分組 QuerySpec：須包含年度欄位非空的條件，依年度（或年度 + 一個維度欄位）分組計數，
+        或只依年度分組並指定數值欄位；其他篩選條件只能作用在分組欄位上
+        """
+        result = self._query(session, spec) if self.enabled and spec.grouped and spec.limit is None else None
+        with self._lock:
+            if result is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'max_values': self.max_values,
+                'hits': self._hits,
+                'misses': self._misses,
+                'changes': self._changes,
+                'builds': self._builds,
+                'build_seconds': round(self._build_seconds, 3),
+            }
+
+    @staticmethod
+    def _has_registry(session):
+        return session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': REGISTRY_TABLE}
+        ).first() is not None
+
+    @staticmethod
+    def _delete(connection, table_name):
+        for table in (REGISTRY_TABLE, COUNTS_TABLE, MOMENTS_TABLE):
+            connection.execute(text(f'DELETE FROM {table} WHERE table_name = :table'), {'table': table_name})
+
+    def _define(self, connection, table_name):
+        columns = [row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info("{table_name}")').fetchall()]
+        year_col = resolve_column_name(None, columns, candidates=STRATUM_CANDIDATES, required=False)
+        if year_col is None:
+            return None
+        candidates = [col for col in columns if col not in ('id', 'user_id', year_col)]
+        if not candidates:
+            return AggregateDefinition(year_col, [], [])
+
+        distinct = connection.execute(text(
+            'SELECT ' + ', '.join(f'COUNT(DISTINCT "{col}")' for col in candidates) + f' FROM "{table_name}"'
+        )).first()
+        dimensions = [col for col, count in zip(candidates, distinct) if count <= self.max_values]
+
+        probe = connection.execute(text(
+            'SELECT ' + ', '.join(f'"{col}"' for col in candidates) + f' FROM "{table_name}" LIMIT {MEASURE_PROBE_ROWS}'
+        )).fetchall()
+        measures = []
+        for col, values in zip(candidates, zip(*probe)):
+            present = [value for value in values if value is not None and value != '']
+            numbers = sum(parse_number(value) is not None for value in present)
+            if present and numbers >= MEASURE_MIN_SHARE * len(present):
+                measures.append(col)
+        return AggregateDefinition(year_col, dimensions, measures)
+
+    @staticmethod
+    def _populate(connection, table_name, definition):
+        year = f'"{definition.year_col}"'
+        where = f'WHERE {year} IS NOT NULL AND {year} != \'\''
+        connection.execute(text(
+            f'INSERT INTO {COUNTS_TABLE} (table_name, dim, year, value, rows) '
+            f'SELECT :table, \'\', {year}, NULL, COUNT(*) FROM "{table_name}" {where} GROUP BY {year}'
+        ), {'table': table_name})
+        for dim in definition.dimensions:
+            connection.execute(text(
+                f'INSERT INTO {COUNTS_TABLE} (table_name, dim, year, value, rows) '
+                f'SELECT :table, :dim, {year}, "{dim}", COUNT(*) FROM "{table_name}" {where} GROUP BY {year}, "{dim}"'
+            ), {'table': table_name, 'dim': dim})
+
+        if definition.measures:
+            _register_numeric_function(connection)
+        for column in definition.measures:
+            connection.execute(text(
+                f'INSERT INTO {MOMENTS_TABLE} (table_name, col, year, rows, value_count, total, sum_sq, vmin, vmax) '
+                f'SELECT :table, :col, _y, COUNT(*), COUNT(_v), TOTAL(_v), TOTAL(_v * _v), MIN(_v), MAX(_v) '
+                f'FROM (SELECT {year} AS _y, {analysis_query.numeric_sql(column)} AS _v FROM "{table_name}" {where} LIMIT -1) '
+                f'GROUP BY _y'
+            ), {'table': table_name, 'col': column})
+
+        connection.execute(text(
+            f'INSERT INTO {REGISTRY_TABLE} (table_name, year_col, dimensions, measures) '
+            'VALUES (:table, :year_col, :dimensions, :measures)'
+        ), {
+            'table': table_name,
+            'year_col': definition.year_col,
+            'dimensions': json.dumps(definition.dimensions, ensure_ascii=False),
+            'measures': json.dumps(definition.measures, ensure_ascii=False),
+        })
+
+    @staticmethod
+    def _add_count(session, table_name, dim, year, value, sign):
+        key = {'table': table_name, 'dim': dim, 'year': year, 'value': value}
+        updated = session.execute(text(
+            f'UPDATE {COUNTS_TABLE} SET rows = rows + :sign '
+            'WHERE table_name = :table AND dim = :dim AND year = :year AND value IS :value'
+        ), {**key, 'sign': sign}).rowcount
+        if sign > 0 and not updated:
+            session.execute(text(
+                f'INSERT INTO {COUNTS_TABLE} (table_name, dim, year, value, rows) VALUES (:table, :dim, :year, :value, 1)'
+            ), key)
+        elif sign < 0:
+            session.execute(text(
+                f'DELETE FROM {COUNTS_TABLE} '
+                'WHERE table_name = :table AND dim = :dim AND year = :year AND value IS :value AND rows <= 0'
+            ), key)
+
+    @staticmethod
+    def _add_moments(session, table_name, definition, column, year, number, sign):
+        key = {'table': table_name, 'col': column, 'year': year}
+        where = 'WHERE table_name = :table AND col = :col AND year = :year'
+        present = number is not None
+        delta = {
+            **key,
+            'sign': sign,
+            'count': sign if present else 0,
+            'total': sign * number if present else 0.0,
+            'sum_sq': sign * number * number if present else 0.0,
+            'number': number if sign > 0 else None,
+        }
+        updated = session.execute(text(
+            f'UPDATE {MOMENTS_TABLE} SET rows = rows + :sign, value_count = value_count + :count, '
+            'total = total + :total, sum_sq = sum_sq + :sum_sq, '
+            'vmin = CASE WHEN :number IS NULL OR vmin <= :number THEN vmin ELSE :number END, '
+            'vmax = CASE WHEN :number IS NULL OR vmax >= :number THEN vmax ELSE :number END '
+            f'{where}'
+        ), delta).rowcount
+        if sign > 0:
+            if not updated:
+                session.execute(text(
+                    f'INSERT INTO {MOMENTS_TABLE} (table_name, col, year, rows, value_count, total, sum_sq, vmin, vmax) '
+                    'VALUES (:table, :col, :year, 1, :count, :total, :sum_sq, :number, :number)'
+                ), delta)
+            return
+
+        session.execute(text(f'DELETE FROM {MOMENTS_TABLE} {where} AND rows <= 0'), key)
+        if not present:
+            return
+        current = session.execute(text(f'SELECT value_count, vmin, vmax FROM {MOMENTS_TABLE} {where}'), key).first()
+        if current is None:
+            return
+        if current[0] == 0:
+            # 沒有有效數值時歸零，避免浮點數累加的殘差
+            session.execute(text(
+                f'UPDATE {MOMENTS_TABLE} SET total = 0.0, sum_sq = 0.0, vmin = NULL, vmax = NULL {where}'
+            ), key)
+        elif number <= current[1] or number >= current[2]:
+            # 移除的是最小或最大值：只重新計算該年度（資料列已在同一交易中寫入）
+            _register_numeric_function(session.connection())
+            extremes = session.execute(text(
+                f'SELECT MIN(_v), MAX(_v) FROM (SELECT {analysis_query.numeric_sql(column)} AS _v '
+                f'FROM "{table_name}" WHERE "{definition.year_col}" = :year LIMIT -1)'
+            ), {'year': year}).first()
+            session.execute(text(f'UPDATE {MOMENTS_TABLE} SET vmin = :vmin, vmax = :vmax {where}'),
+                            {**key, 'vmin': extremes[0], 'vmax': extremes[1]})
+
+    def _query(self, session, spec):
+        definition = self.definition(session, spec.table_name)
+        if definition is None:
+            return None
+        year_col = definition.year_col
+        filters = list(spec.filters)
+        if Filter(year_col, 'not_empty', ()) not in filters or year_col not in spec.columns:
+            return None
+        filters.remove(Filter(year_col, 'not_empty', ()))
+        if len(set(spec.columns)) != len(spec.columns) or any(
+            condition.op == 'any_not_null' or condition.column not in spec.columns for condition in filters
+        ):
+            return None
+
+        if spec.measure_column is not None:
+            if spec.columns != [year_col] or spec.measure_column not in definition.measures:
+                return None
+            rows = session.execute(text(
+                f'SELECT year, rows, value_count, total, sum_sq, vmin, vmax FROM {MOMENTS_TABLE} '
+                'WHERE table_name = :table AND col = :col ORDER BY year'
+            ), {'table': spec.table_name, 'col': spec.measure_column}).fetchall()
+        else:
+            others = [col for col in spec.columns if col != year_col]
+            if len(others) > 1 or (others and others[0] not in definition.dimensions):
+                return None
+            order = ', '.join('year' if col == year_col else 'value' for col in spec.columns)
+            rows = session.execute(text(
+                f'SELECT {order}, rows FROM {COUNTS_TABLE} WHERE table_name = :table AND dim = :dim ORDER BY {order}'
+            ), {'table': spec.table_name, 'dim': others[0] if others else ''}).fetchall()
+
+        columns = [*spec.columns, *analysis_query.partial_columns(spec)]
+        if not filters or not rows:
+            return pd.DataFrame(rows, columns=columns)
+        # 分組欄位上的其他條件只作用在彙總列（與 TableFrame 相同的比較規則）
+        mask = np.ones(len(rows), dtype=bool)
+        for condition in filters:
+            values = _object_array([row[spec.columns.index(condition.column)] for row in rows])
+            if condition.op == 'not_empty':
+                mask &= np.array([value is not None and value != '' for value in values], dtype=bool)
+            elif condition.op == 'not_null':
+                mask &= np.array([value is not None for value in values], dtype=bool)
+            else:
+                mask &= in_mask(values, condition.values)
+        return pd.DataFrame([row for row, keep in zip(rows, mask) if keep], columns=columns)
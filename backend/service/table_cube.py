@@ -0,0 +1,377 @@
+"""
+資料表的 OLAP cube：年度 × 性別 × 學校類型 × 入學管道 × 地區（縣市）各組合的筆數與各科目的成績彙總
+- 與資料表存在同一個 SQLite 資料庫，上傳時建立，資料列新增 / 修改 / 刪除時在同一交易中增量更新（同 table_aggregates）
+- 年度、性別保存原始值；學校類型、入學管道、地區、縣市保存分類後的標籤（分類函式由 app_factory 設定），
+  cube 的列數只取決於不重複的維度組合數，不隨資料筆數增加
+- 成績以 pd.to_numeric(errors='coerce') 轉換（與 subject_average_stats 相同），保存有效筆數、總和、平方和、最小、最大
+- 儀表板端點以 roll-up（SUM ... GROUP BY 所需維度）回答，不再掃描資料表
+"""
+import json
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from service import analysis_query
+from service.column_resolution import resolve_column_name
+from service.table_aggregates import MEASURE_MIN_SHARE, MEASURE_PROBE_ROWS
+from service.table_frame import _object_array, coerce_numeric
+from service.table_sample import STRATUM_CANDIDATES
+
+REGISTRY_TABLE = '_analysis_cubes'
+CELLS_TABLE = '_analysis_cube_cells'
+MOMENTS_TABLE = '_analysis_cube_moments'
+
+# cube 維度 → 來源欄位的候選名稱（與各分析端點自動偵測欄位時相同）；city 與 region 由同一個地區欄位分類
+DIMENSION_CANDIDATES = {
+    'gender': ['性別', 'gender', 'sex'],
+    'school_type': ['高中別', '學校類型', '學校別', 'school_type', 'school'],
+    'method_type': ['入學管道', '管道', 'admission_method', 'admission'],
+    'region': ['地區', '縣市', '城市', 'region', 'city'],
+}
+DIMENSIONS = ('gender', 'school_type', 'method_type', 'region', 'city')
+# 各維度的來源欄位（CubeDefinition.columns 的鍵）
+SOURCE_DIMENSION = {'gender': 'gender', 'school_type': 'school_type', 'method_type': 'method_type',
+                    'region': 'region', 'city': 'region'}
+
+# columns：{維度: 來源欄位或 None}；measures：成績欄位
+CubeDefinition = namedtuple('CubeDefinition', ['year_col', 'columns', 'measures'])
+
+_KEY_COLUMNS = ', '.join(['year', *DIMENSIONS])
+_KEY_MATCH = ' AND '.join(f'{column} IS :{column}' for column in ['year', *DIMENSIONS])
+
+_SCHEMA = (
+    f'CREATE TABLE IF NOT EXISTS {REGISTRY_TABLE} (table_name TEXT PRIMARY KEY, definition TEXT NOT NULL)',
+    # year / gender 不宣告型別，保留資料表原始值的儲存類別
+    f'CREATE TABLE IF NOT EXISTS {CELLS_TABLE} (table_name TEXT NOT NULL, year, gender, school_type TEXT, '
+    'method_type TEXT, region TEXT, city TEXT, rows INTEGER NOT NULL)',
+    f'CREATE INDEX IF NOT EXISTS {CELLS_TABLE}_key ON {CELLS_TABLE} (table_name, {_KEY_COLUMNS})',
+    f'CREATE TABLE IF NOT EXISTS {MOMENTS_TABLE} (table_name TEXT NOT NULL, col TEXT NOT NULL, year, gender, '
+    'school_type TEXT, method_type TEXT, region TEXT, city TEXT, value_count INTEGER NOT NULL, total REAL NOT NULL, '
+    'sum_sq REAL NOT NULL, vmin REAL, vmax REAL)',
+    f'CREATE INDEX IF NOT EXISTS {MOMENTS_TABLE}_key ON {MOMENTS_TABLE} (table_name, col, {_KEY_COLUMNS})',
+)
+
+
+def _to_number(value):
+    """單一值的成績轉換（同 coerce_numeric），無法轉換時回傳 None"""
+    number = coerce_numeric(_object_array([value]))[0]
+    return None if np.isnan(number) else float(number)
+
+
+class TableCubeStore:
+    """
+    OLAP cube 的建立、維護與 roll-up 查詢
+    - build：上傳完成後由資料表重建；維度組合數超過 max_cells 時不建立（cube 不會比掃描資料表省）
+    - apply：資料列異動時以異動前 / 後實際儲存的資料列更新 cube，由呼叫端在同一交易中 commit
+    - counts / moments：依年度與指定維度 roll-up；欄位與 cube 的來源欄位不同時回傳 None，由呼叫端掃描資料表
+    classifiers 為 {school_type, method_type, region, city: 分類函式}；max_cells 為 0 時停用（build 只清除舊 cube）
+    """
+
+    def __init__(self, classifiers, max_cells=20000):
+        self.classifiers = classifiers
+        self.max_cells = max_cells
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._changes = 0
+        self._builds = 0
+        self._skipped = 0
+        self._build_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return self.max_cells > 0
+
+    def build(self, engine, table_name):
+        """重建該表的 cube（單一交易），回傳 CubeDefinition；沒有年度欄位或組合數超過上限時回傳 None"""
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            for statement in _SCHEMA:
+                connection.execute(text(statement))
+            self._delete(connection, table_name)
+            if not self.enabled:
+                return None
+            definition = self._define(connection, table_name)
+            if definition is None:
+                return None
+            cells, moments = self._compute(connection, table_name, definition)
+            if len(cells) > self.max_cells:
+                with self._lock:
+                    self._skipped += 1
+                print(f"[WARNING] {table_name} 維度組合 {len(cells)} 個超過 TABLE_CUBE_MAX_CELLS，不建立 cube")
+                return None
+            if cells:
+                connection.execute(text(
+                    f'INSERT INTO {CELLS_TABLE} (table_name, {_KEY_COLUMNS}, rows) '
+                    f'VALUES (:table, :year, :gender, :school_type, :method_type, :region, :city, :rows)'
+                ), [{'table': table_name, **cell} for cell in cells])
+            if moments:
+                connection.execute(text(
+                    f'INSERT INTO {MOMENTS_TABLE} (table_name, col, {_KEY_COLUMNS}, value_count, total, sum_sq, vmin, vmax) '
+                    'VALUES (:table, :col, :year, :gender, :school_type, :method_type, :region, :city, '
+                    ':value_count, :total, :sum_sq, :vmin, :vmax)'
+                ), [{'table': table_name, **moment} for moment in moments])
+            connection.execute(text(f'INSERT INTO {REGISTRY_TABLE} (table_name, definition) VALUES (:table, :definition)'), {
+                'table': table_name,
+                'definition': json.dumps(definition._asdict(), ensure_ascii=False),
+            })
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._builds += 1
+            self._build_seconds += elapsed
+        print(f"[INFO] {table_name} cube 建立完成：{len(cells)} 個維度組合、{len(definition.measures)} 個成績欄位，"
+              f"{elapsed * 1000:.0f} ms")
+        return definition
+
+    def drop(self, session, table_name):
+        """資料表刪除時在同一交易中移除 cube"""
+        if self._has_registry(session):
+            self._delete(session, table_name)
+
+    def definition(self, session, table_name):
+        """該表的 CubeDefinition，沒有 cube 時回傳 None"""
+        if not self.enabled or not self._has_registry(session):
+            return None
+        row = session.execute(
+            text(f'SELECT definition FROM {REGISTRY_TABLE} WHERE table_name = :table'), {'table': table_name}
+        ).first()
+        return CubeDefinition(**json.loads(row[0])) if row is not None else None
+
+    def apply(self, session, table_name, definition, deleted=None, inserted=None):
+        """以異動前（deleted）/ 後（inserted）的資料列 {欄位: 值} 更新 cube；須在資料列寫入之後、commit 之前呼叫"""
+        for row, sign in ((deleted, -1), (inserted, 1)):
+            if row is None:
+                continue
+            key = self._cell_key(definition, row)
+            if key is None:
+                continue
+            self._add_cell(session, table_name, key, sign)
+            for column in definition.measures:
+                number = _to_number(row.get(column))
+                if number is not None:
+                    self._add_moments(session, table_name, definition, column, key, number, sign)
+        with self._lock:
+            self._changes += 1
+
+    def counts(self, session, table_name, year_col, dimensions):
+        """
+        年度 × dimensions（{cube 維度: 呼叫端使用的來源欄位}）的筆數，
+        回傳 DataFrame：[year_col, *dimensions, analysis_query.ROWS]；cube 不適用時回傳 None
+        """
+        keys = self._rollup_keys(session, table_name, year_col, dimensions)
+        if keys is None:
+            return None
+        rows = session.execute(text(
+            f'SELECT {", ".join(keys)}, SUM(rows) FROM {CELLS_TABLE} WHERE table_name = :table '
+            f'GROUP BY {", ".join(keys)} ORDER BY {", ".join(keys)}'
+        ), {'table': table_name}).fetchall()
+        return pd.DataFrame(rows, columns=[year_col, *dimensions, analysis_query.ROWS])
+
+    def moments(self, session, table_name, year_col, dimensions, columns):
+        """
+        columns 各成績欄位依年度 × dimensions 的彙總，回傳 DataFrame：[year_col, *dimensions, 'col', VALUE_COUNT,
+        VALUE_TOTAL, VALUE_SUM_SQ, VALUE_MIN, VALUE_MAX]（沒有有效成績的組合不列出）；cube 不適用時回傳 None
+        """
+        keys = self._rollup_keys(session, table_name, year_col, dimensions, columns)
+        if keys is None:
+            return None
+        placeholders = ', '.join(f':c{index}' for index in range(len(columns)))
+        group = ', '.join([*keys, 'col'])
+        rows = session.execute(text(
+            f'SELECT {group}, SUM(value_count), TOTAL(total), TOTAL(sum_sq), MIN(vmin), MAX(vmax) FROM {MOMENTS_TABLE} '
+            f'WHERE table_name = :table AND col IN ({placeholders}) GROUP BY {group} ORDER BY {group}'
+        ), {'table': table_name, **{f'c{index}': column for index, column in enumerate(columns)}}).fetchall()
+        return pd.DataFrame(rows, columns=[
+            year_col, *dimensions, 'col', analysis_query.VALUE_COUNT, analysis_query.VALUE_TOTAL,
+            analysis_query.VALUE_SUM_SQ, analysis_query.VALUE_MIN, analysis_query.VALUE_MAX,
+        ])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'max_cells': self.max_cells,
+                'hits': self._hits,
+                'misses': self._misses,
+                'changes': self._changes,
+                'builds': self._builds,
+                'skipped': self._skipped,
+                'build_seconds': round(self._build_seconds, 3),
+            }
+
+    def _rollup_keys(self, session, table_name, year_col, dimensions, columns=()):
+        definition = self.definition(session, table_name)
+        usable = definition is not None and definition.year_col == year_col and all(
+            dimension in DIMENSIONS and column is not None
+            and definition.columns.get(SOURCE_DIMENSION[dimension]) == column
+            for dimension, column in dimensions.items()
+        ) and all(column in definition.measures for column in columns)
+        with self._lock:
+            if usable:
+                self._hits += 1
+            else:
+                self._misses += 1
+        return ['year', *dimensions] if usable else None
+
+    @staticmethod
+    def _has_registry(session):
+        return session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': REGISTRY_TABLE}
+        ).first() is not None
+
+    @staticmethod
+    def _delete(connection, table_name):
+        for table in (REGISTRY_TABLE, CELLS_TABLE, MOMENTS_TABLE):
+            connection.execute(text(f'DELETE FROM {table} WHERE table_name = :table'), {'table': table_name})
+
+    @staticmethod
+    def _define(connection, table_name):
+        columns = [row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info("{table_name}")').fetchall()]
+        year_col = resolve_column_name(None, columns, candidates=STRATUM_CANDIDATES, required=False)
+        if year_col is None:
+            return None
+        sources = {
+            dimension: resolve_column_name(None, columns, candidates=candidates, required=False)
+            for dimension, candidates in DIMENSION_CANDIDATES.items()
+        }
+        candidates = [col for col in columns if col not in ('id', 'user_id', year_col, *sources.values())]
+        measures = []
+        if candidates:
+            probe = connection.execute(text(
+                'SELECT ' + ', '.join(f'"{col}"' for col in candidates) + f' FROM "{table_name}" LIMIT {MEASURE_PROBE_ROWS}'
+            )).fetchall()
+            for col, values in zip(candidates, zip(*probe)):
+                present = [value for value in values if value is not None and value != '']
+                numbers = int((~np.isnan(coerce_numeric(_object_array(present)))).sum()) if present else 0
+                if present and numbers >= MEASURE_MIN_SHARE * len(present):
+                    measures.append(col)
+        return CubeDefinition(year_col, sources, measures)
+
+    def _labels(self, dimension, values):
+        """來源欄位原始值（object 陣列）→ 維度值：性別保留原始值，其餘只對不重複的值分類"""
+        if dimension == 'gender':
+            return values
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        # 空值與空字串同樣分類（school_source_stats 以空字串分類空的學校欄位）
+        labels = _object_array([self.classifiers[dimension]('' if pd.isna(value) else value) for value in uniques])
+        return labels[codes]
+
+    def _cell_key(self, definition, row):
+        year = row.get(definition.year_col)
+        if year is None or year == '':
+            return None
+        key = {'year': year}
+        for dimension in DIMENSIONS:
+            column = definition.columns.get(SOURCE_DIMENSION[dimension])
+            key[dimension] = self._labels(dimension, _object_array([row.get(column)]))[0] if column else None
+        return key
+
+    def _compute(self, connection, table_name, definition):
+        """掃描一次資料表，回傳 (cells, moments) 的 dict 清單"""
+        sources = [column for column in dict.fromkeys(definition.columns.values()) if column]
+        selected = [definition.year_col, *sources, *definition.measures]
+        year = f'"{definition.year_col}"'
+        rows = connection.execute(text(
+            'SELECT ' + ', '.join(f'"{col}"' for col in selected) + f' FROM "{table_name}" '
+            f'WHERE {year} IS NOT NULL AND {year} != \'\''
+        )).fetchall()
+        if not rows:
+            return [], []
+        values = dict(zip(selected, (_object_array(column) for column in zip(*rows))))
+
+        keys = {'year': values[definition.year_col]}
+        for dimension in DIMENSIONS:
+            column = definition.columns.get(SOURCE_DIMENSION[dimension])
+            keys[dimension] = self._labels(dimension, values[column]) if column else _object_array([None] * len(rows))
+        combined = np.zeros(len(rows), dtype=np.int64)
+        for key_values in keys.values():
+            codes, uniques = pd.factorize(key_values, use_na_sentinel=False)
+            combined = combined * max(len(uniques), 1) + codes
+        _, first_index, group_index = np.unique(combined, return_index=True, return_inverse=True)
+        group_count = len(first_index)
+
+        def cell_key(index):
+            return {name: (None if pd.isna(key_values[index]) else key_values[index]) for name, key_values in keys.items()}
+
+        cell_keys = [cell_key(index) for index in first_index]
+        rows_per_cell = np.bincount(group_index, minlength=group_count)
+        cells = [{**key, 'rows': int(count)} for key, count in zip(cell_keys, rows_per_cell)]
+
+        moments = []
+        for column in definition.measures:
+            numbers = coerce_numeric(values[column])
+            valid = ~np.isnan(numbers)
+            finite = np.where(valid, numbers, 0.0)
+            counts = np.bincount(group_index, weights=valid, minlength=group_count)
+            totals = np.bincount(group_index, weights=finite, minlength=group_count)
+            sum_squares = np.bincount(group_index, weights=finite * finite, minlength=group_count)
+            by_cell = pd.Series(numbers[valid]).groupby(group_index[valid])
+            minimums, maximums = by_cell.min(), by_cell.max()
+            for index in np.flatnonzero(counts):
+                moments.append({
+                    **cell_keys[index], 'col': column, 'value_count': int(counts[index]),
+                    'total': float(totals[index]), 'sum_sq': float(sum_squares[index]),
+                    'vmin': float(minimums[index]), 'vmax': float(maximums[index]),
+                })
+        return cells, moments
+
+    @staticmethod
+    def _add_cell(session, table_name, key, sign):
+        params = {'table': table_name, **key}
+        updated = session.execute(text(
+            f'UPDATE {CELLS_TABLE} SET rows = rows + :sign WHERE table_name = :table AND {_KEY_MATCH}'
+        ), {**params, 'sign': sign}).rowcount
+        if sign > 0 and not updated:
+            session.execute(text(
+                f'INSERT INTO {CELLS_TABLE} (table_name, {_KEY_COLUMNS}, rows) '
+                'VALUES (:table, :year, :gender, :school_type, :method_type, :region, :city, 1)'
+            ), params)
+        elif sign < 0:
+            session.execute(text(
+                f'DELETE FROM {CELLS_TABLE} WHERE table_name = :table AND {_KEY_MATCH} AND rows <= 0'
+            ), params)
+
+    def _add_moments(self, session, table_name, definition, column, key, number, sign):
+        params = {'table': table_name, 'col': column, **key}
+        where = f'WHERE table_name = :table AND col = :col AND {_KEY_MATCH}'
+        delta = {**params, 'sign': sign, 'total': sign * number, 'sum_sq': sign * number * number,
+                 'number': number if sign > 0 else None}
+        updated = session.execute(text(
+            f'UPDATE {MOMENTS_TABLE} SET value_count = value_count + :sign, total = total + :total, '
+            'sum_sq = sum_sq + :sum_sq, '
+            'vmin = CASE WHEN :number IS NULL OR vmin <= :number THEN vmin ELSE :number END, '
+            'vmax = CASE WHEN :number IS NULL OR vmax >= :number THEN vmax ELSE :number END '
+            f'{where}'
+        ), delta).rowcount
+        if sign > 0:
+            if not updated:
+                session.execute(text(
+                    f'INSERT INTO {MOMENTS_TABLE} (table_name, col, {_KEY_COLUMNS}, value_count, total, sum_sq, vmin, vmax) '
+                    'VALUES (:table, :col, :year, :gender, :school_type, :method_type, :region, :city, '
+                    '1, :total, :sum_sq, :number, :number)'
+                ), delta)
+            return
+
+        # 沒有有效成績的組合直接移除，避免浮點數累加的殘差
+        session.execute(text(f'DELETE FROM {MOMENTS_TABLE} {where} AND value_count <= 0'), params)
+        current = session.execute(text(f'SELECT vmin, vmax FROM {MOMENTS_TABLE} {where}'), params).first()
+        if current is None or current[0] < number < current[1]:
+            return
+        # 移除的是最小或最大值：重新計算該組合（只讀取同一年度、同一性別的資料列，資料列已在同一交易中寫入）
+        sources = [col for col in dict.fromkeys(definition.columns.values()) if col]
+        conditions = [f'"{definition.year_col}" = :year']
+        if definition.columns.get('gender'):
+            conditions.append(f'"{definition.columns["gender"]}" IS :gender')
+        selected = list(dict.fromkeys([definition.year_col, *sources, column]))
+        rows = session.execute(text(
+            'SELECT ' + ', '.join(f'"{col}"' for col in selected) + f' FROM "{table_name}" WHERE {" AND ".join(conditions)}'
+        ), {'year': key['year'], 'gender': key['gender']}).mappings().fetchall()
+        numbers = [_to_number(row[column]) for row in rows if self._cell_key(definition, row) == key]
+        numbers = [value for value in numbers if value is not None]
+        session.execute(text(f'UPDATE {MOMENTS_TABLE} SET vmin = :vmin, vmax = :vmax {where}'), {
+            **params, 'vmin': min(numbers) if numbers else None, 'vmax': max(numbers) if numbers else None,
+        })
@@ -0,0 +1,438 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from service.analysis_query import PARTIAL_AGGREGATIONS, ROWS
+from service.column_sketch import parse_number
+
+
+def _object_array(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _sqlite_sort_key(value):
+    """SQLite 排序規則：NULL < 數值 < 文字（UTF-8 位元組順序即字元碼順序）< BLOB"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, bytes(value))
+
+
+def _sqlite_in(value, texts, numbers):
+    """模擬 SQLite 欄位與字串參數的 IN 比較（數值欄位會將參數轉為數值後比較）"""
+    if value is None:
+        return False
+    if isinstance(value, str):
+        return value in texts
+    if isinstance(value, (int, float)):
+        return float(value) in numbers
+    return False
+
+
+def coerce_numeric(values):
+    """
+    等同 pd.to_numeric(values, errors='coerce') 轉為 float64 的 ndarray；
+    只轉換不重複的值（成績欄位通常只有數百種值），再以 factorize 的代碼展開
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object), use_na_sentinel=False)
+    numbers = pd.to_numeric(pd.Series(uniques, dtype=object), errors='coerce').to_numpy(dtype='float64')
+    return numbers[codes]
+
+
+def in_mask(values, targets):
+    """values IN (targets) 的布林遮罩；比較只對不重複的值執行（NULL 參數不會相等）"""
+    texts = {str(target) for target in targets if target is not None}
+    numbers = set()
+    for target in texts:
+        try:
+            numbers.add(float(target))
+        except ValueError:
+            pass
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    hits = np.array([_sqlite_in(value, texts, numbers) for value in uniques], dtype=bool)
+    return hits[codes]
+
+
+class EncodedColumn:
+    """
+    欄位值的字典編碼：values = uniques[codes]
+    文字欄位的重複字串只保留一份（codes 為 int32），空值檢查、年度篩選、數值轉換只需處理不重複的值
+    含數值等其他型別的欄位（factorize 會把 1、1.0、True 視為同一個值）保留原始值，codes 為 0..n-1
+    """
+
+    __slots__ = ('codes', 'uniques', 'distinct')
+
+    def __init__(self, values):
+        if pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+            codes, uniques = pd.factorize(values, use_na_sentinel=False)
+            # factorize 會把 None 轉為 NaN，SQLite 的空值一律是 None
+            uniques[pd.isna(uniques)] = None
+            self.codes, self.uniques, self.distinct = codes.astype(np.int32), uniques, True
+        else:
+            self.codes, self.uniques, self.distinct = np.arange(len(values), dtype=np.int32), values, False
+
+    @classmethod
+    def from_parts(cls, codes, uniques, distinct):
+        """由既有的 codes / uniques 建立（例如子行程中指向共用記憶體的 codes）"""
+        column = cls.__new__(cls)
+        column.codes, column.uniques, column.distinct = codes, uniques, distinct
+        return column
+
+    def __len__(self):
+        return len(self.codes)
+
+    def values(self, mask=None):
+        return self.uniques[self.codes if mask is None else self.codes[mask]]
+
+    def per_value(self, fn):
+        """fn 對 uniques 計算的結果展開回每一列"""
+        return fn(self.uniques)[self.codes]
+
+    def memory_bytes(self):
+        return int(self.codes.nbytes + pd.Series(self.uniques).memory_usage(deep=True, index=False))
+
+
+class TableFrame:
+    """
+    資料表部分欄位的記憶體副本，各欄位以 EncodedColumn 保存 SQLite 回傳的原始 Python 值
+    select_rows / select_frame / grouped（analysis_query.QuerySpec 的篩選與分組） 回傳與對應 SQL 查詢相同的結果：
+    資料列順序相同，DataFrame 的 dtype 推斷也與由 fetchall() 的 tuple 清單建立時一致
+    科目分數等欄位可另外保存整欄轉為數值後的結果（numeric），多次分析不必重複轉換
+    """
+
+    def __init__(self, table_name, columns):
+        self.table_name = table_name
+        self.columns = {name: EncodedColumn(values) for name, values in columns.items()}
+        self.numeric_columns = {}
+        self.row_count = len(next(iter(self.columns.values()))) if self.columns else 0
+
+    @classmethod
+    def from_encoded(cls, table_name, columns, numeric_columns=None):
+        """由 EncodedColumn 與已轉換的數值欄位建立，不重新編碼"""
+        frame = cls(table_name, {})
+        frame.columns = dict(columns)
+        frame.numeric_columns = dict(numeric_columns or {})
+        frame.row_count = len(next(iter(frame.columns.values()))) if frame.columns else 0
+        return frame
+
+    @classmethod
+    def load(cls, engine, table_name, column_names):
+        column_names = list(dict.fromkeys(column_names))
+        column_list = ', '.join(f'"{col}"' for col in column_names)
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f'SELECT {column_list} FROM "{table_name}"')
+            rows = cursor.fetchall()
+        finally:
+            connection.close()
+        if rows:
+            values = [_object_array(column) for column in zip(*rows)]
+        else:
+            values = [_object_array([]) for _ in column_names]
+        return cls(table_name, dict(zip(column_names, values)))
+
+    def has_columns(self, column_names):
+        return all(col in self.columns for col in column_names)
+
+    def has_numeric(self, column_names):
+        return all(col in self.numeric_columns for col in column_names)
+
+    def not_null_mask(self, column):
+        return self.columns[column].per_value(lambda values: ~pd.isna(values))
+
+    def not_empty_mask(self, column):
+        """欄位非 NULL 且不為空字串"""
+        return self.columns[column].per_value(lambda values: ~pd.isna(values) & (values != ''))
+
+    def numeric(self, column):
+        """整欄以 pd.to_numeric(errors='coerce') 轉為 float64 後的結果（只轉換一次）"""
+        values = self.numeric_columns.get(column)
+        if values is None:
+            values = self.columns[column].per_value(coerce_numeric)
+            self.numeric_columns[column] = values
+        return values
+
+    def filter_mask(self, filters=()):
+        """analysis_query.Filter 條件（AND）的布林遮罩，語意與 compile_query 產生的 WHERE 相同"""
+        mask = np.ones(self.row_count, dtype=bool)
+        for condition in filters:
+            if condition.op == 'not_empty':
+                mask &= self.not_empty_mask(condition.column)
+            elif condition.op == 'not_null':
+                mask &= self.not_null_mask(condition.column)
+            elif condition.op == 'any_not_null':
+                mask &= np.logical_or.reduce([self.not_null_mask(column) for column in condition.values])
+            else:
+                mask &= self.columns[condition.column].per_value(lambda values: in_mask(values, condition.values))
+        return mask
+
+    def select_rows(self, column_names, filters=(), limit=None):
+        """等同 SELECT column_names WHERE filters [LIMIT limit]，回傳 tuple 清單"""
+        mask = self.filter_mask(filters)
+        if limit is not None:
+            mask &= np.cumsum(mask) <= limit
+        return list(zip(*(self.columns[column].values(mask) for column in column_names)))
+
+    def select_frame(self, column_names, numeric=(), filters=()):
+        """
+        select_rows 的 DataFrame 版本，直接由欄位陣列建立（infer_objects 與 tuple 清單的 dtype 推斷相同）
+        numeric 中的欄位直接回傳轉為 float64 的值
+        """
+        mask = self.filter_mask(filters)
+        frame = pd.DataFrame({
+            position: self.numeric(column)[mask] if column in numeric else self.columns[column].values(mask)
+            for position, column in enumerate(column_names)
+        }).infer_objects()
+        frame.columns = list(column_names)
+        return frame
+
+    def grouped(self, column_names, filters=(), measure_column=None):
+        """
+        等同 compile_query 的分組查詢：SELECT column_names, 部分彙總 WHERE filters GROUP BY column_names
+        群組依 SQLite 的排序規則排列；measure_column 的值以 parse_number 轉換（與 SQL 的 numeric_sql 相同）
+        """
+        mask = self.filter_mask(filters)
+        encoded = []
+        for column in column_names:
+            column_values = self.columns[column]
+            if column_values.distinct:
+                encoded.append((column_values.codes[mask], column_values.uniques))
+            else:
+                encoded.append(pd.factorize(column_values.values(mask), use_na_sentinel=False))
+        partials = [ROWS] if measure_column is None else list(PARTIAL_AGGREGATIONS)
+
+        selected = int(mask.sum())
+        if not column_names:
+            # 不分組的彙總與 SQL 相同，沒有符合的資料列時仍回傳一列
+            group_index, first_index, group_count = np.zeros(selected, dtype=np.int64), np.zeros(1, dtype=np.int64), 1
+        elif selected and math.prod(len(uniques) for _, uniques in encoded) <= np.iinfo(np.int64).max:
+            combined = np.zeros(selected, dtype=np.int64)
+            for codes, uniques in encoded:
+                combined = combined * len(uniques) + codes
+            _, first_index, group_index = np.unique(combined, return_index=True, return_inverse=True)
+            group_count = len(first_index)
+        elif selected:
+            # 各欄位相異值數的乘積超過 int64 時合併代碼會溢位，改以 pandas 依各欄位代碼分組
+            codes_frame = pd.DataFrame({index: codes for index, (codes, _) in enumerate(encoded)})
+            group_index = codes_frame.groupby(list(codes_frame.columns)).ngroup().to_numpy(dtype=np.int64)
+            _, first_index = np.unique(group_index, return_index=True)
+            group_count = len(first_index)
+        else:
+            return pd.DataFrame([], columns=[*column_names, *partials])
+
+        rows_per_group = np.bincount(group_index, minlength=group_count)
+        aggregates = [[int(count)] for count in rows_per_group]
+        if measure_column is not None:
+            numbers = self.columns[measure_column].per_value(
+                lambda values: np.array([parse_number(value) for value in values], dtype=float)
+            )[mask]
+            valid = ~np.isnan(numbers)
+            finite = np.where(valid, numbers, 0.0)
+            counts = np.bincount(group_index, weights=valid, minlength=group_count)
+            totals = np.bincount(group_index, weights=finite, minlength=group_count)
+            sum_squares = np.bincount(group_index, weights=finite * finite, minlength=group_count)
+            by_group = pd.Series(numbers).groupby(group_index)
+            minimums = by_group.min().reindex(range(group_count))
+            maximums = by_group.max().reindex(range(group_count))
+            for index, aggregate in enumerate(aggregates):
+                has_values = counts[index] > 0
+                aggregate.extend([
+                    int(counts[index]), float(totals[index]), float(sum_squares[index]),
+                    float(minimums.iloc[index]) if has_values else None,
+                    float(maximums.iloc[index]) if has_values else None,
+                ])
+
+        rows = [
+            (*(uniques[codes[index]] for codes, uniques in encoded), *aggregate)
+            for index, aggregate in zip(first_index, aggregates)
+        ]
+        rows.sort(key=lambda row: tuple(_sqlite_sort_key(value) for value in row[:len(column_names)]))
+        return pd.DataFrame(rows, columns=[*column_names, *partials])
+
+    def memory_bytes(self):
+        encoded_bytes = sum(column.memory_bytes() for column in self.columns.values())
+        return int(encoded_bytes + sum(values.nbytes for values in self.numeric_columns.values()))
+
+
+def merge_grouped(frames, column_names, measure_column=None):
+    """
+    合併多個資料表相同分組查詢（grouped）的結果，等同 UNION ALL 後再分組：
+    相同值組合的部分彙總相加（最小/最大取極值），群組依 SQLite 的排序規則排列
+    """
+    partials = [ROWS] if measure_column is None else list(PARTIAL_AGGREGATIONS)
+    merged = {}
+    for frame in frames:
+        for row in frame.itertuples(index=False, name=None):
+            # 整欄為 NULL 的浮點欄位會被 pandas 轉為 NaN，還原為 SQLite 的 NULL
+            key = tuple(None if isinstance(value, float) and value != value else value
+                        for value in row[:len(column_names)])
+            values = [None if isinstance(value, float) and value != value else value for value in row[len(column_names):]]
+            current = merged.get(key)
+            if current is None:
+                merged[key] = values
+                continue
+            for index, name in enumerate(partials):
+                if values[index] is None:
+                    continue
+                if current[index] is None:
+                    current[index] = values[index]
+                elif PARTIAL_AGGREGATIONS[name] == 'sum':
+                    current[index] += values[index]
+                else:
+                    current[index] = (min if PARTIAL_AGGREGATIONS[name] == 'min' else max)(current[index], values[index])
+    if not column_names and not merged:
+        merged[()] = [0] * len(partials) if measure_column is None else [0, 0, 0.0, 0.0, None, None]
+    rows = sorted(((*key, *values) for key, values in merged.items()),
+                  key=lambda row: tuple(_sqlite_sort_key(value) for value in row[:len(column_names)]))
+    return pd.DataFrame(rows, columns=[*column_names, *partials])
+
+
+class TableFrameCache:
+    """
+    行程內的資料表欄位快取：保存最近使用資料表的投影欄位（原始值與轉為數值的欄位）
+    - 以資料庫 URL + 資料表名稱為鍵，資料版本（version_fn，與分析結果快取共用 AnalysisCache.table_version）判斷是否有效
+    - 需要的欄位尚未快取時，連同已快取的欄位重新讀取一次；同一資料表同時只有一個讀取
+    - 大小以 memory_usage(deep=True) 量測，總量超過 max_bytes 時淘汰最久未使用的資料表
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024, version_fn=None):
+        self.max_bytes = max_bytes
+        self.version_fn = version_fn
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._entries = OrderedDict()
+        self._epoch = 0
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._column_misses = 0
+        self._evictions = 0
+        self._loads = 0
+        self._load_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, engine, table_name, columns, numeric=()):
+        """回傳 (frame, loaded)：frame 包含 columns 與 numeric 欄位，loaded 表示本次是否讀取了資料庫"""
+        columns = list(dict.fromkeys([*columns, *numeric]))
+        key = (str(engine.url), table_name)
+        version = self.version_fn(table_name) if self.version_fn else 0
+        frame = self._lookup(key, version, columns, count=True)
+        loaded = False
+        if frame is None:
+            with self._load_lock(key):
+                # 等待期間其他執行緒可能已讀取完成
+                frame = self._lookup(key, version, columns, count=False)
+                if frame is None:
+                    frame = self._load(engine, key, version, columns)
+                    loaded = True
+
+        for column in numeric:
+            if column not in frame.numeric_columns:
+                nbytes = frame.numeric(column).nbytes
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None and entry['frame'] is frame:
+                        entry['bytes'] += nbytes
+                        self._bytes += nbytes
+                        self._evict()
+        return frame, loaded
+
+    def clear(self):
+        """資料庫檔案被替換時清除全部資料；進行中的讀取完成後不會存入"""
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses + self._column_misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'column_misses': self._column_misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else None,
+                'evictions': self._evictions,
+                'loads': self._loads,
+                'load_seconds': round(self._load_seconds, 3),
+                'tables': {
+                    table_name: {
+                        'bytes': entry['bytes'],
+                        'rows': entry['frame'].row_count,
+                        'columns': len(entry['frame'].columns),
+                        'numeric_columns': len(entry['frame'].numeric_columns),
+                    }
+                    for (_, table_name), entry in self._entries.items()
+                },
+            }
+
+    def _load_lock(self, key):
+        with self._lock:
+            return self._load_locks.setdefault(key, threading.Lock())
+
+    def _lookup(self, key, version, columns, count):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['version'] == version and entry['frame'].has_columns(columns):
+                self._entries.move_to_end(key)
+                if count:
+                    self._hits += 1
+                return entry['frame']
+            if count:
+                if entry is not None and entry['version'] == version:
+                    self._column_misses += 1
+                else:
+                    self._misses += 1
+            return None
+
+    def _load(self, engine, key, version, columns):
+        table_name = key[1]
+        with self._lock:
+            entry = self._entries.get(key)
+            epoch = self._epoch
+        if entry is not None and entry['version'] == version:
+            columns = [*entry['frame'].columns, *columns]
+
+        started = time.perf_counter()
+        frame = TableFrame.load(engine, table_name, columns)
+        size = frame.memory_bytes()
+        elapsed = time.perf_counter() - started
+
+        current_version = self.version_fn(table_name) if self.version_fn else 0
+        with self._lock:
+            self._loads += 1
+            self._load_seconds += elapsed
+            if epoch != self._epoch or current_version != version or size > self.max_bytes:
+                # 讀取期間資料表已變更或單表超過上限：本次使用但不快取
+                return frame
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous['bytes']
+            self._entries[key] = {'frame': frame, 'version': version, 'bytes': size}
+            self._bytes += size
+            self._evict()
+        return frame
+
+    def _evict(self):
+        """呼叫端須持有 self._lock"""
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted['bytes']
+            self._evictions += 1
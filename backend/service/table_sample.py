@@ -0,0 +1,231 @@
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from service.column_resolution import resolve_column_name
+from service.table_frame import TableFrame, _object_array
+
+# 分層欄位的候選名稱（與分析端點預設的年度欄位候選相同）
+STRATUM_CANDIDATES = ['年度', '入學年度', '學年度', 'year']
+
+
+class TableSample:
+    """
+    資料表依年度分層的隨機樣本
+    - frame：抽中資料列的全部欄位（依 rowid 排序，與直接查詢資料表的順序相同）
+    - strata：{年度原始值: (母體筆數, 樣本筆數)}；沒有年度欄位時整個資料表為單一分層（鍵為 None）
+    """
+
+    def __init__(self, table_name, stratum_column, frame, strata, total_rows, version):
+        self.table_name = table_name
+        self.stratum_column = stratum_column
+        self.frame = frame
+        self.strata = strata
+        self.total_rows = total_rows
+        self.version = version
+        self._year_strata = None
+
+    @property
+    def sample_rows(self):
+        return self.frame.row_count
+
+    def year_strata(self):
+        """
+        {年度: (母體筆數, 樣本筆數)}：年度原始值以分析端點相同的方式（pd.to_numeric 後取整數）轉換，
+        轉換後相同的原始值合併為一層（各層抽樣比例相同或整層納入），無法轉換的原始值不列入
+        """
+        if self._year_strata is None:
+            keys = list(self.strata)
+            years = pd.to_numeric(pd.Series(keys, dtype=object), errors='coerce')
+            merged = {}
+            for key, year in zip(keys, years):
+                if pd.isna(year):
+                    continue
+                population, sampled = merged.get(int(year), (0, 0))
+                merged[int(year)] = (population + self.strata[key][0], sampled + self.strata[key][1])
+            self._year_strata = merged
+        return self._year_strata
+
+    def memory_bytes(self):
+        return self.frame.memory_bytes()
+
+
+class TableSampleStore:
+    """
+    大型資料表的分層隨機樣本（approximate 分析使用）
+    - 上傳時建立（build），之後由 get 取用；資料表版本（version_fn，與分析結果快取共用）改變後下次 get 時重新抽樣
+    - 每個年度至少抽 min_per_stratum 筆（不足時整層納入），其餘依 fraction 比例配置；筆數少於 min_rows 的資料表不抽樣
+    - 樣本大小以 memory_usage(deep=True) 量測，總量超過 max_bytes 時淘汰最久未使用的資料表
+    """
+
+    def __init__(self, fraction=0.05, min_rows=100000, min_per_stratum=200, max_bytes=64 * 1024 * 1024,
+                 version_fn=None, seed=0):
+        self.fraction = fraction
+        self.min_rows = min_rows
+        self.min_per_stratum = min_per_stratum
+        self.max_bytes = max_bytes
+        self.version_fn = version_fn
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self._entries = OrderedDict()
+        self._epoch = 0
+        self._bytes = 0
+        self._hits = 0
+        self._builds = 0
+        self._build_seconds = 0.0
+        self._evictions = 0
+
+    @property
+    def enabled(self):
+        return self.fraction > 0 and self.max_bytes > 0
+
+    def get(self, engine, table_name):
+        """回傳目前版本的 TableSample（需要時重新抽樣）；資料表筆數少於 min_rows 時回傳 None"""
+        if not self.enabled:
+            return None
+        key = (str(engine.url), table_name)
+        version = self._version(table_name)
+        found, sample = self._lookup(key, version)
+        if found:
+            return sample
+        with self._build_lock(key):
+            # 等待期間其他執行緒可能已抽樣完成
+            found, sample = self._lookup(key, version)
+            if found:
+                return sample
+            return self._build(engine, key, version)
+
+    def build(self, engine, table_name):
+        """上傳完成後呼叫：預先抽樣，第一次 approximate 分析不必等待"""
+        return self.get(engine, table_name)
+
+    def drop(self, table_name):
+        """資料表被刪除時釋放其樣本（需在資料表版本遞增之後呼叫，進行中的抽樣因版本不符不會存入）"""
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == table_name]:
+                self._bytes -= self._entries.pop(key)['bytes']
+                self._build_locks.pop(key, None)
+
+    def clear(self):
+        """資料庫檔案被替換時清除全部樣本；進行中的抽樣完成後不會存入"""
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'fraction': self.fraction,
+                'min_rows': self.min_rows,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'builds': self._builds,
+                'build_seconds': round(self._build_seconds, 3),
+                'evictions': self._evictions,
+                'tables': {
+                    table_name: {
+                        'total_rows': entry['sample'].total_rows,
+                        'sample_rows': entry['sample'].sample_rows,
+                        'strata': len(entry['sample'].strata),
+                        'bytes': entry['bytes'],
+                    }
+                    for (_, table_name), entry in self._entries.items() if entry['sample'] is not None
+                },
+            }
+
+    def _version(self, table_name):
+        return self.version_fn(table_name) if self.version_fn else 0
+
+    def _build_lock(self, key):
+        with self._lock:
+            return self._build_locks.setdefault(key, threading.Lock())
+
+    def _lookup(self, key, version):
+        """回傳 (found, sample)：小型資料表也會記錄（sample 為 None），不必每次重新計數"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['version'] != version:
+                return False, None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return True, entry['sample']
+
+    def _build(self, engine, key, version):
+        table_name = key[1]
+        with self._lock:
+            epoch = self._epoch
+        started = time.perf_counter()
+        sample = self._draw(engine, table_name, version)
+        size = sample.memory_bytes() if sample is not None else 0
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self._builds += 1
+            self._build_seconds += elapsed
+            if epoch != self._epoch or self._version(table_name) != version or size > self.max_bytes:
+                # 抽樣期間資料表已變更或樣本超過上限：本次使用但不保存
+                return sample
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous['bytes']
+            self._entries[key] = {'sample': sample, 'version': version, 'bytes': size}
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted['bytes']
+                self._evictions += 1
+        if sample is not None:
+            print(f"[INFO] {table_name} 抽樣完成：{sample.sample_rows}/{sample.total_rows} 筆，"
+                  f"{len(sample.strata)} 層，{elapsed * 1000:.0f} ms")
+        return sample
+
+    def _draw(self, engine, table_name, version):
+        """只讀取 rowid 與年度欄位決定樣本，再以 json_each 一次讀取抽中的資料列"""
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            columns = [row[1] for row in cursor.execute(f'PRAGMA table_info("{table_name}")').fetchall()]
+            stratum_column = resolve_column_name(None, columns, candidates=STRATUM_CANDIDATES, required=False)
+            select = f'rowid, "{stratum_column}"' if stratum_column else 'rowid, NULL'
+            rows = cursor.execute(f'SELECT {select} FROM "{table_name}"').fetchall()
+            if len(rows) < max(self.min_rows, 1):
+                return None
+
+            rowids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            codes, uniques = pd.factorize(_object_array([row[1] for row in rows]), use_na_sentinel=False)
+            uniques[pd.isna(uniques)] = None
+            order = np.argsort(codes, kind='stable')
+            bounds = np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1]
+
+            rng = np.random.default_rng(self.seed)
+            chosen = []
+            strata = {}
+            for stratum, members in zip(uniques, np.split(order, bounds)):
+                population = len(members)
+                size = min(population, max(self.min_per_stratum, math.ceil(population * self.fraction)))
+                chosen.append(rng.choice(members, size, replace=False))
+                strata[stratum] = (population, size)
+            selected = np.sort(rowids[np.concatenate(chosen)])
+
+            cursor.execute(
+                f'SELECT * FROM "{table_name}" WHERE rowid IN (SELECT value FROM json_each(?)) ORDER BY rowid',
+                (json.dumps(selected.tolist()),),
+            )
+            names = [description[0] for description in cursor.description]
+            sampled_rows = cursor.fetchall()
+        finally:
+            connection.close()
+
+        values = [_object_array(column) for column in zip(*sampled_rows)]
+        frame = TableFrame(table_name, dict(zip(names, values)))
+        return TableSample(table_name, stratum_column, frame, strata, len(rows), version)
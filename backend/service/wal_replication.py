@@ -0,0 +1,468 @@
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from service.database_backup import COPY_CHUNK_SIZE, install_database_file, snapshot_database
+
+WAL_PREFIX = 'wal'
+SNAPSHOT_BLOB = 'snapshot.db.gz'
+SEGMENT_SUFFIX = '.wal.gz'
+SEGMENT_MAGIC = b'WALSEG01'
+# 本地資料庫旁記錄最後還原 / 上傳的 generation 與區段序號，與遠端相同時還原不必下載
+LOCAL_STATE_SUFFIX = '.wal-backup.json'
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+WAL_MAGIC_VALUES = (0x377F0682, 0x377F0683)
+
+
+def wal_checksum(data, s0, s1, big_endian):
+    """SQLite WAL 的累積校驗和（以 32 位元字為單位，每次處理兩個字）。"""
+    words = struct.unpack(f"{'>' if big_endian else '<'}{len(data) // 4}I", data)
+    for i in range(0, len(words), 2):
+        s0 = (s0 + words[i] + s1) & 0xFFFFFFFF
+        s1 = (s1 + words[i + 1] + s0) & 0xFFFFFFFF
+    return s0, s1
+
+
+def read_wal_header(wal_path):
+    """讀取 WAL 檔頭並回傳自檔頭開始的讀取位置；WAL 不存在或檔頭無效時回傳 None。"""
+    try:
+        with open(wal_path, 'rb') as f:
+            header = f.read(WAL_HEADER_SIZE)
+    except FileNotFoundError:
+        return None
+    if len(header) < WAL_HEADER_SIZE:
+        return None
+
+    magic, _, page_size, _, salt1, salt2, checksum1, checksum2 = struct.unpack('>8I', header)
+    if magic not in WAL_MAGIC_VALUES:
+        return None
+    big_endian = bool(magic & 1)
+    if wal_checksum(header[:24], 0, 0, big_endian) != (checksum1, checksum2):
+        return None
+    return {
+        'page_size': page_size,
+        'salts': (salt1, salt2),
+        'big_endian': big_endian,
+        'offset': WAL_HEADER_SIZE,
+        'checksum': (checksum1, checksum2),
+    }
+
+
+def read_committed_frames(wal_path, position, out=None):
+    """
+    自 position 起讀取 WAL 中已提交的 frame（salt 相符、校驗和正確，直到最後一個 commit frame）
+    frame（24 bytes 檔頭 + 頁面）依序寫入 out，未提交的尾端會被截掉
+    回傳 (讀到最後一個 commit frame 之後的新位置, 已提交 frame 數)
+    """
+    frame_size = WAL_FRAME_HEADER_SIZE + position['page_size']
+    committed = dict(position)
+    committed_frames = 0
+    offset = position['offset']
+    checksum = position['checksum']
+    frames = 0
+    out_committed = out.tell() if out is not None else 0
+
+    with open(wal_path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            frame = f.read(frame_size)
+            if len(frame) < frame_size:
+                break
+            _, commit_size, salt1, salt2, checksum1, checksum2 = struct.unpack('>6I', frame[:WAL_FRAME_HEADER_SIZE])
+            if (salt1, salt2) != position['salts']:
+                break
+            checksum = wal_checksum(frame[:8] + frame[WAL_FRAME_HEADER_SIZE:], *checksum, position['big_endian'])
+            if checksum != (checksum1, checksum2):
+                break
+
+            offset += frame_size
+            frames += 1
+            if out is not None:
+                out.write(frame)
+            if commit_size:
+                committed.update(offset=offset, checksum=checksum)
+                committed_frames = frames
+                if out is not None:
+                    out_committed = out.tell()
+
+    if out is not None:
+        out.truncate(out_committed)
+    return committed, committed_frames
+
+
+def apply_segment(segment_path, db_file):
+    """將 WAL 區段中的頁面寫回資料庫檔案，回傳 (page_size, 最後一個 commit 的資料庫頁數)。"""
+    db_pages = None
+    with gzip.open(segment_path, 'rb') as source:
+        header = source.read(len(SEGMENT_MAGIC) + 4)
+        if header[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise ValueError(f'無效的 WAL 區段: {segment_path}')
+        page_size = struct.unpack('>I', header[len(SEGMENT_MAGIC):])[0]
+        frame_size = WAL_FRAME_HEADER_SIZE + page_size
+        while True:
+            frame = source.read(frame_size)
+            if not frame:
+                break
+            if len(frame) < frame_size:
+                raise ValueError(f'WAL 區段不完整: {segment_path}')
+            page_number, commit_size = struct.unpack('>2I', frame[:8])
+            db_file.seek((page_number - 1) * page_size)
+            db_file.write(frame[WAL_FRAME_HEADER_SIZE:])
+            if commit_size:
+                db_pages = commit_size
+    return page_size, db_pages
+
+
+def gzip_file(source_path, dest_path):
+    with open(source_path, 'rb') as source, gzip.open(dest_path, 'wb', compresslevel=6) as target:
+        shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+    return os.path.getsize(dest_path)
+
+
+def read_local_state(db_path):
+    """讀取資料庫旁記錄的 {'generation', 'seq'}；沒有或無法解析時回傳 None。"""
+    try:
+        with open(f'{db_path}{LOCAL_STATE_SUFFIX}', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {'generation': state.get('generation'), 'seq': state.get('seq')}
+
+
+def write_local_state(db_path, generation, seq):
+    state_path = f'{db_path}{LOCAL_STATE_SUFFIX}'
+    with open(f'{state_path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'generation': generation, 'seq': seq}, f)
+    os.replace(f'{state_path}.tmp', state_path)
+
+
+def new_generation_id():
+    """generation 名稱依時間排序，還原時取字典序最大者即為最新。"""
+    return f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')}-{uuid.uuid4().hex[:8]}"
+
+
+class WalBackup:
+    """
+    WAL 區段增量備份（介面與 DatabaseBackup 相同：run / restore_if_changed / restore_all）
+    - 資料庫改用 WAL 模式，每次備份只上傳上次備份後新提交的 frame：wal/<db>/<generation>/<seq>.wal.gz
+    - 上傳的 frame 由備份程序自行 checkpoint；備份之間以常駐讀取交易阻止其他連線 checkpoint 超過已備份的位置，
+      因此 WAL 重設（salt 改變）前的 frame 一定都已上傳
+    - 定期（或區段累計大小超過快照時）上傳完整快照並開始新的 generation；
+      還原 = 最新 generation 的快照 + 依序套用區段
+    - 每次還原或上傳後在資料庫旁寫入 <db>.wal-backup.json（generation、seq），與遠端最新的相同時還原直接略過
+    """
+
+    def __init__(self, bucket, databases, snapshot_interval_seconds=3600.0, max_segment_ratio=1.0,
+                 busy_timeout=30.0, keep_generations=2):
+        self.bucket = bucket
+        self.databases = dict(databases)
+        self.snapshot_interval_seconds = snapshot_interval_seconds
+        self.max_segment_ratio = max_segment_ratio
+        self.busy_timeout = busy_timeout
+        self.keep_generations = keep_generations
+        self.last_run = None
+        self.total_bytes_shipped = 0
+        self._reset_state()
+        if hasattr(os, 'register_at_fork'):
+            # 連線不能跨 fork 使用；子行程重新開始新的 generation
+            os.register_at_fork(after_in_child=self._reset_state)
+
+    def _reset_state(self):
+        self._lock = threading.RLock()
+        self._replicas = {}
+        self._generations = {}
+
+    def start(self):
+        """開啟各資料庫的備份連線並切換為 WAL 模式（須在實際處理寫入的行程中、寫入開始前呼叫）。"""
+        with self._lock:
+            for name, path in self.databases.items():
+                if os.path.exists(path):
+                    self._ensure_replica(name, path)
+
+    def run(self):
+        """上傳各資料庫新提交的 WAL 區段（或新的完整快照），回傳本次備份摘要。"""
+        started = time.perf_counter()
+        results = {}
+        bytes_shipped = 0
+        with self._lock:
+            for name, path in self.databases.items():
+                result = self._backup_one(name, path)
+                results[name] = result
+                bytes_shipped += result.get('bytes_shipped', 0)
+
+        self.total_bytes_shipped += bytes_shipped
+        self.last_run = {
+            'databases': results,
+            'bytes_shipped': bytes_shipped,
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+        return self.last_run
+
+    def restore_if_changed(self, name, dest_path, install_fn=install_database_file):
+        """
+        以最新 generation 的快照加上依序套用的 WAL 區段重建資料庫，之後的備份延續同一 generation
+        本地記錄的 generation / seq 與遠端最新的相同時不下載（本地資料庫不會比備份舊），之後的備份改以新快照開始
+        參數與回傳格式與 DatabaseBackup.restore_if_changed 相同
+        """
+        timings = {}
+        started = time.perf_counter()
+        generation, snapshot_blob, segments = self._latest_generation(name)
+        timings['metadata_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        if generation is None:
+            return {'status': 'not_found', **timings}
+
+        latest = {'generation': generation, 'seq': segments[-1][0] if segments else 0}
+        if os.path.exists(dest_path) and read_local_state(dest_path) == latest:
+            return {'status': 'up_to_date', **latest, **timings}
+
+        started = time.perf_counter()
+        temp_path = f'{dest_path}.restore'
+        temp_compressed = f'{dest_path}.restore.gz'
+        try:
+            snapshot_blob.download_to_filename(temp_compressed)
+            base_bytes = os.path.getsize(temp_compressed)
+            with gzip.open(temp_compressed, 'rb') as source, open(temp_path, 'wb') as target:
+                shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+
+            applied = 0
+            segment_bytes = 0
+            complete = True
+            with open(temp_path, 'r+b') as db_file:
+                page_size = db_pages = None
+                for seq, blob in segments:
+                    if seq != applied + 1:
+                        print(f"[WARNING] {name} 的 WAL 區段不連續（缺少 {applied + 1}），只還原到第 {applied} 段")
+                        complete = False
+                        break
+                    blob.download_to_filename(temp_compressed)
+                    segment_bytes += os.path.getsize(temp_compressed)
+                    page_size, pages = apply_segment(temp_compressed, db_file)
+                    db_pages = pages or db_pages
+                    applied = seq
+                if db_pages:
+                    db_file.truncate(db_pages * page_size)
+
+            with self._lock:
+                was_open = self._close_replica(name)
+                install_fn(temp_path, dest_path)
+                write_local_state(dest_path, generation, applied)
+                self._generations.pop(name, None)
+                if complete:
+                    self._generations[name] = {
+                        'generation': generation,
+                        'seq': applied,
+                        'position': None,
+                        'base_bytes': base_bytes,
+                        'segment_bytes': segment_bytes,
+                        'started_at': time.monotonic(),
+                    }
+                if was_open:
+                    self._ensure_replica(name, dest_path)
+        finally:
+            for leftover in (temp_compressed, temp_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        timings['download_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return {
+            'status': 'downloaded',
+            'bytes': os.path.getsize(dest_path),
+            'generation': generation,
+            'segments': applied,
+            **timings,
+        }
+
+    def restore_all(self, names=None, max_workers=None, install_fn=install_database_file):
+        """並行還原多個資料庫，回傳 {名稱: 結果}。"""
+        names = list(names or self.databases)
+        if not names:
+            return {}
+
+        def restore_one(name):
+            try:
+                return self.restore_if_changed(name, self.databases[name], install_fn)
+            except Exception as e:
+                return {'status': 'failed', 'error': str(e)}
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(names), thread_name_prefix='db-restore') as executor:
+            return dict(zip(names, executor.map(restore_one, names)))
+
+    def _ensure_replica(self, name, path):
+        replica = self._replicas.get(name)
+        if replica is not None:
+            return replica
+        # guard 以 BEGIN IMMEDIATE 在擷取 frame 時阻擋寫入；pin 維持讀取交易阻止其他連線 checkpoint
+        guard = sqlite3.connect(path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+        guard.execute('PRAGMA journal_mode=WAL')
+        pin = sqlite3.connect(path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+        self._hold_read_transaction(pin)
+        replica = {'guard': guard, 'pin': pin}
+        self._replicas[name] = replica
+        return replica
+
+    def _close_replica(self, name):
+        replica = self._replicas.pop(name, None)
+        if replica is None:
+            return False
+        replica['pin'].close()
+        replica['guard'].close()
+        return True
+
+    @staticmethod
+    def _hold_read_transaction(connection):
+        connection.execute('BEGIN')
+        connection.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+
+    def _snapshot_due(self, state):
+        if time.monotonic() - state['started_at'] >= self.snapshot_interval_seconds:
+            return True
+        return state['segment_bytes'] > state['base_bytes'] * self.max_segment_ratio
+
+    def _backup_one(self, name, path):
+        if not os.path.exists(path):
+            print(f"[WARNING] {name} 不存在，跳過備份")
+            return {'status': 'missing'}
+
+        replica = self._ensure_replica(name, path)
+        state = self._generations.get(name)
+        work_dir = tempfile.mkdtemp(prefix='wal-backup-')
+        try:
+            guard = replica['guard']
+            guard.execute('BEGIN IMMEDIATE')
+            try:
+                if state is None or self._snapshot_due(state):
+                    capture = self._capture_snapshot(path, work_dir)
+                else:
+                    capture = self._capture_segment(path, state, work_dir)
+                # 已擷取的 frame 交由 checkpoint 寫回資料庫；期間 pin 暫時釋放讀取交易
+                replica['pin'].execute('ROLLBACK')
+                replica['pin'].execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+                self._hold_read_transaction(replica['pin'])
+            finally:
+                guard.execute('ROLLBACK')
+
+            if capture is None:
+                return {'status': 'unchanged', 'generation': state['generation'], 'seq': state['seq']}
+            return self._upload_capture(name, capture)
+        except Exception:
+            # 擷取或上傳失敗時 frame 可能已被 checkpoint，下次改以完整快照開始新的 generation
+            self._generations.pop(name, None)
+            raise
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _capture_snapshot(self, path, work_dir):
+        snapshot_path = os.path.join(work_dir, 'snapshot.db')
+        snapshot_database(path, snapshot_path)
+        position = read_wal_header(f'{path}-wal')
+        if position is not None:
+            position, _ = read_committed_frames(f'{path}-wal', position)
+        compressed_path = f'{snapshot_path}.gz'
+        compressed_size = gzip_file(snapshot_path, compressed_path)
+        generation = new_generation_id()
+        return {
+            'status': 'snapshot',
+            'path': compressed_path,
+            'blob_name': f'{generation}/{SNAPSHOT_BLOB}',
+            'frames': 0,
+            'state': {
+                'generation': generation,
+                'seq': 0,
+                'position': position,
+                'base_bytes': compressed_size,
+                'segment_bytes': 0,
+                'started_at': time.monotonic(),
+            },
+        }
+
+    def _capture_segment(self, path, state, work_dir):
+        header = read_wal_header(f'{path}-wal')
+        if header is None:
+            return None
+        position = state['position']
+        if position is None or position['salts'] != header['salts']:
+            # WAL 已重設：重設前的 frame 都已上傳，自新的檔頭開始讀取
+            position = header
+
+        raw_path = os.path.join(work_dir, 'segment.wal')
+        with open(raw_path, 'w+b') as out:
+            out.write(SEGMENT_MAGIC + struct.pack('>I', position['page_size']))
+            position, frames = read_committed_frames(f'{path}-wal', position, out)
+        if frames == 0:
+            state['position'] = position
+            return None
+
+        compressed_path = f'{raw_path}.gz'
+        compressed_size = gzip_file(raw_path, compressed_path)
+        seq = state['seq'] + 1
+        return {
+            'status': 'segment',
+            'path': compressed_path,
+            'blob_name': f"{state['generation']}/{seq:010d}{SEGMENT_SUFFIX}",
+            'frames': frames,
+            'state': {
+                **state,
+                'seq': seq,
+                'position': position,
+                'segment_bytes': state['segment_bytes'] + compressed_size,
+            },
+        }
+
+    def _upload_capture(self, name, capture):
+        blob_name = f"{WAL_PREFIX}/{name}/{capture['blob_name']}"
+        self.bucket.blob(blob_name).upload_from_filename(
+            capture['path'], content_type='application/gzip'
+        )
+        bytes_shipped = os.path.getsize(capture['path'])
+        state = capture['state']
+        self._generations[name] = state
+        write_local_state(self.databases[name], state['generation'], state['seq'])
+        if capture['status'] == 'snapshot':
+            self._prune_generations(name)
+        print(f"[INFO] ✓ {name} 已備份 {blob_name}（{bytes_shipped} bytes，{capture['frames']} frames）")
+        return {
+            'status': capture['status'],
+            'generation': state['generation'],
+            'seq': state['seq'],
+            'frames': capture['frames'],
+            'bytes_shipped': bytes_shipped,
+        }
+
+    def _list_generations(self, name):
+        prefix = f'{WAL_PREFIX}/{name}/'
+        generations = {}
+        for blob in self.bucket.list_blobs(prefix=prefix):
+            parts = blob.name[len(prefix):].split('/')
+            if len(parts) == 2:
+                generations.setdefault(parts[0], {})[parts[1]] = blob
+        return generations
+
+    def _latest_generation(self, name):
+        generations = self._list_generations(name)
+        for generation in sorted(generations, reverse=True):
+            blobs = generations[generation]
+            if SNAPSHOT_BLOB not in blobs:
+                continue
+            segments = sorted(
+                (int(blob_name[:-len(SEGMENT_SUFFIX)]), blob)
+                for blob_name, blob in blobs.items()
+                if blob_name.endswith(SEGMENT_SUFFIX)
+            )
+            return generation, blobs[SNAPSHOT_BLOB], segments
+        return None, None, []
+
+    def _prune_generations(self, name):
+        """新的快照上傳後只保留最近 keep_generations 個 generation。"""
+        generations = self._list_generations(name)
+        for generation in sorted(generations)[:-self.keep_generations]:
+            for blob in generations[generation].values():
+                blob.delete()
@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+import app_factory
+from service import analysis_service
+
+ROWS = [
+    # 年度, 性別, 入學管道, 高中別, 地區, 微積分, 統計1
+    ('110', '男', '申請入學', '國立新竹高中', '臺北市', '80', '70'),
+    ('110', 'F', '申請入學', '私立延平高中', '台北市', '60', '缺考'),
+    ('110', '女', '繁星推薦', '國立新竹高中', '高雄市', '90', None),
+    ('111', 'M', '繁星推薦', '私立延平高中', '高雄市', '70', '50'),
+    ('111', '女', '申請入學', '國立新竹高中', '台北市', None, '65'),
+]
+
+
+@pytest.fixture
+def students_table(tmp_path, monkeypatch):
+    engine = create_engine(f'sqlite:///{tmp_path / "students.db"}')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE students (id INTEGER PRIMARY KEY, 年度 TEXT, 性別 TEXT, 入學管道 TEXT, '
+                          '高中別 TEXT, 地區 TEXT, 微積分 TEXT, 統計1 TEXT)'))
+        for row in ROWS:
+            conn.execute(text('INSERT INTO students (年度, 性別, 入學管道, 高中別, 地區, 微積分, 統計1) '
+                              'VALUES (:y, :g, :a, :s, :r, :c, :t)'),
+                         dict(zip(['y', 'g', 'a', 's', 'r', 'c', 't'], row)))
+
+    monkeypatch.setattr(analysis_service, 'get_database_engine', lambda table: (engine, inspect(engine)))
+    monkeypatch.setattr(analysis_service, 'resolve_column_name', app_factory.resolve_column_name)
+    monkeypatch.setattr(analysis_service, 'classify_admission_method', app_factory.classify_admission_method)
+    monkeypatch.setattr(analysis_service, 'classify_school_type', app_factory.classify_school_type)
+    monkeypatch.setattr(analysis_service, 'classify_region', app_factory.classify_region)
+    # 預設直接查詢 SQLite；資料表欄位快取的測試自行設定
+    monkeypatch.setattr(analysis_service, 'table_frame_cache', None)
+    monkeypatch.setattr(analysis_service, 'column_sketch_store', None)
+    yield 'students'
+    engine.dispose()
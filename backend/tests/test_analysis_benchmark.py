@@ -0,0 +1,20 @@
+from benchmarks.analysis_benchmark import compare_reports, configured_names, run_benchmark
+from service import analysis_service
+
+
+def test_analysis_benchmark_times_each_analysis_and_restores_service(tmp_path, monkeypatch):
+    # 應用程式啟用的快取與彙總在 benchmark 結束後仍須保留
+    for name in ('table_aggregate_store', 'table_cube_store', 'analysis_pool', 'table_sample_store'):
+        monkeypatch.setattr(analysis_service, name, object())
+    previous = {name: getattr(analysis_service, name) for name in configured_names(analysis_service)}
+    assert 'table_cube_store' in previous
+    report = run_benchmark(
+        [300], str(tmp_path), analyses=['subject_average_stats', 'top_schools_stats'], repeats=1, frame_cache=True
+    )
+
+    assert [result['analysis'] for result in report['results']] == ['subject_average_stats', 'top_schools_stats']
+    assert all(result['median_seconds'] > 0 for result in report['results'])
+    assert all(getattr(analysis_service, name) is value for name, value in previous.items())
+
+    comparison = compare_reports(report, report)
+    assert comparison[0]['median_ratio'] == 1.0
@@ -0,0 +1,70 @@
+import threading
+import time
+
+from service.analysis_cache import AnalysisCache
+
+
+def test_hits_follow_canonical_body_and_table_version():
+    cache = AnalysisCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'rows': len(calls)}
+
+    first = cache.get_or_compute('stats', {'table_name': 't', 'column': 'a'}, compute)
+    second = cache.get_or_compute('stats', {'column': 'a', 'table_name': 't'}, compute)
+    assert first == second == ({'rows': 1}, 200)
+
+    cache.invalidate_table('other')
+    assert cache.get_or_compute('stats', {'table_name': 't', 'column': 'a'}, compute) == ({'rows': 1}, 200)
+
+    cache.invalidate_table('t')
+    assert cache.get_or_compute('stats', {'table_name': 't', 'column': 'a'}, compute) == ({'rows': 2}, 200)
+
+    # 錯誤結果不快取
+    cache.get_or_compute('stats', {'table_name': 't', 'column': 'b'}, lambda: ({'error': 'x'}, 400))
+    assert cache.get_or_compute('stats', {'table_name': 't', 'column': 'b'}, compute) == ({'rows': 3}, 200)
+
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 4
+    assert stats['entries'] == 2
+
+
+def test_lru_eviction_is_bounded_by_bytes():
+    cache = AnalysisCache(max_bytes=600)
+    for column in 'abcd':
+        cache.get_or_compute('stats', {'table_name': 't', 'column': column}, lambda: {'values': 'x' * 200})
+
+    stats = cache.stats()
+    assert stats['bytes'] <= 600
+    assert stats['entries'] == 2
+    assert stats['evictions'] == 2
+
+
+def test_concurrent_identical_misses_compute_once():
+    cache = AnalysisCache()
+    calls = []
+    release = threading.Event()
+
+    def slow_compute():
+        calls.append(1)
+        release.wait(2)
+        return {'ok': True}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_compute('stats', {'table_name': 't'}, slow_compute)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert len(calls) == 1
+    assert results == [({'ok': True}, 200)] * 5
+    assert cache.stats()['coalesced'] == 4
@@ -0,0 +1,52 @@
+from service import analysis_service
+from service.analysis_pool import AnalysisPool, attach_frame, parse_pool_policy, release_frame, share_frame
+from service.analysis_query import row_filters
+from service.table_frame import TableFrame
+
+
+REQUESTS = [
+    ('subject_average_stats', {'year_col': '年度', 'gender_col': '性別', 'subjects': ['微積分', '統計1']}),
+    ('gender_subject_analysis', {'year_col': '年度', 'gender_col': '性別', 'subjects': ['微積分', '統計1']}),
+    ('region_subject_analysis', {'year_col': '年度', 'region_col': '地區', 'subjects': ['微積分']}),
+]
+
+
+def _payload(result):
+    assert not isinstance(result, tuple) or result[1] == 200
+    return result[0] if isinstance(result, tuple) else result
+
+
+def test_shared_frame_round_trip(students_table):
+    engine, _ = analysis_service.get_database_engine(students_table)
+    frame = TableFrame.load(engine, students_table, ['年度', '性別', '微積分'])
+    frame.numeric('微積分')
+
+    handle, segment = share_frame(frame)
+    try:
+        attached, attached_segment = attach_frame(handle)
+        filters = row_filters(['性別'], '年度', [110])
+        assert attached.select_rows(['年度', '性別', '微積分'], filters=filters) == \
+            frame.select_rows(['年度', '性別', '微積分'], filters=filters)
+        assert attached.numeric('微積分').tolist()[:3] == [80.0, 60.0, 90.0]
+        del attached
+        release_frame(attached_segment)
+    finally:
+        segment.close()
+        segment.unlink()
+
+
+def test_offloaded_analyses_match_inline(students_table, monkeypatch):
+    expected = [analysis_service.run_analysis(name, {'table_name': students_table, **params}) for name, params in REQUESTS]
+
+    pool = AnalysisPool(max_workers=1, policy=parse_pool_policy('region_subject_analysis=10', min_rows=0))
+    monkeypatch.setattr(analysis_service, 'analysis_pool', pool)
+    try:
+        results = [analysis_service.run_analysis(name, {'table_name': students_table, **params}) for name, params in REQUESTS]
+    finally:
+        pool.shutdown()
+
+    assert [_payload(result) for result in results] == [_payload(result) for result in expected]
+    stats = pool.stats()
+    # 5 筆資料未達 region_subject_analysis 的門檻，在本行程計算
+    assert (stats['offloaded'], stats['inline'], stats['failures']) == (2, 1, 0)
+    assert stats['shared_bytes'] > 0
@@ -0,0 +1,115 @@
+import threading
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+import app_factory
+from service import analysis_service
+from service.analysis_cache import AnalysisCache
+from service.table_sample import TableSampleStore
+
+
+@pytest.fixture
+def large_table(tmp_path, monkeypatch):
+    rng = np.random.default_rng(7)
+    engine = create_engine(f'sqlite:///{tmp_path / "large.db"}')
+    rows = []
+    for year, size, mean in (('110', 3000, 70), ('111', 2000, 65), ('112', 1000, 75)):
+        for score, gender in zip(rng.normal(mean, 12, size), rng.choice(['男', '女'], size, p=[0.6, 0.4])):
+            rows.append({'y': year, 'g': str(gender), 'c': f'{score:.0f}', 's': rng.choice(['國立中學', '私立中學'])})
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE large (id INTEGER PRIMARY KEY, 年度 TEXT, 性別 TEXT, 微積分 TEXT, 高中別 TEXT)'))
+        conn.execute(text('INSERT INTO large (年度, 性別, 微積分, 高中別) VALUES (:y, :g, :c, :s)'), rows)
+
+    monkeypatch.setattr(analysis_service, 'get_database_engine', lambda table: (engine, inspect(engine)))
+    monkeypatch.setattr(analysis_service, 'resolve_column_name', app_factory.resolve_column_name)
+    monkeypatch.setattr(analysis_service, 'classify_school_type', app_factory.classify_school_type)
+    monkeypatch.setattr(analysis_service, 'classify_admission_method', app_factory.classify_admission_method)
+    monkeypatch.setattr(analysis_service, 'table_frame_cache', None)
+    monkeypatch.setattr(analysis_service, 'analysis_pool', None)
+    store = TableSampleStore(fraction=0.1, min_rows=1000, min_per_stratum=50)
+    monkeypatch.setattr(analysis_service, 'table_sample_store', store)
+    yield 'large', store
+    engine.dispose()
+
+
+def _covers(interval, value, slack=0.0):
+    return interval[0] - slack <= value <= interval[1] + slack
+
+
+def _wait_for_exact_jobs():
+    for thread in threading.enumerate():
+        if thread.name.startswith('exact-'):
+            thread.join(timeout=30)
+
+
+def test_stratified_sample_keeps_every_year(large_table):
+    table_name, store = large_table
+    engine, _ = analysis_service.get_database_engine(table_name)
+    sample = store.build(engine, table_name)
+
+    assert sample.stratum_column == '年度'
+    assert sample.year_strata() == {110: (3000, 300), 111: (2000, 200), 112: (1000, 100)}
+    assert sample.total_rows == 6000 and sample.sample_rows == 600
+    # 資料表版本未變更時重複取用同一份樣本
+    assert store.get(engine, table_name) is sample
+
+
+def test_approximate_estimates_cover_exact_results(large_table):
+    table_name, _ = large_table
+    params = {'table_name': table_name, 'year_col': '年度', 'gender_col': '性別'}
+
+    exact = analysis_service.yearly_admission_stats(params)
+    approximate, status = analysis_service.approximate_analysis('yearly_admission_stats', {**params, 'approximate': True})
+    assert status == 200
+    assert approximate['approximation']['exact'] is False
+    assert approximate['approximation']['sample_fraction'] == 0.1
+    # 每年的總人數即分層的母體筆數
+    assert approximate['total_counts'] == exact['total_counts']
+    assert approximate['total_students'] == exact['total_students']
+    for key in ('male_counts', 'female_counts'):
+        assert all(_covers(ci, value) for ci, value in zip(approximate[f'{key}_ci95'], exact[key]))
+
+    subjects = {'table_name': table_name, 'subjects': ['微積分'], 'year_col': '年度'}
+    exact = analysis_service.multi_subject_stats(subjects)
+    approximate, _ = analysis_service.approximate_analysis('multi_subject_stats', {**subjects, 'approximate': True})
+    assert all(_covers(ci, value, slack=0.01) for ci, value in zip(approximate['data_ci95']['微積分'], exact['data']['微積分']))
+
+    summary = {'table_name': table_name, 'subjects': ['微積分']}
+    exact = analysis_service.subject_average_stats(summary)
+    approximate, _ = analysis_service.approximate_analysis('subject_average_stats', {**summary, 'approximate': True})
+    assert approximate['total_students'] == exact['total_students']
+    overall = approximate['overall_stats']['微積分']
+    assert _covers(overall['overall_average_ci95'], exact['overall_stats']['微積分']['overall_average'], slack=0.01)
+    assert set(approximate['school_type_summary']) == set(exact['school_type_summary'])
+
+
+def test_exact_result_replaces_estimate_once_computed(large_table):
+    table_name, _ = large_table
+    cache = AnalysisCache()
+    params = {'table_name': table_name, 'year_col': '年度'}
+
+    first, _ = analysis_service.approximate_analysis('yearly_admission_stats', {**params, 'approximate': True}, cache)
+    assert first['approximation']['exact_pending'] is True
+    _wait_for_exact_jobs()
+
+    second, _ = analysis_service.approximate_analysis('yearly_admission_stats', {**params, 'approximate': True}, cache)
+    assert second['approximation'] == {'exact': True, 'reason': 'cached'}
+    assert second['total_counts'] == analysis_service.yearly_admission_stats(params)['total_counts']
+
+    # 沒有估計方式的分析直接回傳精確結果
+    schools, status = analysis_service.approximate_analysis(
+        'school_source_stats', {'table_name': table_name, 'year_col': '年度', 'school_col': '高中別', 'approximate': True}, cache
+    )
+    assert status == 200 and schools['approximation']['exact'] is True
+
+
+def test_drop_releases_table_sample(large_table):
+    table_name, store = large_table
+    engine, _ = analysis_service.get_database_engine(table_name)
+    store.build(engine, table_name)
+    assert store.stats()['bytes'] > 0
+
+    store.drop(table_name)
+    assert store.stats()['entries'] == 0 and store.stats()['bytes'] == 0
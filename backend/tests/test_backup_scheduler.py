@@ -0,0 +1,78 @@
+import threading
+import time
+
+from service import backup_scheduler
+from service.backup_scheduler import BackupScheduler
+
+
+class _RecordingBackup:
+    def __init__(self):
+        self.calls = 0
+        self.called = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.called.set()
+        return {"success": True, "message": f"backup {self.calls}"}
+
+
+def test_burst_of_writes_is_coalesced_into_one_backup():
+    backup = _RecordingBackup()
+    scheduler = BackupScheduler(backup, quiet_seconds=0.05, max_delay_seconds=5)
+
+    for _ in range(10):
+        scheduler.mark_dirty()
+
+    assert backup.called.wait(2)
+    time.sleep(0.1)
+    assert backup.calls == 1
+    scheduler.shutdown()
+
+
+def test_max_delay_forces_backup_during_continuous_writes():
+    backup = _RecordingBackup()
+    scheduler = BackupScheduler(backup, quiet_seconds=0.2, max_delay_seconds=0.3)
+
+    deadline = time.monotonic() + 0.6
+    while time.monotonic() < deadline and not backup.called.is_set():
+        scheduler.mark_dirty()
+        time.sleep(0.02)
+
+    assert backup.called.is_set()
+    scheduler.shutdown()
+
+
+def test_flush_runs_backup_immediately_and_returns_result():
+    backup = _RecordingBackup()
+    scheduler = BackupScheduler(backup, quiet_seconds=60, max_delay_seconds=60)
+
+    scheduler.mark_dirty()
+    result = scheduler.flush(timeout=2)
+
+    assert result == {"success": True, "message": "backup 1"}
+    scheduler.shutdown()
+    assert backup.calls == 1
+
+
+def test_shutdown_flushes_pending_changes():
+    backup = _RecordingBackup()
+    scheduler = BackupScheduler(backup, quiet_seconds=60, max_delay_seconds=60)
+
+    scheduler.mark_dirty()
+    scheduler.shutdown(timeout=2)
+
+    assert backup.calls == 1
+    assert scheduler.status()["pending"] is False
+
+
+
+def test_shutdown_releases_atexit_hook(monkeypatch):
+    hooks = []
+    monkeypatch.setattr(backup_scheduler.atexit, "register", hooks.append)
+    monkeypatch.setattr(backup_scheduler.atexit, "unregister", hooks.remove)
+
+    scheduler = BackupScheduler(_RecordingBackup())
+    assert hooks == [scheduler.shutdown]
+    scheduler.shutdown(timeout=2)
+    scheduler.shutdown(timeout=2)
+    assert hooks == []
@@ -0,0 +1,54 @@
+from service import analysis_service
+from service.analysis_cache import AnalysisCache
+
+
+SPECS = [
+    {'id': 'scores', 'type': 'column_stats', 'params': {'column': '微積分'}},
+    {'id': 'yearly', 'type': 'yearly_admission_stats', 'params': {'year_col': '年度', 'gender_col': '性別'}},
+    {'id': 'schools', 'type': 'school_source_stats', 'params': {'year_col': '年度', 'school_col': '高中別'}},
+    {'id': 'regions', 'type': 'region_subject_analysis', 'params': {
+        'year_col': '年度', 'region_col': '地區', 'subjects': ['微積分', '統計1'], 'years': [110],
+    }},
+    {'id': 'gender', 'type': 'gender_subject_analysis', 'params': {
+        'year_col': '年度', 'gender_col': '性別', 'subjects': ['微積分', '統計1'], 'analysis_mode': 'overall',
+    }},
+]
+
+
+def test_batch_results_match_single_endpoints_with_one_table_read(students_table):
+    result = analysis_service.batch_analysis({'table_name': students_table, 'analyses': SPECS})
+
+    assert result['tables'][students_table]['loads'] == 1
+    for spec in SPECS:
+        params = {'table_name': students_table, **spec['params']}
+        assert result['results'][spec['id']] == {
+            'status': 200,
+            'data': getattr(analysis_service, spec['type'])(params),
+        }
+
+
+def test_batch_reports_per_spec_errors_and_rejects_bad_specs(students_table):
+    result = analysis_service.batch_analysis({'table_name': students_table, 'analyses': [
+        {'id': 'missing', 'type': 'column_stats', 'params': {'column': '不存在'}},
+    ]})
+    assert result['results']['missing']['status'] == 400
+
+    _, status = analysis_service.batch_analysis({'analyses': [{'id': 'x', 'type': 'drop_table'}]})
+    assert status == 400
+    _, status = analysis_service.batch_analysis({'analyses': [{'id': 'x', 'type': 'column_stats'}] * 2})
+    assert status == 400
+
+
+def test_batch_shares_result_cache_with_single_endpoints(students_table):
+    cache = AnalysisCache()
+    params = {'table_name': students_table, 'year_col': '年度', 'school_col': '高中別'}
+    cache.get_or_compute('school_source_stats', params, lambda: analysis_service.school_source_stats(params))
+
+    result = analysis_service.batch_analysis(
+        {'table_name': students_table, 'analyses': [SPECS[2]]}, analysis_cache=cache
+    )
+
+    assert result['results']['schools']['status'] == 200
+    assert cache.stats()['hits'] == 1
+    # 全部命中快取時不讀取資料表
+    assert result['tables'][students_table]['loads'] == 0
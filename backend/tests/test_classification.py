@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from service.classification import (
+    classification_cache_info,
+    classify_admission_method,
+    classify_distinct,
+    classify_region,
+    classify_school_type,
+    normalize_city,
+)
+
+
+def test_classifiers_handle_blank_and_missing_values():
+    for value in (None, np.nan, '', '   \n'):
+        assert classify_admission_method(value) == '其他'
+        assert classify_school_type(value) == '其他'
+        assert classify_region(value) == '其他'
+
+    assert classify_admission_method(' (自然組) ') == '自然組'
+    assert classify_admission_method('申請入學 ') == '申請入學'
+    assert classify_admission_method('申請入學二') == '其他'
+    assert classify_school_type('臺北市立建國高中') == '市立'
+    assert classify_school_type('財團法人') == '財團'
+    assert classify_school_type('馬來西亞華校') == '其他'
+    assert classify_region('臺南市') == '南台灣'
+
+
+def test_district_level_regions_match_city_prefix():
+    assert normalize_city(' 臺北市大安區') == '台北市'
+    assert normalize_city('新竹縣竹北市') == '新竹縣'
+    assert normalize_city('馬來西亞') is None
+    assert normalize_city(None) is None
+    assert classify_region('高雄市前鎮區') == '南台灣'
+
+
+def test_classify_distinct_calls_classifier_once_per_unique_value():
+    calls = []
+
+    def counting_classifier(value):
+        calls.append(value)
+        return classify_region(value)
+
+    values = pd.Series(['台北市', '臺南市', None, '台北市', np.nan, '臺南市'] * 100, index=range(10, 610))
+    result = classify_distinct(values, counting_classifier)
+
+    assert len(calls) == 3
+    assert result.index.equals(values.index)
+    assert result.tolist() == values.map(classify_region).tolist()
+
+
+def test_cache_is_shared_across_calls():
+    classify_school_type('國立某某高中')
+    before = classification_cache_info()['school_type']['hits']
+    classify_school_type('國立某某高中')
+    assert classification_cache_info()['school_type']['hits'] == before + 1
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from sqlalchemy import text
+
+from service import analysis_service
+from service.column_sketch import ColumnSketchStore, KLLSketch, exact_percentiles, parse_numeric_values
+
+
+def test_kll_sketch_quantiles_are_close_and_mergeable():
+    values = np.random.default_rng(1).normal(60, 15, 200000)
+    first, second = KLLSketch(), KLLSketch()
+    first.update(values[:120000])
+    second.update(values[120000:])
+    first.merge(second)
+
+    assert first.n == len(values)
+    assert first.memory_bytes() < 20000
+    points = np.percentile(values, [10, 50, 90])
+    ranks = first.rank(points) / len(values)
+    assert np.abs(ranks - [0.1, 0.5, 0.9]).max() < 0.02
+
+    small = KLLSketch()
+    small.update([3, 1, 2])
+    assert small.exact and list(small.rank([2])) == [2]
+
+
+def test_column_stats_uses_sketch_above_threshold_and_tracks_row_changes(students_table, monkeypatch):
+    store = ColumnSketchStore(exact_max_values=2)
+    monkeypatch.setattr(analysis_service, 'column_sketch_store', store)
+    params = {'table_name': students_table, 'column': '微積分', 'percentiles': [0, 50, 100], 'bins': 2}
+
+    exact = analysis_service.column_stats({**params, 'mode': 'exact'})
+    assert exact['mode'] == 'exact'
+    assert exact['percentiles'] == {'p0': 60.0, 'p50': 75.0, 'p100': 90.0}
+    assert exact['histogram'] == {'edges': [60.0, 75.0, 90.0], 'counts': [2, 2]}
+
+    sketched = analysis_service.column_stats(params)
+    assert sketched['mode'] == 'sketch'
+    assert sketched['stats'] == exact['stats']
+    assert sketched['histogram'] == exact['histogram']
+    assert store.stats()['entries'] == 1
+
+    # 資料列新增：寫入前後呼叫 begin_change / end_change，摘要增量更新而不重讀欄位
+    engine, _ = analysis_service.get_database_engine(students_table)
+    previous_version = store.begin_change(students_table)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO students (年度, 微積分) VALUES ('111', '1,00')"))
+    store.end_change(students_table, previous_version, committed=True, inserted={'年度': '111', '微積分': '1,00'})
+
+    updated = analysis_service.column_stats(params)
+    assert store.stats()['updates'] == 1 and store.stats()['builds'] == 1
+    assert updated['stats'] == pytest.approx(analysis_service.column_stats({**params, 'mode': 'exact'})['stats'])
+    assert updated['stats']['max'] == 100.0 and updated['stats']['count'] == 5
+
+    # 刪除目前的最大值無法增量維護，摘要移除後下次查詢重建
+    previous_version = store.begin_change(students_table)
+    store.end_change(students_table, previous_version, committed=True, deleted={'微積分': '100'})
+    assert store.get(students_table, '微積分') is None
+
+
+def test_column_stats_rejects_bad_options(students_table):
+    for options in ({'mode': 'fast'}, {'percentiles': [150]}, {'bins': 101}):
+        _, status = analysis_service.column_stats({'table_name': students_table, 'column': '微積分', **options})
+        assert status == 400
+
+
+def test_exact_percentiles_from_distinct_counts_match_numpy():
+    values = np.random.default_rng(2).integers(0, 40, 999).astype(float)
+    distinct, counts = np.unique(values, return_counts=True)
+    percentiles = [0, 2.5, 25, 50, 62.5, 99, 100]
+
+    result = exact_percentiles(distinct, counts, percentiles)
+
+    assert list(result.values()) == [float(point) for point in np.percentile(values, percentiles)]
+
+
+def test_column_stats_parses_numbers_in_sqlite_like_python(students_table):
+    raw = [' 5 ', '1,000', '１２', '1e2', '.5', 'nan', 'abc', '12abc', '0x10', '  ']
+    engine, _ = analysis_service.get_database_engine(students_table)
+    with engine.begin() as conn:
+        for value in raw:
+            conn.execute(text('INSERT INTO students (年度, 統計1) VALUES (:y, :v)'), {'y': '112', 'v': value})
+
+    result = analysis_service.column_stats({'table_name': students_table, 'column': '統計1', 'mode': 'exact'})
+
+    values, skipped = parse_numeric_values(['70', '缺考', '50', '65', *raw])
+    assert result['stats'] == pytest.approx({
+        'mean': values.mean(), 'std': values.std(ddof=1), 'min': values.min(), 'max': values.max(),
+        'count': len(values), 'skipped': skipped,
+    })
+    assert skipped == 6
+    assert result['percentiles']['p50'] == float(np.percentile(values, 50))
+
+
+def test_drop_removes_only_that_tables_sketches():
+    store = ColumnSketchStore(exact_max_values=2)
+    for table_name in ('a', 'b'):
+        for column in ('x', 'y'):
+            store.build(table_name, column, np.arange(10.0), 0, 0)
+    store.drop('a')
+    assert not store.has_table('a')
+    assert store.get('b', 'x') is not None and store.stats()['entries'] == 2
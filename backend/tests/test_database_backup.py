@@ -0,0 +1,126 @@
+import sqlite3
+
+from service.database_backup import DatabaseBackup, LocalDirectoryBucket, snapshot_database
+
+
+def _create_database(path, rows):
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS students (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO students (name) VALUES (?)", [(f"student-{i}",) for i in range(rows)])
+    conn.close()
+
+
+def _count_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM students").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_backup_skips_unchanged_databases(tmp_path):
+    main_db = tmp_path / "excel_data.db"
+    demo_db = tmp_path / "fakedata.db"
+    _create_database(main_db, 100)
+    _create_database(demo_db, 100)
+    bucket = LocalDirectoryBucket(tmp_path / "bucket")
+    backup = DatabaseBackup(bucket, {"excel_data.db": str(main_db), "fakedata.db": str(demo_db)})
+
+    first = backup.run()
+    assert {result["status"] for result in first["databases"].values()} == {"uploaded"}
+    assert first["bytes_shipped"] > 0
+
+    second = backup.run()
+    assert {result["status"] for result in second["databases"].values()} == {"unchanged"}
+    assert second["bytes_shipped"] == 0
+
+    _create_database(main_db, 1)
+    third = backup.run()
+    assert third["databases"]["excel_data.db"]["status"] == "uploaded"
+    assert third["databases"]["fakedata.db"]["status"] == "unchanged"
+
+
+def test_new_process_does_not_reupload_identical_snapshot(tmp_path):
+    db_path = tmp_path / "excel_data.db"
+    _create_database(db_path, 10)
+    bucket = LocalDirectoryBucket(tmp_path / "bucket")
+    DatabaseBackup(bucket, {"excel_data.db": str(db_path)}).run()
+
+    uploaded_before = bucket.bytes_uploaded
+    result = DatabaseBackup(bucket, {"excel_data.db": str(db_path)}).run()
+
+    assert result["databases"]["excel_data.db"]["status"] == "unchanged"
+    assert bucket.bytes_uploaded == uploaded_before
+
+
+def test_restore_uses_latest_compressed_snapshot(tmp_path):
+    db_path = tmp_path / "excel_data.db"
+    _create_database(db_path, 10)
+    bucket = LocalDirectoryBucket(tmp_path / "bucket")
+    DatabaseBackup(bucket, {"excel_data.db": str(db_path)}).run()
+    _create_database(db_path, 5)
+    DatabaseBackup(bucket, {"excel_data.db": str(db_path)}).run()
+
+    restored = tmp_path / "restored.db"
+    restore = DatabaseBackup(bucket, {"excel_data.db": str(restored)})
+    assert restore.restore_all()["excel_data.db"]["status"] == "downloaded"
+    assert _count_rows(restored) == 15
+
+
+def test_restore_skips_download_when_local_copy_matches(tmp_path):
+    db_path = tmp_path / "excel_data.db"
+    _create_database(db_path, 10)
+    bucket = LocalDirectoryBucket(tmp_path / "bucket")
+    DatabaseBackup(bucket, {"excel_data.db": str(db_path)}).run()
+
+    restored = tmp_path / "restored.db"
+    restore = DatabaseBackup(bucket, {"excel_data.db": str(restored)})
+    restore.restore_all()
+    downloaded_before = bucket.bytes_downloaded
+
+    assert restore.restore_all()["excel_data.db"]["status"] == "up_to_date"
+    assert bucket.bytes_downloaded == downloaded_before
+
+
+def test_restore_compares_legacy_blob_md5(tmp_path):
+    db_path = tmp_path / "fakedata.db"
+    _create_database(db_path, 10)
+    bucket = LocalDirectoryBucket(tmp_path / "bucket")
+    bucket.blob("fakedata.db").upload_from_filename(str(db_path))
+
+    restore = DatabaseBackup(bucket, {"fakedata.db": str(db_path), "excel_data.db": str(tmp_path / "missing.db")})
+    results = restore.restore_all()
+
+    assert results["fakedata.db"]["status"] == "up_to_date"
+    assert results["excel_data.db"]["status"] == "not_found"
+
+
+def test_backup_keeps_only_recent_snapshots(tmp_path):
+    db_path = tmp_path / "excel_data.db"
+    bucket = LocalDirectoryBucket(tmp_path / "bucket")
+    backup = DatabaseBackup(bucket, {"excel_data.db": str(db_path)}, keep_snapshots=2)
+    for _ in range(4):
+        _create_database(db_path, 3)
+        result = backup.run()
+        assert result["databases"]["excel_data.db"]["status"] == "uploaded"
+
+    assert result["databases"]["excel_data.db"]["snapshots_deleted"] == 1
+    entry = backup._load_manifest()["databases"]["excel_data.db"]
+    snapshots = [blob.name for blob in bucket.list_blobs(prefix="snapshots/excel_data.db/")]
+    assert sorted(snapshots) == sorted([entry["blob"], *entry["previous"]])
+    assert len(snapshots) == 2
+
+    restored = tmp_path / "restored.db"
+    DatabaseBackup(bucket, {"excel_data.db": str(restored)}).restore_all()
+    assert _count_rows(restored) == 12
+
+
+def test_snapshot_handles_uri_characters_in_path(tmp_path):
+    source_dir = tmp_path / "data?#%20 dir"
+    source_dir.mkdir()
+    source_path = str(source_dir / "excel data.db")
+    _create_database(source_path, 3)
+
+    snapshot_path = str(tmp_path / "snapshot.db")
+    snapshot_database(source_path, snapshot_path)
+    assert _count_rows(snapshot_path) == 3
@@ -0,0 +1,51 @@
+from service import analysis_service
+
+
+def test_yearly_admission_stats_counts_genders_per_year(students_table):
+    result = analysis_service.yearly_admission_stats({'table_name': students_table, 'year_col': '年度', 'gender_col': '性別'})
+
+    assert result['years'] == [110, 111]
+    assert result['male_counts'] == [1, 1]
+    assert result['female_counts'] == [2, 1]
+    assert result['total_students'] == 5
+
+
+def test_category_distributions_fold_distinct_value_counts(students_table):
+    methods = analysis_service.admission_method_stats({'table_name': students_table, 'year_col': '年度', 'method_col': '入學管道'})
+    assert methods['data']['申請入學']['counts'] == [2, 1]
+    assert methods['data']['繁星推薦']['counts'] == [1, 1]
+    assert methods['year_totals'] == [3, 2]
+
+    schools = analysis_service.school_source_stats({'table_name': students_table, 'year_col': '年度', 'school_col': '高中別'})
+    assert schools['data']['國立']['counts'] == [2, 1]
+    assert schools['total_students'] == 5
+
+    geo = analysis_service.geographic_stats({
+        'table_name': students_table, 'year_col': '年度', 'region_col': '地區', 'get_city_details': True,
+    })
+    assert geo['data']['北台灣'] == [2, 1]
+    assert geo['data']['南台灣'] == [1, 1]
+    # 「臺北市」與「台北市」合併計算
+    assert geo['detailed']['北台灣']['cities'] == [{'name': '台北市', 'data': [2, 1]}]
+
+
+def test_top_schools_pivot_with_top_n_others_and_year_filter(students_table):
+    result = analysis_service.top_schools_stats({
+        'table_name': students_table, 'school_col': '高中別', 'year_col': '年度', 'top_n': 1, 'include_others': True,
+    })
+    assert result['years'] == [110, 111]
+    assert result['schools'] == [{
+        'rank': 1, 'school_name': '國立新竹高中', 'total_count': 3, 'percentage': 60.0, 'year_110': 2, 'year_111': 1,
+    }]
+    assert result['others'] == {'school_count': 1, 'total_count': 2, 'percentage': 40.0, 'year_110': 1, 'year_111': 1}
+
+    filtered = analysis_service.top_schools_stats({
+        'table_name': students_table, 'school_col': '高中別', 'year_col': '年度', 'years': [111],
+    })
+    assert filtered['years'] == [111]
+    assert filtered['total_students'] == 2
+    # 人數相同時依學校名稱排列
+    assert [school['school_name'] for school in filtered['schools']] == ['國立新竹高中', '私立延平高中']
+
+    _, status = analysis_service.top_schools_stats({'table_name': students_table, 'school_col': '高中別', 'top_n': 0})
+    assert status == 400
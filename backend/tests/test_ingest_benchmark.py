@@ -0,0 +1,30 @@
+import app_factory
+from benchmarks.ingest_benchmark import DATA_SERVICE_GLOBALS, STAGE_ORDER, compare_reports, run_benchmark
+from service import data_service
+
+
+def test_ingest_benchmark_reports_every_stage(tmp_path, monkeypatch, capsys):
+    # 門檻調低，50 筆也建立欄位摘要與分層樣本
+    monkeypatch.setattr(app_factory.column_sketch_store, 'exact_max_values', 10)
+    monkeypatch.setattr(app_factory.table_sample_store, 'min_rows', 10)
+    # configure_data_service 設定的模組變數都在還原清單中
+    assert set(data_service.configure_data_service.__code__.co_names) <= set(DATA_SERVICE_GLOBALS)
+    for name in DATA_SERVICE_GLOBALS:
+        monkeypatch.setattr(data_service, name, object())
+    previous = {name: getattr(data_service, name) for name in DATA_SERVICE_GLOBALS}
+
+    report = run_benchmark([50], [10], str(tmp_path), isolated=False)
+
+    result = report["results"][0]
+    assert result["rows_inserted"] == 50
+    assert list(result["stages"]) == STAGE_ORDER
+    assert {"column_sketches", "aggregates", "cube", "table_sample"} <= set(result["stages"])
+    assert "建立失敗" not in capsys.readouterr().err
+    assert result["rows_per_second"] > 0
+    # 備份階段實際 flush 到暫存 bucket
+    assert result["backup_bytes"] > 0
+    # in-process 執行結束後 data_service 的設定全部還原
+    assert all(getattr(data_service, name) is value for name, value in previous.items())
+
+    comparison = compare_reports(report, report)
+    assert comparison[0]["total_ratio"] == 1.0
@@ -0,0 +1,47 @@
+from service import analysis_service
+
+
+def test_pivot_with_classifier_matches_school_source_stats(students_table):
+    result = analysis_service.pivot_analysis({
+        'table_name': students_table, 'rows': ['年度'], 'column': {'column': '高中別', 'classifier': 'school_type'},
+    })
+    school_source = analysis_service.school_source_stats({
+        'table_name': students_table, 'year_col': '年度', 'school_col': '高中別',
+    })
+
+    assert result['row_keys'] == [['110'], ['111']]
+    for column_index, school_type in enumerate(result['column_keys']):
+        assert [row[column_index] for row in result['cells']] == school_source['data'][school_type]['counts']
+    assert result['grand_total'] == result['total_rows'] == school_source['total_students']
+
+
+def test_pivot_mean_measure_with_filters_and_totals(students_table):
+    result = analysis_service.pivot_analysis({
+        'table_name': students_table,
+        'rows': [{'column': '地區', 'classifier': 'city'}],
+        'column': '入學管道',
+        'measure': {'type': 'mean', 'column': '統計1'},
+        'filters': [{'column': '年度', 'op': 'in', 'values': ['110', '111']}],
+    })
+
+    assert result['row_keys'] == [['台北市'], ['高雄市']]
+    assert result['column_keys'] == ['申請入學', '繁星推薦']
+    # 「缺考」與空值不計入平均；沒有有效數值的格為 None
+    assert result['cells'] == [[67.5, None], [None, 50.0]]
+    assert result['row_totals'] == [67.5, 50.0]
+    assert result['grand_total'] == 61.67
+
+    count = analysis_service.pivot_analysis({'table_name': students_table, 'rows': '性別', 'years': [111], 'year_col': '年度'})
+    assert count['row_keys'] == [['M'], ['女']] and count['cells'] == [[1], [1]]
+
+
+def test_pivot_rejects_bad_specs(students_table):
+    for spec in (
+        {'rows': [{'column': '高中別', 'classifier': 'unknown'}]},
+        {'rows': ['年度'], 'measure': {'type': 'median', 'column': '微積分'}},
+        {'rows': ['年度'], 'measure': {'type': 'mean'}},
+        {'rows': ['不存在']},
+        {'rows': ['年度'], 'years': [110]},
+    ):
+        _, status = analysis_service.pivot_analysis({'table_name': students_table, **spec})
+        assert status == 400
@@ -0,0 +1,50 @@
+import threading
+
+import app_factory
+from service.database_backup import DatabaseSwapGate
+
+
+def test_writes_wait_for_background_restore(monkeypatch):
+    monkeypatch.setattr(app_factory, 'restore_complete', app_factory.threading.Event())
+    monkeypatch.setattr(app_factory, '_deferred_restore_started', True)
+    monkeypatch.setattr(app_factory, 'DB_RESTORE_WRITE_WAIT_SECONDS', 0.01)
+    monkeypatch.setattr(app_factory, 'database_swap_gate', DatabaseSwapGate())
+    client = app_factory.app.test_client()
+
+    response = client.post('/api/auth/register', json={})
+    assert response.status_code == 503
+    assert response.get_json()['code'] == 'database_restoring'
+
+    response = client.get('/api/database/tables')
+    assert response.status_code != 503
+    # 請求結束後都已放開共用權，替換檔案不會一直等待
+    assert app_factory.database_swap_gate._active == 0
+
+    app_factory.restore_complete.set()
+    response = client.post('/api/auth/register', json={})
+    assert response.status_code != 503
+
+
+def test_restored_database_is_installed_after_requests_finish(tmp_path, monkeypatch):
+    gate = DatabaseSwapGate()
+    monkeypatch.setattr(app_factory, 'database_swap_gate', gate)
+    source, dest = tmp_path / 'excel_data.db.download', tmp_path / 'excel_data.db'
+    source.write_bytes(b'restored')
+    dest.write_bytes(b'local')
+    (tmp_path / 'excel_data.db-wal').write_bytes(b'wal')
+
+    # 進行中的請求持有共用權時不替換檔案，也不接受新的請求
+    assert gate.acquire_shared()
+    installer = threading.Thread(target=app_factory._install_restored_database, args=(str(source), str(dest)))
+    installer.start()
+    installer.join(0.1)
+    assert installer.is_alive() and dest.read_bytes() == b'local'
+    assert not gate.acquire_shared(timeout=0.01)
+
+    gate.release_shared()
+    installer.join(5)
+    assert not installer.is_alive()
+    assert dest.read_bytes() == b'restored'
+    assert not (tmp_path / 'excel_data.db-wal').exists()
+    assert gate.acquire_shared(timeout=0)
+    gate.release_shared()
@@ -0,0 +1,109 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from service import analysis_service
+
+SPREAD_KEYS = ('male_std', 'female_std', 'male_ci95', 'female_ci95', 'difference_ci95')
+
+
+def _without_spread(row):
+    return {key: value for key, value in row.items() if key not in SPREAD_KEYS}
+
+
+def test_gender_subject_analysis_groups_by_year_and_gender(students_table):
+    result = analysis_service.gender_subject_analysis({
+        'table_name': students_table, 'year_col': '年度', 'gender_col': '性別',
+        'subjects': ['微積分', '統計1'], 'analysis_mode': 'overall',
+    })
+
+    assert [_without_spread(row) for row in result['subject_details']['微積分']] == [
+        {'year': 110, 'male_avg': 80.0, 'female_avg': 75.0, 'male_count': 1, 'female_count': 2, 'difference': 5.0},
+        {'year': 111, 'male_avg': 70.0, 'female_avg': None, 'male_count': 1, 'female_count': 0, 'difference': None},
+    ]
+    assert result['overall_summary']['total_male_records'] == 4
+    assert result['overall_summary']['total_female_records'] == 3
+    assert _without_spread(result['subject_comparison'][1]) == {
+        'subject': '統計1', 'male_avg': 60.0, 'female_avg': 65.0, 'difference': -5.0, 'male_count': 2, 'female_count': 1,
+    }
+
+
+def test_gender_subject_analysis_reports_spread_from_streaming_moments(students_table):
+    result = analysis_service.gender_subject_analysis({
+        'table_name': students_table, 'year_col': '年度', 'gender_col': '性別',
+        'subjects': ['微積分', '統計1'], 'analysis_mode': 'overall',
+    })
+
+    # 單一筆成績無法估計變異
+    first_year = result['subject_details']['微積分'][0]
+    assert first_year['male_std'] is None and first_year['male_ci95'] is None
+    assert first_year['difference_ci95'] is None
+
+    # 整體標準差與 ScoreMoments 合併後的結果一致（與 numpy 的樣本標準差比對）
+    summary = result['overall_summary']
+    assert summary['male_std'] == round(float(np.std([80, 70, 70, 50], ddof=1)), 2)
+    low, high = summary['male_ci95']
+    assert low < summary['male_avg'] < high
+    assert summary['difference_ci95'][0] < summary['difference'] < summary['difference_ci95'][1]
+
+    moments = analysis_service._combine_scores([
+        analysis_service.ScoreMoments(150.0, 2, 80.0 ** 2 + 70.0 ** 2),
+        analysis_service.ScoreMoments(120.0, 2, 70.0 ** 2 + 50.0 ** 2),
+    ])
+    assert math.isclose(analysis_service._score_variance(moments), pd.Series([80, 70, 70, 50]).var())
+
+
+def test_category_subject_analyses_share_output_shapes(students_table):
+    admission = analysis_service.admission_subject_analysis({
+        'table_name': students_table, 'year_col': '年度', 'admission_col': '入學管道', 'subjects': ['微積分', '統計1'],
+    })
+    assert admission['years'] == ['110', '111']
+    assert admission['method_details']['申請入學'] == [
+        {'year': '110', 'subjects': {'微積分': 70.0, '統計1': 70.0}},
+        {'year': '111', 'subjects': {'統計1': 65.0}},
+    ]
+
+    school_type = analysis_service.school_type_subject_analysis({
+        'table_name': students_table, 'year_col': '年度', 'school_type_col': '高中別', 'subjects': ['微積分'],
+    })
+    assert school_type['type_details']['國立'] == [
+        {'year': '110', 'subjects': {'微積分': 85.0}},
+        {'year': '111', 'subjects': {}},
+    ]
+
+    region = analysis_service.region_subject_analysis({
+        'table_name': students_table, 'year_col': '年度', 'region_col': '地區', 'subjects': ['微積分', '統計1'],
+    })
+    assert region['regions'] == ['台北市', '高雄市']
+    assert region['region_details']['台北市'] == [
+        {'year': '110', 'subjects': {'微積分': 70.0, '統計1': 70.0}},
+        {'year': '111', 'subjects': {'微積分': None, '統計1': 65.0}},
+    ]
+
+
+def test_pairwise_correlations_match_pandas():
+    rng = np.random.default_rng(3)
+    base = rng.normal(70, 10, 200)
+    values = np.column_stack([base, base * 0.5 + rng.normal(0, 5, 200), rng.integers(0, 5, 200).astype(float)])
+    values[rng.random(values.shape) < 0.2] = np.nan
+    frame = pd.DataFrame(values)
+
+    pearson, pairs = analysis_service._pairwise_pearson(values)
+    np.testing.assert_allclose(pearson, frame.corr(method='pearson').to_numpy(), atol=1e-10)
+    np.testing.assert_allclose(analysis_service._pairwise_spearman(values),
+                               frame.corr(method='spearman').to_numpy(), atol=1e-10)
+    assert pairs[0, 1] == int((frame[0].notna() & frame[1].notna()).sum())
+
+
+def test_subject_correlation_analysis_splits_by_gender(students_table):
+    result = analysis_service.subject_correlation_analysis({
+        'table_name': students_table, 'subjects': ['微積分', '統計1'], 'group_by': 'gender',
+    })
+
+    assert result['subjects'] == ['微積分', '統計1']
+    # 只有兩位學生兩科皆有成績，成對筆數不足時不計算
+    assert result['overall']['pairs'] == [[4, 2], [2, 3]]
+    assert result['overall']['pearson'] == [[1.0, None], [None, 1.0]]
+    assert [group['group'] for group in result['groups']] == ['男', '女']
+    assert result['groups'][0]['records'] == 2
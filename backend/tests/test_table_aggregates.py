@@ -0,0 +1,146 @@
+from functools import partial
+
+import pandas as pd
+import pytest
+from sqlalchemy import MetaData, create_engine, inspect, text
+from sqlalchemy.orm import Session, sessionmaker
+
+import app_factory
+from service import analysis_service, data_service, database_service
+from service.analysis_query import QuerySpec, row_filters, run_query
+from service.table_aggregates import TableAggregateStore
+
+ROWS = [
+    ('u1', '110', '男', '國立新竹高中', '80'),
+    ('u1', '110', 'F', '私立延平高中', '60'),
+    ('u1', '110', '女', '國立新竹高中', '缺考'),
+    ('u1', '111', 'M', '私立延平高中', '1,070'),
+    ('u1', '111', '女', None, '65'),
+    ('u1', '', '女', '國立新竹高中', '50'),
+]
+
+
+@pytest.fixture
+def aggregated_table(tmp_path, monkeypatch):
+    engine = create_engine(f'sqlite:///{tmp_path / "aggregates.db"}')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE scores (id INTEGER PRIMARY KEY, user_id TEXT, 年度 TEXT, 性別 TEXT, '
+                          '高中別 TEXT, 微積分 TEXT)'))
+        for row in ROWS:
+            conn.execute(text('INSERT INTO scores (user_id, 年度, 性別, 高中別, 微積分) VALUES (:u, :y, :g, :s, :c)'),
+                         dict(zip('uygsc', row)))
+
+    store = TableAggregateStore(max_values=100)
+    monkeypatch.setattr(database_service, 'get_database_engine', lambda table: (engine, inspect(engine)))
+    monkeypatch.setattr(database_service, 'database_repository', None)
+    monkeypatch.setattr(database_service, 'analysis_cache', None)
+    monkeypatch.setattr(database_service, 'column_sketch_store', None)
+    monkeypatch.setattr(database_service, 'table_aggregate_store', store)
+    monkeypatch.setattr(analysis_service, 'get_database_engine', lambda table: (engine, inspect(engine)))
+    monkeypatch.setattr(analysis_service, 'table_frame_cache', None)
+    monkeypatch.setattr(analysis_service, 'table_aggregate_store', store)
+    yield engine, store
+    engine.dispose()
+
+
+SPECS = [
+    QuerySpec('scores', ['年度'], row_filters(['年度']), grouped=True),
+    QuerySpec('scores', ['年度', '性別'], row_filters(['年度']), grouped=True),
+    QuerySpec('scores', ['高中別', '年度'], row_filters(['年度'], '年度', [110]), grouped=True),
+    QuerySpec('scores', ['年度', '高中別'], row_filters(['年度', '高中別']), grouped=True),
+    QuerySpec('scores', ['年度'], row_filters(['年度']), grouped=True, measure_column='微積分'),
+]
+
+
+def _assert_matches_table(engine, store):
+    with Session(engine) as session:
+        for spec in SPECS:
+            aggregated = store.query(session, spec)
+            assert aggregated is not None, spec
+            pd.testing.assert_frame_equal(aggregated, run_query(session, spec))
+
+
+def test_aggregates_follow_row_changes(aggregated_table):
+    engine, store = aggregated_table
+    definition = store.build(engine, 'scores')
+    assert definition.year_col == '年度'
+    assert '微積分' in definition.measures and '性別' in definition.dimensions
+    _assert_matches_table(engine, store)
+
+    # 新增（年度以數字傳入，彙總使用實際儲存的值）、修改最大值、刪除
+    payload, status = database_service.create_table_row('scores', 'u1', {'年度': 112, '性別': '男', '微積分': '95'})
+    assert status == 200
+    _assert_matches_table(engine, store)
+    assert database_service.update_table_row('scores', 4, 'u1', {'微積分': '70', '年度': '110'})[1] == 200
+    _assert_matches_table(engine, store)
+    assert database_service.delete_table_row('scores', payload['inserted_id'], 'u1')[1] == 200
+    assert database_service.delete_table_row('scores', 6, 'u1')[1] == 200
+    _assert_matches_table(engine, store)
+
+
+def test_analysis_reads_aggregates(aggregated_table):
+    engine, store = aggregated_table
+    params = {'table_name': 'scores', 'year_col': '年度', 'gender_col': '性別'}
+    expected = analysis_service.yearly_admission_stats(params)
+    store.build(engine, 'scores')
+    hits = store.stats()['hits']
+    assert analysis_service.yearly_admission_stats(params) == expected
+    assert store.stats()['hits'] == hits + 1
+
+    # 分組欄位以外的條件不在彙總範圍內，改為直接查詢
+    with Session(engine) as session:
+        assert store.query(session, QuerySpec('scores', ['年度'], row_filters(['年度', '微積分']), grouped=True)) is None
+
+
+def test_subject_means_follow_to_numeric(aggregated_table):
+    engine, store = aggregated_table
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO scores (user_id, 年度, 性別, 微積分) VALUES ('u1', '111', '女', '８０')"))
+        frame = pd.read_sql('SELECT 年度, 微積分 FROM scores', conn)
+    # 與 subject_average_stats 相同，千分位逗號（1,070）與全形數字（８０）不計入成績
+    frame = frame[frame['年度'] != '']
+    frame['微積分'] = pd.to_numeric(frame['微積分'], errors='coerce')
+    expected = frame.groupby(frame['年度'].astype(int))['微積分'].mean()
+
+    params = {'table_name': 'scores', 'subjects': ['微積分'], 'year_col': '年度'}
+    scanned = analysis_service.multi_subject_stats(params)
+    assert scanned['years'] == list(expected.index)
+    assert scanned['data']['微積分'] == pytest.approx(list(expected))
+
+    store.build(engine, 'scores')
+    hits = store.stats()['hits']
+    assert analysis_service.multi_subject_stats(params) == scanned
+    assert store.stats()['hits'] == hits + 1
+
+
+def test_upload_succeeds_when_aggregate_build_fails(tmp_path, monkeypatch):
+    class FailingStore:
+        def build(self, engine, table_name):
+            raise RuntimeError('disk I/O error')
+
+    class IdleScheduler:
+        def mark_dirty(self):
+            pass
+
+    engine = create_engine(f'sqlite:///{tmp_path / "uploads.db"}')
+    metadata = MetaData()
+    monkeypatch.setattr(data_service, 'Session', sessionmaker(bind=engine))
+    monkeypatch.setattr(data_service, 'create_excel_table',
+                        partial(app_factory.create_excel_table, target_engine=engine, target_metadata=metadata))
+    monkeypatch.setattr(data_service, 'filter_dataframe_until_empty_row', app_factory.filter_dataframe_until_empty_row)
+    monkeypatch.setattr(data_service, 'get_database_engine', lambda table: (engine, inspect(engine)))
+    monkeypatch.setattr(data_service, 'backup_scheduler', IdleScheduler())
+    monkeypatch.setattr(data_service, 'analysis_cache', None)
+    monkeypatch.setattr(data_service, 'column_sketch_store', None)
+    monkeypatch.setattr(data_service, 'table_sample_store', None)
+    monkeypatch.setattr(data_service, 'table_cube_store', None)
+    monkeypatch.setattr(data_service, 'table_aggregate_store', FailingStore())
+
+    df = pd.DataFrame({'年度': ['110', '111'], '微積分': ['80', '70']})
+    payload, status = data_service.process_excel_data(None, df, 'scores', 'u1', stored_filename='scores.xlsx')
+
+    # 資料表已 commit，彙總建立失敗不影響上傳結果
+    assert status == 200
+    with engine.connect() as conn:
+        assert conn.execute(text(f'SELECT COUNT(*) FROM "{payload["table_name"]}"')).scalar() == 2
+    engine.dispose()
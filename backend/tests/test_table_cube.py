@@ -0,0 +1,86 @@
+import pytest
+from sqlalchemy import text
+
+import app_factory
+from service import analysis_service, database_service
+from service.classification import normalize_city
+from service.table_cube import TableCubeStore
+
+ANALYSES = [
+    ('yearly_admission_stats', {'year_col': '年度', 'gender_col': '性別'}),
+    ('school_source_stats', {'year_col': '年度', 'school_col': '高中別'}),
+    ('admission_method_stats', {'year_col': '年度', 'method_col': '入學管道'}),
+    ('geographic_stats', {'year_col': '年度', 'region_col': '地區', 'get_city_details': True}),
+    ('subject_average_stats', {'year_col': '年度', 'gender_col': '性別', 'subjects': ['微積分', '統計1']}),
+]
+
+
+@pytest.fixture
+def cube_table(students_table, monkeypatch):
+    engine, _ = analysis_service.get_database_engine(students_table)
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE students ADD COLUMN user_id TEXT'))
+        conn.execute(text("UPDATE students SET user_id = 'u1'"))
+
+    store = TableCubeStore(classifiers={
+        'school_type': app_factory.classify_school_type,
+        'method_type': app_factory.classify_admission_method,
+        'region': app_factory.classify_region,
+        'city': normalize_city,
+    })
+    monkeypatch.setattr(database_service, 'get_database_engine', analysis_service.get_database_engine)
+    monkeypatch.setattr(database_service, 'database_repository', None)
+    monkeypatch.setattr(database_service, 'analysis_cache', None)
+    monkeypatch.setattr(database_service, 'column_sketch_store', None)
+    monkeypatch.setattr(database_service, 'table_aggregate_store', None)
+    monkeypatch.setattr(database_service, 'table_cube_store', store)
+    monkeypatch.setattr(analysis_service, 'table_aggregate_store', None)
+    monkeypatch.setattr(analysis_service, 'table_cube_store', store)
+    yield engine, store
+
+
+def _assert_matches_table(table_name, store, monkeypatch):
+    with monkeypatch.context() as patch:
+        patch.setattr(analysis_service, 'table_cube_store', None)
+        expected = [analysis_service.BATCH_ANALYSES[name]({**params, 'table_name': table_name}) for name, params in ANALYSES]
+    hits = store.stats()['hits']
+    for (name, params), result in zip(ANALYSES, expected):
+        assert analysis_service.BATCH_ANALYSES[name]({**params, 'table_name': table_name}) == result, name
+    # subject_average_stats 另讀取成績彙總
+    assert store.stats()['hits'] == hits + len(ANALYSES) + 1
+
+
+def test_cube_answers_dashboard_analyses(cube_table, monkeypatch):
+    engine, store = cube_table
+    definition = store.build(engine, 'students')
+    assert definition.year_col == '年度'
+    assert set(definition.measures) == {'微積分', '統計1'}
+    _assert_matches_table('students', store, monkeypatch)
+
+    # 年度 × 類別的 roll-up 不含資料表的其他欄位
+    result = analysis_service.geographic_stats({'table_name': 'students', 'year_col': '年度', 'region_col': '地區'})
+    assert result['data']['北台灣'] == [2, 1]
+
+
+def test_cube_follows_row_changes(cube_table, monkeypatch):
+    engine, store = cube_table
+    store.build(engine, 'students')
+
+    # 新增、修改最大值所在的資料列、刪除最小值
+    payload, status = database_service.create_table_row('students', 'u1', {
+        '年度': 112, '性別': '男', '入學管道': '考試分發', '高中別': '市立建國中學', '地區': '新竹縣', '微積分': '95',
+    })
+    assert status == 200
+    _assert_matches_table('students', store, monkeypatch)
+    assert database_service.update_table_row('students', 3, 'u1', {'微積分': '40', '地區': '臺中市'})[1] == 200
+    _assert_matches_table('students', store, monkeypatch)
+    assert database_service.delete_table_row('students', 2, 'u1')[1] == 200
+    assert database_service.delete_table_row('students', payload['inserted_id'], 'u1')[1] == 200
+    _assert_matches_table('students', store, monkeypatch)
+
+    # 移除 cube 後改由資料表計算
+    with engine.begin() as conn:
+        store.drop(conn, 'students')
+    hits = store.stats()['hits']
+    assert analysis_service.yearly_admission_stats({'table_name': 'students', 'year_col': '年度'})['years'] == [110, 111]
+    assert store.stats()['hits'] == hits
@@ -0,0 +1,112 @@
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from service import analysis_service
+from service.analysis_query import ROWS, Filter, QuerySpec, row_filters, run_query, spec_columns
+from service.table_frame import TableFrame, TableFrameCache
+
+
+REQUESTS = [
+    ('column_stats', {'column': '統計1'}),
+    ('school_source_stats', {'year_col': '年度', 'school_col': '高中別'}),
+    ('gender_subject_analysis', {
+        'year_col': '年度', 'gender_col': '性別', 'subjects': ['微積分', '統計1'], 'years': [110],
+    }),
+    ('region_subject_analysis', {'year_col': '年度', 'region_col': '地區', 'subjects': ['微積分', '統計1']}),
+]
+
+
+def test_cached_frames_match_sqlite_queries(students_table, monkeypatch):
+    expected = [
+        getattr(analysis_service, name)({'table_name': students_table, **params}) for name, params in REQUESTS
+    ]
+
+    cache = TableFrameCache()
+    monkeypatch.setattr(analysis_service, 'table_frame_cache', cache)
+    for _ in range(2):
+        assert [
+            getattr(analysis_service, name)({'table_name': students_table, **params}) for name, params in REQUESTS
+        ] == expected
+
+    stats = cache.stats()
+    assert stats['entries'] == 1
+    assert stats['hits'] > 0
+    assert stats['tables'][students_table]['numeric_columns'] == 2
+    assert stats['bytes'] > 0
+
+
+def test_version_change_reloads_and_budget_evicts(students_table):
+    engine, _ = analysis_service.get_database_engine(students_table)
+    versions = {students_table: 0}
+    cache = TableFrameCache(version_fn=lambda table: versions.get(table, 0))
+
+    frame, loaded = cache.get(engine, students_table, ['年度'])
+    assert loaded and frame.row_count == 5
+    assert cache.get(engine, students_table, ['年度']) == (frame, False)
+
+    with engine.begin() as conn:
+        conn.execute(text('DELETE FROM students WHERE 年度 = :year'), {'year': '111'})
+    versions[students_table] += 1
+    frame, loaded = cache.get(engine, students_table, ['年度'])
+    assert loaded and frame.row_count == 3
+
+    # 缺少欄位時連同已快取的欄位重新讀取
+    frame, loaded = cache.get(engine, students_table, ['性別'], numeric=['微積分'])
+    assert loaded and frame.has_columns(['年度', '性別', '微積分'])
+    assert cache.stats()['column_misses'] == 1
+
+    small = TableFrameCache(max_bytes=1)
+    frame, _ = small.get(engine, students_table, ['年度'])
+    assert frame.row_count == 3
+    assert small.stats()['entries'] == 0
+
+
+def test_encoded_columns_keep_raw_values():
+    frame = TableFrame('t', {
+        'text': np.array(['80', None, '', '80'], dtype=object),
+        'mixed': np.array([1, 1.0, True, None], dtype=object),
+    })
+
+    assert frame.columns['text'].distinct and len(frame.columns['text'].uniques) == 3
+    assert frame.select_rows(['text', 'mixed']) == [('80', 1), (None, 1.0), ('', True), ('80', None)]
+    assert frame.select_rows(['text'], filters=row_filters(['text'])) == [('80',), ('80',)]
+    assert frame.numeric('text').tolist()[::3] == [80.0, 80.0]
+
+
+def _records(df):
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+
+def test_grouped_specs_match_sqlite(students_table):
+    engine, _ = analysis_service.get_database_engine(students_table)
+    cache = TableFrameCache()
+    specs = [
+        QuerySpec(students_table, ['年度', '性別'], row_filters(['年度']), grouped=True),
+        QuerySpec(students_table, ['性別'], [Filter('年度', 'in', ('110', None))], grouped=True, measure_column='統計1'),
+        QuerySpec(students_table, [], row_filters(['統計1']), grouped=True, measure_column='統計1'),
+        QuerySpec(students_table, [], [Filter('年度', 'eq', ('999',))], grouped=True, measure_column='統計1'),
+        QuerySpec(students_table, ['年度', '性別'], row_filters(any_not_null=['統計1', '微積分']), limit=2),
+    ]
+    with Session(engine) as session:
+        for spec in specs:
+            frame, _ = cache.get(engine, students_table, spec_columns(spec))
+            expected = run_query(session, spec)
+            if spec.grouped:
+                actual = frame.grouped(spec.columns, filters=spec.filters, measure_column=spec.measure_column)
+                assert _records(actual) == _records(expected)
+            else:
+                assert frame.select_rows(spec.columns, filters=spec.filters, limit=spec.limit) == [tuple(row) for row in expected]
+
+
+def test_grouped_handles_cardinality_beyond_int64():
+    # 5 個各 2^16 種值的欄位：合併代碼 a·2^64 + … 在 int64 中會溢位，('1', '0', '0', '0', '0') 會與全為 '0' 的列合併
+    size = 1 << 16
+    columns = {name: np.array([str(i) for i in range(size)] + ['0'], dtype=object) for name in 'abcde'}
+    columns['a'][-1] = '1'
+    frame = TableFrame('t', columns)
+
+    grouped = frame.grouped(list('abcde'))
+    assert len(grouped) == size + 1
+    assert grouped[ROWS].sum() == size + 1
+    assert grouped.iloc[0].tolist()[:5] == ['0'] * 5 and grouped.iloc[0][ROWS] == 1
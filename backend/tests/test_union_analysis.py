@@ -0,0 +1,90 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+import app_factory
+from service import analysis_service
+from service.analysis_cache import AnalysisCache
+
+COHORTS = {
+    'cohort_a': ['年度', '性別', '微積分'],
+    'cohort_b': ['年度', '性別', '微積分', '統計1'],
+}
+ROWS = {
+    'cohort_a': [('110', '男', '80'), ('110', '女', '60'), ('111', '女', '缺考')],
+    'cohort_b': [('111', 'M', '70', '55'), ('112', '女', '90', None), ('112', '女', None, '65')],
+}
+
+
+@pytest.fixture
+def cohort_tables(tmp_path, monkeypatch):
+    engine = create_engine(f'sqlite:///{tmp_path / "cohorts.db"}')
+    with engine.begin() as conn:
+        for table_name, columns in COHORTS.items():
+            conn.execute(text(f'CREATE TABLE {table_name} (id INTEGER PRIMARY KEY, '
+                              + ', '.join(f'{col} TEXT' for col in columns) + ')'))
+            placeholders = ', '.join(f':c{index}' for index in range(len(columns)))
+            for row in ROWS[table_name]:
+                conn.execute(text(f'INSERT INTO {table_name} ({", ".join(columns)}) VALUES ({placeholders})'),
+                             {f'c{index}': value for index, value in enumerate(row)})
+        # 兩屆資料的聯集作為對照
+        conn.execute(text('CREATE TABLE combined (id INTEGER PRIMARY KEY, 年度 TEXT, 性別 TEXT, 微積分 TEXT, 統計1 TEXT)'))
+        conn.execute(text('INSERT INTO combined (年度, 性別, 微積分) SELECT 年度, 性別, 微積分 FROM cohort_a'))
+        conn.execute(text('INSERT INTO combined (年度, 性別, 微積分, 統計1) SELECT 年度, 性別, 微積分, 統計1 FROM cohort_b'))
+
+    def get_engine(table_name):
+        current_inspector = inspect(engine)
+        if not current_inspector.has_table(table_name):
+            raise ValueError(f'找不到指定的資料表: {table_name}')
+        return engine, current_inspector
+
+    monkeypatch.setattr(analysis_service, 'get_database_engine', get_engine)
+    monkeypatch.setattr(analysis_service, 'resolve_column_name', app_factory.resolve_column_name)
+    monkeypatch.setattr(analysis_service, 'table_frame_cache', None)
+    monkeypatch.setattr(analysis_service, 'column_sketch_store', None)
+    monkeypatch.setattr(analysis_service, 'table_aggregate_store', None)
+    yield list(COHORTS)
+    engine.dispose()
+
+
+@pytest.mark.parametrize('analysis_type, params', [
+    ('yearly_admission_stats', {'year_col': '年度', 'gender_col': '性別'}),
+    ('multi_subject_stats', {'subjects': ['微積分', '統計1'], 'year_col': '年度'}),
+    ('column_stats', {'column': '統計1'}),
+])
+def test_union_matches_single_combined_table(cohort_tables, analysis_type, params):
+    expected = analysis_service.BATCH_ANALYSES[analysis_type]({**params, 'table_name': 'combined'})
+    payload, status = analysis_service.union_analysis(analysis_type, {**params, 'table_names': cohort_tables})
+
+    assert status == 200
+    assert payload.pop('union')['tables'] == cohort_tables
+    assert payload == expected
+
+
+def test_source_table_is_a_pivot_dimension(cohort_tables):
+    payload, status = analysis_service.union_analysis('pivot_analysis', {
+        'table_names': cohort_tables,
+        'rows': [analysis_service.SOURCE_TABLE_COLUMN],
+        'measure': {'type': 'mean', 'column': '微積分'},
+        'filters': [{'column': '年度', 'op': 'in', 'values': ['111', '112']}],
+    })
+
+    assert status == 200
+    assert payload['row_keys'] == [['cohort_a'], ['cohort_b']]
+    # cohort_a 在 111 年只有缺考
+    assert payload['row_totals'] == [None, 80.0]
+
+
+def test_union_errors_and_cache_invalidation(cohort_tables):
+    assert analysis_service.union_analysis('column_stats', {'table_names': 'cohort_a'})[1] == 400
+    assert analysis_service.union_analysis('column_stats', {'table_names': ['cohort_a', 'missing'], 'column': '微積分'})[1] == 404
+
+    cache = AnalysisCache()
+    request = {'table_names': cohort_tables, 'column': '微積分'}
+    compute = lambda: analysis_service.union_analysis('column_stats', request)
+    first = cache.get_or_compute('column_stats', request, compute)
+    assert cache.get_or_compute('column_stats', request, compute) == first
+    assert cache.stats()['hits'] == 1
+
+    # 任一資料表變更後重新計算
+    cache.invalidate_table('cohort_b')
+    assert cache.stats()['entries'] == 0
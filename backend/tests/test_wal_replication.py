@@ -0,0 +1,99 @@
+import sqlite3
+
+from service.database_backup import LocalDirectoryBucket
+from service.wal_replication import WalBackup
+
+
+def _write(path, statements):
+    with sqlite3.connect(path) as conn:
+        for statement in statements:
+            conn.execute(statement)
+    conn.close()
+
+
+def _rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT id, value FROM items ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+
+def test_restore_replays_segments_on_top_of_snapshot(tmp_path):
+    db_path = str(tmp_path / 'app.db')
+    _write(db_path, ['CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT)'])
+    _write(db_path, [f"INSERT INTO items (value) VALUES ('{'x' * 200}')" for _ in range(2000)])
+
+    bucket = LocalDirectoryBucket(str(tmp_path / 'bucket'))
+    backup = WalBackup(bucket, {'app.db': db_path})
+    backup.start()
+    first = backup.run()['databases']['app.db']
+    assert first['status'] == 'snapshot'
+
+    # 每輪備份後 checkpoint，下一輪寫入會重設 WAL（salt 改變）
+    for round_number in range(3):
+        _write(db_path, [f"INSERT INTO items (value) VALUES ('round {round_number}')"])
+        _write(db_path, [f"UPDATE items SET value = 'updated {round_number}' WHERE id = {round_number + 1}"])
+        result = backup.run()['databases']['app.db']
+        assert result['status'] == 'segment'
+        assert result['seq'] == round_number + 1
+        # 只上傳變更的頁面，而非整個資料庫
+        assert result['bytes_shipped'] < first['bytes_shipped'] / 5
+
+    assert backup.run()['databases']['app.db']['status'] == 'unchanged'
+
+    restored_path = str(tmp_path / 'restored.db')
+    restored = WalBackup(bucket, {'app.db': restored_path}).restore_all()
+    assert restored['app.db']['status'] == 'downloaded'
+    assert restored['app.db']['segments'] == 3
+    assert _rows(restored_path) == _rows(db_path)
+
+
+def test_restore_after_shrinking_database_and_new_generation(tmp_path):
+    db_path = str(tmp_path / 'app.db')
+    _write(db_path, ['CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT)'])
+    _write(db_path, [f"INSERT INTO items (value) VALUES ('{'y' * 500}')" for _ in range(500)])
+
+    bucket = LocalDirectoryBucket(str(tmp_path / 'bucket'))
+    backup = WalBackup(bucket, {'app.db': db_path}, snapshot_interval_seconds=0)
+    backup.start()
+    backup.run()
+    _write(db_path, ['DELETE FROM items WHERE id > 10'])
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('VACUUM')
+    conn.close()
+    backup.run()
+    backup.run()
+
+    generations = {blob.name.split('/')[2] for blob in bucket.list_blobs('wal/app.db/')}
+    assert len(generations) == 2
+
+    restored_path = str(tmp_path / 'restored.db')
+    WalBackup(bucket, {'app.db': restored_path}).restore_all()
+    assert _rows(restored_path) == _rows(db_path)
+
+
+def test_restore_skips_download_when_local_matches_latest_segment(tmp_path):
+    db_path = str(tmp_path / 'app.db')
+    _write(db_path, ['CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT)'])
+    bucket = LocalDirectoryBucket(str(tmp_path / 'bucket'))
+    backup = WalBackup(bucket, {'app.db': db_path})
+    backup.start()
+    backup.run()
+    _write(db_path, ["INSERT INTO items (value) VALUES ('a')"])
+    backup.run()
+
+    # 備份程序自己的資料庫已是最新上傳的狀態
+    result = WalBackup(bucket, {'app.db': db_path}).restore_if_changed('app.db', db_path)
+    assert result['status'] == 'up_to_date' and result['seq'] == 1
+
+    restored_path = str(tmp_path / 'restored.db')
+    replica = WalBackup(bucket, {'app.db': restored_path})
+    assert replica.restore_all()['app.db']['status'] == 'downloaded'
+    assert replica.restore_all()['app.db']['status'] == 'up_to_date'
+
+    # 遠端有新的區段時重新下載
+    _write(db_path, ["INSERT INTO items (value) VALUES ('b')"])
+    backup.run()
+    assert replica.restore_all()['app.db']['status'] == 'downloaded'
+    assert _rows(restored_path) == _rows(db_path)
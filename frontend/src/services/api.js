@@ -196,5 +196,8 @@ export const API_ENDPOINTS = {
   SCHOOL_TYPE_SUBJECT_STATS: '/analysis/school-type-subject',
   
   // 地區科目成績分析
-  REGION_SUBJECT_STATS: '/analysis/region-subject'
+  REGION_SUBJECT_STATS: '/analysis/region-subject',
+
+  // 批次分析（同一資料表多個分析共用一次讀取）
+  BATCH_ANALYSIS: '/analysis/batch'
 }